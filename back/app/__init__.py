@@ -9,6 +9,7 @@ import os
 import re
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from app.config import Config
 
 # --- Initialize Extensions ---
 db = SQLAlchemy()
@@ -16,10 +17,10 @@ migrate = Migrate()
 jwt = JWTManager()
 
 # Production-ready rate limiter (Redis backend)
-# Change "localhost" to your VPS IP or Docker container name if needed
+# Set REDIS_URL to your VPS IP or Docker container name if needed
 limiter = Limiter(
     key_func=get_remote_address,
-    storage_uri="redis://localhost:6379"  # ? avoids the in-memory warning
+    storage_uri=Config.REDIS_URL  # ? avoids the in-memory warning
 )
 
 def create_app():
@@ -54,7 +55,7 @@ def create_app():
          origins=allowed_origins_list,
          methods=['GET', 'POST', 'PUT', 'DELETE', 'PATCH', 'OPTIONS'],
          allow_headers=['Content-Type', 'Authorization', 'X-Requested-With', 'Accept', 'Origin'],
-         expose_headers=['Content-Type', 'Authorization'],
+         expose_headers=['Content-Type', 'Authorization', 'Retry-After', 'ETag'],
          max_age=3600)
     
     # Helper function to check if origin is allowed (for manual fallback)
@@ -124,6 +125,10 @@ def create_app():
     # Import models to register them with SQLAlchemy
     from app import models
 
+    # Reject tokens issued before a user's role/activation changed
+    from app.principal import is_token_revoked
+    jwt.token_in_blocklist_loader(is_token_revoked)
+
     # Register blueprints
     from app.routes.auth import auth_blueprint
     from app.routes.class_routes import class_blueprint
@@ -148,6 +153,10 @@ def create_app():
     app.register_blueprint(substitution_bp, url_prefix='/api/substitutions')
     app.register_blueprint(notification_blueprint, url_prefix='/api/notifications') 
     app.register_blueprint(parent_pickup_bp, url_prefix='/api/parent-pickup')
+
+    # Scheduled job commands (flask <command>)
+    from app.commands import register_commands
+    register_commands(app)
   
 
     # --- Security Headers ---
@@ -0,0 +1,52 @@
+# app/cache.py
+"""
+Shared Redis connection for caches and counters that must agree across
+gunicorn workers. Uses the same Redis instance as the rate limiter.
+
+Redis is optional at runtime: if the package is missing or the server is
+unreachable, get_redis() returns None and callers fall back to in-process state.
+"""
+import time
+import logging
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# After a connection failure, don't retry Redis for this many seconds
+REDIS_RETRY_AFTER_SECONDS = 30
+
+_redis_client = None
+_redis_down_until = 0.0
+
+
+def get_redis():
+    """Return a shared Redis client, or None if Redis is unavailable."""
+    global _redis_client, _redis_down_until
+
+    if _redis_client is not None:
+        return _redis_client
+    if time.monotonic() < _redis_down_until:
+        return None
+
+    try:
+        import redis
+        client = redis.Redis.from_url(
+            Config.REDIS_URL,
+            socket_connect_timeout=0.5,
+            socket_timeout=0.5,
+            decode_responses=True
+        )
+        client.ping()
+        _redis_client = client
+        return _redis_client
+    except Exception as e:
+        logger.warning(f"Redis unavailable, using in-process fallback: {str(e)}")
+        _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER_SECONDS
+        return None
+
+
+def mark_redis_down():
+    """Drop the shared client after a failed command so the next call backs off."""
+    global _redis_client, _redis_down_until
+    _redis_client = None
+    _redis_down_until = time.monotonic() + REDIS_RETRY_AFTER_SECONDS
@@ -0,0 +1,213 @@
+# app/commands.py
+"""
+Flask CLI commands for scheduled jobs.
+
+Run from the back/ directory, e.g. from cron:
+    FLASK_APP=run.py flask sweep-forgotten-students
+    FLASK_APP=run.py flask roll-partitions          (monthly)
+    FLASK_APP=run.py flask build-student-summaries  (nightly)
+    FLASK_APP=run.py flask sweep-notifications      (nightly)
+    FLASK_APP=run.py flask refresh-sms-balances     (every few minutes)
+"""
+import click
+from datetime import datetime
+
+
+def _default_job_user_id():
+    """Notifications need a creator; scheduled jobs use the first active system admin."""
+    from app.models import User
+    admin = User.query.filter_by(user_role='admin', is_active=True).order_by(User.id).first()
+    return admin.id if admin else None
+
+
+def register_commands(app):
+    """Attach the scheduled job commands to the Flask CLI."""
+
+    @app.cli.command('sweep-forgotten-students')
+    @click.option('--school-id', 'school_ids', type=int, multiple=True,
+                  help='Restrict the sweep to these school IDs (repeatable). Defaults to all schools.')
+    @click.option('--date', 'day', default=None, help='Date to check as YYYY-MM-DD. Defaults to today (Oman time).')
+    @click.option('--created-by', type=int, default=None,
+                  help='User ID recorded as the notification creator. Defaults to the first system admin.')
+    @click.option('--dry-run', is_flag=True, help='Report buses with students still on board without notifying.')
+    def sweep_forgotten_students_command(school_ids, day, created_by, dry_run):
+        """Alert drivers and school admins about students left on buses."""
+        from app.services.bus_sweeper import sweep_forgotten_students
+
+        target_day = datetime.strptime(day, '%Y-%m-%d').date() if day else None
+        created_by = created_by or _default_job_user_id()
+        if not created_by and not dry_run:
+            raise click.ClickException('No active system admin found; pass --created-by.')
+
+        result = sweep_forgotten_students(
+            created_by=created_by,
+            school_ids=list(school_ids) or None,
+            day=target_day,
+            notify=not dry_run
+        )
+
+        click.echo(
+            f"Buses with students on board: {len(result['buses'])}, "
+            f"notifications sent: {len(result['notifications'])}, "
+            f"already notified: {len(result['already_notified'])}"
+        )
+        for bus in result['buses']:
+            click.echo(f"  school={bus['school_id']} bus={bus['bus_number']} students={bus['students_count']}")
+
+    @app.cli.command('roll-partitions')
+    @click.option('--months-ahead', type=int, default=None, help='Monthly partitions to keep ahead of today (default 3).')
+    @click.option('--init', is_flag=True,
+                  help='Convert tables that are not partitioned yet (drops their foreign keys; run off-hours).')
+    def roll_partitions_command(months_ahead, init):
+        """Add upcoming monthly partitions to attendances, bus_scans and action_logs."""
+        from app import db
+        from app.services.partitioning import (
+            PARTITIONED_TABLES, MONTHS_AHEAD, get_partitions, partition_table, roll_partitions_forward
+        )
+
+        months_ahead = MONTHS_AHEAD if months_ahead is None else months_ahead
+        with db.engine.connect() as conn:
+            for table in PARTITIONED_TABLES:
+                if not get_partitions(conn, table):
+                    if not init:
+                        click.echo(f"{table}: not partitioned (pass --init to convert)")
+                        continue
+                    partition_table(conn, table, months_ahead=months_ahead)
+                    click.echo(f"{table}: converted to monthly partitions")
+                    continue
+                added = roll_partitions_forward(conn, table, months_ahead=months_ahead)
+                click.echo(f"{table}: added {', '.join(added) if added else 'nothing'}")
+
+    @app.cli.command('archive-academic-year')
+    @click.argument('start_year', type=int)
+    @click.option('--table', 'tables', multiple=True,
+                  help='Only archive these tables (repeatable). Defaults to attendances, bus_scans and action_logs.')
+    @click.option('--dry-run', is_flag=True, help='Only count the rows that would be archived.')
+    def archive_academic_year_command(start_year, tables, dry_run):
+        """Move a closed academic year (e.g. 2023 for 2023-2024) into the archive tables."""
+        from app import db
+        from app.services.partitioning import PARTITIONED_TABLES, archive_academic_year
+
+        unknown = [table for table in tables if table not in PARTITIONED_TABLES]
+        if unknown:
+            raise click.ClickException(f"Unknown table(s): {', '.join(unknown)}")
+
+        with db.engine.connect() as conn:
+            try:
+                result = archive_academic_year(conn, start_year, tables=list(tables) or None, dry_run=dry_run)
+            except ValueError as e:
+                raise click.ClickException(str(e))
+
+        verb = 'would archive' if dry_run else 'archived'
+        for table, rows in result.items():
+            click.echo(f"{table}: {verb} {rows} row(s)")
+
+    @app.cli.command('rebuild-student-days')
+    @click.option('--school-id', type=int, default=None, help='Only rebuild this school. Defaults to all schools.')
+    @click.option('--from', 'start', default=None, help='First date as YYYY-MM-DD (with --to).')
+    @click.option('--to', 'end', default=None, help='Last date as YYYY-MM-DD.')
+    def rebuild_student_days_command(school_id, start, end):
+        """Rebuild student_day_attendance bitmask rows from attendances (archived years are left as they are)."""
+        from app import db
+        from app.services.attendance_days import refresh_student_days
+
+        start_date = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+        end_date = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+        if bool(start_date) != bool(end_date):
+            raise click.ClickException('Pass both --from and --to, or neither.')
+
+        refresh_student_days(start_date=start_date, end_date=end_date, school_id=school_id)
+        db.session.commit()
+
+        # Running workers reload their in-memory snapshots on the next read
+        from app.models import School
+        from app.services.attendance_snapshot import invalidate_snapshot
+        for target_school_id in ([school_id] if school_id else [s.id for s in School.query.all()]):
+            invalidate_snapshot(target_school_id)
+        click.echo('student_day_attendance rebuilt.')
+
+    @app.cli.command('build-student-summaries')
+    @click.option('--school-id', 'school_ids', type=int, multiple=True,
+                  help='Only rebuild these school IDs (repeatable). Defaults to all active schools.')
+    @click.option('--workers', type=int, default=None,
+                  help='Worker processes, one school each. Defaults to the CPU count; 1 runs inline.')
+    @click.option('--date', 'day', default=None, help='Last day to include as YYYY-MM-DD. Defaults to yesterday.')
+    def build_student_summaries_command(school_ids, workers, day):
+        """Rebuild the nightly per-student attendance summaries."""
+        from app.models import School
+        from app.services.student_summaries import build_all_summaries
+
+        as_of = datetime.strptime(day, '%Y-%m-%d').date() if day else None
+        school_ids = list(school_ids) or [s.id for s in School.query.filter_by(is_active=True).all()]
+        if not school_ids:
+            click.echo('No schools to summarize.')
+            return
+
+        failed = 0
+        for school_id, written, error in sorted(build_all_summaries(school_ids, as_of=as_of, workers=workers)):
+            if error:
+                failed += 1
+                click.echo(f"  school={school_id} failed: {error}")
+            else:
+                click.echo(f"  school={school_id} students={written}")
+        click.echo(f"Summaries rebuilt for {len(school_ids) - failed} of {len(school_ids)} schools.")
+        if failed:
+            raise SystemExit(1)
+
+    @app.cli.command('rebuild-expected-sessions')
+    @click.option('--school-id', 'school_ids', type=int, multiple=True,
+                  help='Only rebuild these school IDs (repeatable). Defaults to schools with an active timetable.')
+    def rebuild_expected_sessions_command(school_ids):
+        """Re-resolve active timetables into expected_sessions (e.g. after classes were renamed)."""
+        from app import db
+        from app.models import Timetable
+        from app.services.expected_sessions import rebuild_expected_sessions
+        from app.services.teacher_compliance import invalidate_teacher_compliance
+
+        school_ids = list(school_ids) or sorted({
+            t.school_id for t in Timetable.query.filter_by(is_active=True).all()
+        })
+        for school_id in school_ids:
+            written = rebuild_expected_sessions(school_id)
+            db.session.commit()
+            invalidate_teacher_compliance(school_id)
+            click.echo(f"  school={school_id} slots={written}")
+        click.echo(f"Expected sessions rebuilt for {len(school_ids)} schools.")
+
+    @app.cli.command('sweep-notifications')
+    @click.option('--days', 'retention_days', type=int, default=None,
+                  help='Archive notifications older than this many days (default NOTIFICATION_RETENTION_DAYS).')
+    @click.option('--chunk-size', type=int, default=None, help='Notifications moved per transaction (default 1000).')
+    @click.option('--dry-run', is_flag=True, help='Only count the rows that would be moved.')
+    def sweep_notifications_command(retention_days, chunk_size, dry_run):
+        """Archive expired/old notifications with their receipts and drop inactive push subscriptions."""
+        from app.services.notification_retention import CHUNK_SIZE, sweep_notifications
+
+        metrics = sweep_notifications(
+            retention_days=retention_days,
+            chunk_size=chunk_size or CHUNK_SIZE,
+            dry_run=dry_run
+        )
+
+        verb = 'would move' if dry_run else 'moved'
+        for table in ('notifications', 'notification_reads', 'notification_deleted', 'notification_audiences'):
+            click.echo(f"{table}: {verb} {metrics[table]} row(s)")
+        click.echo(f"push_subscriptions: {'would remove' if dry_run else 'removed'} {metrics['push_subscriptions_removed']} inactive")
+        if not dry_run:
+            click.echo(f"{metrics['chunks']} chunk(s) in {metrics['seconds']}s")
+
+    @app.cli.command('refresh-sms-balances')
+    @click.option('--school-id', 'school_ids', type=int, multiple=True,
+                  help='Only refresh these school IDs (repeatable). Defaults to all schools with SMS credentials.')
+    @click.option('--all', 'refresh_all', is_flag=True, help='Also refresh balances that are not stale yet.')
+    def refresh_sms_balances_command(school_ids, refresh_all):
+        """Query the SMS provider for stale school balances and store them."""
+        from ibulk_sms_service import refresh_sms_balances
+
+        results = refresh_sms_balances(school_ids=list(school_ids) or None, stale_only=not refresh_all)
+        for school_id, result in results.items():
+            if result.get('success'):
+                click.echo(f"  school={school_id} balance={result['balance']}")
+            else:
+                click.echo(f"  school={school_id} failed: {result.get('message')}")
+        click.echo(f"SMS balances refreshed for {len(results)} schools.")
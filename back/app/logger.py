@@ -1,16 +1,17 @@
 import uuid
-from flask import request
-from app import db
-from app.models import ActionLog
+from flask import request, current_app
 from flask_jwt_extended import get_jwt_identity
-from functools import wraps
+from functools import wraps, lru_cache
 from app.config import get_oman_time
+from app.services.audit_log_writer import build_action_log_record, enqueue_action_log
+from app.principal import current_principal
 
 def get_client_ip():
     if request.headers.get('X-Forwarded-For'):
         return request.headers['X-Forwarded-For'].split(',')[0]
     return request.remote_addr
 
+@lru_cache(maxsize=1)
 def get_mac_address():
     try:
         mac = ':'.join(['{:02x}'.format((uuid.getnode() >> ele) & 0xff)
@@ -32,6 +33,14 @@ def log_action(action_type, description=None, content=''):
                 except Exception:
                     user_id = None
 
+                school_id = None
+                if user_id:
+                    try:
+                        principal = current_principal()
+                        school_id = principal.school_id if principal else None
+                    except Exception:
+                        school_id = None
+
                 # Extract status code (handle both (data, code) or response object)
                 status_code = None
                 if isinstance(response, tuple) and len(response) == 2:
@@ -39,7 +48,8 @@ def log_action(action_type, description=None, content=''):
                 elif hasattr(response, 'status_code'):
                     status_code = response.status_code
 
-                log = ActionLog(
+                # Written by the background audit writer; the request doesn't wait for a commit
+                enqueue_action_log(current_app._get_current_object(), build_action_log_record(
                     user_id=user_id,
                     action_type=action_type,
                     endpoint=request.path,
@@ -49,19 +59,11 @@ def log_action(action_type, description=None, content=''):
                     ip_address=get_client_ip(),
                     mac_address=get_mac_address(),
                     status_code=status_code,
-                    timestamp= get_oman_time()
-                )
-
-                db.session.add(log)
-                db.session.commit()
+                    timestamp=get_oman_time(),
+                    school_id=school_id
+                ))
             except Exception as e:
                 # Log the error but don't crash the application
-                # Rollback the session to prevent any partial state
-                try:
-                    db.session.rollback()
-                except Exception:
-                    pass
-                # Optionally log to console/stderr for debugging
                 import logging
                 logger = logging.getLogger(__name__)
                 logger.error(f"Failed to log action {action_type}: {str(e)}", exc_info=True)
@@ -1,5 +1,6 @@
 from app import db
 from datetime import datetime, timezone
+from sqlalchemy.orm import validates
 from app.config import get_oman_time
 
 # Base User model
@@ -15,6 +16,8 @@ class User(db.Model):
     email = db.Column(db.String(100), unique=True, nullable=False)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     school_id = db.Column(db.Integer, db.ForeignKey('schools.id'), nullable=True)
+    # Bumped on role/school/activation changes; tokens with an older "tv" claim are rejected
+    token_version = db.Column(db.Integer, nullable=False, default=0)
 
     __table_args__ = (db.Index('ix_users_school_id_is_active', 'school_id', 'is_active'),)
 
@@ -174,6 +177,11 @@ class School(db.Model):
     ibulk_balance_threshold = db.Column(db.Float, nullable=True, default=10.0)  # Minimum balance threshold
     ibulk_last_balance_check = db.Column(db.DateTime, nullable=True)
     ibulk_current_balance = db.Column(db.Float, nullable=True, default=0.0)
+    # Balance endpoint found by probing (see IBulkSMSService.check_balance) and its payload shape
+    ibulk_balance_url = db.Column(db.String(255), nullable=True)
+    ibulk_balance_payload = db.Column(db.String(20), nullable=True)
+    # Bumped on every SMS/WhatsApp config edit; cached provider clients are rebuilt when it changes
+    provider_config_version = db.Column(db.Integer, nullable=False, default=1)
 
     # Evolution API (WhatsApp) Configuration Fields
     evolution_whatsapp_enabled = db.Column(db.Boolean, nullable=False, default=False)
@@ -292,10 +300,13 @@ class Attendance(db.Model):
     subject = db.relationship('Subject', back_populates='attendances')
 
      # Add a unique constraint and indexes for stats + per-student queries
+     # (monthly RANGE partitions on date are managed by app/services/partitioning.py)
     __table_args__ = (
         db.UniqueConstraint('student_id', 'class_id', 'date', 'class_time_num', 'subject_id', name='unique_attendance_record'),
         db.Index('ix_attendances_class_id_date', 'class_id', 'date'),
         db.Index('ix_attendances_student_id_date', 'student_id', 'date'),
+        # Covers the per-teacher GROUP BY in app/services/teacher_compliance.py
+        db.Index('ix_attendances_teacher_id_date', 'teacher_id', 'date', 'class_id', 'class_time_num'),
     )
 
     def to_dict(self):
@@ -315,6 +326,83 @@ class Attendance(db.Model):
         }
 
 
+class StudentDayAttendance(db.Model):
+    """
+    One row per student per class per day, derived from attendances.
+    Bit k of each mask is set when the student had that status in period k
+    (class_time_num), so "absent in period 3" is absent_mask & (1 << 3).
+    Maintained by app/services/attendance_days.py on every attendance write.
+    """
+    __tablename__ = 'student_day_attendance'
+
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id', ondelete='CASCADE'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    class_id = db.Column(db.Integer, db.ForeignKey('classes.id', ondelete='CASCADE'), primary_key=True)
+    absent_mask = db.Column(db.SmallInteger, nullable=False, default=0)    # is_Acsent (هروب)
+    late_mask = db.Column(db.SmallInteger, nullable=False, default=0)      # is_late
+    excused_mask = db.Column(db.SmallInteger, nullable=False, default=0)   # is_Excus (غياب)
+    present_mask = db.Column(db.SmallInteger, nullable=False, default=0)   # is_present
+
+    __table_args__ = (
+        db.Index('ix_student_day_attendance_class_id_date', 'class_id', 'date'),
+    )
+
+
+class StudentAttendanceSummary(db.Model):
+    """
+    Nightly term-to-date attendance totals per student (through as_of_date),
+    built by `flask build-student-summaries`. Counts are in periods, like the
+    per-record counts in attendances; today's activity is added at read time.
+    """
+    __tablename__ = 'student_attendance_summaries'
+
+    # Keyed per school: a student with classes in two schools gets one row from each school's build
+    school_id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('students.id', ondelete='CASCADE'), primary_key=True)
+    class_id = db.Column(db.Integer, nullable=True)
+    term_start = db.Column(db.Date, nullable=False)
+    as_of_date = db.Column(db.Date, nullable=False)
+    total_records = db.Column(db.Integer, nullable=False, default=0)
+    total_days = db.Column(db.Integer, nullable=False, default=0)
+    present_count = db.Column(db.Integer, nullable=False, default=0)
+    absent_count = db.Column(db.Integer, nullable=False, default=0)
+    excused_count = db.Column(db.Integer, nullable=False, default=0)
+    late_count = db.Column(db.Integer, nullable=False, default=0)
+    absent_days = db.Column(db.Integer, nullable=False, default=0)
+    last_absence_date = db.Column(db.Date, nullable=True)
+    current_streak = db.Column(db.Integer, nullable=False, default=0)
+    longest_streak = db.Column(db.Integer, nullable=False, default=0)
+    risk_score = db.Column(db.Float, nullable=False, default=0)
+    risk_tier = db.Column(db.String(10), nullable=False, default='low')
+    computed_at = db.Column(db.DateTime, default=lambda: get_oman_time())
+
+    __table_args__ = (
+        db.Index('ix_student_attendance_summaries_school_id_risk', 'school_id', 'risk_score'),
+        db.Index('ix_student_attendance_summaries_student_id', 'student_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'student_id': self.student_id,
+            'school_id': self.school_id,
+            'class_id': self.class_id,
+            'term_start': self.term_start.isoformat() if self.term_start else None,
+            'as_of_date': self.as_of_date.isoformat() if self.as_of_date else None,
+            'total_records': self.total_records,
+            'total_days': self.total_days,
+            'present_count': self.present_count,
+            'absent_count': self.absent_count,
+            'excused_count': self.excused_count,
+            'late_count': self.late_count,
+            'absent_days': self.absent_days,
+            'last_absence_date': self.last_absence_date.isoformat() if self.last_absence_date else None,
+            'current_streak': self.current_streak,
+            'longest_streak': self.longest_streak,
+            'risk_score': round(self.risk_score or 0, 3),
+            'risk_tier': self.risk_tier
+        }
+
+
 
 class News(db.Model):
     __tablename__ = 'news'
@@ -393,6 +481,13 @@ class ActionLog(db.Model):
     description = db.Column(db.Text, nullable=True)
     timestamp = db.Column(db.DateTime, default=get_oman_time().utcnow)
     status_code = db.Column(db.Integer)
+    # Copied from the acting user at log time so view_logs can filter without joining users
+    school_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_action_logs_school_id_timestamp_id', 'school_id', 'timestamp', 'id'),
+        db.Index('ix_action_logs_timestamp_id', 'timestamp', 'id'),
+    )
 
 
 
@@ -482,6 +577,83 @@ class BusScan(db.Model):
         }
 
 
+class ForgottenStudentAlert(db.Model):
+    """One row per bus per day once drivers/admins were alerted about students left on it"""
+    __tablename__ = 'forgotten_student_alerts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    bus_id = db.Column(db.Integer, db.ForeignKey('buses.id'), nullable=False)
+    school_id = db.Column(db.Integer, db.ForeignKey('schools.id'), nullable=False)
+    alert_date = db.Column(db.Date, nullable=False)
+    students_count = db.Column(db.Integer, nullable=False, default=0)
+    student_ids = db.Column(db.Text, nullable=True)  # JSON array of student IDs still on the bus
+    created_at = db.Column(db.DateTime, default=lambda: get_oman_time())
+
+    __table_args__ = (
+        db.UniqueConstraint('bus_id', 'alert_date', name='unique_bus_alert_date'),
+        db.Index('ix_forgotten_student_alerts_school_id_alert_date', 'school_id', 'alert_date'),
+    )
+
+    def to_dict(self):
+        import json
+        return {
+            'id': self.id,
+            'bus_id': self.bus_id,
+            'school_id': self.school_id,
+            'alert_date': self.alert_date.isoformat() if self.alert_date else None,
+            'students_count': self.students_count,
+            'student_ids': json.loads(self.student_ids) if self.student_ids else [],
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class DataArchiveRun(db.Model):
+    """A closed date range moved from a live table into its <table>_archive copy"""
+    __tablename__ = 'data_archive_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    range_start = db.Column(db.Date, nullable=False)
+    range_end = db.Column(db.Date, nullable=False)  # exclusive
+    rows_archived = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, default=lambda: get_oman_time())
+
+    __table_args__ = (
+        db.UniqueConstraint('table_name', 'range_start', name='unique_archive_table_range'),
+    )
+
+
+class SchoolCalendar(db.Model):
+    """
+    A school's calendar entries: 'term' rows bound the teaching year, 'holiday'
+    rows (one day or a break) are days off. Dates are inclusive.
+    """
+    __tablename__ = 'school_calendar'
+
+    id = db.Column(db.Integer, primary_key=True)
+    school_id = db.Column(db.Integer, db.ForeignKey('schools.id', ondelete='CASCADE'), nullable=False)
+    entry_type = db.Column(db.String(20), nullable=False, default='holiday')  # 'holiday' or 'term'
+    name = db.Column(db.String(255), nullable=True)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: get_oman_time())
+
+    __table_args__ = (
+        db.Index('ix_school_calendar_school_id_start_date', 'school_id', 'start_date'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'school_id': self.school_id,
+            'entry_type': self.entry_type,
+            'name': self.name,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
 
 
 # Timetable Models
@@ -634,6 +806,30 @@ class TimetableSchedule(db.Model):
         }
 
 
+class ExpectedSession(db.Model):
+    """
+    One lesson slot from the school's active timetable, resolved to real ids:
+    (class, teacher, weekday, period). Rebuilt by app/services/expected_sessions.py
+    whenever a timetable is activated or its teacher mappings change.
+    weekday follows date.weekday() / MySQL WEEKDAY(): Monday = 0 ... Sunday = 6.
+    """
+    __tablename__ = 'expected_sessions'
+
+    id = db.Column(db.Integer, primary_key=True)
+    school_id = db.Column(db.Integer, db.ForeignKey('schools.id', ondelete='CASCADE'), nullable=False)
+    timetable_id = db.Column(db.Integer, db.ForeignKey('timetables.id', ondelete='CASCADE'), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey('classes.id', ondelete='CASCADE'), nullable=True)  # None if the timetable class has no match
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id', ondelete='CASCADE'), nullable=True)  # None until the teacher is mapped
+    weekday = db.Column(db.SmallInteger, nullable=False)
+    period = db.Column(db.SmallInteger, nullable=False)
+    subject_name = db.Column(db.String(100), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_expected_sessions_school_weekday_class', 'school_id', 'weekday', 'class_id', 'period'),
+        db.Index('ix_expected_sessions_teacher_weekday', 'teacher_id', 'weekday', 'period'),
+    )
+
+
 
 class TeacherSubstitution(db.Model):
     """Records when a teacher is absent and needs substitution"""
@@ -740,17 +936,22 @@ class Notification(db.Model):
     __tablename__ = 'notifications'
     
     id = db.Column(db.Integer, primary_key=True)
-    school_id = db.Column(db.Integer, db.ForeignKey('schools.id'), nullable=False)
+    school_id = db.Column(db.Integer, db.ForeignKey('schools.id'), nullable=True)  # None = global broadcast
     
     # Notification content
     title = db.Column(db.String(255), nullable=False)
-    message = db.Column(db.Text, nullable=False)
+    message = db.Column(db.Text, nullable=True)  # None when rendered from template_key at read time
     type = db.Column(db.String(50), nullable=False)  # 'attendance', 'bus', 'behavior', 'timetable', 'substitution', 'news', 'general'
+    template_key = db.Column(db.String(50), nullable=True)  # e.g. 'attendance.v1' (see notification_templates)
+    template_params = db.Column(db.Text, nullable=True)  # Compact JSON parameters for template_key
+    digest_key = db.Column(db.String(100), nullable=True)  # e.g. 'attendance:<student_id>:<date>' for updatable daily digests
     priority = db.Column(db.String(20), nullable=False, default='normal')  # 'low', 'normal', 'high', 'urgent'
+    priority_rank = db.Column(db.SmallInteger, nullable=False, default=2)  # Feed sort key kept in sync with priority (see PRIORITY_RANKS)
     
     # Target users
     target_role = db.Column(db.String(50), nullable=True)  # 'student', 'teacher', 'school_admin', 'analyst', 'driver' or None for specific users
     target_user_ids = db.Column(db.Text, nullable=True)  # JSON array of specific user IDs
+    # Broadcasts (school/global + roles) are stored as NotificationAudience rows instead
     target_class_ids = db.Column(db.Text, nullable=True)  # JSON array of class IDs (for class-specific notifications)
     
     # Related entities (for linking notifications to specific records)
@@ -766,20 +967,44 @@ class Notification(db.Model):
     # Action link (optional)
     action_url = db.Column(db.String(500), nullable=True)  # Deep link to specific page
 
-    __table_args__ = (db.Index('ix_notifications_school_id_is_active', 'school_id', 'is_active'),)
+    __table_args__ = (
+        db.Index('ix_notifications_school_id_is_active', 'school_id', 'is_active'),
+        db.Index('ix_notifications_feed', 'school_id', 'is_active', 'priority_rank', 'created_at', 'id'),
+        db.UniqueConstraint('digest_key', name='ux_notifications_digest_key'),
+    )
+
+    # The feed sorts by (priority_rank, created_at, id) all descending, so one
+    # backward scan of ix_notifications_feed serves it: urgent first, unknown last
+    PRIORITY_RANKS = {'urgent': 4, 'high': 3, 'normal': 2, 'low': 1}
+
+    @validates('priority')
+    def _sync_priority_rank(self, key, priority):
+        self.priority_rank = self.PRIORITY_RANKS.get(priority, 0)
+        return priority
 
     # Relationships
     school = db.relationship('School', backref='notifications')
     creator = db.relationship('User', foreign_keys=[created_by], backref='notifications_created')
     reads = db.relationship('NotificationRead', back_populates='notification', cascade='all, delete-orphan')
+    audiences = db.relationship('NotificationAudience', back_populates='notification', cascade='all, delete-orphan')
     
+    def rendered_message(self):
+        """The stored message, or the message rendered from template_key and template_params"""
+        if self.template_key:
+            from app.services.notification_templates import render_message
+            rendered = render_message(self.template_key, self.template_params)
+            if rendered is not None:
+                return rendered
+        return self.message or ''
+
     def to_dict(self):
         import json
         return {
             'id': self.id,
             'school_id': self.school_id,
+            'is_global': self.school_id is None,
             'title': self.title,
-            'message': self.message,
+            'message': self.rendered_message(),
             'type': self.type,
             'priority': self.priority,
             'target_role': self.target_role,
@@ -821,6 +1046,28 @@ class NotificationRead(db.Model):
         }
 
 
+class NotificationAudience(db.Model):
+    """A role (in one school, or in every school) that a broadcast notification is addressed to"""
+    __tablename__ = 'notification_audiences'
+
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(db.Integer, db.ForeignKey('notifications.id', ondelete='CASCADE'), nullable=False)
+    school_id = db.Column(db.Integer, db.ForeignKey('schools.id', ondelete='CASCADE'), nullable=True)  # None = all schools
+    role = db.Column(db.String(50), nullable=False)
+
+    notification = db.relationship('Notification', back_populates='audiences')
+
+    __table_args__ = (
+        db.Index('ix_notification_audiences_role_school', 'role', 'school_id', 'notification_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'school_id': self.school_id,
+            'role': self.role
+        }
+
+
 class PushSubscription(db.Model):
     """Store push notification subscriptions for PWA (Web Push + FCM)"""
     __tablename__ = 'push_subscriptions'
@@ -0,0 +1,242 @@
+# app/principal.py
+"""
+Request identity without a polymorphic User load on every request.
+
+Login embeds role, school_id, is_active and a token version ("tv") as signed
+JWT claims. current_principal() reads them from the verified token, so routes
+that only need the caller's role and school never touch the database. When the
+full ORM user is needed, load_user() serves it from a small TTL cache.
+
+Changing a user's role, school or activation must call bump_token_version():
+tokens carrying an older version are then rejected by the JWT blocklist check.
+"""
+import threading
+import time
+import logging
+from flask import g, has_request_context
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import inspect, event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from app import db
+from app.models import User
+from app.cache import get_redis, mark_redis_down
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_ENTRIES = 5000
+TOKEN_VERSION_TTL_SECONDS = 60 * 60        # Redis copy of users.token_version
+LOCAL_TOKEN_VERSION_TTL_SECONDS = 30       # per-worker fallback when Redis is down
+
+_lock = threading.Lock()
+_user_cache = {}            # user_id -> (expires_at, token_version, detached user snapshot)
+_local_token_versions = {}  # user_id -> (expires_at, token_version or None)
+
+
+class Principal:
+    """The authenticated caller, built from JWT claims. Attribute names mirror User."""
+
+    __slots__ = ('id', 'user_role', 'school_id', 'is_active', 'token_version', '_user')
+
+    def __init__(self, user_id, user_role, school_id, is_active, token_version, user=None):
+        self.id = user_id
+        self.user_role = user_role
+        self.school_id = school_id
+        self.is_active = is_active
+        self.token_version = token_version
+        self._user = user
+
+    @property
+    def user(self):
+        """Full ORM user (Student/Teacher/Driver/User), loaded at most once per request."""
+        if self._user is None:
+            self._user = load_user(self.id, self.token_version)
+        return self._user
+
+
+def build_token_claims(user):
+    """Additional JWT claims written at login."""
+    return {
+        'role': user.user_role,
+        'school_id': user.school_id,
+        'is_active': bool(user.is_active),
+        'tv': user.token_version or 0
+    }
+
+
+def current_principal():
+    """Return the Principal for the current request (requires a verified JWT)."""
+    if has_request_context() and getattr(g, '_current_principal', None) is not None:
+        return g._current_principal
+
+    user_id = int(get_jwt_identity())
+    claims = get_jwt()
+
+    if 'role' in claims and 'tv' in claims:
+        principal = Principal(
+            user_id,
+            claims.get('role'),
+            claims.get('school_id'),
+            claims.get('is_active', True),
+            claims.get('tv', 0)
+        )
+    else:
+        # Tokens issued before claims were added: fall back to the cached user
+        user = load_user(user_id)
+        if user is None:
+            return None
+        principal = Principal(
+            user.id, user.user_role, user.school_id, user.is_active, user.token_version or 0, user=user
+        )
+
+    if has_request_context():
+        g._current_principal = principal
+    return principal
+
+
+def get_current_user():
+    """Full ORM user for the current request, or None."""
+    principal = current_principal()
+    return principal.user if principal else None
+
+
+def _snapshot(user):
+    """Detached copy of a loaded user with all column attributes populated."""
+    mapper = inspect(user).mapper
+    snapshot = mapper.class_(**{attr.key: getattr(user, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def load_user(user_id, token_version=None):
+    """
+    Return the user attached to the current session, served from a TTL cache
+    when possible. A cached entry is ignored if its token version differs.
+    """
+    user_id = int(user_id)
+    now = time.monotonic()
+
+    with _lock:
+        entry = _user_cache.get(user_id)
+    if entry and entry[0] > now and (token_version is None or entry[1] == token_version):
+        try:
+            return db.session.merge(entry[2], load=False)
+        except Exception as e:
+            logger.warning(f"Cached user {user_id} could not be merged: {str(e)}")
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+
+    try:
+        snapshot = _snapshot(user)
+        with _lock:
+            if len(_user_cache) >= USER_CACHE_MAX_ENTRIES:
+                # Drop the entry closest to expiry
+                oldest = min(_user_cache, key=lambda key: _user_cache[key][0])
+                _user_cache.pop(oldest, None)
+            _user_cache[user_id] = (now + USER_CACHE_TTL_SECONDS, user.token_version or 0, snapshot)
+    except Exception as e:
+        logger.warning(f"Could not cache user {user_id}: {str(e)}")
+    return user
+
+
+def invalidate_user(user_id):
+    """Drop this worker's cached copy of a user (e.g. after a profile edit)."""
+    with _lock:
+        _user_cache.pop(int(user_id), None)
+        _local_token_versions.pop(int(user_id), None)
+
+
+def _token_version_key(user_id):
+    return f"user_token_version:{user_id}"
+
+
+def _forget_token_versions(user_ids):
+    for user_id in user_ids:
+        invalidate_user(user_id)
+
+    client = get_redis()
+    if client is not None:
+        try:
+            client.delete(*[_token_version_key(user_id) for user_id in user_ids])
+        except Exception:
+            mark_redis_down()
+
+
+def bump_token_version(user_ids):
+    """
+    Invalidate outstanding tokens for the given users after a role, school or
+    activation change. Call inside the transaction that makes the change;
+    cached versions are dropped again once it commits.
+    """
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    user_ids = [int(user_id) for user_id in user_ids]
+    if not user_ids:
+        return
+
+    User.query.filter(User.id.in_(user_ids)).update(
+        {User.token_version: User.token_version + 1}, synchronize_session='fetch'
+    )
+    db.session.info.setdefault('bumped_token_user_ids', set()).update(user_ids)
+    _forget_token_versions(user_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _forget_committed_token_versions(session):
+    # A request that read the old version before our commit may have re-cached it
+    user_ids = session.info.pop('bumped_token_user_ids', None)
+    if user_ids:
+        _forget_token_versions(user_ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_bumped_token_versions(session):
+    session.info.pop('bumped_token_user_ids', None)
+
+
+def _current_token_version(user_id):
+    """users.token_version for a user (None if the user no longer exists)."""
+    client = get_redis()
+    if client is not None:
+        try:
+            cached = client.get(_token_version_key(user_id))
+            if cached is not None:
+                return None if cached == '' else int(cached)
+        except Exception:
+            mark_redis_down()
+            client = None
+
+    now = time.monotonic()
+    if client is None:
+        with _lock:
+            entry = _local_token_versions.get(user_id)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    row = db.session.query(User.token_version).filter(User.id == user_id).first()
+    version = (row[0] or 0) if row else None
+
+    if client is not None:
+        try:
+            client.set(_token_version_key(user_id), '' if version is None else version, ex=TOKEN_VERSION_TTL_SECONDS)
+        except Exception:
+            mark_redis_down()
+    else:
+        with _lock:
+            _local_token_versions[user_id] = (now + LOCAL_TOKEN_VERSION_TTL_SECONDS, version)
+    return version
+
+
+def is_token_revoked(jwt_header, jwt_payload):
+    """JWT blocklist callback: reject tokens issued before the user's last version bump."""
+    try:
+        user_id = int(jwt_payload.get('sub'))
+    except (TypeError, ValueError):
+        return True
+
+    current_version = _current_token_version(user_id)
+    if current_version is None:
+        return True
+    return int(jwt_payload.get('tv', 0)) < current_version
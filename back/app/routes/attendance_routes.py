@@ -2,7 +2,7 @@
 
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import Teacher, Class, Attendance, Student,User,Subject,ConformAtt
+from app.models import Teacher, Class, Attendance, Student,Subject,ConformAtt, StudentDayAttendance, StudentAttendanceSummary
 from datetime import datetime , date ,timedelta
 from app import db
 from collections import defaultdict
@@ -13,6 +13,16 @@ from ibulk_sms_service import get_attendance_sms_service, get_ibulk_sms_service
 from flask_cors import CORS
 from app.routes.notification_routes import create_notification
 from app.services.notification_service import notify_student_attendance
+from app.services.attendance_days import refresh_class_day
+from app.services.absence_analytics import compute_absence_metrics, absent_dates, risk_tier
+from app.services.attendance_snapshot import snapshot_for_range, record_class_day
+from app.services.student_summaries import get_student_summary
+from app.services.partitioning import current_academic_year_start, model_in_range
+from app.services.teacher_compliance import get_teacher_compliance, invalidate_teacher_compliance
+from app.services.school_calendar import working_days_between, school_weeks, expected_sessions
+from app.services.expected_sessions import expected_periods_by_class, expected_sessions_by_teacher, missing_sessions
+from app.principal import current_principal, get_current_user
+import numpy as np
 
 
 
@@ -120,15 +130,21 @@ def take_attendances():
             db.session.rollback()
             return jsonify(message=f"Error processing attendance: {str(e)}"), 400
 
+    # Rebuild the per-day bitmask rows for this class and date in the same transaction
+    db.session.flush()
+    refresh_class_day(class_id, attendance_date)
+
     # Commit changes once for all records
     db.session.commit()
+    invalidate_teacher_compliance(class_obj.school_id)
+    record_class_day(class_obj.school_id, class_id, attendance_date.date() if isinstance(attendance_date, datetime) else attendance_date)
 
     # Create notifications for absent, late, and excused students
     # BEST PRACTICE: Only notify affected students, not admins for every attendance issue
     try:
         from app.services.notification_utils import should_notify_admin_for_attendance, get_users_by_role
         
-        user = User.query.get(teacher_id)
+        user = current_principal()
         if user and user.school_id:
             absent_students = []
             excused_students = []
@@ -224,9 +240,8 @@ def take_attendances():
 @attendance_blueprint.route('/attendanceByClass/<int:class_id>', methods=['GET'])
 @jwt_required()
 def get_attendance_by_class(class_id):
-    teacher_id = get_jwt_identity()
     class_obj = Class.query.get(class_id)
-    user = User.query.get(teacher_id)
+    user = current_principal()
 
     if user.user_role !='admin':
     # Validate class ownership
@@ -278,9 +293,8 @@ def get_attendance_by_class(class_id):
 @attendance_blueprint.route('/attendanceByClass_subject/<int:class_id>', methods=['GET'])
 @jwt_required()
 def get_attendance_by_class_and_subject(class_id):
-    teacher_id = get_jwt_identity()
     class_obj = Class.query.get(class_id)
-    user = User.query.get(teacher_id)
+    user = current_principal()
 
     # Authorization validation (uncomment if needed)
     # if user.user_role != 'admin':
@@ -302,19 +316,20 @@ def get_attendance_by_class_and_subject(class_id):
 
     day_start = datetime.combine(selected_date, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
 
     # Query attendance for this class on the selected date (index-friendly range)
-    query = Attendance.query.filter(
+    query = db.session.query(attendance_rows).filter(
         and_(
-            Attendance.class_id == class_id,
-            Attendance.date >= day_start,
-            Attendance.date < day_end,
+            attendance_rows.class_id == class_id,
+            attendance_rows.date >= day_start,
+            attendance_rows.date < day_end,
         )
     )
 
     # If a subject_id is provided, filter by subject_id
     if selected_subject_id:
-        query = query.filter(Attendance.subject_id == selected_subject_id)
+        query = query.filter(attendance_rows.subject_id == selected_subject_id)
 
     attendances = query.all()
 
@@ -352,8 +367,7 @@ def get_attendance_by_class_and_subject(class_id):
 @jwt_required()
 def get_attendance_summary_all_classes():
     try:
-        teacher_id = get_jwt_identity()
-        user = User.query.get(teacher_id)
+        user = current_principal()
 
         # Authorization validation
         if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -388,61 +402,62 @@ def get_attendance_summary_all_classes():
 
         day_start = datetime.combine(selected_date, datetime.min.time())
         day_end = day_start + timedelta(days=1)
+        attendance_rows = model_in_range(Attendance, day_start, day_end)
 
         # Get all attendance data for all classes in one optimized query
         attendance_stats = db.session.query(
-            Attendance.class_id,
-            func.count(func.distinct(Attendance.student_id)).label('total_students'),
-            func.count(func.distinct(case((Attendance.is_present == True, Attendance.student_id), else_=None))).label('total_present'),
-            func.count(func.distinct(case((Attendance.is_Acsent == True, Attendance.student_id), else_=None))).label('total_absent'),
-            func.count(func.distinct(case((Attendance.is_Excus == True, Attendance.student_id), else_=None))).label('total_excused'),
-            func.count(func.distinct(case((Attendance.is_late == True, Attendance.student_id), else_=None))).label('total_late')
+            attendance_rows.class_id,
+            func.count(func.distinct(attendance_rows.student_id)).label('total_students'),
+            func.count(func.distinct(case((attendance_rows.is_present == True, attendance_rows.student_id), else_=None))).label('total_present'),
+            func.count(func.distinct(case((attendance_rows.is_Acsent == True, attendance_rows.student_id), else_=None))).label('total_absent'),
+            func.count(func.distinct(case((attendance_rows.is_Excus == True, attendance_rows.student_id), else_=None))).label('total_excused'),
+            func.count(func.distinct(case((attendance_rows.is_late == True, attendance_rows.student_id), else_=None))).label('total_late')
         ).filter(
             and_(
-                Attendance.class_id.in_(class_ids),
-                Attendance.date >= day_start,
-                Attendance.date < day_end,
+                attendance_rows.class_id.in_(class_ids),
+                attendance_rows.date >= day_start,
+                attendance_rows.date < day_end,
             )
-        ).group_by(Attendance.class_id).all()
+        ).group_by(attendance_rows.class_id).all()
 
         # Get all absent/excused students with their details in one optimized query
         absent_students_data = db.session.query(
-            Attendance.class_id,
-            Attendance.student_id,
-            Attendance.teacher_id,
-            Attendance.subject_id,
-            Attendance.class_time_num,
-            Attendance.ExcusNote,
-            Attendance.is_Acsent,
-            Attendance.is_Excus,
-            Attendance.is_late,
+            attendance_rows.class_id,
+            attendance_rows.student_id,
+            attendance_rows.teacher_id,
+            attendance_rows.subject_id,
+            attendance_rows.class_time_num,
+            attendance_rows.ExcusNote,
+            attendance_rows.is_Acsent,
+            attendance_rows.is_Excus,
+            attendance_rows.is_late,
             Student.fullName.label('student_name'),
             Teacher.fullName.label('teacher_name'),
             Subject.name.label('subject_name')
         ).join(
-            Student, Student.id == Attendance.student_id
+            Student, Student.id == attendance_rows.student_id
         ).join(
-            Teacher, Teacher.id == Attendance.teacher_id
+            Teacher, Teacher.id == attendance_rows.teacher_id
         ).join(
-            Subject, Subject.id == Attendance.subject_id
+            Subject, Subject.id == attendance_rows.subject_id
         ).filter(
             and_(
-                Attendance.class_id.in_(class_ids),
-                Attendance.date >= day_start,
-                Attendance.date < day_end,
-                or_(Attendance.is_Acsent == True, Attendance.is_Excus == True, Attendance.is_late == True)
+                attendance_rows.class_id.in_(class_ids),
+                attendance_rows.date >= day_start,
+                attendance_rows.date < day_end,
+                or_(attendance_rows.is_Acsent == True, attendance_rows.is_Excus == True, attendance_rows.is_late == True)
             )
         ).all()
 
         # Get unique class_time_nums for each class in one optimized query
         class_time_nums_data = db.session.query(
-            Attendance.class_id,
-            Attendance.class_time_num
+            attendance_rows.class_id,
+            attendance_rows.class_time_num
         ).filter(
             and_(
-                Attendance.class_id.in_(class_ids),
-                Attendance.date >= day_start,
-                Attendance.date < day_end,
+                attendance_rows.class_id.in_(class_ids),
+                attendance_rows.date >= day_start,
+                attendance_rows.date < day_end,
             )
         ).distinct().all()
 
@@ -480,6 +495,9 @@ def get_attendance_summary_all_classes():
                 "is_late": record.is_late
             })
 
+        # Periods each class should have today, from the active timetable (None = no timetable)
+        expected_by_class = expected_periods_by_class(user.school_id, selected_date)
+
         # Build response for each class
         for class_id, class_info in class_map.items():
             stats = stats_dict.get(class_id)
@@ -487,8 +505,11 @@ def get_attendance_summary_all_classes():
             absent_students = absent_students_dict.get(class_id, [])
 
             # Calculate missing class_time_nums
-            all_possible_time_nums = set(range(1, 9))  # All possible class_time_nums (1-8)
-            not_in_class_time_nums = list(all_possible_time_nums - set(class_time_nums))
+            if expected_by_class is not None:
+                all_possible_time_nums = expected_by_class.get(class_id, set())
+            else:
+                all_possible_time_nums = set(range(1, 9))  # No timetable: assume periods 1-8
+            not_in_class_time_nums = sorted(all_possible_time_nums - set(class_time_nums))
 
             # Update counters
             total_not_in_class_time_nums += len(not_in_class_time_nums)
@@ -513,7 +534,8 @@ def get_attendance_summary_all_classes():
             "date": selected_date.strftime('%Y-%m-%d'),
             "attendance_summary": attendance_summary,
             "total_not_in_class_time_nums": total_not_in_class_time_nums,  # Total missing class_time_nums
-            "total_class_time_nums": total_class_time_nums  # Total present class_time_nums
+            "total_class_time_nums": total_class_time_nums,  # Total present class_time_nums
+            "expected_source": "timetable" if expected_by_class is not None else "default_periods"
         }), 200
 
     except Exception as e:
@@ -526,8 +548,7 @@ def get_attendance_summary_all_classes():
 @jwt_required()
 def get_teacher_report():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = current_principal()
 
         # Authorization validation
         if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -569,67 +590,46 @@ def get_teacher_report():
                 "total_attendance_records": 0
             }), 200
 
+        # One grouped pass for every teacher of the school (cached per school and range)
+        compliance_school_id = None if user.user_role == 'admin' else user.school_id
+        compliance = get_teacher_compliance(compliance_school_id, from_date, to_date)
+        # Sessions each teacher's timetable expects on the school's working days
+        timetable_expected = expected_sessions_by_teacher(compliance_school_id, from_date, to_date)
+
         teacher_summary = []
         total_classes_taught = 0
         total_attendance_records = 0
 
         for teacher in teachers:
-            # Get classes taught by this teacher
-            classes_taught = Class.query.filter_by(teacher_id=teacher.id).all()
-            class_names = [cls.name for cls in classes_taught]
-
-            # Calculate recorded days (days with at least one record) for the date range (index-friendly)
-            range_start = datetime.combine(from_date, datetime.min.time())
-            range_end = datetime.combine(to_date, datetime.min.time()) + timedelta(days=1)
-            recorded_days = db.session.query(
-                func.count(func.distinct(func.date(Attendance.date)))
-            ).filter(
-                and_(
-                    Attendance.teacher_id == teacher.id,
-                    Attendance.date >= range_start,
-                    Attendance.date < range_end
-                )
-            ).scalar()
+            stats = compliance.get(teacher.id, {})
+            class_names = stats.get('classes', [])
+            recorded_days = stats.get('recorded_days', 0)
+            teacher_actual_classes = stats.get('recorded_sessions', 0)
 
-            # Calculate working days in the date range
-            working_days = 0
-            current_date = from_date
-            while current_date <= to_date:
-                # Sunday = 6, Monday = 0, Tuesday = 1, Wednesday = 2, Thursday = 3
-                if current_date.weekday() in [6, 0, 1, 2, 3]:  # Sunday to Thursday
-                    working_days += 1
-                current_date += timedelta(days=1)
+            # Working days from the teacher's school calendar (holidays and breaks excluded)
+            working_days = working_days_between(teacher.school_id, from_date, to_date)
+            number_of_weeks = round(school_weeks(working_days), 1)
 
             # Calculate teacher attendance based on weekly class number
             teacher_weekly_classes = teacher.week_Classes_Number or 0
 
-            # Calculate number of weeks in the date range
-            days_diff = (to_date - from_date).days
-            number_of_weeks = max(1, (days_diff + 1) // 7)  # At least 1 week, round up for partial weeks
-
-            # Calculate expected classes based on weeks
-            total_expected_classes = teacher_weekly_classes * number_of_weeks
-
-            # Get total actual classes recorded for additional info (index-friendly)
-            teacher_actual_classes = db.session.query(
-                func.count(func.distinct(
-                    func.concat(
-                        Attendance.class_id, '-', Attendance.class_time_num, '-', func.date(Attendance.date)
-                    )
-                ))
-            ).filter(
-                and_(
-                    Attendance.teacher_id == teacher.id,
-                    Attendance.date >= range_start,
-                    Attendance.date < range_end
-                )
-            ).scalar()
+            if teacher.id in timetable_expected:
+                # Expected = the teacher's timetable slots on working days; only sessions on those slots count
+                total_expected_classes = timetable_expected[teacher.id]
+                on_schedule_classes = min(stats.get('matched_sessions', 0), total_expected_classes)
+                expected_source = 'timetable'
+            else:
+                # Calculate expected classes based on the school weeks in the range
+                total_expected_classes = expected_sessions(teacher_weekly_classes, working_days)
+                on_schedule_classes = teacher_actual_classes
+                expected_source = 'weekly_classes'
+            missing_classes = max(total_expected_classes - on_schedule_classes, 0)
 
             # Calculate attendance percentage based on actual classes vs expected classes
-            teacher_attendance_percentage = round((teacher_actual_classes / total_expected_classes * 100) if total_expected_classes > 0 else 0, 2)
+            teacher_attendance_percentage = round((on_schedule_classes / total_expected_classes * 100) if total_expected_classes > 0 else 0, 2)
 
             # Update global counters
-            total_classes_taught += len(classes_taught)
+            total_classes_taught += len(class_names)
             total_attendance_records += teacher_actual_classes
 
             teacher_summary.append({
@@ -637,14 +637,16 @@ def get_teacher_report():
                 "teacher_name": teacher.fullName,
                 "job_name": teacher.job_name,
                 "classes_taught": class_names,
-                "total_classes": len(classes_taught),
+                "total_classes": len(class_names),
                 "weekly_classes": teacher_weekly_classes,
                 "actual_classes": teacher_actual_classes,
                 "teacher_attendance_percentage": teacher_attendance_percentage,
                 "working_days": working_days,
                 "recorded_days": recorded_days,
                 "number_of_weeks": number_of_weeks,
-                "total_expected_classes": total_expected_classes
+                "total_expected_classes": total_expected_classes,
+                "missing_classes": missing_classes,
+                "expected_source": expected_source
             })
 
         return jsonify({
@@ -663,12 +665,60 @@ def get_teacher_report():
         return jsonify(message=f"Internal server error: {str(e)}"), 500
 
 
+@attendance_blueprint.route('/missing_sessions', methods=['GET'])
+@jwt_required()
+def get_missing_sessions():
+    """
+    Timetable slots with no attendance recorded on a day (default today),
+    grouped by teacher. Teachers only see their own slots.
+    """
+    user = current_principal()
+    if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
+        return jsonify(message="Unauthorized access."), 403
+
+    school_id = user.school_id if user.user_role != 'admin' else request.args.get('school_id', type=int)
+    if not school_id:
+        return jsonify(message="School ID required."), 400
+
+    selected_date = _parse_date(request.args.get('date')) or get_oman_time().date()
+    missing = missing_sessions(school_id, selected_date)
+    if missing is None:
+        return jsonify(date=selected_date.isoformat(), has_timetable=False, total_missing=0, teachers=[]), 200
+
+    if user.user_role == 'teacher':
+        missing = [slot for slot in missing if slot['teacher_id'] == user.id]
+
+    class_names = {c.id: c.name for c in Class.query.filter_by(school_id=school_id).all()}
+    teacher_ids = {slot['teacher_id'] for slot in missing if slot['teacher_id']}
+    teacher_names = {t.id: t.fullName for t in Teacher.query.filter(Teacher.id.in_(teacher_ids)).all()} if teacher_ids else {}
+
+    by_teacher = {}
+    for slot in missing:
+        entry = by_teacher.setdefault(slot['teacher_id'], {
+            "teacher_id": slot['teacher_id'],
+            "teacher_name": teacher_names.get(slot['teacher_id']),
+            "missing_sessions": []
+        })
+        entry["missing_sessions"].append({
+            "class_id": slot['class_id'],
+            "class_name": class_names.get(slot['class_id']),
+            "class_time_num": slot['period'],
+            "subject_name": slot['subject_name']
+        })
+
+    return jsonify(
+        date=selected_date.isoformat(),
+        has_timetable=True,
+        total_missing=len(missing),
+        teachers=list(by_teacher.values()),
+    ), 200
+
+
 @attendance_blueprint.route('/teacherHistory/<int:teacher_id>', methods=['GET'])
 @jwt_required()
 def get_teacher_history(teacher_id):
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = current_principal()
 
         # Authorization validation
         if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -708,37 +758,39 @@ def get_teacher_history(teacher_id):
         classes_taught = Class.query.filter_by(teacher_id=teacher_id).all()
         class_ids = [cls.id for cls in classes_taught]
 
+        attendance_rows = model_in_range(Attendance, start_date)
+
         # Get detailed attendance history
         attendance_history = db.session.query(
-            Attendance.date,
-            Attendance.class_id,
-            Attendance.subject_id,
-            Attendance.class_time_num,
+            attendance_rows.date,
+            attendance_rows.class_id,
+            attendance_rows.subject_id,
+            attendance_rows.class_time_num,
             Class.name.label('class_name'),
             Subject.name.label('subject_name'),
-            func.count(Attendance.student_id).label('total_students'),
-            func.count(case((Attendance.is_present == True, Attendance.student_id), else_=None)).label('present_students'),
-            func.count(case((Attendance.is_Acsent == True, Attendance.student_id), else_=None)).label('absent_students'),
-            func.count(case((Attendance.is_late == True, Attendance.student_id), else_=None)).label('late_students'),
-            func.count(case((Attendance.is_Excus == True, Attendance.student_id), else_=None)).label('excused_students')
+            func.count(attendance_rows.student_id).label('total_students'),
+            func.count(case((attendance_rows.is_present == True, attendance_rows.student_id), else_=None)).label('present_students'),
+            func.count(case((attendance_rows.is_Acsent == True, attendance_rows.student_id), else_=None)).label('absent_students'),
+            func.count(case((attendance_rows.is_late == True, attendance_rows.student_id), else_=None)).label('late_students'),
+            func.count(case((attendance_rows.is_Excus == True, attendance_rows.student_id), else_=None)).label('excused_students')
         ).join(
-            Class, Class.id == Attendance.class_id
+            Class, Class.id == attendance_rows.class_id
         ).join(
-            Subject, Subject.id == Attendance.subject_id
+            Subject, Subject.id == attendance_rows.subject_id
         ).filter(
             and_(
-                Attendance.teacher_id == teacher_id,
-                Attendance.date >= start_date,
-                Attendance.date <= end_date
+                attendance_rows.teacher_id == teacher_id,
+                attendance_rows.date >= start_date,
+                attendance_rows.date <= end_date
             )
         ).group_by(
-            Attendance.date,
-            Attendance.class_id,
-            Attendance.subject_id,
-            Attendance.class_time_num
+            attendance_rows.date,
+            attendance_rows.class_id,
+            attendance_rows.subject_id,
+            attendance_rows.class_time_num
         ).order_by(
-            Attendance.date.desc(),
-            Attendance.class_time_num
+            attendance_rows.date.desc(),
+            attendance_rows.class_time_num
         ).all()
 
         # Group by date for easier frontend consumption
@@ -786,13 +838,21 @@ def get_teacher_history(teacher_id):
         # Calculate teacher attendance based on weekly class number
         teacher_weekly_classes = teacher.week_Classes_Number or 0
 
-        # Calculate number of weeks in the date range
-        days_diff = (end_date - start_date).days
-        number_of_weeks = max(1, (days_diff + 1) // 7)  # At least 1 week, round up for partial weeks
-
-        # Calculate expected classes based on weeks
-        total_expected_classes = teacher_weekly_classes * number_of_weeks
-        teacher_attendance_percentage = round((total_classes / total_expected_classes * 100) if total_expected_classes > 0 else 0, 2)
+        # School weeks in the range, from the school calendar (holidays and breaks excluded)
+        working_days = working_days_between(teacher.school_id, start_date, end_date)
+        number_of_weeks = round(school_weeks(working_days), 1)
+
+        # Expected classes: the teacher's timetable slots when a timetable is active, else weekly classes per week
+        timetable_expected = expected_sessions_by_teacher(teacher.school_id, start_date, end_date).get(teacher.id)
+        if timetable_expected is not None:
+            # Same numerator as /teacherReport: only sessions on the teacher's timetable slots count
+            total_expected_classes = timetable_expected
+            stats = get_teacher_compliance(teacher.school_id, start_date, end_date).get(teacher.id, {})
+            on_schedule_classes = min(stats.get('matched_sessions', 0), total_expected_classes)
+        else:
+            total_expected_classes = expected_sessions(teacher_weekly_classes, working_days)
+            on_schedule_classes = total_classes
+        teacher_attendance_percentage = round((on_schedule_classes / total_expected_classes * 100) if total_expected_classes > 0 else 0, 2)
 
         return jsonify({
             "teacher": {
@@ -816,8 +876,11 @@ def get_teacher_history(teacher_id):
                 "total_excused": sum(day["excused_students"] for day in history_by_date.values()),
                 "overall_attendance_percentage": overall_attendance_percentage,
                 "teacher_weekly_classes": teacher_weekly_classes,
+                "working_days": working_days,
                 "number_of_weeks": number_of_weeks,
                 "total_expected_classes": total_expected_classes,
+                "on_schedule_classes": on_schedule_classes,
+                "expected_source": "timetable" if timetable_expected is not None else "weekly_classes",
                 "teacher_attendance_percentage": teacher_attendance_percentage
             },
             "history": list(history_by_date.values())
@@ -833,7 +896,7 @@ def get_teacher_history(teacher_id):
 @jwt_required()
 def get_attendance_details_by_student():
     teacher_id = get_jwt_identity()
-    user = User.query.get(teacher_id)
+    user = current_principal()
 
     # Authorization validation
     if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -864,34 +927,35 @@ def get_attendance_details_by_student():
 
     day_start = datetime.combine(selected_date, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
 
     # OPTIMIZATION 1: Single optimized query with all needed data
     # Use select_from to avoid multiple joins and get all data in one query
     attendance_records = db.session.query(
-        Attendance.class_id,
-        Attendance.student_id,
-        Attendance.class_time_num,
-        Attendance.is_Acsent,
-        Attendance.is_Excus,
-        Attendance.is_late,
-        Attendance.ExcusNote,
+        attendance_rows.class_id,
+        attendance_rows.student_id,
+        attendance_rows.class_time_num,
+        attendance_rows.is_Acsent,
+        attendance_rows.is_Excus,
+        attendance_rows.is_late,
+        attendance_rows.ExcusNote,
         Student.fullName.label('student_name'),
         Student.phone_number,
         Teacher.fullName.label('teacher_name')
-    ).select_from(Attendance).join(
-        Student, Student.id == Attendance.student_id
+    ).select_from(attendance_rows).join(
+        Student, Student.id == attendance_rows.student_id
     ).join(
-        Teacher, Teacher.id == Attendance.teacher_id
+        Teacher, Teacher.id == attendance_rows.teacher_id
     ).filter(
-        Attendance.class_id.in_(class_id_list),
-        Attendance.date >= day_start,
-        Attendance.date < day_end,
+        attendance_rows.class_id.in_(class_id_list),
+        attendance_rows.date >= day_start,
+        attendance_rows.date < day_end,
         db.or_(
-            Attendance.is_Acsent == True,
-            Attendance.is_Excus == True,
-            Attendance.is_late == True
+            attendance_rows.is_Acsent == True,
+            attendance_rows.is_Excus == True,
+            attendance_rows.is_late == True
         )
-    ).order_by( Attendance.class_id).all()
+    ).order_by( attendance_rows.class_id).all()
 
     # OPTIMIZATION 2: Use dictionaries for faster lookups
     class_data = {}
@@ -1003,7 +1067,7 @@ def get_attendance_details_by_student():
 @jwt_required()
 def get_attendance_details_by_students():
     teacher_id = get_jwt_identity()
-    user = User.query.get(teacher_id)
+    user = current_principal()
 
     # Authorization validation
     if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -1068,16 +1132,32 @@ def _parse_date(s):
         return None
 
 
+def _student_classes_in_range(student_ids, class_ids, range_start, range_end):
+    """{student_id: Class} using the student's attendance rows within the range."""
+    class_map = {c.id: c for c in Class.query.filter(Class.id.in_(class_ids)).all()}
+    student_class = {}
+    for rec in db.session.query(StudentDayAttendance.student_id, StudentDayAttendance.class_id).filter(
+        StudentDayAttendance.student_id.in_(student_ids),
+        StudentDayAttendance.class_id.in_(class_ids),
+        StudentDayAttendance.date >= range_start,
+        StudentDayAttendance.date <= range_end,
+    ).distinct().all():
+        if rec.student_id not in student_class:
+            student_class[rec.student_id] = class_map.get(rec.class_id)
+    return student_class
+
+
 @attendance_blueprint.route('/repeated_absence', methods=['GET'])
 @jwt_required()
 def get_repeated_absence():
     """
     Students with absent (هارب) or excused (غائب) on at least min_days distinct days in the date range.
     Optional start_date, end_date (YYYY-MM-DD). If not provided, uses current week (Sunday to today).
-    min_days: minimum number of days with at least one absent or excused record. all_days=true: only students absent/excused on every day in range.
+    min_days: minimum number of days with at least one absent or excused record. all_days=true: only students absent/excused on every school day in range
+    (days on which attendance was taken). Computed on a student x day matrix by app/services/absence_analytics.py.
     """
     teacher_id = get_jwt_identity()
-    user = User.query.get(teacher_id)
+    user = current_principal()
     if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
         return jsonify(message="Unauthorized access."), 403
 
@@ -1088,9 +1168,10 @@ def get_repeated_absence():
         min_days = None
 
     if user.user_role == 'teacher':
+        school_id = user.school_id
         class_ids = [c.id for c in Class.query.filter_by(teacher_id=teacher_id).all()]
     else:
-        school_id = user.school_id if user.user_role != 'admin' else request.args.get('school_id')
+        school_id = user.school_id if user.user_role != 'admin' else request.args.get('school_id', type=int)
         if not school_id:
             return jsonify(message="School ID required."), 400
         class_ids = [c.id for c in Class.query.filter_by(school_id=school_id).all()]
@@ -1124,30 +1205,15 @@ def get_repeated_absence():
     if not week_dates:
         return jsonify(week_start=range_start.isoformat(), week_end=range_end.isoformat(), min_days=min_days, students=[]), 200
 
-    # Distinct (student_id, date) where is_Acsent OR is_Excus (absent or excused)
-    range_start_dt = datetime.combine(range_start, datetime.min.time())
-    range_end_dt = datetime.combine(range_end, datetime.min.time()) + timedelta(days=1)
-    absent_per_student = defaultdict(set)
-    q = (
-        db.session.query(Attendance.student_id, func.date(Attendance.date).label('att_date'))
-        .filter(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date >= range_start_dt,
-            Attendance.date < range_end_dt,
-            or_(Attendance.is_Acsent == True, Attendance.is_Excus == True),
-        )
-        .distinct()
-    )
-    for row in q.all():
-        student_id, att_date = row.student_id, row.att_date
-        if att_date is not None:
-            absent_per_student[student_id].add(att_date)
-
-    num_days_in_range = len(week_dates)
+    # Student x school-day matrix of absent (is_Acsent) or excused (is_Excus) days, one query
+    # Served from the school's in-memory term snapshot (one-off load for older ranges)
+    matrix = snapshot_for_range(school_id, range_start, range_end).absence_matrix(class_ids, range_start, range_end)
+    metrics = compute_absence_metrics(matrix.absent)
     if all_days:
-        student_ids = [sid for sid, dates in absent_per_student.items() if len(dates) == num_days_in_range]
+        selected = np.flatnonzero(metrics['all_days'] & (metrics['days_absent'] > 0))
     else:
-        student_ids = [sid for sid, dates in absent_per_student.items() if len(dates) >= min_days]
+        selected = np.flatnonzero(metrics['days_absent'] >= min_days)
+    student_ids = [int(matrix.student_ids[row]) for row in selected]
     if not student_ids:
         return jsonify(
             week_start=range_start.isoformat(),
@@ -1159,38 +1225,25 @@ def get_repeated_absence():
 
     students = Student.query.filter(Student.id.in_(student_ids)).all()
     student_map = {s.id: s for s in students}
-    class_map = {c.id: c for c in Class.query.filter(Class.id.in_(class_ids)).all()}
-    # Student may be in one class; get first class from attendance for that student
-    student_class = {}
-    for rec in db.session.query(Attendance.student_id, Attendance.class_id).filter(
-        Attendance.student_id.in_(student_ids),
-        Attendance.class_id.in_(class_ids),
-    ).distinct().all():
-        if rec.student_id not in student_class:
-            student_class[rec.student_id] = rec.class_id
+    student_class = _student_classes_in_range(student_ids, class_ids, range_start, range_end)
 
     result = []
-    for sid in student_ids:
+    for row in selected:
+        sid = int(matrix.student_ids[row])
         s = student_map.get(sid)
         if not s:
             continue
-        dates = sorted(absent_per_student[sid])
-        cid = student_class.get(sid)
-        c = class_map.get(cid) if cid else None
-        date_strs = []
-        for d in dates:
-            if hasattr(d, 'isoformat'):
-                date_strs.append(d.isoformat())
-            else:
-                date_strs.append(str(d))
+        c = student_class.get(sid)
         result.append({
             "student_id": sid,
             "student_name": s.fullName,
             "phone_number": getattr(s, 'phone_number', None) or None,
             "class_name": c.name if c else None,
-            "class_id": cid,
-            "absent_days_count": len(dates),
-            "absent_dates": date_strs,
+            "class_id": c.id if c else None,
+            "absent_days_count": int(metrics['days_absent'][row]),
+            "absent_dates": absent_dates(matrix, row),
+            "longest_streak": int(metrics['longest_streak'][row]),
+            "current_streak": int(metrics['current_streak'][row]),
         })
 
     result.sort(key=lambda x: (-x["absent_days_count"], x["student_name"] or ""))
@@ -1204,6 +1257,140 @@ def get_repeated_absence():
     ), 200
 
 
+@attendance_blueprint.route('/absence_risk', methods=['GET'])
+@jwt_required()
+def get_absence_risk():
+    """
+    Rank students by absence risk over a window of school days.
+    Optional start_date, end_date (YYYY-MM-DD; default last 30 days, max 180 days),
+    class_id to narrow to one class, tier (high/medium/low) and limit (default 100).
+    """
+    user_id = get_jwt_identity()
+    user = current_principal()
+    if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
+        return jsonify(message="Unauthorized access."), 403
+
+    if user.user_role == 'teacher':
+        school_id = user.school_id
+        class_ids = [c.id for c in Class.query.filter_by(teacher_id=user_id).all()]
+    else:
+        school_id = user.school_id if user.user_role != 'admin' else request.args.get('school_id', type=int)
+        if not school_id:
+            return jsonify(message="School ID required."), 400
+        class_ids = [c.id for c in Class.query.filter_by(school_id=school_id).all()]
+
+    class_id = request.args.get('class_id', type=int)
+    if class_id:
+        if class_id not in class_ids:
+            return jsonify(message="Unauthorized access."), 403
+        class_ids = [class_id]
+
+    today = get_oman_time().date()
+    end_date = _parse_date(request.args.get('end_date')) or today
+    start_date = _parse_date(request.args.get('start_date')) or (end_date - timedelta(days=30))
+    if start_date > end_date:
+        start_date, end_date = end_date, start_date
+    if (end_date - start_date).days > 180:
+        start_date = end_date - timedelta(days=180)
+
+    tier_filter = request.args.get('tier')
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+
+    if not class_ids:
+        return jsonify(start_date=start_date.isoformat(), end_date=end_date.isoformat(), school_days=0, students=[]), 200
+
+    matrix = snapshot_for_range(school_id, start_date, end_date).absence_matrix(class_ids, start_date, end_date)
+    metrics = compute_absence_metrics(matrix.absent)
+
+    # Highest risk first; students with no absences are never listed
+    order = np.argsort(-metrics['risk_score'], kind='stable')
+    order = order[metrics['days_absent'][order] > 0]
+    if tier_filter:
+        order = [row for row in order if risk_tier(float(metrics['risk_score'][row])) == tier_filter]
+    order = list(order[:limit])
+
+    student_ids = [int(matrix.student_ids[row]) for row in order]
+    student_map = {s.id: s for s in Student.query.filter(Student.id.in_(student_ids)).all()} if student_ids else {}
+    student_class = _student_classes_in_range(student_ids, class_ids, start_date, end_date) if student_ids else {}
+
+    result = []
+    for row in order:
+        sid = int(matrix.student_ids[row])
+        s = student_map.get(sid)
+        if not s:
+            continue
+        c = student_class.get(sid)
+        score = float(metrics['risk_score'][row])
+        result.append({
+            "student_id": sid,
+            "student_name": s.fullName,
+            "phone_number": getattr(s, 'phone_number', None) or None,
+            "class_id": c.id if c else None,
+            "class_name": c.name if c else None,
+            "risk_score": round(score, 3),
+            "risk_tier": risk_tier(score),
+            "days_absent": int(metrics['days_absent'][row]),
+            "absence_rate": round(float(metrics['absence_rate'][row]) * 100, 1),
+            "recent_absence_rate": round(float(metrics['recent_rate'][row]) * 100, 1),
+            "longest_streak": int(metrics['longest_streak'][row]),
+            "current_streak": int(metrics['current_streak'][row]),
+            "absent_every_day": bool(metrics['all_days'][row]),
+        })
+
+    return jsonify(
+        start_date=start_date.isoformat(),
+        end_date=end_date.isoformat(),
+        school_days=len(matrix.dates),
+        students=result,
+    ), 200
+
+
+
+@attendance_blueprint.route('/student_summaries', methods=['GET'])
+@jwt_required()
+def get_student_summaries():
+    """
+    Term-to-date attendance totals and risk per student from the nightly
+    summaries (no live delta). Optional class_id, tier (high/medium/low) and
+    limit (default 200); highest risk first.
+    """
+    user_id = get_jwt_identity()
+    user = current_principal()
+    if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
+        return jsonify(message="Unauthorized access."), 403
+
+    query = db.session.query(StudentAttendanceSummary, Student.fullName).join(
+        Student, Student.id == StudentAttendanceSummary.student_id
+    )
+    if user.user_role == 'teacher':
+        class_ids = [c.id for c in Class.query.filter_by(teacher_id=user_id).all()]
+        query = query.filter(StudentAttendanceSummary.class_id.in_(class_ids))
+    else:
+        school_id = user.school_id if user.user_role != 'admin' else request.args.get('school_id', type=int)
+        if not school_id:
+            return jsonify(message="School ID required."), 400
+        query = query.filter(StudentAttendanceSummary.school_id == school_id)
+
+    class_id = request.args.get('class_id', type=int)
+    if class_id:
+        query = query.filter(StudentAttendanceSummary.class_id == class_id)
+    tier_filter = request.args.get('tier')
+    if tier_filter:
+        query = query.filter(StudentAttendanceSummary.risk_tier == tier_filter)
+    limit = max(1, min(request.args.get('limit', 200, type=int), 2000))
+
+    rows = query.order_by(StudentAttendanceSummary.risk_score.desc(), StudentAttendanceSummary.student_id).limit(limit).all()
+    result = []
+    for summary, student_name in rows:
+        item = summary.to_dict()
+        item['student_name'] = student_name
+        result.append(item)
+
+    return jsonify(
+        as_of_date=rows[0][0].as_of_date.isoformat() if rows else None,
+        students=result,
+    ), 200
+
 
 
 @attendance_blueprint.route('/students_with_excused_attendance', methods=['GET'])
@@ -1214,8 +1401,7 @@ def get_students_with_excused_attendance():
     """
 
     # Get the authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can access this endpoint
     if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -1255,28 +1441,29 @@ def get_students_with_excused_attendance():
 
     day_start = datetime.combine(selected_date, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
 
     # Query for excused attendance records
     excused_attendance_records = (
         db.session.query(
-            Attendance.student_id,
+            attendance_rows.student_id,
             Student.fullName.label("student_name"),
             Student.phone_number,
             Class.name.label("class_name"),
             Class.id.label("class_id"),
-            Attendance.class_time_num,
+            attendance_rows.class_time_num,
             Subject.name.label("subject_name"),
             Subject.id.label("subject_id"),
-            Attendance.ExcusNote.label("excus_note")
+            attendance_rows.ExcusNote.label("excus_note")
         )
-        .join(Student, Student.id == Attendance.student_id)
-        .join(Class, Class.id == Attendance.class_id)
-        .join(Subject, Subject.id == Attendance.subject_id)
+        .join(Student, Student.id == attendance_rows.student_id)
+        .join(Class, Class.id == attendance_rows.class_id)
+        .join(Subject, Subject.id == attendance_rows.subject_id)
         .filter(
-            Attendance.is_Excus == True,
+            attendance_rows.is_Excus == True,
             Class.school_id == school_id,
-            Attendance.date >= day_start,
-            Attendance.date < day_end,
+            attendance_rows.date >= day_start,
+            attendance_rows.date < day_end,
         )
         .all()
     )
@@ -1312,8 +1499,7 @@ def update_excuse_note():
     """
 
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can update attendance
     if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -1443,15 +1629,17 @@ def get_student_attendance_log():
     except ValueError:
         return jsonify(message="Invalid date format. Use YYYY-MM-DD"), 400
 
-    records = Attendance.query.filter(
-        Attendance.student_id == student_id,
-        Attendance.date.between(start, end),
+    attendance_rows = model_in_range(Attendance, start)
+
+    records = db.session.query(attendance_rows).filter(
+        attendance_rows.student_id == student_id,
+        attendance_rows.date.between(start, end),
         or_(
-            Attendance.is_late == True,
-            Attendance.is_Acsent == True,
-            Attendance.is_Excus == True
+            attendance_rows.is_late == True,
+            attendance_rows.is_Acsent == True,
+            attendance_rows.is_Excus == True
         )
-    ).order_by(Attendance.date.asc()).all()
+    ).order_by(attendance_rows.date.asc()).all()
 
     result_by_date = {}
     for record in records:
@@ -1497,8 +1685,7 @@ def update_excuse():
     is_has_exuse = data.get('is_has_exuse')  # Expected to be True or False
 
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can update attendance
     if user.user_role not in ['school_admin', 'data_analyst']:
@@ -1542,8 +1729,7 @@ def confirm_day_absents():
     Confirm day absents for school admin.
     """
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only school_admin can confirm
     if user.user_role != 'school_admin':
@@ -1627,8 +1813,7 @@ def get_confirmation_status():
     Get confirmation status for a specific date.
     """
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can access
     if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -1705,11 +1890,12 @@ def get_confirmation_status():
 @jwt_required()
 def get_my_attendance_history():
     """
-    Get complete attendance history for the authenticated student.
+    Get attendance history (absences, excuses, lates) for the authenticated student.
+    Defaults to the current term; ?all=true returns every term. Optional page/per_page.
     """
     # Get the authenticated user
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = get_current_user()
 
     # Ensure only students can access this endpoint
     if user.user_role != 'student':
@@ -1721,33 +1907,47 @@ def get_my_attendance_history():
             "flag": 1
         }), 403
 
-    # Get all attendance records for this student (excluding present records)
+    # Get all attendance records for this student (excluding present records);
+    # ?all=true also reads archived years
+    history_start = None
+    if request.args.get('all', 'false').lower() != 'true':
+        history_start = datetime.combine(current_academic_year_start(), datetime.min.time())
+    attendance_rows = model_in_range(Attendance, history_start)
     attendance_records = db.session.query(
-        Attendance.date,
-        Attendance.class_time_num,
-        Attendance.is_present,
-        Attendance.is_Acsent,
-        Attendance.is_Excus,
-        Attendance.is_late,
-        Attendance.ExcusNote,
+        attendance_rows.date,
+        attendance_rows.class_time_num,
+        attendance_rows.is_present,
+        attendance_rows.is_Acsent,
+        attendance_rows.is_Excus,
+        attendance_rows.is_late,
+        attendance_rows.ExcusNote,
         Class.name.label('class_name'),
         Class.id.label('class_id'),
         Subject.name.label('subject_name'),
         Teacher.fullName.label('teacher_name')
     ).join(
-        Class, Class.id == Attendance.class_id
+        Class, Class.id == attendance_rows.class_id
     ).join(
-        Subject, Subject.id == Attendance.subject_id
+        Subject, Subject.id == attendance_rows.subject_id
     ).join(
-        Teacher, Teacher.id == Attendance.teacher_id
+        Teacher, Teacher.id == attendance_rows.teacher_id
     ).filter(
-        Attendance.student_id == user_id,
+        attendance_rows.student_id == user_id,
         or_(
-            Attendance.is_Acsent == True,
-            Attendance.is_Excus == True,
-            Attendance.is_late == True
+            attendance_rows.is_Acsent == True,
+            attendance_rows.is_Excus == True,
+            attendance_rows.is_late == True
         )
-    ).order_by(Attendance.date.desc()).all()
+    )
+    if history_start is not None:
+        attendance_records = attendance_records.filter(attendance_rows.date >= history_start)
+    attendance_records = attendance_records.order_by(attendance_rows.date.desc(), attendance_rows.class_time_num.desc())
+
+    page = request.args.get('page', type=int)
+    if page:
+        per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+        attendance_records = attendance_records.offset((max(page, 1) - 1) * per_page).limit(per_page)
+    attendance_records = attendance_records.all()
 
     # Process the data
     attendance_data = []
@@ -1782,7 +1982,7 @@ def get_my_attendance_stats():
     """
     # Get the authenticated user
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = get_current_user()
 
     # Ensure only students can access this endpoint
     if user.user_role != 'student':
@@ -1794,28 +1994,19 @@ def get_my_attendance_stats():
             "flag": 1
         }), 403
 
-    # Get attendance statistics
-    stats = db.session.query(
-        func.count(Attendance.id).label('total_records'),
-        func.count(func.distinct(Attendance.date)).label('total_days'),
-        func.count(case((Attendance.is_present == True, Attendance.id), else_=None)).label('present_count'),
-        func.count(case((Attendance.is_Acsent == True, Attendance.id), else_=None)).label('absent_count'),
-        func.count(case((Attendance.is_Excus == True, Attendance.id), else_=None)).label('excused_count'),
-        func.count(case((Attendance.is_late == True, Attendance.id), else_=None)).label('late_count')
-    ).filter(
-        Attendance.student_id == user_id
-    ).first()
+    # Nightly term-to-date row plus today's records
+    stats = get_student_summary(user.id, user.school_id)
 
     # Get student behavior note
-    student = Student.query.get(user_id)
+    student = user if isinstance(user, Student) else None
     behavior_note = student.behavior_note if student and student.behavior_note else ""
 
     # Calculate percentages
-    total_records = stats.total_records or 0
-    present_count = stats.present_count or 0
-    absent_count = stats.absent_count or 0
-    excused_count = stats.excused_count or 0
-    late_count = stats.late_count or 0
+    total_records = stats['total_records']
+    present_count = stats['present_count']
+    absent_count = stats['absent_count']
+    excused_count = stats['excused_count']
+    late_count = stats['late_count']
 
     attendance_rate = (present_count / total_records * 100) if total_records > 0 else 0
     absence_rate = (absent_count / total_records * 100) if total_records > 0 else 0
@@ -1827,7 +2018,7 @@ def get_my_attendance_stats():
         "student_name": user.fullName,
         "statistics": {
             "total_records": total_records,
-            "total_days": stats.total_days or 0,
+            "total_days": stats['total_days'],
             "present_count": present_count,
             "absent_count": absent_count,
             "excused_count": excused_count,
@@ -1836,7 +2027,13 @@ def get_my_attendance_stats():
             "absence_rate": round(absence_rate, 2),
             "excuse_rate": round(excuse_rate, 2),
             "late_rate": round(late_rate, 2),
-            "behavior_note": behavior_note
+            "behavior_note": behavior_note,
+            "term_start": stats['term_start'],
+            "absent_days": stats['absent_days'],
+            "last_absence_date": stats['last_absence_date'],
+            "current_streak": stats['current_streak'],
+            "longest_streak": stats['longest_streak'],
+            "risk_tier": stats['risk_tier']
         }
     }), 200
 
@@ -1850,7 +2047,7 @@ def get_my_profile():
     """
     # Get the authenticated user
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = get_current_user()
 
     # Ensure only students can access this endpoint
     if user.user_role != 'student':
@@ -1906,8 +2103,7 @@ def send_daily_sms_reports():
     """
     try:
         # Get authenticated user
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = current_principal()
         
         if not user:
             return jsonify({
@@ -2118,8 +2314,7 @@ def check_sms_balance():
     Check SMS account balance for a school
     """
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can check SMS balance
     if user.user_role not in ['admin', 'school_admin', 'teacher', 'data_analyst']:
@@ -2147,8 +2342,9 @@ def check_sms_balance():
         # Initialize SMS service
         sms_service = get_ibulk_sms_service(school_id)
         
-        # Check balance
-        balance_result = sms_service.check_balance()
+        # Stored balance unless it is older than SMS_BALANCE_TTL_SECONDS; ?refresh=1 asks the provider now
+        force = request.args.get('refresh', '').lower() in ('1', 'true')
+        balance_result = sms_service.check_balance(force=force)
         
         return jsonify({
             "message": {
@@ -2179,8 +2375,7 @@ def send_test_sms():
     """
     try:
         # Get authenticated user
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = current_principal()
         
         if not user:
             return jsonify({
@@ -3,7 +3,8 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from app.models import User, Student, Teacher, School ,Class , Subject , student_classes ,Attendance ,News ,ActionLog, Driver, Bus, BusScan, bus_students, Timetable, TimetableDay, TimetablePeriod, TimetableSchedule, TimetableTeacherMapping, TeacherSubstitution, SubstitutionAssignment, Notification, NotificationRead, NotificationDeleted
+from app.models import User, Student, Teacher, School ,Class , Subject , student_classes ,Attendance ,News ,ActionLog, Driver, Bus, BusScan, bus_students, Timetable, TimetableDay, TimetablePeriod, TimetableSchedule, TimetableTeacherMapping, TeacherSubstitution, SubstitutionAssignment, Notification, NotificationRead, NotificationDeleted, NotificationAudience, StudentDayAttendance, StudentAttendanceSummary
+from app.services.attendance_snapshot import invalidate_snapshot
 from app import db ,limiter
 import csv
 from flask import send_file, Response
@@ -13,9 +14,11 @@ import pandas as pd
 import re
 from sqlalchemy import and_
 from datetime import datetime, timedelta
-from time import time, sleep
 from app.logger import log_action
 from app.config import get_oman_time
+from app.services.login_throttle import check_login_allowed, record_login_failure, clear_login_failures
+from app.principal import build_token_claims, bump_token_version, invalidate_user, current_principal, get_current_user
+from app.services.action_log_browser import apply_cursor, encode_cursor, count_logs_cached, LOG_MAX_DAYS_BACK
 from flask_cors import CORS
 
 import logging
@@ -27,18 +30,21 @@ logger = logging.getLogger(__name__)
 auth_blueprint = Blueprint('auth_blueprint', __name__)
 CORS(auth_blueprint)
 
-# Memory-based failed login tracking (replace with Redis for production)
-FAILED_LOGINS = {}
-MAX_ATTEMPTS = 15
-BLOCK_TIME_SECONDS = 60  # 1 minutes
+def _failed_login_response(ip, username_or_email, message, status_code):
+    """Record a failed attempt and tell the client how long to wait (no worker sleep)."""
+    retry_after = record_login_failure(ip, username_or_email)
+    response = jsonify(message=message, retry_after=retry_after)
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
+
 
 @auth_blueprint.route('/login', methods=['POST'])
-@limiter.limit("30 per minute")  # Generous limit to avoid 429 on deploy/restart; brute-force still protected by FAILED_LOGINS below
+@limiter.limit("30 per minute")  # Generous limit to avoid 429 on deploy/restart; brute-force still protected by login_throttle below
 @log_action("تسجيل ", description="تسجيل الدخول للموقع " , content='')
 def login():
     try:
         ip = request.remote_addr
-        now = time()
 
         # Parse login data with error handling
         try:
@@ -54,13 +60,15 @@ def login():
         if not username_or_email or not password:
             return jsonify(message="اسم المستخدم/رمز المرور مطلوب. Username/email and password are required."), 400
 
-        # 🔐 Check if IP is blocked
-        if ip in FAILED_LOGINS:
-            if now - FAILED_LOGINS[ip]['first_try'] < BLOCK_TIME_SECONDS:
-                if FAILED_LOGINS[ip]['count'] >= MAX_ATTEMPTS:
-                    return jsonify(message=" تم حظر المحاولة مؤقتاً بسبب عدد محاولات خاطئة كثيرة. الرجاء الانتظار والمحاولة بعد 5 دقائق."), 429
-            else:
-                FAILED_LOGINS.pop(ip)  # Reset expired block
+        # 🔐 Check if IP or account is throttled (shared across workers)
+        retry_after = check_login_allowed(ip, username_or_email)
+        if retry_after:
+            response = jsonify(
+                message=" تم حظر المحاولة مؤقتاً بسبب عدد محاولات خاطئة كثيرة. الرجاء الانتظار والمحاولة لاحقاً.",
+                retry_after=retry_after
+            )
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
 
         # Find user by username or email (case-insensitive) with error handling
         try:
@@ -73,18 +81,14 @@ def login():
 
         # Check if user exists and is active
         if not user:
-            # Track failed login
-            FAILED_LOGINS[ip] = FAILED_LOGINS.get(ip, {"count": 0, "first_try": now})
-            FAILED_LOGINS[ip]['count'] += 1
-            sleep(1)  # Delay for failed attempts
-            return jsonify(message="لا يوجد مستخدم بهذا الإسم. Username not found."), 400
+            return _failed_login_response(
+                ip, username_or_email, "لا يوجد مستخدم بهذا الإسم. Username not found.", 400
+            )
 
         if not user.is_active:
-            # Track failed login for inactive accounts
-            FAILED_LOGINS[ip] = FAILED_LOGINS.get(ip, {"count": 0, "first_try": now})
-            FAILED_LOGINS[ip]['count'] += 1
-            sleep(1)  # Delay for failed attempts
-            return jsonify(message="الحساب غير مفعل. الرجاء التواصل مع الإدارة. Account is inactive."), 400
+            return _failed_login_response(
+                ip, username_or_email, "الحساب غير مفعل. الرجاء التواصل مع الإدارة. Account is inactive.", 400
+            )
 
         # Check password with error handling
         try:
@@ -94,19 +98,16 @@ def login():
             return jsonify(message="Authentication error. Please try again."), 500
 
         if not password_valid:
-            # Track failed login
-            FAILED_LOGINS[ip] = FAILED_LOGINS.get(ip, {"count": 0, "first_try": now})
-            FAILED_LOGINS[ip]['count'] += 1
-            sleep(1)  # Delay for failed attempts
-            return jsonify(message="اسم المستخدم أو كلمة المرور غير صحيحة. Incorrect username or password."), 401
+            return _failed_login_response(
+                ip, username_or_email, "اسم المستخدم أو كلمة المرور غير صحيحة. Incorrect username or password.", 401
+            )
 
-        # ✅ Success — Clear failed attempts for this IP
-        if ip in FAILED_LOGINS:
-            FAILED_LOGINS.pop(ip)
+        # ✅ Success — Clear failed attempts for this account
+        clear_login_failures(username_or_email)
 
         # Create access token with error handling
         try:
-            access_token = create_access_token(identity=str(user.id))
+            access_token = create_access_token(identity=str(user.id), additional_claims=build_token_claims(user))
             return jsonify(access_token=access_token), 200
         except Exception as e:
             print(f"Token creation error: {str(e)}")
@@ -121,8 +122,7 @@ def login():
 @jwt_required()
 @log_action("إضافة", description="إضافة مستخدم جديد ")
 def register():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     if Login_user.user_role != 'admin' :  # Ensure only admin can register users
         return jsonify(message={"en": "Unauthorized to make this action.", "ar": "غير مصرح لك بتنفيذ هذا الإجراء."}, flag=1), 400
@@ -219,8 +219,7 @@ def register():
 @jwt_required()
 @log_action("إضافة", description="إضافة معلم جديد " ,content='')
 def register_single_teacher():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     if Login_user.user_role != 'school_admin' and Login_user.user_role != 'data_analyst':  # Ensure only school_admin can register teachers
         return jsonify(message={"en": "Unauthorized to make this action.", "ar": "غير مصرح لك بتنفيذ هذا الإجراء."}, flag=1), 400
@@ -282,8 +281,7 @@ def register_single_teacher():
 @jwt_required()
 @log_action("إضافة", description="إضافة قائمة معلمين جدد ")
 def register_Users():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     data = request.get_json()
 
@@ -390,8 +388,7 @@ def register_Users():
 @jwt_required()
 @log_action("إضافة", description="إضافة محلل بيانات جديد " ,content='')
 def register_single_data_analyst():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     if Login_user.user_role != 'school_admin':  # Ensure only school_admin can register data_analyst
         return jsonify(message={"en": "Unauthorized to make this action.", "ar": "غير مصرح لك بتنفيذ هذا الإجراء."}, flag=1), 400
@@ -448,8 +445,7 @@ def register_single_data_analyst():
 @jwt_required()
 @log_action("?????", description="????? ???? ???? " ,content='') 
 def register_single_driver():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     if Login_user.user_role != 'school_admin':  # Ensure only school_admin can register drivers
         return jsonify(message={"en": "Unauthorized to make this action.", "ar": "??? ???? ?? ?????? ??? ???????."}, flag=1), 400
@@ -515,8 +511,7 @@ def register_single_driver():
 @jwt_required()
 @log_action("إضافة", description="إضافة قائمة سائقين جدد ")
 def register_Drivers():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     data = request.get_json()
     
@@ -640,8 +635,7 @@ def register_Drivers():
 @jwt_required()
 @log_action("إضافة", description="إضافة طالب جديد ")
 def register_single_assign_student():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     # ✅ تحقق من صلاحية المستخدم
     if Login_user.user_role != 'school_admin':
@@ -711,8 +705,7 @@ def register_single_assign_student():
 @jwt_required()
 @log_action("إضافة", description="إضافة قائمة طلاب جدد ")
 def register_Students():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     # Authorization check
     if Login_user.user_role != 'school_admin':
@@ -825,8 +818,7 @@ def register_Students():
 @jwt_required()
 @log_action("إضافة", description="إضافة قائمة الهواتف للطلبة  ")
 def update_students_phone_numbers():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     # Ensure only school_admin can update student phone numbers
     if Login_user.user_role != 'school_admin':
@@ -915,8 +907,7 @@ def update_students_phone_numbers():
 @jwt_required()
 @log_action("إضافة", description="إضافة وتسجيل طلاب جدد ")
 def register_and_assign_students():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     # Authorization check
     if not Login_user.user_role == 'school_admin':
@@ -998,8 +989,7 @@ def register_and_assign_students():
 @jwt_required()
 @log_action("إضافة", description="إضافة وتسجيل طلاب جدد ")
 def register_and_assign_students_v2():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     # Authorization check
     if Login_user.user_role != 'school_admin':
@@ -1276,9 +1266,8 @@ def register_and_assign_students_v2():
 @auth_blueprint.route('/user', methods=['GET'])
 @jwt_required()
 def get_user_details():
-    user_id = get_jwt_identity()
     #user = User.query.get(user_id)
-    user = User.query.get(int(user_id))
+    user = get_current_user()
 
     if not user:
         return jsonify(message="User not found"), 404
@@ -1340,7 +1329,7 @@ def get_user_details():
 @log_action("تعديل", description="تعديل بيانات مستخدم")
 def update_user(user_id):
     current_user_id = get_jwt_identity()
-    current_user = User.query.get(current_user_id)
+    current_user = current_principal()
 
     # Authorization check
     if current_user.user_role not in ['admin', 'school_admin'] and current_user_id != user_id:
@@ -1385,6 +1374,13 @@ def update_user(user_id):
         if not school:
             return jsonify(message="School not found."), 404
 
+    # Role, school or activation changes invalidate the user's outstanding tokens
+    access_changed = (
+        (is_active is not None and bool(is_active) != bool(user.is_active)) or
+        (user_role and user_role != user.user_role) or
+        (school_id and hasattr(user, 'school_id') and school_id != user.school_id)
+    )
+
     # Update shared fields
     if username:
         user.username = username
@@ -1432,6 +1428,11 @@ def update_user(user_id):
         if location is not None:
             user.location = location
 
+    if access_changed:
+        bump_token_version(user.id)
+    else:
+        invalidate_user(user.id)
+
     try:
         db.session.commit()
     except Exception as e:
@@ -1572,7 +1573,7 @@ def delete_users(user_id):
         ), 400
 
     # Authorization check (allow admins, school admins from same school, or the user themselves to delete)
-    current_user = User.query.get(current_user_id)
+    current_user = current_principal()
 
     # Check if current user can delete this user
     can_delete = False
@@ -1596,7 +1597,8 @@ def delete_users(user_id):
     if current_user_id == user_id and (current_user.user_role == 'admin' or current_user.user_role == 'school_admin'):
         return jsonify(message="لا يمكن للمدير حذف حسابه الخاص."), 400
 
-    # Delete the user
+    # Delete the user (and revoke their tokens)
+    bump_token_version(user.id)
     db.session.delete(user)
     db.session.commit()
 
@@ -1618,8 +1620,7 @@ def send_absence_notifications():
     Send WhatsApp notifications to students with absences
     """
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user = current_principal()
 
         # Check authorization (only school admins and data analysts)
         if current_user.user_role not in ['school_admin', 'data_analyst', 'admin']:
@@ -1679,8 +1680,7 @@ def get_absence_stats():
     Get statistics about students with absences
     """
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user = current_principal()
 
         # Check authorization
         if current_user.user_role not in ['school_admin', 'data_analyst', 'admin']:
@@ -1756,8 +1756,7 @@ def validate_password_strength(password):
 @log_action("تعديل", description="تعديل رمز المرور للمستخدم")
 def change_password():
     # Get the current user ID from the JWT
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = get_current_user()
 
     if not user:
         return jsonify(message="User not found."), 404
@@ -1807,8 +1806,7 @@ def delete_school_data():
     """
 
     # Get authenticated user
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
     school_id = Login_user.school_id 
 
     # Ensure only school_admins can perform deletion
@@ -1875,6 +1873,12 @@ def delete_school_data():
                     db.session.query(Class.id).filter_by(school_id=school_id)
                 )
             ).delete(synchronize_session=False)
+            db.session.query(StudentDayAttendance).filter(
+                StudentDayAttendance.class_id.in_(
+                    db.session.query(Class.id).filter_by(school_id=school_id)
+                )
+            ).delete(synchronize_session=False)
+            db.session.query(StudentAttendanceSummary).filter_by(school_id=school_id).delete(synchronize_session=False)
 
         ### **3️⃣ Delete Action Logs (if logs selected OR if deleting users)**
         # Delete logs before deleting users to avoid foreign key constraint errors
@@ -2011,6 +2015,10 @@ def delete_school_data():
                 db.session.query(NotificationRead).filter(
                     NotificationRead.notification_id.in_(notification_ids)
                 ).delete(synchronize_session=False)
+                # Delete broadcast audiences
+                db.session.query(NotificationAudience).filter(
+                    NotificationAudience.notification_id.in_(notification_ids)
+                ).delete(synchronize_session=False)
             # Delete notifications
             db.session.query(Notification).filter_by(school_id=school_id).delete(synchronize_session=False)
 
@@ -2028,6 +2036,7 @@ def delete_school_data():
 
         # Commit changes
         db.session.commit()
+        invalidate_snapshot(school_id)
 
         return jsonify({
             "message": {
@@ -2057,8 +2066,7 @@ def toggle_school_status(school_id):
     If the school is active, deactivate it along with its users.
     If the school is inactive, activate it along with its users.
     """
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     # Ensure only school_admins can perform this action
     if Login_user.user_role != 'admin':
@@ -2091,6 +2099,9 @@ def toggle_school_status(school_id):
             # User.user_role != 'school_admin'
         ).update({"is_active": new_status}, synchronize_session=False)
 
+        # Revoke tokens issued before the status change
+        bump_token_version([uid for (uid,) in db.session.query(User.id).filter(User.school_id == school_id)])
+
         # Update school status
         school.is_active = new_status
 
@@ -2119,50 +2130,47 @@ def toggle_school_status(school_id):
 @auth_blueprint.route('/view_logs', methods=['GET'])
 @jwt_required()
 def view_logs():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user:
         return jsonify(message="Unauthorized"), 403
 
-    # Get pagination parameters
-    page = request.args.get('page', 1, type=int)
+    # Cursor pagination: pass back pagination.next_cursor to get the next page
+    cursor = request.args.get('cursor')
     per_page = request.args.get('per_page', 50, type=int)
 
     # Limit per_page to prevent excessive data loading
-    per_page = min(per_page, 100)
+    per_page = max(1, min(per_page, 100))
 
     # Get date filter parameter (optional)
     days_back = request.args.get('days', 30, type=int)
-    days_back = min(days_back, 90)  # Limit to 90 days max
+    days_back = min(days_back, LOG_MAX_DAYS_BACK)  # Limit how far back the view reads
 
     # 🔍 Calculate the date filter
     date_filter = get_oman_time() - timedelta(days=days_back)
 
-    # Build optimized query with proper joins and eager loading
-    query = db.session.query(ActionLog, User.fullName, User.user_role).join(
-        User, ActionLog.user_id == User.id
-    )
-
     if user.user_role == 'school_admin' or user.user_role == 'data_analyst':
-        query = query.filter(User.school_id == user.school_id)
+        school_id = user.school_id
     elif user.user_role == 'admin':
-        pass
+        school_id = request.args.get('school_id', type=int)
     else:
         return jsonify(message="Access denied"), 403
 
-    # ⏳ Filter logs from the specified date range
-    query = query.filter(ActionLog.timestamp >= date_filter)
+    # school_id is stored on each log, so the (school_id, timestamp, id) index serves the page
+    query = db.session.query(ActionLog, User.fullName, User.user_role).outerjoin(
+        User, ActionLog.user_id == User.id
+    ).filter(ActionLog.timestamp >= date_filter)
+    if school_id:
+        query = query.filter(ActionLog.school_id == school_id)
 
-    # Get total count for pagination info
-    total_count = query.count()
+    query = apply_cursor(query, cursor)
 
-    # Apply pagination and ordering
-    logs_data = query.order_by(ActionLog.timestamp.desc()).paginate(
-        page=page,
-        per_page=per_page,
-        error_out=False
-    )
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(ActionLog.timestamp.desc(), ActionLog.id.desc()).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    total_count = count_logs_cached(school_id, date_filter, days_back)
 
     role_map = {
         "teacher": "tch",
@@ -2187,17 +2195,18 @@ def view_logs():
             "timestamp": log.timestamp.strftime('%d-%m-%Y %I:%M %p'),
             "status_code": log.status_code
         }
-        for log, user_fullName, user_role in logs_data.items
+        for log, user_fullName, user_role in rows
     ]
 
     return jsonify({
         "logs": response_data,
         "pagination": {
-            "page": page,
             "per_page": per_page,
             "total": total_count,
-            "pages": logs_data.pages,
-            "has_next": logs_data.has_next,
-            "has_prev": logs_data.has_prev
+            "total_is_estimate": True,
+            "pages": (total_count + per_page - 1) // per_page,
+            "next_cursor": encode_cursor(rows[-1][0]) if has_next and rows else None,
+            "has_next": has_next,
+            "has_prev": bool(cursor)
         }
     }), 200
@@ -1,18 +1,17 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import Bus, BusScan, Student, User, School, bus_students, Driver
+from app.models import Bus, BusScan, Student, bus_students, Driver
 from app import db
-from datetime import datetime, date, timezone
+from datetime import datetime, date, timedelta, timezone
 from app.config import get_oman_time
 from app.logger import log_action
 from sqlalchemy import func, and_, or_
 from flask_cors import CORS
 from app.routes.notification_routes import create_notification
-from app.services.notification_service import (
-    notify_student_bus_scan,
-    notify_driver_forgot_students,
-    notify_admin_forgot_students_on_bus
-)
+from app.services.notification_service import notify_student_bus_scan
+from app.services.bus_sweeper import sweep_forgotten_students
+from app.services.partitioning import model_in_range
+from app.principal import current_principal, get_current_user
 
 bus_blueprint = Blueprint('bus_blueprint', __name__)
 
@@ -24,10 +23,9 @@ CORS(bus_blueprint)
 @jwt_required()
 def get_driver_bus():
     """Get the bus assigned to the logged-in driver"""
-    user_id = get_jwt_identity()
-    driver = Driver.query.get(user_id)
+    driver = get_current_user()
     
-    if not driver:
+    if not isinstance(driver, Driver):
         return jsonify(message="User is not a driver"), 403
     
     if not driver.bus:
@@ -45,8 +43,7 @@ def get_driver_bus():
 @jwt_required()
 def get_buses():
     """Get all buses for the school"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify(message="User not associated with a school"), 400
@@ -64,8 +61,7 @@ def get_buses():
 @jwt_required()
 def get_bus(bus_id):
     """Get single bus details"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     bus = Bus.query.get(bus_id)
     if not bus:
@@ -83,8 +79,7 @@ def get_bus(bus_id):
 @log_action("إضافة", description="إضافة حافلة جديدة")
 def create_bus():
     """Create a new bus"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify(message="Permission denied"), 403
@@ -119,8 +114,7 @@ def create_bus():
 @log_action("تعديل", description="تعديل بيانات حافلة")
 def update_bus(bus_id):
     """Update bus information"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify(message="Permission denied"), 403
@@ -161,8 +155,7 @@ def update_bus(bus_id):
 @log_action("حذف", description="حذف حافلة")
 def delete_bus(bus_id):
     """Delete a bus"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify(message="Permission denied"), 403
@@ -187,8 +180,7 @@ def delete_bus(bus_id):
 @jwt_required()
 def get_bus_students(bus_id):
     """Get all students assigned to a bus"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     bus = Bus.query.get(bus_id)
     if not bus:
@@ -213,8 +205,7 @@ def get_bus_students(bus_id):
 @log_action("تعيين", description="تعيين طلاب للحافلة")
 def assign_students_to_bus(bus_id):
     """Assign multiple students to a bus"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify(message="Permission denied"), 403
@@ -264,8 +255,7 @@ def assign_students_to_bus(bus_id):
 @log_action("إزالة", description="إزالة طلاب من الحافلة")
 def remove_students_from_bus(bus_id):
     """Remove students from a bus"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify(message="Permission denied"), 403
@@ -305,7 +295,7 @@ def remove_students_from_bus(bus_id):
 def scan_student():
     """Scan student QR code (board or exit)"""
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     data = request.get_json()
     
@@ -409,8 +399,7 @@ def scan_student():
 @jwt_required()
 def get_scans():
     """Get scan history with filters"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     # Query parameters
     bus_id = request.args.get('bus_id', type=int)
@@ -418,30 +407,37 @@ def get_scans():
     scan_date = request.args.get('date')  # Format: YYYY-MM-DD
     scan_type = request.args.get('scan_type')
     
-    query = BusScan.query
+    # A given date may fall in an archived year; the undated listing is live scans only
+    scan_rows = BusScan
+    if scan_date:
+        try:
+            target_date = datetime.strptime(scan_date, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify(message="Invalid date format. Use YYYY-MM-DD"), 400
+        day_start = datetime.combine(target_date, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        scan_rows = model_in_range(BusScan, day_start, day_end)
+    
+    query = db.session.query(scan_rows)
     
     # Filter by school
     if user.user_role != 'admin':
-        query = query.join(Bus).filter(Bus.school_id == user.school_id)
+        query = query.join(Bus, Bus.id == scan_rows.bus_id).filter(Bus.school_id == user.school_id)
     
     # Apply filters
     if bus_id:
-        query = query.filter(BusScan.bus_id == bus_id)
+        query = query.filter(scan_rows.bus_id == bus_id)
     
     if student_id:
-        query = query.filter(BusScan.student_id == student_id)
+        query = query.filter(scan_rows.student_id == student_id)
     
     if scan_date:
-        try:
-            target_date = datetime.strptime(scan_date, '%Y-%m-%d').date()
-            query = query.filter(func.date(BusScan.scan_time) == target_date)
-        except ValueError:
-            return jsonify(message="Invalid date format. Use YYYY-MM-DD"), 400
+        query = query.filter(scan_rows.scan_time >= day_start, scan_rows.scan_time < day_end)
     
     if scan_type:
-        query = query.filter(BusScan.scan_type == scan_type)
+        query = query.filter(scan_rows.scan_type == scan_type)
     
-    scans = query.order_by(BusScan.scan_time.desc()).limit(1000).all()
+    scans = query.order_by(scan_rows.scan_time.desc()).limit(1000).all()
     
     return jsonify([scan.to_dict() for scan in scans]), 200
 
@@ -450,8 +446,7 @@ def get_scans():
 @jwt_required()
 def get_student_bus_status(student_id):
     """Get current bus status for a student (are they on the bus?)"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     student = Student.query.get(student_id)
     if not student:
@@ -493,8 +488,7 @@ def get_student_bus_status(student_id):
 @jwt_required()
 def get_current_students_on_bus(bus_id):
     """Get list of students currently on the bus"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     bus = Bus.query.get(bus_id)
     if not bus:
@@ -541,8 +535,7 @@ def get_current_students_on_bus(bus_id):
 @jwt_required()
 def get_daily_bus_report():
     """Get daily bus attendance report"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     # Query parameters
     report_date = request.args.get('date')  # Format: YYYY-MM-DD
@@ -567,13 +560,17 @@ def get_daily_bus_report():
     
     buses = buses_query.all()
     
+    day_start = datetime.combine(target_date, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    scan_rows = model_in_range(BusScan, day_start, day_end)
     report = []
     
     for bus in buses:
         # Get scans for this bus on target date
-        scans = BusScan.query.filter(
-            BusScan.bus_id == bus.id,
-            func.date(BusScan.scan_time) == target_date
+        scans = db.session.query(scan_rows).filter(
+            scan_rows.bus_id == bus.id,
+            scan_rows.scan_time >= day_start,
+            scan_rows.scan_time < day_end
         ).all()
         
         board_count = sum(1 for scan in scans if scan.scan_type == 'board')
@@ -600,12 +597,12 @@ def get_daily_bus_report():
 def check_forgotten_students():
     """
     Check for students who are still on buses (boarded but not exited)
-    Send notifications to drivers and school admins
-    Can be called manually or via cron job at end of school day
+    Send notifications to drivers and school admins (once per bus per day)
+    Scheduled runs use the `flask sweep-forgotten-students` command instead
     """
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = current_principal()
         
         if not user:
             return jsonify(message="User not found"), 404
@@ -614,102 +611,21 @@ def check_forgotten_students():
         if user.user_role not in ['school_admin', 'admin']:
             return jsonify(message="Unauthorized"), 403
         
-        # Get today's date
-        today = date.today()
-        
-        # Determine which schools to check
+        # System admin checks all schools, school admin only their own
         if user.user_role == 'admin':
-            # System admin can check all schools
-            schools = School.query.all()
+            school_ids = None
         else:
-            # School admin checks only their school
-            schools = [School.query.get(user.school_id)] if user.school_id else []
-        
-        notifications_sent = []
-        buses_with_students = []
+            school_ids = [user.school_id] if user.school_id else []
         
-        for school in schools:
-            if not school:
-                continue
-            
-            # Get all buses for this school
-            buses = Bus.query.filter_by(school_id=school.id, is_active=True).all()
-            
-            for bus in buses:
-                # Get today's scans for this bus
-                scans_today = BusScan.query.filter(
-                    BusScan.bus_id == bus.id,
-                    func.date(BusScan.scan_time) == today
-                ).order_by(BusScan.student_id, BusScan.scan_time.desc()).all()
-                
-                # Group scans by student to find who's still on the bus
-                student_scans = {}
-                for scan in scans_today:
-                    if scan.student_id not in student_scans:
-                        student_scans[scan.student_id] = []
-                    student_scans[scan.student_id].append(scan)
-                
-                # Check which students are still on the bus
-                students_on_bus = []
-                for student_id, scans in student_scans.items():
-                    # Get the most recent scan for this student
-                    last_scan = scans[0]  # Already sorted by desc
-                    
-                    if last_scan.scan_type == 'board':
-                        # Student boarded but hasn't exited
-                        student = Student.query.get(student_id)
-                        if student:
-                            students_on_bus.append(student)
-                
-                # If there are students still on the bus, send notifications
-                if students_on_bus:
-                    bus_data = {
-                        'id': bus.id,
-                        'bus_number': bus.bus_number,
-                        'bus_name': bus.bus_name,
-                        'students_count': len(students_on_bus),
-                        'student_names': [s.fullName for s in students_on_bus],
-                        'driver_name': bus.driver.fullName if bus.driver else 'غير محدد'
-                    }
-                    
-                    buses_with_students.append(bus_data)
-                    
-                    # Notify the driver
-                    if bus.driver_id:
-                        try:
-                            notify_driver_forgot_students(
-                                driver_id=bus.driver_id,
-                                school_id=school.id,
-                                bus_data=bus_data,
-                                created_by=user_id
-                            )
-                            notifications_sent.append({
-                                'type': 'driver',
-                                'recipient_id': bus.driver_id,
-                                'bus_number': bus.bus_number
-                            })
-                        except Exception as e:
-                            print(f"Error notifying driver {bus.driver_id}: {str(e)}")
-                    
-                    # Notify school admins
-                    try:
-                        notify_admin_forgot_students_on_bus(
-                            school_id=school.id,
-                            bus_data=bus_data,
-                            created_by=user_id
-                        )
-                        notifications_sent.append({
-                            'type': 'admin',
-                            'school_id': school.id,
-                            'bus_number': bus.bus_number
-                        })
-                    except Exception as e:
-                        print(f"Error notifying admins for school {school.id}: {str(e)}")
+        result = sweep_forgotten_students(created_by=user_id, school_ids=school_ids)
+        buses_with_students = result['buses']
+        notifications_sent = result['notifications']
         
         return jsonify({
             'message': 'Check completed successfully',
             'buses_with_students': len(buses_with_students),
             'notifications_sent': len(notifications_sent),
+            'already_notified': len(result['already_notified']),
             'details': {
                 'buses': buses_with_students,
                 'notifications': notifications_sent
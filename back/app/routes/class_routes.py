@@ -6,6 +6,7 @@ from app.models import Teacher, Class, Student, student_classes, School, User, S
 from sqlalchemy import func
 from app import db
 from app.logger import log_action
+from app.principal import current_principal, get_current_user
 from flask_cors import CORS
 
 
@@ -16,8 +17,7 @@ CORS(class_blueprint)
 @log_action("إضافة ", description="إضافة مدرسة جديدة")
 @jwt_required()
 def create_school():
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
     if Login_user.user_role != 'admin':  # Ensure only school_admin can register teachers
         return jsonify(message={"en": "Unauthorized to make this action.", "ar": "غير مصرح لك بتنفيذ هذا الإجراء."}, flag=1), 400
 
@@ -36,8 +36,7 @@ def create_school():
 @jwt_required()
 @log_action("تعديل", description="تعديل بيانات المدرسة")
 def update_school(school_id):
-    user_id = get_jwt_identity()
-    Login_user = User.query.get(user_id)
+    Login_user = current_principal()
 
     if Login_user.user_role != 'admin':  # Ensure only admin can update schools
         return jsonify(message={"en": "Unauthorized to make this action.", "ar": "غير مصرح لك بتنفيذ هذا الإجراء."}, flag=1), 400
@@ -83,9 +82,8 @@ def create_class():
     if not name:
         return jsonify(message="Class name is required."), 400
 
-    user_id = get_jwt_identity()
 
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user.user_role == 'school_admin' and not user.user_role == 'data_analyst':
         return jsonify(message="Only admin can create classes."), 403
@@ -112,8 +110,7 @@ def create_classes():
     if not isinstance(data, list) or not data:
         return jsonify(message="Invalid data format. Expected a list of class names."), 400
 
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role != 'school_admin':
         return jsonify(message="Only admin can create classes."), 403
@@ -156,8 +153,7 @@ def update_multiple_classes():
     if not isinstance(lists, list):
         return jsonify(message="Invalid data format. Expecting a list of class updates."), 400
 
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure the user is a school admin
     if user.user_role != 'school_admin':
@@ -205,8 +201,7 @@ def update_multiple_Subject():
     if not isinstance(lists, list):
         return jsonify(message="Invalid data format. Expecting a list of class updates."), 400
 
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure the user is a school admin
     if user.user_role != 'school_admin':
@@ -254,9 +249,8 @@ def create_subject():
     if not name:
         return jsonify(message="Class name is required."), 400
 
-    user_id = get_jwt_identity()
 
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user.user_role == 'school_admin' and not user.user_role == 'data_analyst':
         return jsonify(message="Only admin can create classes."), 403
@@ -277,10 +271,9 @@ def create_subject():
 @class_blueprint.route('/myClasses', methods=['GET'])
 @jwt_required()
 def get_my_classes():
-    teacher_id = get_jwt_identity()
-    teacher = Teacher.query.get(teacher_id)
+    teacher = get_current_user()
 
-    if not teacher:
+    if not isinstance(teacher, Teacher):
         return jsonify(message={"Only teachers can view their classes ,يمكن للمعلمين فقط عرض فصولهم."}), 403
 
     # Retrieve only classes that belong to the teacher's school
@@ -304,8 +297,7 @@ def get_my_classes():
 @class_blueprint.route('/AllSchool', methods=['GET'])
 @jwt_required()
 def get_Schools():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     # Only admin can access all schools data
     if user.user_role != 'admin':
@@ -326,8 +318,7 @@ def get_Schools():
 @class_blueprint.route('/AllClass', methods=['GET'])
 @jwt_required()
 def get_Class():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     
     # Fetch all classes
     classes = Class.query.all()
@@ -357,8 +348,7 @@ def get_Class():
 @class_blueprint.route('/AllSubject', methods=['GET'])
 @jwt_required()
 def get_subjects():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user:
         return jsonify(message={"User not found. ,لم يتم العثور على المستخدم."}), 404
@@ -437,10 +427,9 @@ def get_class_students(class_id):
 @class_blueprint.route('/my-school-students', methods=['GET'])
 @jwt_required()
 def get_students_from_my_school():
-    teacher_id = get_jwt_identity()
-    teacher = Teacher.query.get(teacher_id)
+    teacher = get_current_user()
 
-    if not teacher:
+    if not isinstance(teacher, Teacher):
         return jsonify(message="Only teachers can access this resource."), 403
 
     # Query students in the teacher's school who are not assigned to any class
@@ -550,7 +539,7 @@ def delete_class(class_id):
     """Delete a class with validation checks"""
     try:
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = current_principal()
         
         if not user:
             return jsonify({
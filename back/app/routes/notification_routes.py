@@ -6,10 +6,15 @@ from app.models import (
     NotificationPreference, User, Student, Teacher, School
 )
 from app.config import get_oman_time, Config
+from app.principal import current_principal
+from app.services.push_dispatcher import dispatch_push
+from app.services.notification_audience import visible_notifications_filter, visible_notification_scopes, is_visible_to, audience_user_filter
+from app.services.notification_preferences import get_preference_masks, allows, invalidate_preferences
 from datetime import datetime, timedelta
+import base64
+import binascii
 import json
-from sqlalchemy import or_, and_
-import threading
+from sqlalchemy import or_, and_, insert, select, literal, exists
 from flask_cors import CORS
 
 notification_blueprint = Blueprint('notification_blueprint', __name__, url_prefix='/api/notifications')
@@ -20,9 +25,10 @@ def send_push_notification(notification):
     """
     Send push notification to all subscribed users who should receive this notification.
     This works when the app is in the background or closed (mobile, Windows, Mac).
+    Subscriptions and preferences are resolved here; delivery runs on the push dispatcher.
     """
     try:
-        from pywebpush import webpush, WebPushException
+        import pywebpush  # noqa: F401
     except ImportError:
         print("Warning: pywebpush not installed. Install with: pip install pywebpush")
         return
@@ -41,46 +47,55 @@ def send_push_notification(notification):
             return
         
         # Get all active push subscriptions for users who should receive this notification
-        query = PushSubscription.query.filter_by(is_active=True)
-        
-        # Filter by target users if specified
-        if notification.target_user_ids:
-            target_user_ids = json.loads(notification.target_user_ids)
-            if target_user_ids:
-                query = query.filter(PushSubscription.user_id.in_(target_user_ids))
-        # Filter by target role if specified
-        elif notification.target_role:
-            users_with_role = User.query.filter_by(
-                user_role=notification.target_role,
-                school_id=notification.school_id
-            ).all()
-            user_ids = [u.id for u in users_with_role]
-            if user_ids:
-                query = query.filter(PushSubscription.user_id.in_(user_ids))
+        query = db.session.query(
+            PushSubscription.id,
+            PushSubscription.user_id,
+            PushSubscription.endpoint,
+            PushSubscription.p256dh_key,
+            PushSubscription.auth_key
+        ).filter(PushSubscription.is_active == True)
+        
+        target_user_ids = json.loads(notification.target_user_ids) if notification.target_user_ids else None
+        audience_filter = audience_user_filter(notification)
+        if target_user_ids:
+            # Filter by target users if specified
+            query = query.filter(PushSubscription.user_id.in_(target_user_ids))
+        elif audience_filter is not None:
+            # Broadcast: every active user of the audience roles in the school (or all schools)
+            query = query.join(User, User.id == PushSubscription.user_id).filter(audience_filter)
         else:
-            # Send to all users in the school
-            users_in_school = User.query.filter_by(school_id=notification.school_id).all()
-            user_ids = [u.id for u in users_in_school]
-            if user_ids:
-                query = query.filter(PushSubscription.user_id.in_(user_ids))
+            query = query.join(User, User.id == PushSubscription.user_id).filter(
+                User.school_id == notification.school_id
+            )
+            # Filter by target role if specified, otherwise send to all users in the school
+            if notification.target_role:
+                query = query.filter(User.user_role == notification.target_role)
         
         subscriptions = query.all()
-        target_user_ids_flat = list(set(s.user_id for s in subscriptions))
-        
         if not subscriptions:
             print("Push: No active subscriptions for this notification target (notification_id=%s)." % (notification.id,))
             return
         
-        print("Push: Sending to %s subscription(s) for notification id=%s (user_ids=%s)" % (
-            len(subscriptions), notification.id, target_user_ids_flat))
+        # Preferences for every recipient from the bitmask cache
+        masks = get_preference_masks(set(s.user_id for s in subscriptions))
+        blocked_user_ids = set(
+            user_id for user_id, mask in masks.items() if not allows(mask, notification.type)
+        )
+        
+        targets = [tuple(s) for s in subscriptions if s.user_id not in blocked_user_ids]
+        if not targets:
+            print("Push: All recipients disabled push for notification id=%s." % (notification.id,))
+            return
         
-        vapid_claims = {"sub": vapid_claim_email or "mailto:admin@tatubu.com"}
+        print("Push: Sending to %s subscription(s) for notification id=%s (%s user(s) opted out)" % (
+            len(targets), notification.id, len(blocked_user_ids)))
         
         # Prepare notification payload for background push
+        message = notification.rendered_message()
         payload = {
             "title": notification.title,
-            "message": notification.message,
-            "body": notification.message,
+            "message": message,
+            "body": message,
             "type": notification.type,
             "id": notification.id,
             "notification_id": notification.id,
@@ -97,62 +112,15 @@ def send_push_notification(notification):
             "timestamp": get_oman_time().isoformat()
         }
         
-        # Send push notification to each subscription in background thread
-        def send_to_subscription(subscription):
-            try:
-                # Check user preferences
-                user_pref = NotificationPreference.query.filter_by(user_id=subscription.user_id).first()
-                if user_pref and not user_pref.push_enabled:
-                    return
-                
-                # Check type-specific preferences
-                if user_pref:
-                    type_enabled_map = {
-                        'attendance': user_pref.attendance_enabled,
-                        'bus': user_pref.bus_enabled,
-                        'behavior': user_pref.behavior_enabled,
-                        'timetable': user_pref.timetable_enabled,
-                        'substitution': user_pref.substitution_enabled,
-                        'news': user_pref.news_enabled,
-                        'general': user_pref.general_enabled
-                    }
-                    if notification.type in type_enabled_map and not type_enabled_map[notification.type]:
-                        return
-                
-                subscription_data = {
-                    "endpoint": subscription.endpoint,
-                    "keys": {
-                        "p256dh": subscription.p256dh_key,
-                        "auth": subscription.auth_key
-                    }
-                }
-                
-                webpush(
-                    subscription_info=subscription_data,
-                    data=json.dumps(payload),
-                    vapid_private_key=vapid_private_key,
-                    vapid_claims=vapid_claims
-                )
-                print(f"✅ Push notification sent to user {subscription.user_id}")
-            except WebPushException as e:
-                # Handle expired/invalid subscriptions
-                status = e.response.status_code if e.response else None
-                body = (e.response.text or "")[:200] if e.response else ""
-                if status in [410, 404]:
-                    print("⚠️ Subscription expired for user %s (HTTP %s), marking inactive" % (subscription.user_id, status))
-                    subscription.is_active = False
-                    db.session.commit()
-                else:
-                    print("❌ Push failed user %s: HTTP %s %s" % (subscription.user_id, status, body or str(e)))
-            except Exception as e:
-                import traceback
-                print("❌ Push error user %s: %s" % (subscription.user_id, str(e)))
-                traceback.print_exc()
-        
-        # Send notifications in background thread to avoid blocking
-        thread = threading.Thread(target=lambda: [send_to_subscription(sub) for sub in subscriptions])
-        thread.daemon = True
-        thread.start()
+        dispatch_push(
+            current_app._get_current_object(),
+            notification.id,
+            payload,
+            targets,
+            vapid_private_key,
+            vapid_claim_email,
+            digest=bool(notification.digest_key)
+        )
         
     except Exception as e:
         print(f"❌ Error in send_push_notification: {str(e)}")
@@ -195,144 +163,131 @@ def create_notification(school_id, title, message, notification_type,
         return None
 
 
+def _not_receipted(model, user_id):
+    """Anti-join: the user has no NotificationRead/NotificationDeleted row for the notification."""
+    return ~exists().where(model.notification_id == Notification.id, model.user_id == user_id)
+
+
+def _encode_cursor(notification):
+    raw = f"{notification.priority_rank}|{notification.created_at.isoformat()}|{notification.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """(priority_rank, created_at, id) of the last notification on the previous page."""
+    rank, created_at, notification_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return int(rank), datetime.fromisoformat(created_at), int(notification_id)
+
+
+def _after_cursor(rank, created_at, notification_id):
+    """Rows after the cursor in (priority_rank, created_at, id) descending order."""
+    return or_(
+        Notification.priority_rank < rank,
+        and_(Notification.priority_rank == rank, Notification.created_at < created_at),
+        and_(Notification.priority_rank == rank, Notification.created_at == created_at, Notification.id < notification_id)
+    )
+
+
 @notification_blueprint.route('', methods=['GET'], strict_slashes=False)
 @jwt_required()
 def get_notifications():
-    """Get notifications for the current user"""
+    """
+    Get notifications for the current user, most urgent then newest first.
+    Keyset pagination: pass the returned next_cursor as ?cursor= for the next
+    page. Only legacy ?page= requests run the COUNT and OFFSET and return
+    total/pages.
+    """
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        # Role and school come from the token claims; these endpoints are polled
+        user = current_principal()
         
         if not user:
             return jsonify({"message": "User not found"}), 404
+        current_user_id = user.id
         
         # Get query parameters
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        cursor = request.args.get('cursor')
+        page = request.args.get('page', type=int)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
         unread_only = request.args.get('unread_only', 'false').lower() == 'true'
         notification_type = request.args.get('type', None)
         
-        # School filter: for super admin, also show notifications where they are in target_user_ids (e.g. WhatsApp requests from any school)
-        user_id = user.id
-        target_ids_conditions = or_(
-            Notification.target_user_ids.like(f'%[{user_id}]%'),
-            Notification.target_user_ids.like(f'%"{user_id}"%'),
-            Notification.target_user_ids.like(f'%{user_id}%')
-        )
-        if user.user_role == 'admin':
-            school_filter = or_(
-                Notification.school_id == user.school_id,
-                target_ids_conditions
-            )
-        else:
-            school_filter = Notification.school_id == user.school_id
-        
-        # Build base query
-        query = Notification.query.filter(
-            school_filter,
-            Notification.is_active == True
-        )
-        
-        # Filter by expiration
+        # Active, unexpired rows of the requested type that this user hasn't deleted
+        # (or read, if asked); receipts are checked with anti-joins
         now = get_oman_time()
-        query = query.filter(
+        filters = [
+            Notification.is_active == True,
             or_(
                 Notification.expires_at.is_(None),
                 Notification.expires_at > now
-            )
-        )
-        
-        # Filter by target (role-based or specific user)
-        # IMPORTANT: Only show notifications where user is explicitly targeted
-        # - target_role matches user's role, OR
-        # - user ID is in target_user_ids
-        # DO NOT show notifications with target_role=None (those are invalid/broadcast)
-        
-        # Build conditions for targeting
-        conditions = []
-        
-        # Condition 1: Role-based targeting
-        if user.user_role:
-            conditions.append(Notification.target_role == user.user_role)
-        
-        # Condition 2: User-specific targeting (check if user ID is in JSON array)
-        # Handle both JSON array format [1,2,3] and string format (user_id already set above)
-        conditions.append(
-            or_(
-                Notification.target_user_ids.like(f'%[{user_id}]%'),  # [1,2,3] format
-                Notification.target_user_ids.like(f'%"{user_id}"%'),  # ["1","2","3"] format
-                Notification.target_user_ids.like(f'%{user_id}%')     # Fallback
-            )
-        )
-        
-        # Apply filter - user must match either role OR be in target_user_ids
-        query = query.filter(or_(*conditions))
-        
-        # Filter by type if specified
+            ),
+            _not_receipted(NotificationDeleted, current_user_id)
+        ]
         if notification_type:
-            query = query.filter(Notification.type == notification_type)
-        
-        # Exclude deleted notifications for this user
-        deleted_notification_ids = db.session.query(NotificationDeleted.notification_id).filter(
-            NotificationDeleted.user_id == current_user_id
-        ).all()
-        deleted_ids = [d[0] for d in deleted_notification_ids]
-        if deleted_ids:
-            query = query.filter(~Notification.id.in_(deleted_ids))
-        
-        # Get user's read notification IDs
+            filters.append(Notification.type == notification_type)
         if unread_only:
-            read_notification_ids = db.session.query(NotificationRead.notification_id).filter(
-                NotificationRead.user_id == current_user_id
-            ).all()
-            read_ids = [r[0] for r in read_notification_ids]
-            
-            if read_ids:
-                query = query.filter(~Notification.id.in_(read_ids))
-        
-        # Order by priority and created date
-        priority_order = db.case(
-            (Notification.priority == 'urgent', 1),
-            (Notification.priority == 'high', 2),
-            (Notification.priority == 'normal', 3),
-            (Notification.priority == 'low', 4),
-            else_=5
+            filters.append(_not_receipted(NotificationRead, current_user_id))
+        
+        # Stored rank + created_at + id: matches ix_notifications_feed, no filesort of a CASE
+        feed_order = (
+            Notification.priority_rank.desc(),
+            Notification.created_at.desc(),
+            Notification.id.desc()
         )
-        query = query.order_by(priority_order, Notification.created_at.desc())
         
-        # Paginate
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        notifications = pagination.items
+        pagination = None
+        if page is not None:
+            # Own school's and global rows addressed to the user by id, role or broadcast audience
+            # (super admin also sees rows from any school that list them, e.g. WhatsApp requests)
+            query = Notification.query.filter(visible_notifications_filter(user), *filters).order_by(*feed_order)
+            pagination = query.paginate(page=max(page, 1), per_page=per_page, error_out=False)
+            notifications = pagination.items
+            has_more = pagination.has_next
+        else:
+            if cursor:
+                try:
+                    filters.append(_after_cursor(*_decode_cursor(cursor)))
+                except (ValueError, UnicodeDecodeError, binascii.Error):
+                    return jsonify({"message": "Invalid cursor"}), 400
+            
+            # UNION ALL of one index-ordered LIMIT read per school_id scope (own school,
+            # global, ...); an OR across school_id would rule out the ordered index scan
+            notifications = []
+            for scope in visible_notification_scopes(user):
+                notifications.extend(
+                    Notification.query.filter(scope, *filters).order_by(*feed_order).limit(per_page + 1).all()
+                )
+            notifications.sort(key=lambda n: (n.priority_rank, n.created_at, n.id), reverse=True)
+            has_more = len(notifications) > per_page
+            notifications = notifications[:per_page]
         
         # Get read status for each notification
-        read_notification_ids = db.session.query(NotificationRead.notification_id).filter(
-            NotificationRead.user_id == current_user_id,
-            NotificationRead.notification_id.in_([n.id for n in notifications])
-        ).all()
-        read_ids = set([r[0] for r in read_notification_ids])
-        
-        # Get deleted notification IDs for this user (should already be filtered, but double-check)
-        deleted_notification_ids = db.session.query(NotificationDeleted.notification_id).filter(
-            NotificationDeleted.user_id == current_user_id,
-            NotificationDeleted.notification_id.in_([n.id for n in notifications])
-        ).all()
-        deleted_ids = set([d[0] for d in deleted_notification_ids])
-        
-        # Prepare response (exclude deleted notifications)
+        read_ids = set()
+        if notifications:
+            read_ids = set(r[0] for r in db.session.query(NotificationRead.notification_id).filter(
+                NotificationRead.user_id == current_user_id,
+                NotificationRead.notification_id.in_([n.id for n in notifications])
+            ).all())
+        
         notification_list = []
         for notif in notifications:
-            if notif.id not in deleted_ids:  # Double-check: don't include deleted
-                notif_dict = notif.to_dict()
-                notif_dict['is_read'] = notif.id in read_ids
-                notification_list.append(notif_dict)
+            notif_dict = notif.to_dict()
+            notif_dict['is_read'] = notif.id in read_ids
+            notification_list.append(notif_dict)
         
-        return jsonify({
+        response = {
             "notifications": notification_list,
-            "total": pagination.total,
-            "pages": pagination.pages,
-            "current_page": page,
-            "per_page": per_page
-        }), 200
+            "per_page": per_page,
+            "has_more": has_more,
+            "next_cursor": _encode_cursor(notifications[-1]) if has_more and notifications else None
+        }
+        if pagination is not None:
+            response.update({
+                "total": pagination.total,
+                "pages": pagination.pages,
+                "current_page": max(page, 1)
+            })
+        return jsonify(response), 200
         
     except Exception as e:
         return jsonify({"message": f"Error fetching notifications: {str(e)}"}), 500
@@ -343,57 +298,29 @@ def get_notifications():
 def get_unread_count():
     """Get count of unread notifications for the current user"""
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        # Role and school come from the token claims; these endpoints are polled
+        user = current_principal()
         
         if not user:
             return jsonify({"message": "User not found"}), 404
+        current_user_id = user.id
         
         # Get all active notifications for the user (same filtering as get_notifications)
         now = get_oman_time()
-        user_id = user.id
-        target_ids_conditions = or_(
-            Notification.target_user_ids.like(f'%[{user_id}]%'),
-            Notification.target_user_ids.like(f'%"{user_id}"%'),
-            Notification.target_user_ids.like(f'%{user_id}%')
-        )
-        school_filter = or_(Notification.school_id == user.school_id, target_ids_conditions) if user.user_role == 'admin' else (Notification.school_id == user.school_id)
-        
-        # Build conditions for targeting (same logic as get_notifications)
-        conditions = []
-        if user.user_role:
-            conditions.append(Notification.target_role == user.user_role)
-        conditions.append(target_ids_conditions)
-        
         notifications_query = Notification.query.filter(
-            school_filter,
+            visible_notifications_filter(user),
             Notification.is_active == True,
             or_(
                 Notification.expires_at.is_(None),
                 Notification.expires_at > now
-            ),
-            or_(*conditions)  # User must match either role OR be in target_user_ids
+            )
         )
         
-        # Exclude deleted notifications for this user
-        deleted_notification_ids = db.session.query(NotificationDeleted.notification_id).filter(
-            NotificationDeleted.user_id == current_user_id
-        ).all()
-        deleted_ids = [d[0] for d in deleted_notification_ids]
-        if deleted_ids:
-            notifications_query = notifications_query.filter(~Notification.id.in_(deleted_ids))
-        
-        # Get read notification IDs
-        read_notification_ids = db.session.query(NotificationRead.notification_id).filter(
-            NotificationRead.user_id == current_user_id
-        ).all()
-        read_ids = [r[0] for r in read_notification_ids]
-        
-        # Count unread (excluding deleted and read notifications)
-        if read_ids:
-            unread_count = notifications_query.filter(~Notification.id.in_(read_ids)).count()
-        else:
-            unread_count = notifications_query.count()
+        # Unread = no read receipt and no delete receipt (anti-joins)
+        unread_count = notifications_query.filter(
+            _not_receipted(NotificationDeleted, current_user_id),
+            _not_receipted(NotificationRead, current_user_id)
+        ).count()
         
         return jsonify({"unread_count": unread_count}), 200
         
@@ -401,37 +328,60 @@ def get_unread_count():
         return jsonify({"message": f"Error fetching unread count: {str(e)}"}), 500
 
 
+# Per-user receipts share a unique (notification_id, user_id) key, so they are
+# written with INSERT IGNORE instead of checking for an existing row first
+MAX_BATCH_IDS = 500
+
+
+def _visible_conditions(user):
+    """Active, unexpired notifications addressed to the user."""
+    now = get_oman_time()
+    return [
+        visible_notifications_filter(user),
+        Notification.is_active == True,
+        or_(
+            Notification.expires_at.is_(None),
+            Notification.expires_at > now
+        )
+    ]
+
+
+def _insert_receipts(model, timestamp_column, user_id, *conditions):
+    """
+    INSERT IGNORE ... SELECT one receipt row (NotificationRead or
+    NotificationDeleted) for every notification matching `conditions`.
+    Returns the number of rows inserted (already existing rows are skipped).
+    """
+    rows = select(
+        Notification.id,
+        literal(user_id),
+        literal(datetime.utcnow())  # same clock as the read_at/deleted_at column defaults
+    ).where(*conditions)
+    statement = insert(model).from_select(
+        ['notification_id', 'user_id', timestamp_column], rows
+    ).prefix_with('IGNORE', dialect='mysql')
+    return db.session.execute(statement).rowcount
+
+
 @notification_blueprint.route('/<int:notification_id>/read', methods=['POST'])
 @jwt_required()
 def mark_notification_read(notification_id):
     """Mark a notification as read"""
     try:
-        current_user_id = get_jwt_identity()
-        
-        # Check if notification exists
-        notification = Notification.query.get(notification_id)
-        if not notification:
-            return jsonify({"message": "Notification not found"}), 404
-        
-        # Check if already marked as read
-        existing_read = NotificationRead.query.filter_by(
-            notification_id=notification_id,
-            user_id=current_user_id
-        ).first()
-        
-        if existing_read:
-            return jsonify({"message": "Notification already marked as read"}), 200
+        current_user_id = int(get_jwt_identity())
         
-        # Create read record
-        notification_read = NotificationRead(
-            notification_id=notification_id,
-            user_id=current_user_id
+        inserted = _insert_receipts(
+            NotificationRead, 'read_at', current_user_id, Notification.id == notification_id
         )
-        
-        db.session.add(notification_read)
         db.session.commit()
         
-        return jsonify({"message": "Notification marked as read"}), 200
+        if inserted:
+            return jsonify({"message": "Notification marked as read"}), 200
+        
+        # Nothing inserted: either already read or no such notification
+        if not db.session.query(Notification.id).filter(Notification.id == notification_id).first():
+            return jsonify({"message": "Notification not found"}), 404
+        return jsonify({"message": "Notification already marked as read"}), 200
         
     except Exception as e:
         db.session.rollback()
@@ -443,54 +393,13 @@ def mark_notification_read(notification_id):
 def mark_all_notifications_read():
     """Mark all notifications as read for the current user"""
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = current_principal()
         
         if not user:
             return jsonify({"message": "User not found"}), 404
         
-        # Get all unread notifications (same filtering as get_notifications)
-        now = get_oman_time()
-        user_id = user.id
-        target_ids_conditions = or_(
-            Notification.target_user_ids.like(f'%[{user_id}]%'),
-            Notification.target_user_ids.like(f'%"{user_id}"%'),
-            Notification.target_user_ids.like(f'%{user_id}%')
-        )
-        school_filter = or_(Notification.school_id == user.school_id, target_ids_conditions) if user.user_role == 'admin' else (Notification.school_id == user.school_id)
-        
-        conditions = []
-        if user.user_role:
-            conditions.append(Notification.target_role == user.user_role)
-        conditions.append(target_ids_conditions)
-        
-        notifications = Notification.query.filter(
-            school_filter,
-            Notification.is_active == True,
-            or_(
-                Notification.expires_at.is_(None),
-                Notification.expires_at > now
-            ),
-            or_(*conditions)  # User must match either role OR be in target_user_ids
-        ).all()
-        
-        # Get already read notification IDs
-        read_notification_ids = db.session.query(NotificationRead.notification_id).filter(
-            NotificationRead.user_id == current_user_id
-        ).all()
-        read_ids = set([r[0] for r in read_notification_ids])
-        
-        # Mark unread ones as read
-        count = 0
-        for notification in notifications:
-            if notification.id not in read_ids:
-                notification_read = NotificationRead(
-                    notification_id=notification.id,
-                    user_id=current_user_id
-                )
-                db.session.add(notification_read)
-                count += 1
-        
+        # One INSERT IGNORE ... SELECT over the same filtering as get_notifications
+        count = _insert_receipts(NotificationRead, 'read_at', user.id, *_visible_conditions(user))
         db.session.commit()
         
         return jsonify({
@@ -508,62 +417,69 @@ def mark_all_notifications_read():
 def delete_all_notifications():
     """Soft-delete all notifications for the current user (per-user deletion)."""
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = current_principal()
         
         if not user:
             return jsonify({"message": "User not found"}), 404
         
-        now = get_oman_time()
-        user_id = user.id
-        target_ids_conditions = or_(
-            Notification.target_user_ids.like(f'%[{user_id}]%'),
-            Notification.target_user_ids.like(f'%"{user_id}"%'),
-            Notification.target_user_ids.like(f'%{user_id}%')
-        )
-        school_filter = or_(Notification.school_id == user.school_id, target_ids_conditions) if user.user_role == 'admin' else (Notification.school_id == user.school_id)
-        
-        conditions = []
-        if user.user_role:
-            conditions.append(Notification.target_role == user.user_role)
-        conditions.append(target_ids_conditions)
+        count = _insert_receipts(NotificationDeleted, 'deleted_at', user.id, *_visible_conditions(user))
+        db.session.commit()
         
-        notifications = Notification.query.filter(
-            school_filter,
-            Notification.is_active == True,
-            or_(
-                Notification.expires_at.is_(None),
-                Notification.expires_at > now
-            ),
-            or_(*conditions)
-        ).all()
+        return jsonify({
+            "message": "تم حذف جميع الإشعارات" if count > 0 else "لا توجد إشعارات للحذف",
+            "count": count
+        }), 200
         
-        already_deleted = set(
-            r[0] for r in db.session.query(NotificationDeleted.notification_id).filter(
-                NotificationDeleted.user_id == current_user_id
-            ).all()
-        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Error deleting notifications: {str(e)}"}), 500
+
+
+@notification_blueprint.route('/batch', methods=['POST'])
+@jwt_required()
+def batch_update_notifications():
+    """
+    Mark a list of notifications as read or deleted for the current user.
+    Body: {"ids": [1, 2, 3], "action": "read" | "delete"}
+    IDs the user cannot see are ignored.
+    """
+    try:
+        user = current_principal()
         
-        count = 0
-        for notification in notifications:
-            if notification.id not in already_deleted:
-                db.session.add(NotificationDeleted(
-                    notification_id=notification.id,
-                    user_id=current_user_id
-                ))
-                count += 1
-                already_deleted.add(notification.id)
+        if not user:
+            return jsonify({"message": "User not found"}), 404
         
+        data = request.get_json() or {}
+        action = data.get('action')
+        if action not in ('read', 'delete'):
+            return jsonify({"message": "action must be 'read' or 'delete'"}), 400
+        
+        try:
+            ids = list({int(i) for i in data.get('ids') or []})
+        except (TypeError, ValueError):
+            return jsonify({"message": "ids must be a list of integers"}), 400
+        if not ids:
+            return jsonify({"message": "No notification ids given", "count": 0}), 200
+        if len(ids) > MAX_BATCH_IDS:
+            return jsonify({"message": f"At most {MAX_BATCH_IDS} ids per request"}), 400
+        
+        if action == 'read':
+            model, timestamp_column = NotificationRead, 'read_at'
+        else:
+            model, timestamp_column = NotificationDeleted, 'deleted_at'
+        count = _insert_receipts(
+            model, timestamp_column, user.id, Notification.id.in_(ids), *_visible_conditions(user)
+        )
         db.session.commit()
         
         return jsonify({
-            "message": "تم حذف جميع الإشعارات" if count > 0 else "لا توجد إشعارات للحذف",
+            "message": f"Updated {count} notifications",
             "count": count
         }), 200
         
     except Exception as e:
         db.session.rollback()
-        return jsonify({"message": f"Error deleting notifications: {str(e)}"}), 500
+        return jsonify({"message": f"Error updating notifications: {str(e)}"}), 500
 
 
 @notification_blueprint.route('/<int:notification_id>/delete', methods=['DELETE'])
@@ -571,8 +487,7 @@ def delete_all_notifications():
 def delete_notification(notification_id):
     """Delete a notification for the current user (soft delete - per user)"""
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = current_principal()
         
         if not user:
             return jsonify({"message": "User not found"}), 404
@@ -583,48 +498,20 @@ def delete_notification(notification_id):
             return jsonify({"message": "Notification not found"}), 404
         
         # Verify notification belongs to user's school (super admin can see notifications where they are in target_user_ids)
-        if notification.school_id != user.school_id and user.user_role != 'admin':
+        if notification.school_id is not None and notification.school_id != user.school_id and user.user_role != 'admin':
             return jsonify({"message": "Unauthorized"}), 403
         
-        # Verify user is targeted by this notification
-        user_is_targeted = False
-        
-        # Check role-based targeting
-        if notification.target_role == user.user_role:
-            user_is_targeted = True
-        
-        # Check user-specific targeting
-        if notification.target_user_ids:
-            try:
-                target_user_ids = json.loads(notification.target_user_ids)
-                if isinstance(target_user_ids, list) and current_user_id in target_user_ids:
-                    user_is_targeted = True
-            except:
-                # Fallback: check if user ID appears in string
-                if str(current_user_id) in notification.target_user_ids:
-                    user_is_targeted = True
-        
-        if not user_is_targeted:
+        # Verify user is targeted by this notification (by id, role or broadcast audience)
+        if not is_visible_to(notification, user):
             return jsonify({"message": "Notification not found or not accessible"}), 404
         
-        # Check if already deleted
-        existing_deletion = NotificationDeleted.query.filter_by(
-            notification_id=notification_id,
-            user_id=current_user_id
-        ).first()
-        
-        if existing_deletion:
-            return jsonify({"message": "Notification already deleted"}), 200
-        
-        # Create deletion record
-        notification_deleted = NotificationDeleted(
-            notification_id=notification_id,
-            user_id=current_user_id
+        inserted = _insert_receipts(
+            NotificationDeleted, 'deleted_at', user.id, Notification.id == notification_id
         )
-        
-        db.session.add(notification_deleted)
         db.session.commit()
         
+        if not inserted:
+            return jsonify({"message": "Notification already deleted"}), 200
         return jsonify({"message": "Notification deleted successfully"}), 200
         
     except Exception as e:
@@ -641,7 +528,7 @@ def create_notification_endpoint():
     """Create a new notification (admin/teacher only)"""
     try:
         current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = current_principal()
         
         if not user:
             return jsonify({"message": "User not found"}), 404
@@ -815,7 +702,7 @@ def get_notification_preferences():
             return jsonify({"message": "User not authenticated"}), 401
         
         # Check if user exists
-        user = User.query.get(current_user_id)
+        user = current_principal()
         if not user:
             return jsonify({"message": "User not found"}), 404
         
@@ -890,6 +777,7 @@ def update_notification_preferences():
         
         preferences.updated_at = get_oman_time()
         db.session.commit()
+        invalidate_preferences(current_user_id, preferences)
         
         return jsonify({
             "message": "Preferences updated successfully",
@@ -3,12 +3,15 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, create_access_token
 from werkzeug.security import generate_password_hash, check_password_hash
-from app.models import User, Student, ParentPickup, School
+from app.models import Student, ParentPickup
 from app import db
 from app.config import get_oman_time
 from datetime import datetime, date
 from sqlalchemy import and_
 from app.logger import log_action
+from app.services.pickup_display_feed import get_pickup_feed, bump_pickup_feed_version
+from app.services.login_throttle import check_login_allowed, record_login_failure, clear_login_failures
+from app.principal import build_token_claims, current_principal, get_current_user
 import re
 import logging
 from flask_cors import CORS
@@ -29,6 +32,32 @@ parent_pickup_bp = Blueprint('parent_pickup', __name__)
 CORS(parent_pickup_bp, supports_credentials=True)
 
 MAX_PARENT_FAILED_ATTEMPTS = 5
+PARENT_THROTTLE_SCOPE = 'parent_login'
+
+
+def _with_retry_after(response, status_code, retry_after):
+    """Attach Retry-After so clients back off instead of the worker sleeping."""
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response, status_code
+
+
+def _parent_throttled(student_username):
+    """Return a 429 response if this IP or student is throttled, else None."""
+    retry_after = check_login_allowed(request.remote_addr, student_username, scope=PARENT_THROTTLE_SCOPE)
+    if not retry_after:
+        return None
+    return _with_retry_after(
+        jsonify(message="محاولات كثيرة. الرجاء الانتظار والمحاولة لاحقاً.", retry_after=retry_after),
+        429,
+        retry_after
+    )
+
+
+def _parent_failure(student_username, status_code, **payload):
+    """Count a failed parent attempt (shared across workers) and build the response."""
+    retry_after = record_login_failure(request.remote_addr, student_username, scope=PARENT_THROTTLE_SCOPE)
+    return _with_retry_after(jsonify(retry_after=retry_after, **payload), status_code, retry_after)
 
 
 @parent_pickup_bp.route('/verify-parent-phone', methods=['POST'])
@@ -47,9 +76,13 @@ def verify_parent_phone():
         if not student_username or not parent_phone:
             return jsonify(verified=False, message="اسم المستخدم ورقم الهاتف مطلوبان."), 400
 
+        throttled = _parent_throttled(student_username)
+        if throttled:
+            return throttled
+
         student = Student.query.filter_by(username=student_username).first()
         if not student:
-            return jsonify(verified=False, message="الطالب غير موجود."), 404
+            return _parent_failure(student_username, 404, verified=False, message="الطالب غير موجود.")
 
         now = get_oman_time()
         if getattr(student, 'parent_locked_until', None) and student.parent_locked_until and student.parent_locked_until > now:
@@ -62,7 +95,7 @@ def verify_parent_phone():
         student_phone = _normalize_phone(student.phone_number)
         given_phone = _normalize_phone(parent_phone)
         if not student_phone or student_phone != given_phone:
-            return jsonify(verified=False, message="رقم الهاتف غير صحيح."), 401
+            return _parent_failure(student_username, 401, verified=False, message="رقم الهاتف غير صحيح.")
 
         if not student.is_active:
             return jsonify(verified=False, message="حساب الطالب غير مفعل."), 403
@@ -101,9 +134,13 @@ def parent_login():
         if not pin_str or not pin_str.isdigit() or len(pin_str) != 6:
             return jsonify(message="كلمة المرور يجب أن تكون 6 أرقام."), 400
 
+        throttled = _parent_throttled(student_username)
+        if throttled:
+            return throttled
+
         student = Student.query.filter_by(username=student_username).first()
         if not student:
-            return jsonify(message="الطالب غير موجود."), 404
+            return _parent_failure(student_username, 404, message="الطالب غير موجود.")
 
         now = get_oman_time()
         if getattr(student, 'parent_locked_until', None) and student.parent_locked_until and student.parent_locked_until > now:
@@ -114,7 +151,7 @@ def parent_login():
         student_phone = _normalize_phone(student.phone_number)
         given_phone = _normalize_phone(parent_phone)
         if not student_phone or student_phone != given_phone:
-            return jsonify(message="رقم الهاتف غير صحيح."), 401
+            return _parent_failure(student_username, 401, message="رقم الهاتف غير صحيح.")
 
         if not student.is_active:
             return jsonify(message="حساب الطالب غير مفعل."), 403
@@ -144,13 +181,15 @@ def parent_login():
                     ), 403
                 db.session.add(student)
                 db.session.commit()
-                return jsonify(message="كلمة المرور (6 أرقام) غير صحيحة."), 401
+                return _parent_failure(student_username, 401, message="كلمة المرور (6 أرقام) غير صحيحة.")
             student.parent_failed_attempts = 0
             student.parent_locked_until = None
             db.session.add(student)
             db.session.commit()
 
-        access_token = create_access_token(identity=str(student.id))
+        clear_login_failures(student_username, scope=PARENT_THROTTLE_SCOPE)
+
+        access_token = create_access_token(identity=str(student.id), additional_claims=build_token_claims(student))
         return jsonify({
             'access_token': access_token,
             'student': {
@@ -176,8 +215,7 @@ def admin_reset_parent_pin():
     Body: { "student_id": int }
     """
     try:
-        identity = get_jwt_identity()
-        user = User.query.get(int(identity))
+        user = get_current_user()
         if not user:
             return jsonify(message="المستخدم غير موجود."), 404
         # Parent login uses student id as identity; staff use user id. Staff are Teacher or base User (admin).
@@ -316,6 +354,7 @@ def request_pickup():
         
         db.session.add(new_pickup)
         db.session.commit()
+        bump_pickup_feed_version(new_pickup.school_id)
         
         return jsonify(
             message="تم إرسال طلب الاستلام بنجاح. Pickup request submitted successfully.",
@@ -362,6 +401,7 @@ def confirm_pickup():
         pickup_request.confirmation_time = current_time
         
         db.session.commit()
+        bump_pickup_feed_version(pickup_request.school_id)
         
         return jsonify(
             message="تم تأكيد وصولك. سيتم إخطار المدرسة. Confirmation successful. School will be notified.",
@@ -408,6 +448,7 @@ def complete_pickup():
         pickup_request.completed_time = current_time
         
         db.session.commit()
+        bump_pickup_feed_version(pickup_request.school_id)
         
         return jsonify(
             message="تم تأكيد استلام الطالب بنجاح. Pickup completed successfully.",
@@ -497,69 +538,28 @@ def get_display_pickups():
     """
     Get pickup requests for the logged-in user's school only (secure).
     Requires login; school_id from JWT (User or Student) — no query param.
+    Supports If-None-Match: returns 304 when the feed hasn't changed.
     """
     try:
-        identity = get_jwt_identity()
         try:
-            uid = int(identity)
+            principal = current_principal()
         except (TypeError, ValueError):
             return jsonify(message="Unauthorized."), 401
 
-        school_id = None
-        user = User.query.get(uid)
-        if user and getattr(user, 'school_id', None) is not None:
-            school_id = user.school_id
-        if school_id is None:
-            student = Student.query.get(uid)
-            if student and getattr(student, 'school_id', None) is not None:
-                school_id = student.school_id
+        # school_id comes from the signed token claims; no user lookup per poll
+        school_id = principal.school_id if principal else None
         if not school_id:
             return jsonify(
                 message="لا توجد مدرسة مرتبطة بحسابك.",
                 message_en="No school linked to your account."
             ), 403
 
-        current_date = get_oman_time().date()
-        query = ParentPickup.query.filter(
-            ParentPickup.pickup_date == current_date,
-            ParentPickup.school_id == school_id
-        )
-        pickups = query.all()
-        
-        # Priority order: confirmed first (oldest first), then pending (oldest first), then completed (newest first)
-        def sort_key(p):
-            dt = get_oman_time()
-            if p.status == 'confirmed':
-                t = p.confirmation_time or dt
-                t = t.replace(tzinfo=None) if hasattr(t, 'replace') and getattr(t, 'tzinfo', None) else t
-                return (0, t)
-            if p.status == 'pending':
-                t = p.request_time or dt
-                t = t.replace(tzinfo=None) if hasattr(t, 'replace') and getattr(t, 'tzinfo', None) else t
-                return (1, t)
-            # completed: newest first
-            t = p.completed_time or dt
-            t = t.replace(tzinfo=None) if hasattr(t, 'replace') and getattr(t, 'tzinfo', None) else t
-            return (2, t)
-        
-        pickups_sorted = sorted(pickups, key=sort_key)
-        # Reverse completed segment so newest first
-        out = []
-        completed_list = [p for p in pickups_sorted if p.status == 'completed']
-        others = [p for p in pickups_sorted if p.status != 'completed']
-        for p in others:
-            out.append(p)
-        for p in reversed(completed_list):
-            out.append(p)
-        pickups_sorted = out
-        
-        school = School.query.get(school_id)
-        school_name = school.name if school else None
-
-        return jsonify(
-            pickups=[p.to_dict() for p in pickups_sorted],
-            school_name=school_name
-        ), 200
+        # Cached per school until the next pickup mutation; unchanged feeds answer 304
+        feed, etag = get_pickup_feed(school_id)
+        response = jsonify(feed)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
         
     except Exception as e:
         logger.error(f"Error in get_display_pickups: {str(e)}")
@@ -573,8 +573,7 @@ def get_all_pickups():
     Get all pickup requests (for school admins)
     """
     try:
-        user_id = int(get_jwt_identity())
-        user = User.query.get(user_id)
+        user = current_principal()
         
         if not user or user.user_role not in ['admin', 'school_admin', 'data_analyst']:
             return jsonify(message="Unauthorized."), 403
@@ -621,8 +620,7 @@ def cancel_pickup():
     Parent or admin cancels a pickup request
     """
     try:
-        user_id = int(get_jwt_identity())
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         data = request.get_json()
         pickup_id = data.get('pickup_id')
@@ -643,8 +641,10 @@ def cancel_pickup():
             return jsonify(message="Unauthorized."), 403
         
         # Delete the pickup request
+        school_id = pickup_request.school_id
         db.session.delete(pickup_request)
         db.session.commit()
+        bump_pickup_feed_version(school_id)
         
         return jsonify(message="تم إلغاء طلب الاستلام. Pickup request cancelled."), 200
         
@@ -2,7 +2,7 @@
 
 from flask import Blueprint, jsonify ,request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import User, Student, Teacher, School ,Class,Attendance ,student_classes,News,Subject,Timetable,TeacherSubstitution,Driver,Bus
+from app.models import User, Student, Teacher, School ,Class,Attendance ,student_classes,News,Subject,Timetable,TeacherSubstitution,Driver,Bus,SchoolCalendar
 from app import db
 from werkzeug.security import generate_password_hash
 from io import StringIO
@@ -16,18 +16,23 @@ from app.config import get_oman_time
 import logging
 import requests
 import json
-from ibulk_sms_service import get_ibulk_sms_service, IBulkSMSService
+from ibulk_sms_service import get_ibulk_sms_service, IBulkSMSService, reset_balance_discovery
 from evolution_whatsapp_service import get_evolution_service, invalidate_service_cache, EvolutionWhatsAppService
 from flask_cors import CORS
 from app.services.notification_service import (
-    notify_students_school_news,
-    notify_teachers_school_news,
-    notify_teachers_system_news,
-    notify_driver_school_news,
-    notify_admin_system_news,
+    notify_school_news,
+    notify_system_news,
     notify_super_admin_whatsapp_request,
     notify_school_admins_whatsapp_activated,
 )
+from app.services.teacher_compliance import get_teacher_compliance
+from app.services.school_calendar import working_days_between, invalidate_school_calendar, ENTRY_TYPES
+from app.services.expected_sessions import expected_sessions_by_teacher
+from app.services.attendance_snapshot import snapshot_for_range
+from app.services.partitioning import model_in_range
+from app.services import http_client
+from app.services.provider_registry import bump_config_version
+from app.principal import current_principal
 
 
 logger = logging.getLogger(__name__)
@@ -45,6 +50,7 @@ def get_school_statistics(user, school_id, selected_date):
 
     day_start = datetime.combine(selected_date, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
 
     school = db.session.query(School).filter(School.id == school_id, School.is_active == True).first()
     if not school:
@@ -70,22 +76,22 @@ def get_school_statistics(user, school_id, selected_date):
     # All four attendance counts in a single query using conditional aggregation
     att = db.session.query(
         func.count(func.distinct(
-            case((Attendance.is_Acsent == True, Attendance.student_id))
+            case((attendance_rows.is_Acsent == True, attendance_rows.student_id))
         )).label('num_absents'),
         func.count(func.distinct(
-            case((Attendance.is_late == True, Attendance.student_id))
+            case((attendance_rows.is_late == True, attendance_rows.student_id))
         )).label('num_lates'),
         func.count(func.distinct(
-            case((Attendance.is_present == True, Attendance.student_id))
+            case((attendance_rows.is_present == True, attendance_rows.student_id))
         )).label('num_presents'),
         func.count(func.distinct(
-            case((Attendance.is_Excus == True, Attendance.student_id))
+            case((attendance_rows.is_Excus == True, attendance_rows.student_id))
         )).label('num_excus'),
     ).filter(
         and_(
-            Attendance.class_id.in_(active_classes),
-            Attendance.date >= day_start,
-            Attendance.date < day_end,
+            attendance_rows.class_id.in_(active_classes),
+            attendance_rows.date >= day_start,
+            attendance_rows.date < day_end,
         )
     ).first()
 
@@ -109,6 +115,7 @@ def get_class_statistics(user, school_id, selected_date):
 
     day_start = datetime.combine(selected_date, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
 
     # All active classes with their teacher names — single query
     classes = db.session.query(Class.id, Class.name, Teacher.fullName).join(Teacher).filter(
@@ -132,26 +139,26 @@ def get_class_statistics(user, school_id, selected_date):
 
     # All attendance stats for all classes — single bulk query with conditional aggregation
     att_rows = db.session.query(
-        Attendance.class_id,
+        attendance_rows.class_id,
         func.count(func.distinct(
-            case((Attendance.is_present == True, Attendance.student_id))
+            case((attendance_rows.is_present == True, attendance_rows.student_id))
         )).label('presents'),
         func.count(func.distinct(
-            case((Attendance.is_Acsent == True, Attendance.student_id))
+            case((attendance_rows.is_Acsent == True, attendance_rows.student_id))
         )).label('absents'),
         func.count(func.distinct(
-            case((Attendance.is_Excus == True, Attendance.student_id))
+            case((attendance_rows.is_Excus == True, attendance_rows.student_id))
         )).label('excus'),
         func.count(func.distinct(
-            case((Attendance.is_late == True, Attendance.student_id))
+            case((attendance_rows.is_late == True, attendance_rows.student_id))
         )).label('lates'),
     ).filter(
         and_(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date >= day_start,
-            Attendance.date < day_end,
+            attendance_rows.class_id.in_(class_ids),
+            attendance_rows.date >= day_start,
+            attendance_rows.date < day_end,
         )
-    ).group_by(Attendance.class_id).all()
+    ).group_by(attendance_rows.class_id).all()
 
     attendance_map = {row.class_id: row for row in att_rows}
 
@@ -181,6 +188,7 @@ def get_school_with_class_statistics(user, school_id, selected_date):
     # Index-friendly date range for attendances.date (DateTime column)
     day_start = datetime.combine(selected_date, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
 
     # ── Query 1 ──────────────────────────────────────────────────────────────
     # School name + active student/teacher/class counts as scalar subqueries,
@@ -239,26 +247,26 @@ def get_school_with_class_statistics(user, school_id, selected_date):
     # ── Query 3 ──────────────────────────────────────────────────────────────
     # Per-class attendance using conditional aggregation + GROUP BY.
     att_rows = db.session.query(
-        Attendance.class_id,
+        attendance_rows.class_id,
         func.count(func.distinct(
-            case((Attendance.is_present == True, Attendance.student_id))
+            case((attendance_rows.is_present == True, attendance_rows.student_id))
         )).label('presents'),
         func.count(func.distinct(
-            case((Attendance.is_Acsent == True, Attendance.student_id))
+            case((attendance_rows.is_Acsent == True, attendance_rows.student_id))
         )).label('absents'),
         func.count(func.distinct(
-            case((Attendance.is_Excus == True, Attendance.student_id))
+            case((attendance_rows.is_Excus == True, attendance_rows.student_id))
         )).label('excus'),
         func.count(func.distinct(
-            case((Attendance.is_late == True, Attendance.student_id))
+            case((attendance_rows.is_late == True, attendance_rows.student_id))
         )).label('lates'),
     ).filter(
         and_(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date >= day_start,
-            Attendance.date < day_end,
+            attendance_rows.class_id.in_(class_ids),
+            attendance_rows.date >= day_start,
+            attendance_rows.date < day_end,
         )
-    ).group_by(Attendance.class_id).all()
+    ).group_by(attendance_rows.class_id).all()
 
     attendance_map = {row.class_id: row for row in att_rows}
 
@@ -268,22 +276,22 @@ def get_school_with_class_statistics(user, school_id, selected_date):
     # if a student appears in more than one class on the same day).
     school_att = db.session.query(
         func.count(func.distinct(
-            case((Attendance.is_Acsent == True, Attendance.student_id))
+            case((attendance_rows.is_Acsent == True, attendance_rows.student_id))
         )).label('num_absents'),
         func.count(func.distinct(
-            case((Attendance.is_late == True, Attendance.student_id))
+            case((attendance_rows.is_late == True, attendance_rows.student_id))
         )).label('num_lates'),
         func.count(func.distinct(
-            case((Attendance.is_present == True, Attendance.student_id))
+            case((attendance_rows.is_present == True, attendance_rows.student_id))
         )).label('num_presents'),
         func.count(func.distinct(
-            case((Attendance.is_Excus == True, Attendance.student_id))
+            case((attendance_rows.is_Excus == True, attendance_rows.student_id))
         )).label('num_excus'),
     ).filter(
         and_(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date >= day_start,
-            Attendance.date < day_end,
+            attendance_rows.class_id.in_(class_ids),
+            attendance_rows.date >= day_start,
+            attendance_rows.date < day_end,
         )
     ).first()
 
@@ -319,8 +327,7 @@ def get_school_with_class_statistics(user, school_id, selected_date):
 @static_blueprint.route('/', methods=['GET'])
 @jwt_required()
 def school_statistics():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     # print(f"User ID: {user_id}, Role: {user.user_role}")
 
     # Retrieve the school_id dynamically based on user role
@@ -354,8 +361,7 @@ def school_statistics():
 @static_blueprint.route('/teacher_attendance_this_week', methods=['GET'])
 @jwt_required()
 def teacher_attendance_this_week():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # 1️⃣ Get selected date
     selected_date_str = request.args.get('date')
@@ -373,9 +379,6 @@ def teacher_attendance_this_week():
     start_of_week = selected_date - timedelta(days=adjusted_day)
     end_of_week = start_of_week + timedelta(days=4)
 
-    week_start_dt = datetime.combine(start_of_week, datetime.min.time())
-    week_end_dt = datetime.combine(end_of_week, datetime.min.time()) + timedelta(days=1)
-
     teacher_attendance_summary = []
 
     # 3️⃣ If user is a teacher
@@ -383,63 +386,31 @@ def teacher_attendance_this_week():
         teacher = Teacher.query.get(user.id)
         if not teacher:
             return jsonify(message="Teacher not found."), 404
-
-        attendance_count = db.session.query(
-            func.count(
-                func.distinct(
-                    func.concat(
-                        Attendance.class_id, '-', Attendance.class_time_num, '-', func.date(Attendance.date)
-                    )
-                )
-            )
-        ).filter(
-            and_(
-                Attendance.teacher_id == teacher.id,
-                Attendance.date >= week_start_dt,
-                Attendance.date < week_end_dt
-            )
-        ).scalar()
-
-        teacher_attendance_summary.append({
-            "teacher_id": teacher.id,
-            "teacher_name": teacher.fullName,
-            "job_name": teacher.job_name,
-            "recorded_class_sessions_this_week": attendance_count,
-            "week_Classes_Number": teacher.week_Classes_Number
-        })
+        teachers = [teacher]
 
     # 4️⃣ If user is a school_admin
     elif user.user_role == 'school_admin' or user.user_role == 'data_analyst':
         teachers = Teacher.query.filter_by(school_id=user.school_id, is_active=True).all()
 
-        for teacher in teachers:
-            attendance_count = db.session.query(
-                func.count(
-                    func.distinct(
-                        func.concat(
-                            Attendance.class_id, '-', Attendance.class_time_num, '-', func.date(Attendance.date)
-                        )
-                    )
-                )
-            ).filter(
-                and_(
-                    Attendance.teacher_id == teacher.id,
-                    Attendance.date >= week_start_dt,
-                    Attendance.date < week_end_dt
-                )
-            ).scalar()
-
-            teacher_attendance_summary.append({
-                "teacher_id": teacher.id,
-                "teacher_name": teacher.fullName,
-                "job_name": teacher.job_name,
-                "recorded_class_sessions_this_week": attendance_count,
-                "week_Classes_Number": teacher.week_Classes_Number
-            })
-
     else:
         return jsonify(message="Unauthorized access."), 403
 
+    compliance = get_teacher_compliance(user.school_id, start_of_week.date(), end_of_week.date())
+    # Sessions each teacher's timetable expects this week (teachers without a timetable are absent)
+    timetable_expected = expected_sessions_by_teacher(user.school_id, start_of_week.date(), end_of_week.date())
+    for teacher in teachers:
+        stats = compliance.get(teacher.id, {})
+        expected = timetable_expected.get(teacher.id)
+        teacher_attendance_summary.append({
+            "teacher_id": teacher.id,
+            "teacher_name": teacher.fullName,
+            "job_name": teacher.job_name,
+            "recorded_class_sessions_this_week": stats.get('recorded_sessions', 0),
+            "week_Classes_Number": teacher.week_Classes_Number,
+            "expected_sessions_this_week": expected,
+            "missing_sessions_this_week": max(expected - stats.get('matched_sessions', 0), 0) if expected is not None else None
+        })
+
     return jsonify({
         "week_range": {
             "start": start_of_week.strftime('%Y-%m-%d'),
@@ -454,8 +425,7 @@ def teacher_attendance_this_week():
 @jwt_required()
 def teacher_master_report():
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = current_principal()
 
         if not user:
             return jsonify(message="User not found."), 404
@@ -477,9 +447,6 @@ def teacher_master_report():
         if start_date > end_date:
             return jsonify(message="Start date cannot be after end date."), 400
 
-        range_start_dt = datetime.combine(start_date, datetime.min.time())
-        range_end_dt = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
-
         teacher_master_summary = []
 
         # If user is a teacher
@@ -487,31 +454,35 @@ def teacher_master_report():
             teacher = Teacher.query.get(user.id)
             if not teacher:
                 return jsonify(message="Teacher not found."), 404
+            teachers = [teacher]
 
-            # Calculate recorded days (days with at least one record) for the date range (index-friendly)
-            recorded_days = db.session.query(
-                func.count(func.distinct(func.date(Attendance.date)))
-            ).filter(
-                and_(
-                    Attendance.teacher_id == teacher.id,
-                    Attendance.date >= range_start_dt,
-                    Attendance.date < range_end_dt
-                )
-            ).scalar()
-
-            # Calculate total expected classes for the date range
-            # Count working days (Sunday to Thursday) in the date range
-            working_days = 0
-            current_date = start_date
-            while current_date <= end_date:
-                # Sunday = 6, Monday = 0, Tuesday = 1, Wednesday = 2, Thursday = 3
-                if current_date.weekday() in [6, 0, 1, 2, 3]:  # Sunday to Thursday
-                    working_days += 1
-                current_date += timedelta(days=1)
+        # If user is a school_admin
+        elif user.user_role == 'school_admin' or user.user_role == 'data_analyst':
+            teachers = Teacher.query.filter_by(school_id=user.school_id).all()
+
+        else:
+            return jsonify(message="Unauthorized access."), 403
+
+        # Recorded days for every teacher in one grouped pass (cached per school and range)
+        compliance = get_teacher_compliance(user.school_id, start_date, end_date)
+        # Working days (Sunday to Thursday, minus school holidays) in the date range
+        working_days = working_days_between(user.school_id, start_date, end_date)
+
+        # Sessions each teacher's timetable expects in the range (teachers without a timetable are absent)
+        timetable_expected = expected_sessions_by_teacher(user.school_id, start_date, end_date)
+
+        for teacher in teachers:
+            stats = compliance.get(teacher.id, {})
+            recorded_days = stats.get('recorded_days', 0)
 
             # Handle case where week_Classes_Number is None or 0
             week_classes = teacher.week_Classes_Number or 0
-            total_expected_classes = working_days * week_classes
+            if teacher.id in timetable_expected:
+                total_expected_classes = timetable_expected[teacher.id]
+                missing_classes = max(total_expected_classes - stats.get('matched_sessions', 0), 0)
+            else:
+                total_expected_classes = working_days * week_classes
+                missing_classes = None
             percentage = round((recorded_days / working_days * 100) if working_days > 0 else 0, 2)
 
             teacher_master_summary.append({
@@ -522,54 +493,10 @@ def teacher_master_report():
                 "working_days": working_days,
                 "week_classes": week_classes,
                 "total_expected_classes": total_expected_classes,
+                "missing_classes": missing_classes,
                 "percentage": percentage
             })
 
-        # If user is a school_admin
-        elif user.user_role == 'school_admin' or user.user_role == 'data_analyst':
-            teachers = Teacher.query.filter_by(school_id=user.school_id).all()
-
-            for teacher in teachers:
-                # Calculate recorded days (days with at least one record) for the date range (index-friendly)
-                recorded_days = db.session.query(
-                    func.count(func.distinct(func.date(Attendance.date)))
-                ).filter(
-                    and_(
-                        Attendance.teacher_id == teacher.id,
-                        Attendance.date >= range_start_dt,
-                        Attendance.date < range_end_dt
-                    )
-                ).scalar()
-
-                # Calculate total expected classes for the date range
-                # Count working days (Sunday to Thursday) in the date range
-                working_days = 0
-                current_date = start_date
-                while current_date <= end_date:
-                    # Sunday = 6, Monday = 0, Tuesday = 1, Wednesday = 2, Thursday = 3
-                    if current_date.weekday() in [6, 0, 1, 2, 3]:  # Sunday to Thursday
-                        working_days += 1
-                    current_date += timedelta(days=1)
-
-                # Handle case where week_Classes_Number is None or 0
-                week_classes = teacher.week_Classes_Number or 0
-                total_expected_classes = working_days * week_classes
-                percentage = round((recorded_days / working_days * 100) if working_days > 0 else 0, 2)
-
-                teacher_master_summary.append({
-                    "teacher_id": teacher.id,
-                    "teacher_name": teacher.fullName,
-                    "job_name": teacher.job_name,
-                    "recorded_days": recorded_days,
-                    "working_days": working_days,
-                    "week_classes": week_classes,
-                    "total_expected_classes": total_expected_classes,
-                    "percentage": percentage
-                })
-
-        else:
-            return jsonify(message="Unauthorized access."), 403
-
         return jsonify({
             "date_range": {
                 "start": start_date.strftime('%Y-%m-%d'),
@@ -583,12 +510,120 @@ def teacher_master_report():
 
 
 
+def _calendar_school_id(user):
+    """School whose calendar the user manages: their own, or ?school_id / body school_id for admins."""
+    if user.user_role == 'admin':
+        data = request.get_json(silent=True) or {}
+        return request.args.get('school_id', type=int) or data.get('school_id')
+    if user.user_role in ['school_admin', 'data_analyst']:
+        return user.school_id
+    return None
+
+
+@static_blueprint.route('/school_calendar', methods=['GET'])
+@jwt_required()
+def get_school_calendar_entries():
+    user = current_principal()
+
+    school_id = _calendar_school_id(user) if user.user_role != 'teacher' else user.school_id
+    if not school_id:
+        return jsonify(message="Unauthorized access."), 403
+
+    entries = SchoolCalendar.query.filter_by(school_id=school_id).order_by(SchoolCalendar.start_date).all()
+    return jsonify([entry.to_dict() for entry in entries]), 200
+
+
+@static_blueprint.route('/school_calendar/import', methods=['POST'])
+@jwt_required()
+@log_action("إضافة ", description="استيراد التقويم المدرسي")
+def import_school_calendar():
+    """
+    Import holidays, breaks and term dates:
+    {"entries": [{"entry_type": "holiday"|"term", "name": ..., "start_date": "YYYY-MM-DD",
+    "end_date": "YYYY-MM-DD" (optional, defaults to start_date)}], "replace": false}
+    The whole batch is validated first; with replace=true the school's existing
+    entries are then replaced, and nothing changes if no entry is valid.
+    """
+    user = current_principal()
+
+    school_id = _calendar_school_id(user)
+    if not school_id:
+        return jsonify(message="Unauthorized access."), 403
+
+    data = request.get_json(silent=True)
+    entries = data.get('entries') if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return jsonify(message="Invalid data format. Expected a list of calendar entries."), 400
+
+    # Validate the whole batch before touching the existing calendar
+    response = []
+    valid_entries = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            response.append({"name": None, "message": "Each entry must be an object.", "status": "failed"})
+            continue
+        entry_type = entry.get('entry_type') or 'holiday'
+        try:
+            start_date = datetime.strptime(entry.get('start_date') or '', '%Y-%m-%d').date()
+            end_date = datetime.strptime(entry.get('end_date') or entry.get('start_date'), '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            response.append({"name": entry.get('name'), "message": "Invalid date format. Use YYYY-MM-DD.", "status": "failed"})
+            continue
+
+        if not isinstance(entry_type, str) or entry_type.lower() not in ENTRY_TYPES:
+            response.append({"name": entry.get('name'), "message": "Invalid entry type. Use 'holiday' or 'term'.", "status": "failed"})
+            continue
+        if start_date > end_date:
+            response.append({"name": entry.get('name'), "message": "Start date cannot be after end date.", "status": "failed"})
+            continue
+
+        valid_entries.append(SchoolCalendar(
+            school_id=school_id,
+            entry_type=entry_type.lower(),
+            name=entry.get('name'),
+            start_date=start_date,
+            end_date=end_date
+        ))
+        response.append({"name": entry.get('name'), "message": "Entry imported successfully", "status": "success"})
+
+    if not valid_entries:
+        # Nothing to import: leave the existing calendar as it is
+        return jsonify(message="No valid calendar entries to import.", imported=0, results=response), 400
+
+    if data.get('replace'):
+        SchoolCalendar.query.filter_by(school_id=school_id).delete(synchronize_session=False)
+    db.session.add_all(valid_entries)
+    db.session.commit()
+    invalidate_school_calendar(school_id)
+
+    return jsonify(imported=len(valid_entries), results=response), 201
+
+
+@static_blueprint.route('/school_calendar/<int:entry_id>', methods=['DELETE'])
+@jwt_required()
+@log_action("حذف", description="حذف من التقويم المدرسي")
+def delete_school_calendar_entry(entry_id):
+    user = current_principal()
+
+    entry = SchoolCalendar.query.get(entry_id)
+    if not entry:
+        return jsonify(message="Calendar entry not found."), 404
+    if user.user_role != 'admin' and (user.user_role not in ['school_admin', 'data_analyst'] or entry.school_id != user.school_id):
+        return jsonify(message="Unauthorized access."), 403
+
+    school_id = entry.school_id
+    db.session.delete(entry)
+    db.session.commit()
+    invalidate_school_calendar(school_id)
+
+    return jsonify(message="Calendar entry deleted successfully."), 200
+
+
 @static_blueprint.route('/news', methods=['POST'])
 @jwt_required()
 @log_action("إضافة ", description="إضافة خبر جديد")
 def add_news():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     data = request.get_json()
     title = data.get('title')
@@ -635,17 +670,11 @@ def add_news():
         }
         
         if news_type == 'school':
-            # School news - notify students, teachers, analysts, and drivers
-            notify_students_school_news(school_id, news_data, user.id)
-            notify_teachers_school_news(school_id, news_data, user.id)
-            notify_driver_school_news(school_id, news_data, user.id)
+            # School news - one broadcast to students, teachers, analysts, and drivers
+            notify_school_news(school_id, news_data, user.id)
         elif news_type == 'global':
-            # System news - notify teachers, analysts, and school admins across all schools
-            # For global news, we'll notify for each school separately
-            schools = School.query.all()
-            for school in schools:
-                notify_teachers_system_news(school.id, news_data, user.id)
-                notify_admin_system_news(school.id, news_data, user.id)
+            # System news - one global broadcast to teachers, analysts, and school admins
+            notify_system_news(news_data, user.id)
     except Exception as e:
         print(f"Error creating news notifications: {str(e)}")
 
@@ -655,8 +684,7 @@ def add_news():
 @static_blueprint.route('/news', methods=['GET'])
 @jwt_required()
 def get_news():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     today = get_oman_time().utcnow()
 
     query = News.query.filter(
@@ -712,8 +740,7 @@ def send_bulk_daily_reports():
     Optimized for PythonAnywhere deployment
     """
     try:
-        current_user_id = get_jwt_identity()
-        current_user = User.query.get(current_user_id)
+        current_user = current_principal()
 
         # Check authorization (only school admins and data analysts)
         if current_user.user_role not in ['school_admin', 'data_analyst', 'admin']:
@@ -757,16 +784,17 @@ def send_bulk_daily_reports():
 
         day_start = datetime.combine(date if hasattr(date, 'year') else datetime.strptime(str(date), '%Y-%m-%d').date(), datetime.min.time())
         day_end = day_start + timedelta(days=1)
+        attendance_rows = model_in_range(Attendance, day_start, day_end)
 
         # Query students with attendance records for the date
-        attendance_records = db.session.query(Attendance, Student, Class).join(
-            Student, Attendance.student_id == Student.id
+        attendance_records = db.session.query(attendance_rows, Student, Class).join(
+            Student, attendance_rows.student_id == Student.id
         ).join(
-            Class, Attendance.class_id == Class.id
+            Class, attendance_rows.class_id == Class.id
         ).filter(
             and_(
-                Attendance.date >= day_start,
-                Attendance.date < day_end,
+                attendance_rows.date >= day_start,
+                attendance_rows.date < day_end,
                 Student.school_id == school_id,
                 Student.phone_number.isnot(None),
                 Student.phone_number != ''
@@ -922,8 +950,7 @@ def check_bulk_messaging_status():
 @log_action("حذف ", description="حذف خبر ")
 def delete_news(news_id):
 
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Fetch the news item
     news_item = News.query.get(news_id)
@@ -952,8 +979,7 @@ def delete_news(news_id):
 @static_blueprint.route('/school_absence_statistics', methods=['GET'])
 @jwt_required()
 def school_absence_statistics():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin','teacher', 'data_analyst']:
         return jsonify(message="Unauthorized access"), 403
@@ -999,123 +1025,42 @@ def school_absence_statistics():
     adjusted_day = (weekday + 1) % 7  # Makes Sunday == 0
     first_sunday = start_of_month - timedelta(days=adjusted_day)
 
-    # --- FETCH ALL ATTENDANCE DATA FOR THE GIVEN DATE RANGE AT ONCE ---
+    # --- ALL COUNTS FROM THE SCHOOL'S IN-MEMORY ATTENDANCE SNAPSHOT ---
     # Find the earliest and latest dates needed for any query
     earliest_date = min(start_of_week, first_sunday, custom_start)
     latest_date = max(start_of_week + timedelta(days=4), last_day, custom_end)
+    snapshot = snapshot_for_range(user.school_id, earliest_date, latest_date)
 
-    # Get all attendance records for the entire date range in a single query
-    all_attendance = db.session.query(
-        Attendance.date,
-        Attendance.student_id,
-        Attendance.is_Acsent,
-        Attendance.is_late,
-        Attendance.is_Excus
-    ).filter(
-        Attendance.class_id.in_(class_ids),
-        Attendance.date.between(earliest_date, latest_date)
-    ).all()
+    def distinct_counts(ranges):
+        # Distinct students per range with each status in any period (class_ids: active classes only)
+        counts = {status: snapshot.distinct_students(status, ranges, class_ids) for status in ('absent', 'late', 'excused')}
+        return [{"absent": counts['absent'][i], "late": counts['late'][i], "excused": counts['excused'][i]} for i in range(len(ranges))]
 
-    # Create an index for faster lookups
-    attendance_by_date = {}
-    for record in all_attendance:
-        date_str = record.date.strftime('%Y-%m-%d')
-        if date_str not in attendance_by_date:
-            attendance_by_date[date_str] = []
-        attendance_by_date[date_str].append(record)
-
-    # --- WEEKLY: Process the pre-fetched data ---
+    # --- WEEKLY: one bucket per day, Sunday to Thursday ---
     weekly = []
-    for day in week_days:
-        day_str = day.strftime('%Y-%m-%d')
-        day_records = attendance_by_date.get(day_str, [])
-
-        absent_students = set()
-        late_students = set()
-        excused_students = set()
-
-        for record in day_records:
-            if record.is_Acsent:
-                absent_students.add(record.student_id)
-            if record.is_late:
-                late_students.add(record.student_id)
-            if record.is_Excus:
-                excused_students.add(record.student_id)
-
-        weekly.append({
-            "date": day_str,
-            "absent": len(absent_students),
-            "late": len(late_students),
-            "excused": len(excused_students)
-        })
+    for day, counts in zip(week_days, distinct_counts([(day, day) for day in week_days])):
+        weekly.append({"date": day.strftime('%Y-%m-%d'), **counts})
 
-    # --- MONTHLY: Process the pre-fetched data ---
-    month_stats = []
+    # --- MONTHLY: one bucket per Sunday-Thursday week ---
+    month_weeks = []
     current = first_sunday
     while current <= last_day:
-        week_start = current
-        week_end = week_start + timedelta(days=4)  # Sunday to Thursday
-
-        if week_end > last_day:
-            week_end = last_day
-
-        absent_students = set()
-        late_students = set()
-        excused_students = set()
-
-        # Process each day in the week
-        day = week_start
-        while day <= week_end:
-            day_str = day.strftime('%Y-%m-%d')
-            day_records = attendance_by_date.get(day_str, [])
-
-            for record in day_records:
-                if record.is_Acsent:
-                    absent_students.add(record.student_id)
-                if record.is_late:
-                    late_students.add(record.student_id)
-                if record.is_Excus:
-                    excused_students.add(record.student_id)
-
-            day += timedelta(days=1)
+        month_weeks.append((current, min(current + timedelta(days=4), last_day)))
+        current += timedelta(days=7)
 
+    month_stats = []
+    for (week_start, week_end), counts in zip(month_weeks, distinct_counts(month_weeks)):
         month_stats.append({
             "start": week_start.strftime('%Y-%m-%d'),
             "end": week_end.strftime('%Y-%m-%d'),
-            "absent": len(absent_students),
-            "late": len(late_students),
-            "excused": len(excused_students)
+            **counts
         })
 
-        current += timedelta(days=7)
-
-    # --- CUSTOM DAILY: Process the pre-fetched data ---
+    # --- CUSTOM DAILY: one bucket per day in the range ---
+    custom_days = [custom_start + timedelta(days=i) for i in range((custom_end - custom_start).days + 1)]
     custom_daily = []
-    current_day = custom_start
-    while current_day <= custom_end:
-        day_str = current_day.strftime('%Y-%m-%d')
-        day_records = attendance_by_date.get(day_str, [])
-
-        absent_students = set()
-        late_students = set()
-        excused_students = set()
-
-        for record in day_records:
-            if record.is_Acsent:
-                absent_students.add(record.student_id)
-            if record.is_late:
-                late_students.add(record.student_id)
-            if record.is_Excus:
-                excused_students.add(record.student_id)
-
-        custom_daily.append({
-            "date": day_str,
-            "absent": len(absent_students),
-            "late": len(late_students),
-            "excused": len(excused_students)
-        })
-
-        current_day += timedelta(days=1)
+    for day, counts in zip(custom_days, distinct_counts([(day, day) for day in custom_days])):
+        custom_daily.append({"date": day.strftime('%Y-%m-%d'), **counts})
 
     return jsonify({
         "weekly_by_day": weekly,
@@ -1131,8 +1076,7 @@ def get_schools_statistics():
     Includes number of students, teachers, classes, attendance, absents, presents, lates, and overall totals.
     """
 
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user or user.user_role != 'admin':
         return jsonify(message="Unauthorized access"), 403
@@ -1166,41 +1110,30 @@ def get_schools_statistics():
     total_lates = 0
     total_Excus =0
 
+    # Head counts for every school in one grouped query each
+    school_ids = [school.id for school in active_schools]
+    student_counts = dict(db.session.query(Student.school_id, func.count(Student.id)).filter(
+        Student.school_id.in_(school_ids), Student.is_active == True).group_by(Student.school_id).all()) if school_ids else {}
+    teacher_counts = dict(db.session.query(Teacher.school_id, func.count(Teacher.id)).filter(
+        Teacher.school_id.in_(school_ids), Teacher.is_active == True).group_by(Teacher.school_id).all()) if school_ids else {}
+    active_classes = {}
+    for class_id, class_school_id in db.session.query(Class.id, Class.school_id).filter(
+            Class.school_id.in_(school_ids), Class.is_active == True).all() if school_ids else []:
+        active_classes.setdefault(class_school_id, []).append(class_id)
+
     for school in active_schools:
-        num_students = Student.query.filter_by(school_id=school.id, is_active=True).count()
-        num_teachers = Teacher.query.filter_by(school_id=school.id, is_active=True).count()
-        num_classes = Class.query.filter_by(school_id=school.id, is_active=True).count()
-
-        class_ids = db.session.query(Class.id).filter_by(school_id=school.id, is_active=True).subquery()
-
-        num_attendances = db.session.query(Attendance.id).filter(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date.between(start_date, end_date)
-        ).count()
-
-        num_absents = db.session.query(Attendance.id).filter(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date.between(start_date, end_date),
-            Attendance.is_Acsent == True
-        ).count()
-
-        num_presents = db.session.query(Attendance.id).filter(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date.between(start_date, end_date),
-            Attendance.is_present == True
-        ).count()
-
-        num_lates = db.session.query(Attendance.id).filter(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date.between(start_date, end_date),
-            Attendance.is_late == True
-        ).count()
-
-        num_Excus = db.session.query(Attendance.id).filter(
-            Attendance.class_id.in_(class_ids),
-            Attendance.date.between(start_date, end_date),
-            Attendance.is_Excus == True
-        ).count()
+        num_students = student_counts.get(school.id, 0)
+        num_teachers = teacher_counts.get(school.id, 0)
+        class_ids = active_classes.get(school.id, [])
+        num_classes = len(class_ids)
+
+        # Period counts from the school's in-memory attendance snapshot
+        totals = snapshot_for_range(school.id, start_date, end_date).period_totals(start_date, end_date, class_ids)
+        num_attendances = totals['records']
+        num_absents = totals['absent']
+        num_presents = totals['present']
+        num_lates = totals['late']
+        num_Excus = totals['excused']
 
         results.append({
             "school_id": school.id,
@@ -1247,8 +1180,7 @@ def get_bulk_operations_status():
     Get the status of bulk operations setup steps for the school.
     Returns which steps are completed and which need attention.
     """
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -1393,8 +1325,7 @@ STATUS_LABELS_WHATSAPP = {
 @jwt_required()
 def get_schools_whatsapp_status():
     """Get WhatsApp status for all schools (super admin only)."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
     if user.user_role != 'admin':
         return jsonify({"message": {"en": "Unauthorized.", "ar": "غير مصرح."}, "flag": 1}), 403
 
@@ -1433,8 +1364,7 @@ def get_schools_whatsapp_status():
 @jwt_required()
 def get_whatsapp_config():
     """Get Evolution API WhatsApp configuration for a school."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify({"message": {"en": "Unauthorized access.", "ar": "ليس لديك صلاحية الوصول."}, "flag": 1}), 403
@@ -1475,7 +1405,7 @@ def get_whatsapp_config():
 def update_whatsapp_config():
     """Update Evolution API WhatsApp configuration for a school."""
     user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify({"message": {"en": "Unauthorized access.", "ar": "ليس لديك صلاحية الوصول."}, "flag": 1}), 403
@@ -1566,8 +1496,7 @@ def update_whatsapp_config():
 @log_action("اختبار", description="اختبار اتصال WhatsApp")
 def test_whatsapp_connection():
     """Test Evolution API connection and check the instance status."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify({"message": {"en": "Unauthorized access.", "ar": "ليس لديك صلاحية الوصول."}, "flag": 1}), 403
@@ -1619,8 +1548,7 @@ def create_whatsapp_instance():
     Create a new Evolution API instance for the school.
     This must be called once before the school can connect their WhatsApp number.
     """
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify({"message": {"en": "Unauthorized access.", "ar": "ليس لديك صلاحية الوصول."}, "flag": 1}), 403
@@ -1680,8 +1608,7 @@ def create_whatsapp_instance():
 @jwt_required()
 def get_whatsapp_qr():
     """Get QR code for connecting a WhatsApp number to the instance."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify({"message": {"en": "Unauthorized access.", "ar": "ليس لديك صلاحية الوصول."}, "flag": 1}), 403
@@ -1691,8 +1618,7 @@ def get_whatsapp_qr():
     if not school:
         return jsonify({"message": {"en": "School not found.", "ar": "المدرسة غير موجودة."}, "flag": 2}), 404
 
-    # Always use fresh service for QR — bypasses stale cache
-    invalidate_service_cache(school_id)
+    # The cached service is rebuilt whenever the school's config version changed
     svc = get_evolution_service(school_id)
     if not svc.is_configured:
         return jsonify({
@@ -1716,8 +1642,7 @@ def get_whatsapp_qr():
 @jwt_required()
 def get_whatsapp_status():
     """Refresh and return the current WhatsApp instance connection status."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify({"message": {"en": "Unauthorized access.", "ar": "ليس لديك صلاحية الوصول."}, "flag": 1}), 403
@@ -1745,8 +1670,7 @@ def get_whatsapp_status():
 @log_action("اختبار", description="إرسال رسالة WhatsApp تجريبية")
 def send_whatsapp_test_message():
     """Send a test WhatsApp message to verify the setup is working."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin']:
         return jsonify({"message": {"en": "Unauthorized access.", "ar": "ليس لديك صلاحية الوصول."}, "flag": 1}), 403
@@ -1779,8 +1703,7 @@ def send_whatsapp_test_message():
 @log_action("إرسال", description="إرسال تقارير الحضور عبر WhatsApp")
 def send_whatsapp_reports():
     """Send daily attendance reports to parents via WhatsApp (Evolution API)."""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if user.user_role not in ['admin', 'school_admin', 'data_analyst']:
         return jsonify({"message": {"en": "Unauthorized.", "ar": "غير مصرح."}, "flag": 1}), 403
@@ -1822,16 +1745,17 @@ def send_whatsapp_reports():
 
     day_start = datetime.combine(report_date_parsed, datetime.min.time())
     day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
 
     # Attendance model: one row per (student, class, date, class_time_num, subject) with is_Acsent, is_Excus, is_late
-    attendance_records = db.session.query(Attendance, Student, Class).join(
-        Student, Attendance.student_id == Student.id
+    attendance_records = db.session.query(attendance_rows, Student, Class).join(
+        Student, attendance_rows.student_id == Student.id
     ).join(
-        Class, Attendance.class_id == Class.id
+        Class, attendance_rows.class_id == Class.id
     ).filter(
         and_(
-            Attendance.date >= day_start,
-            Attendance.date < day_end,
+            attendance_rows.date >= day_start,
+            attendance_rows.date < day_end,
             Student.school_id == school_id,
             Student.phone_number.isnot(None),
             Student.phone_number != ''
@@ -1938,8 +1862,7 @@ def get_sms_config():
     Get SMS configuration for a school
     """
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can access SMS config
     if user.user_role not in ['admin', 'school_admin']:
@@ -2011,8 +1934,7 @@ def update_sms_config():
     Update SMS configuration for a school
     """
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can update SMS config
     if user.user_role not in ['admin', 'school_admin']:
@@ -2068,8 +1990,14 @@ def update_sms_config():
         if 'ibulk_balance_threshold' in data:
             school.ibulk_balance_threshold = float(data['ibulk_balance_threshold'])
 
+        # New credentials or URL: the stored balance endpoint and balance no longer apply
+        if any(key in data for key in ('ibulk_username', 'ibulk_password', 'ibulk_api_url')):
+            reset_balance_discovery(school)
+
         # Commit changes
         db.session.commit()
+        # Every worker rebuilds its cached SMS client for this school
+        bump_config_version(school.id)
 
         return jsonify({
             "message": {
@@ -2109,8 +2037,7 @@ def test_sms_connection():
     Test SMS service connection and credentials
     """
     # Get authenticated user
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     # Ensure only authorized roles can test SMS connection
     if user.user_role not in ['admin', 'school_admin']:
@@ -2198,7 +2125,7 @@ def test_sms_connection():
         }
         
         try:
-            test_response = requests.post(
+            test_response = http_client.post(
                 sms_service.api_url,
                 json=test_payload,
                 headers={'Content-Type': 'application/json', 'Cache-Control': 'no-cache'},
@@ -7,6 +7,7 @@ import json
 from flask_cors import CORS
 from app.routes.notification_routes import create_notification
 from app.services.notification_service import notify_teacher_substitution
+from app.principal import current_principal
 
 substitution_bp = Blueprint('substitution', __name__, url_prefix='/api/substitutions')
 CORS(substitution_bp)
@@ -356,8 +357,7 @@ def calculate_substitute_teachers(timetable_id, absent_teacher_xml_id, school_id
 @jwt_required()
 def get_substitutions():
     """Get all substitutions for the current school"""
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
@@ -403,8 +403,7 @@ def get_substitutions():
 @jwt_required()
 def calculate_substitution():
     """Calculate substitute teacher assignments without saving"""
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
@@ -658,7 +657,7 @@ def calculate_substitution():
 def create_substitution():
     """Create a new teacher substitution with assignments"""
     current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
@@ -869,8 +868,7 @@ def create_substitution():
 @jwt_required()
 def get_substitution(substitution_id):
     """Get a specific substitution with all assignments"""
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
@@ -889,8 +887,7 @@ def get_substitution(substitution_id):
 @jwt_required()
 def update_substitution(substitution_id):
     """Update substitution assignments (change substitute teachers)"""
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
@@ -953,8 +950,7 @@ def update_substitution(substitution_id):
 @jwt_required()
 def delete_substitution(substitution_id):
     """Delete a substitution and all its assignments"""
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
@@ -976,8 +972,7 @@ def delete_substitution(substitution_id):
 @jwt_required()
 def deactivate_substitution(substitution_id):
     """Deactivate a substitution (soft delete)"""
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
@@ -1000,8 +995,7 @@ def deactivate_substitution(substitution_id):
 @jwt_required()
 def get_teacher_substitutions(teacher_user_id):
     """Get all active substitution assignments for a specific teacher"""
-    current_user = get_jwt_identity()
-    user = User.query.get(current_user)
+    user = current_principal()
     
     if not user or not user.school_id:
         return jsonify({'error': 'User not found or not associated with a school'}), 404
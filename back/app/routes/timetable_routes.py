@@ -3,12 +3,15 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
 from app.models import (
     Timetable, TimetableDay, TimetablePeriod, 
-    TimetableTeacherMapping, TimetableSchedule, Teacher, User
+    TimetableTeacherMapping, TimetableSchedule, Teacher
 )
 from datetime import datetime
 from flask_cors import CORS
 from app.routes.notification_routes import create_notification
 from app.services.notification_service import notify_teachers_timetable_change
+from app.services.expected_sessions import rebuild_expected_sessions
+from app.services.teacher_compliance import invalidate_teacher_compliance
+from app.principal import current_principal
 timetable_bp = Blueprint('timetable', __name__)
 CORS(timetable_bp)
 
@@ -17,8 +20,7 @@ CORS(timetable_bp)
 def get_timetables():
     """Get all timetables for the user's school"""
     try:
-        user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         if not current_user or not current_user.school_id:
             return jsonify({'error': 'User not associated with a school'}), 400
@@ -34,8 +36,7 @@ def get_timetables():
 def get_timetable(timetable_id):
     """Get a specific timetable with all its data"""
     try:
-        user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         timetable = Timetable.query.get(timetable_id)
         if not timetable:
@@ -62,7 +63,7 @@ def create_timetable():
     """Create a new timetable from XML data"""
     try:
         user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         data = request.get_json()
         
@@ -130,7 +131,10 @@ def create_timetable():
             )
             db.session.add(schedule)
         
+        db.session.flush()
+        rebuild_expected_sessions(current_user.school_id)
         db.session.commit()
+        invalidate_teacher_compliance(current_user.school_id)
         
         # Create notification for new timetable - notify all teachers and analysts
         try:
@@ -166,7 +170,7 @@ def update_timetable(timetable_id):
     """Update an existing timetable"""
     try:
         user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         timetable = Timetable.query.get(timetable_id)
         if not timetable:
@@ -240,7 +244,10 @@ def update_timetable(timetable_id):
                 )
                 db.session.add(schedule)
         
+        db.session.flush()
+        rebuild_expected_sessions(timetable.school_id)
         db.session.commit()
+        invalidate_teacher_compliance(timetable.school_id)
         
         # Notify teachers about timetable update
         try:
@@ -271,8 +278,7 @@ def update_timetable(timetable_id):
 def delete_timetable(timetable_id):
     """Delete a timetable"""
     try:
-        user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         timetable = Timetable.query.get(timetable_id)
         if not timetable:
@@ -282,7 +288,10 @@ def delete_timetable(timetable_id):
             return jsonify({'error': 'Unauthorized'}), 403
         
         db.session.delete(timetable)
+        db.session.flush()
+        rebuild_expected_sessions(timetable.school_id)
         db.session.commit()
+        invalidate_teacher_compliance(timetable.school_id)
         
         return jsonify({'message': 'Timetable deleted successfully'}), 200
     except Exception as e:
@@ -295,8 +304,7 @@ def delete_timetable(timetable_id):
 def get_teacher_mappings(timetable_id):
     """Get teacher mappings for a timetable along with available school teachers"""
     try:
-        user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         timetable = Timetable.query.get(timetable_id)
         if not timetable:
@@ -325,8 +333,7 @@ def get_teacher_mappings(timetable_id):
 def update_teacher_mappings(timetable_id):
     """Update teacher mappings for a timetable"""
     try:
-        user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         timetable = Timetable.query.get(timetable_id)
         if not timetable:
@@ -351,7 +358,10 @@ def update_teacher_mappings(timetable_id):
                 mapping.teacher_id = teacher_id
         
         timetable.updated_at = datetime.utcnow()
+        db.session.flush()
+        rebuild_expected_sessions(timetable.school_id)
         db.session.commit()
+        invalidate_teacher_compliance(timetable.school_id)
         
         return jsonify({'message': 'Teacher mappings updated successfully'}), 200
         
@@ -365,8 +375,7 @@ def update_teacher_mappings(timetable_id):
 def activate_timetable(timetable_id):
     """Activate a timetable and deactivate others"""
     try:
-        user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         timetable = Timetable.query.get(timetable_id)
         if not timetable:
@@ -382,7 +391,11 @@ def activate_timetable(timetable_id):
         timetable.is_active = True
         timetable.updated_at = datetime.utcnow()
         
+        # Resolve the timetable into expected (class, teacher, weekday, period) slots
+        db.session.flush()
+        rebuild_expected_sessions(current_user.school_id)
         db.session.commit()
+        invalidate_teacher_compliance(current_user.school_id)
         
         return jsonify({'message': 'Timetable activated successfully'}), 200
         
@@ -396,8 +409,7 @@ def activate_timetable(timetable_id):
 def get_teacher_timetable():
     """Get timetable for the current teacher"""
     try:
-        user_id = get_jwt_identity()
-        current_user = User.query.get(user_id)
+        current_user = current_principal()
         
         # Check if user is a teacher
         teacher = Teacher.query.get(current_user.id)
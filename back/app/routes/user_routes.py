@@ -2,11 +2,12 @@
 
 from flask import Blueprint, jsonify ,request
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import User, Student, Teacher, School,Class, Subject, student_classes, Driver
+from app.models import Student, Teacher, School,Class, Subject, student_classes, Driver
 from app import db
 from werkzeug.security import generate_password_hash
 from io import StringIO
 from app.logger import log_action
+from app.principal import bump_token_version, current_principal
 import pandas as pd
 from flask_cors import CORS
 
@@ -16,8 +17,7 @@ CORS(user_blueprint)
 @user_blueprint.route('/my-school', methods=['GET'])
 @jwt_required()
 def get_users_of_my_school():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user:
         return jsonify(message="User not found."), 404
@@ -25,8 +25,8 @@ def get_users_of_my_school():
     # Check user role
     if user.user_role == 'teacher' or user.user_role == 'school_admin' or user.user_role == 'data_analyst':
         # Retrieve the Teacher instance to get school_id
-        teacher = Teacher.query.get(user_id)
-        if not teacher or not user.school_id:
+        teacher = user.user
+        if not isinstance(teacher, Teacher) or not user.school_id:
             return jsonify(message="User is not associated with a school."), 400
         school_id = user.school_id
 
@@ -53,8 +53,7 @@ def get_users_of_my_school():
 @user_blueprint.route('/my-school-Teachers', methods=['GET'])
 @jwt_required()
 def get_Teachers_of_my_school():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user:
         return jsonify(message="User not found."), 404
@@ -62,8 +61,8 @@ def get_Teachers_of_my_school():
     # Check user role
     if user.user_role == 'teacher' or user.user_role == 'school_admin' or user.user_role == 'data_analyst':
         # Retrieve the Teacher instance to get school_id
-        teacher = Teacher.query.get(user_id)
-        if not teacher or not user.school_id:
+        teacher = user.user
+        if not isinstance(teacher, Teacher) or not user.school_id:
             return jsonify(message="User is not associated with a school."), 400
         school_id = user.school_id
 
@@ -87,8 +86,7 @@ def get_Teachers_of_my_school():
 @user_blueprint.route('/my-school-Students', methods=['GET'])
 @jwt_required()
 def get_Students_of_my_school():
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user:
         return jsonify(message="User not found."), 404
@@ -141,8 +139,7 @@ def get_Students_of_my_school():
 @jwt_required()
 def update_student_behavior_note(student_id):
     """Update behavior note for a specific student"""
-    user_id = get_jwt_identity()
-    user = User.query.get(user_id)
+    user = current_principal()
 
     if not user:
         return jsonify(message="User not found."), 404
@@ -199,6 +196,9 @@ def deactivate_school(school_id):
         for teacher in teachers:
             teacher.is_active = False
 
+        # Revoke tokens of everyone who was just deactivated
+        bump_token_version([student.id for student in students] + [teacher.id for teacher in teachers])
+
         # Deactivate related classes
         classes = Class.query.filter_by(school_id=school_id).all()
         for class_obj in classes:
@@ -0,0 +1,149 @@
+"""
+Absence Analytics - Vectorized absence streaks and risk ranking.
+
+A school's absences for a window are loaded in one query from
+student_day_attendance into a students x school-days boolean matrix. A day
+counts as absent when the student was هارب (is_Acsent) or غائب (is_Excus) in
+any period. School days are the dates on which attendance was taken for any of
+the classes, so weekends and holidays never break a streak.
+
+Everything after the load is NumPy array arithmetic over the whole matrix:
+days absent, absence rate, longest and current consecutive-day streaks,
+rolling absence rate and "absent every day" flags. 5,000 students x 180 days
+computes in a few milliseconds (see benchmark_absence_analytics.py).
+"""
+from datetime import date
+import numpy as np
+from app import db
+from app.models import StudentDayAttendance
+
+# Rolling absence rate window, in school days
+ROLLING_WINDOW_DAYS = 5
+
+# Risk score weights (score is in [0, 1]) and tier thresholds
+RISK_WEIGHTS = {'absence_rate': 0.5, 'current_streak': 0.3, 'recent_rate': 0.2}
+STREAK_FOR_MAX_RISK = 5
+RISK_TIERS = ((0.5, 'high'), (0.25, 'medium'), (0.0, 'low'))
+
+
+class AbsenceMatrix:
+    """Students x school-days absence matrix with row/column labels."""
+
+    def __init__(self, student_ids, dates, absent):
+        self.student_ids = student_ids  # np.ndarray[int64], one per row
+        self.dates = dates              # list[date], one per column, ascending
+        self.absent = absent            # np.ndarray[bool], shape (students, days)
+
+    @property
+    def shape(self):
+        return self.absent.shape
+
+
+def load_absence_matrix(class_ids, start_date, end_date):
+    """One query for every (student, day) in the window; returns an AbsenceMatrix."""
+    day = StudentDayAttendance
+    rows = db.session.query(
+        day.student_id,
+        day.date,
+        ((day.absent_mask.op('|')(day.excused_mask)) != 0).label('is_absent')
+    ).filter(
+        day.class_id.in_(class_ids),
+        day.date >= start_date,
+        day.date <= end_date
+    ).all()
+
+    if not rows:
+        return AbsenceMatrix(np.empty(0, dtype=np.int64), [], np.zeros((0, 0), dtype=bool))
+
+    student_col = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    date_ordinals = np.fromiter((r[1].toordinal() for r in rows), dtype=np.int64, count=len(rows))
+    absent_col = np.fromiter((bool(r[2]) for r in rows), dtype=bool, count=len(rows))
+
+    student_ids, student_index = np.unique(student_col, return_inverse=True)
+    day_ordinals, day_index = np.unique(date_ordinals, return_inverse=True)
+
+    absent = np.zeros((len(student_ids), len(day_ordinals)), dtype=bool)
+    # A student can have rows in two classes on one day: absent in either counts
+    np.logical_or.at(absent, (student_index, day_index), absent_col)
+
+    dates = [date.fromordinal(int(ordinal)) for ordinal in day_ordinals]
+    return AbsenceMatrix(student_ids, dates, absent)
+
+
+def run_lengths(absent):
+    """Length of the absence run ending at each day (0 where present)."""
+    counts = np.cumsum(absent, axis=1, dtype=np.int32)
+    # Running total at the most recent present day, carried forward
+    reset = np.maximum.accumulate(np.where(absent, 0, counts), axis=1)
+    return counts - reset
+
+
+def rolling_rate(absent, window):
+    """Absence rate over the trailing `window` school days, per student and day."""
+    days = absent.shape[1]
+    if days == 0:
+        return np.zeros(absent.shape, dtype=np.float32)
+    padded = np.zeros((absent.shape[0], days + 1), dtype=np.int32)
+    np.cumsum(absent, axis=1, out=padded[:, 1:])
+    starts = np.maximum(np.arange(1, days + 1) - window, 0)
+    lengths = np.arange(1, days + 1) - starts
+    return (padded[:, 1:] - padded[:, starts]) / lengths.astype(np.float32)
+
+
+def compute_absence_metrics(absent, window=ROLLING_WINDOW_DAYS):
+    """
+    Per-student metrics for a boolean (students, days) matrix, as a dict of
+    arrays: days_absent, absence_rate, longest_streak, current_streak,
+    recent_rate (last rolling window), max_rolling_rate, all_days,
+    risk_score.
+    """
+    students, days = absent.shape
+    if students == 0 or days == 0:
+        empty_int = np.zeros(students, dtype=np.int32)
+        empty_float = np.zeros(students, dtype=np.float32)
+        return {
+            'days_absent': empty_int, 'absence_rate': empty_float,
+            'longest_streak': empty_int, 'current_streak': empty_int,
+            'recent_rate': empty_float, 'max_rolling_rate': empty_float,
+            'all_days': np.zeros(students, dtype=bool), 'risk_score': empty_float
+        }
+
+    days_absent = absent.sum(axis=1, dtype=np.int32)
+    absence_rate = days_absent / np.float32(days)
+
+    runs = run_lengths(absent)
+    longest_streak = runs.max(axis=1)
+    current_streak = runs[:, -1]
+
+    rolling = rolling_rate(absent, window)
+    recent_rate = rolling[:, -1]
+    max_rolling_rate = rolling.max(axis=1)
+
+    risk_score = (
+        RISK_WEIGHTS['absence_rate'] * absence_rate
+        + RISK_WEIGHTS['current_streak'] * np.minimum(current_streak / STREAK_FOR_MAX_RISK, 1.0)
+        + RISK_WEIGHTS['recent_rate'] * recent_rate
+    ).astype(np.float32)
+
+    return {
+        'days_absent': days_absent,
+        'absence_rate': absence_rate.astype(np.float32),
+        'longest_streak': longest_streak,
+        'current_streak': current_streak,
+        'recent_rate': recent_rate,
+        'max_rolling_rate': max_rolling_rate,
+        'all_days': days_absent == days,
+        'risk_score': risk_score
+    }
+
+
+def risk_tier(score):
+    for threshold, tier in RISK_TIERS:
+        if score >= threshold:
+            return tier
+    return 'low'
+
+
+def absent_dates(matrix, row):
+    """ISO dates on which the student in `row` was absent."""
+    return [matrix.dates[i].isoformat() for i in np.flatnonzero(matrix.absent[row])]
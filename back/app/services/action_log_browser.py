@@ -0,0 +1,90 @@
+"""
+Action Log Browser - Cursor pagination and cached totals for /api/auth/view_logs.
+
+Logs are read newest first using the (school_id, timestamp, id) index: each
+page returns an opaque cursor holding the last row's (timestamp, id), and the
+next page continues strictly after it, so deep pages cost the same as the
+first one. The total shown in the UI is a count cached for a few minutes per
+(school, days) instead of a COUNT(*) on every 30-second refresh.
+"""
+import base64
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import func, or_, and_
+from app import db
+from app.models import ActionLog
+from app.cache import get_redis, mark_redis_down
+
+LOG_COUNT_TTL_SECONDS = 5 * 60
+# view_logs never reads further back than this (older years may be archived)
+LOG_MAX_DAYS_BACK = 90
+
+_lock = threading.Lock()
+_local_counts = {}  # cache key -> (expires_at, count)
+
+
+def encode_cursor(log):
+    raw = f"{log.timestamp.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return (timestamp, id) from a cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        timestamp, log_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except (ValueError, UnicodeError):
+        return None
+
+
+def apply_cursor(query, cursor):
+    """Restrict a newest-first query to rows strictly older than the cursor."""
+    position = decode_cursor(cursor)
+    if position is None:
+        return query
+    timestamp, log_id = position
+    return query.filter(
+        ActionLog.timestamp <= timestamp,
+        or_(ActionLog.timestamp < timestamp, and_(ActionLog.timestamp == timestamp, ActionLog.id < log_id))
+    )
+
+
+def count_logs_cached(school_id, date_filter, days_back):
+    """Number of logs since date_filter for a school (None = all schools), cached briefly."""
+    cache_key = f"action_log_count:{school_id or 'all'}:{days_back}"
+
+    client = get_redis()
+    if client is not None:
+        try:
+            cached = client.get(cache_key)
+            if cached is not None:
+                return int(cached)
+        except Exception:
+            mark_redis_down()
+            client = None
+
+    now = time.monotonic()
+    if client is None:
+        with _lock:
+            entry = _local_counts.get(cache_key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    query = db.session.query(func.count(ActionLog.id)).filter(ActionLog.timestamp >= date_filter)
+    if school_id:
+        query = query.filter(ActionLog.school_id == school_id)
+    total = query.scalar() or 0
+
+    if client is not None:
+        try:
+            client.set(cache_key, total, ex=LOG_COUNT_TTL_SECONDS)
+        except Exception:
+            mark_redis_down()
+    else:
+        with _lock:
+            _local_counts[cache_key] = (now + LOG_COUNT_TTL_SECONDS, total)
+    return total
@@ -0,0 +1,106 @@
+"""
+Attendance Days - Keeps student_day_attendance in step with attendances.
+
+attendances stores one row per student per period; range analytics only need
+to know, per student and day, which periods had each status. Every write path
+calls refresh_student_days() for the (class, date) it touched, inside the same
+transaction, and the day rows are rebuilt from the source rows with a single
+INSERT ... SELECT ... GROUP BY, so they never drift from attendances.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+from app import db
+
+# Periods above this share the top bit (SMALLINT holds bits 0-14)
+MAX_PERIOD_BIT = 14
+
+_PERIOD_BIT = f"(1 << LEAST(GREATEST(a.class_time_num, 0), {MAX_PERIOD_BIT}))"
+
+
+def period_bit(class_time_num):
+    """Mask bit for a period number (class_time_num)."""
+    return 1 << min(max(int(class_time_num or 0), 0), MAX_PERIOD_BIT)
+
+
+def count_periods(mask):
+    """Number of periods set in a mask."""
+    return bin(mask or 0).count('1')
+
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def refresh_student_days(class_ids=None, start_date=None, end_date=None, student_ids=None, school_id=None):
+    """
+    Rebuild day rows for the given scope (any combination of classes, an
+    inclusive date range, students and school) from attendances. Without a
+    date range only dates from the oldest live attendance on are rebuilt, so
+    the day rows of archived years are kept. Runs in the caller's
+    transaction; the caller commits.
+    """
+    conditions = []
+    params = {}
+    bind_params = []
+
+    if class_ids is not None:
+        class_ids = list(class_ids)
+        if not class_ids:
+            return
+        conditions.append("{alias}class_id IN :class_ids")
+        params['class_ids'] = class_ids
+        bind_params.append(bindparam('class_ids', expanding=True))
+    if student_ids is not None:
+        student_ids = list(student_ids)
+        if not student_ids:
+            return
+        conditions.append("{alias}student_id IN :student_ids")
+        params['student_ids'] = student_ids
+        bind_params.append(bindparam('student_ids', expanding=True))
+    if school_id is not None:
+        conditions.append("{alias}class_id IN (SELECT id FROM classes WHERE school_id = :school_id)")
+        params['school_id'] = school_id
+
+    start_date = _as_date(start_date)
+    end_date = _as_date(end_date) if end_date is not None else start_date
+    if start_date is not None:
+        params['start_date'] = start_date
+        params['end_date_exclusive'] = end_date + timedelta(days=1)
+    else:
+        # Older attendances were moved to attendances_archive; their day rows stay as they are
+        oldest_live = db.session.execute(text("SELECT MIN(date) FROM attendances")).scalar()
+        if oldest_live is None:
+            return
+        conditions.append("{alias}date >= :oldest_live")
+        params['oldest_live'] = _as_date(oldest_live)
+
+    def where(alias, date_column):
+        clauses = [condition.format(alias=alias) for condition in conditions]
+        if start_date is not None:
+            clauses.append(f"{alias}{date_column} >= :start_date AND {alias}{date_column} < :end_date_exclusive")
+        return " AND ".join(clauses) if clauses else "1 = 1"
+
+    delete_sql = text(f"DELETE FROM student_day_attendance WHERE {where('', 'date')}")
+    insert_sql = text(f"""
+        INSERT INTO student_day_attendance
+            (student_id, date, class_id, absent_mask, late_mask, excused_mask, present_mask)
+        SELECT a.student_id, DATE(a.date), a.class_id,
+               BIT_OR(IF(a.is_Acsent, {_PERIOD_BIT}, 0)),
+               BIT_OR(IF(a.is_late, {_PERIOD_BIT}, 0)),
+               BIT_OR(IF(a.is_Excus, {_PERIOD_BIT}, 0)),
+               BIT_OR(IF(a.is_present, {_PERIOD_BIT}, 0))
+        FROM attendances a
+        WHERE {where('a.', 'date')}
+        GROUP BY a.student_id, DATE(a.date), a.class_id
+    """)
+    if bind_params:
+        delete_sql = delete_sql.bindparams(*bind_params)
+        insert_sql = insert_sql.bindparams(*bind_params)
+
+    db.session.execute(delete_sql, params)
+    db.session.execute(insert_sql, params)
+
+
+def refresh_class_day(class_id, day):
+    """Rebuild one class's day rows after attendance was taken or edited."""
+    refresh_student_days(class_ids=[class_id], start_date=day)
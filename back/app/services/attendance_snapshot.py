@@ -0,0 +1,306 @@
+"""
+Attendance Snapshot - Per-school columnar copy of the current term's attendance.
+
+Each school's student_day_attendance rows since the start of the academic year
+are held in memory as parallel NumPy arrays (student_id, class_id, day index,
+and the absent/late/excused/present period bitmasks), so analytics endpoints
+answer with vectorized group-bys instead of re-fetching rows per request.
+
+- Snapshots load lazily on first use and are kept in an LRU bounded by
+  Config.ATTENDANCE_SNAPSHOT_MAX_MB; the least recently used school is dropped
+  first.
+- Taking attendance calls record_class_day(), which appends the (class, day)
+  to a per-school delta log in Redis. Every worker replays the log on its next
+  read by reloading just those class-days. Without Redis, deltas apply to the
+  local snapshot only and snapshots are reloaded after LOCAL_MAX_AGE_SECONDS.
+- Ranges that start before the term are served by a one-off snapshot of that
+  range with the same query methods.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+import numpy as np
+from app import db
+from app.models import Class, StudentDayAttendance
+from app.config import Config
+from app.cache import get_redis, mark_redis_down
+from app.services.absence_analytics import AbsenceMatrix
+from app.services.partitioning import current_academic_year_start
+
+STATUSES = ('absent', 'late', 'excused', 'present')
+
+# Redis keeps this many (class, day) deltas per school; readers further behind reload
+DELTA_LOG_LENGTH = 500
+RELOAD_MARKER = '*'
+
+# Without Redis other workers' writes are invisible, so reload periodically
+LOCAL_MAX_AGE_SECONDS = 5 * 60
+
+# Set bits per mask value (masks use bits 0-14)
+_POPCOUNT = np.unpackbits(
+    np.arange(1 << 15, dtype='>u2').view(np.uint8)
+).reshape(-1, 16).sum(axis=1).astype(np.uint8)
+
+_lock = threading.Lock()
+_snapshots = OrderedDict()  # school_id -> AttendanceSnapshot, least recently used first
+
+
+class AttendanceSnapshot:
+    """Columnar attendance rows for one school from `origin`; day index 0 = origin."""
+
+    def __init__(self, school_id, origin, student_ids, class_ids, days, masks, generation=None):
+        self.school_id = school_id
+        self.origin = origin
+        self.student_ids = student_ids  # int32
+        self.class_ids = class_ids      # int32
+        self.days = days                # int16, days since origin
+        self.masks = masks              # {status: int16 period bitmask}
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+
+    @property
+    def nbytes(self):
+        return (self.student_ids.nbytes + self.class_ids.nbytes + self.days.nbytes
+                + sum(mask.nbytes for mask in self.masks.values()))
+
+    def __len__(self):
+        return len(self.days)
+
+    def day_index(self, day):
+        return (day - self.origin).days
+
+    def covers(self, start_date):
+        return start_date >= self.origin
+
+    def _rows(self, start_date, end_date, class_ids=None):
+        rows = (self.days >= self.day_index(start_date)) & (self.days <= self.day_index(end_date))
+        if class_ids is not None:
+            rows &= np.isin(self.class_ids, np.asarray(list(class_ids), dtype=np.int32))
+        return rows
+
+    def distinct_students(self, status, ranges, class_ids=None):
+        """
+        Number of distinct students with `status` in any period, for each
+        (start, end) date range in `ranges` (non-overlapping). Returns a list.
+        """
+        if not ranges or len(self) == 0:
+            return [0] * len(ranges)
+        span = int(self.days.max()) + 1
+        bucket_of_day = np.full(span, -1, dtype=np.int32)
+        for bucket, (start_date, end_date) in enumerate(ranges):
+            first = max(self.day_index(start_date), 0)
+            last = min(self.day_index(end_date), span - 1)
+            if first <= last:
+                bucket_of_day[first:last + 1] = bucket
+
+        rows = self.masks[status] != 0
+        if class_ids is not None:
+            rows &= np.isin(self.class_ids, np.asarray(list(class_ids), dtype=np.int32))
+        buckets = bucket_of_day[self.days[rows]]
+        students = self.student_ids[rows]
+        keep = buckets >= 0
+        keys = np.unique((buckets[keep].astype(np.int64) << 32) | students[keep].astype(np.int64))
+        return np.bincount((keys >> 32).astype(np.int64), minlength=len(ranges)).tolist()
+
+    def period_totals(self, start_date, end_date, class_ids=None):
+        """Period counts in the range: records (any status) and one total per status."""
+        rows = self._rows(start_date, end_date, class_ids)
+        totals = {status: int(_POPCOUNT[self.masks[status][rows]].sum(dtype=np.int64)) for status in STATUSES}
+        any_status = self.masks['absent'][rows] | self.masks['late'][rows] | self.masks['excused'][rows] | self.masks['present'][rows]
+        totals['records'] = int(_POPCOUNT[any_status].sum(dtype=np.int64))
+        return totals
+
+    def absence_matrix(self, class_ids, start_date, end_date):
+        """Same result as absence_analytics.load_absence_matrix, without a query."""
+        rows = self._rows(start_date, end_date, class_ids)
+        if not rows.any():
+            return AbsenceMatrix(np.empty(0, dtype=np.int64), [], np.zeros((0, 0), dtype=bool))
+
+        absent_col = (self.masks['absent'][rows] | self.masks['excused'][rows]) != 0
+        student_ids, student_index = np.unique(self.student_ids[rows].astype(np.int64), return_inverse=True)
+        day_values, day_index = np.unique(self.days[rows], return_inverse=True)
+
+        absent = np.zeros((len(student_ids), len(day_values)), dtype=bool)
+        np.logical_or.at(absent, (student_index, day_index), absent_col)
+        dates = [self.origin + timedelta(days=int(d)) for d in day_values]
+        return AbsenceMatrix(student_ids, dates, absent)
+
+    def with_class_days(self, class_days):
+        """A copy with the rows of the given (class_id, date) pairs reloaded from the database."""
+        if not class_days:
+            return self
+        row_keys = (self.class_ids.astype(np.int64) << 16) | self.days.astype(np.int64)
+        stale_keys = np.array([
+            (class_id << 16) | self.day_index(day) for class_id, day in class_days if self.covers(day)
+        ], dtype=np.int64)
+        drop = np.isin(row_keys, stale_keys)
+        fresh = _query_rows(self.school_id, self.origin, class_days=class_days)
+
+        keep = ~drop
+        snapshot = AttendanceSnapshot(
+            self.school_id, self.origin,
+            np.concatenate([self.student_ids[keep], fresh.student_ids]),
+            np.concatenate([self.class_ids[keep], fresh.class_ids]),
+            np.concatenate([self.days[keep], fresh.days]),
+            {status: np.concatenate([self.masks[status][keep], fresh.masks[status]]) for status in STATUSES},
+            generation=self.generation
+        )
+        snapshot.loaded_at = self.loaded_at
+        return snapshot
+
+
+def _query_rows(school_id, origin, end_date=None, class_days=None):
+    day = StudentDayAttendance
+    query = db.session.query(
+        day.student_id, day.class_id, day.date,
+        day.absent_mask, day.late_mask, day.excused_mask, day.present_mask
+    ).filter(
+        day.class_id.in_(db.session.query(Class.id).filter(Class.school_id == school_id)),
+        day.date >= origin
+    )
+    if end_date is not None:
+        query = query.filter(day.date <= end_date)
+    if class_days:
+        query = query.filter(db.or_(*[
+            db.and_(day.class_id == class_id, day.date == class_day) for class_id, class_day in class_days
+        ]))
+    rows = query.all()
+
+    count = len(rows)
+    origin_ordinal = origin.toordinal()
+    columns = [
+        np.fromiter((r[0] for r in rows), dtype=np.int32, count=count),
+        np.fromiter((r[1] for r in rows), dtype=np.int32, count=count),
+        np.fromiter((r[2].toordinal() - origin_ordinal for r in rows), dtype=np.int16, count=count),
+    ]
+    masks = {
+        status: np.fromiter((r[3 + i] or 0 for r in rows), dtype=np.int16, count=count)
+        for i, status in enumerate(STATUSES)
+    }
+    return AttendanceSnapshot(school_id, origin, *columns, masks)
+
+
+# ============================================================================
+# Cache and delta log
+# ============================================================================
+
+def _generation_key(school_id):
+    return f"attendance_snapshot_gen:{school_id}"
+
+
+def _delta_key(school_id):
+    return f"attendance_snapshot_deltas:{school_id}"
+
+
+def _remote_generation(client, school_id):
+    if client is None:
+        return None
+    try:
+        return int(client.get(_generation_key(school_id)) or 0)
+    except Exception:
+        mark_redis_down()
+        return None
+
+
+def _pending_deltas(client, school_id, behind):
+    """The last `behind` deltas, or None if the snapshot must be reloaded."""
+    if behind <= 0 or behind > DELTA_LOG_LENGTH:
+        return None
+    try:
+        entries = client.lrange(_delta_key(school_id), -behind, -1)
+    except Exception:
+        mark_redis_down()
+        return None
+    if len(entries) != behind or RELOAD_MARKER in entries:
+        return None
+    class_days = set()
+    for entry in entries:
+        class_id, ordinal = entry.split(':')
+        class_days.add((int(class_id), date.fromordinal(int(ordinal))))
+    return sorted(class_days)
+
+
+def _publish(school_id, entry):
+    client = get_redis()
+    if client is None:
+        return False
+    try:
+        pipe = client.pipeline(transaction=True)
+        pipe.incr(_generation_key(school_id))
+        pipe.rpush(_delta_key(school_id), entry)
+        pipe.ltrim(_delta_key(school_id), -DELTA_LOG_LENGTH, -1)
+        pipe.execute()
+        return True
+    except Exception:
+        mark_redis_down()
+        return False
+
+
+def _store(snapshot):
+    budget = Config.ATTENDANCE_SNAPSHOT_MAX_MB * 1024 * 1024
+    with _lock:
+        _snapshots[snapshot.school_id] = snapshot
+        _snapshots.move_to_end(snapshot.school_id)
+        total = sum(s.nbytes for s in _snapshots.values())
+        while total > budget and len(_snapshots) > 1:
+            _, evicted = _snapshots.popitem(last=False)
+            total -= evicted.nbytes
+
+
+def get_snapshot(school_id):
+    """The school's current-term snapshot, loading or catching up as needed."""
+    term_start = current_academic_year_start()
+    client = get_redis()
+    generation = _remote_generation(client, school_id)
+
+    with _lock:
+        snapshot = _snapshots.get(school_id)
+        if snapshot is not None:
+            _snapshots.move_to_end(school_id)
+
+    if snapshot is not None and snapshot.origin != term_start:
+        snapshot = None
+    if snapshot is not None and generation is None and time.monotonic() - snapshot.loaded_at > LOCAL_MAX_AGE_SECONDS:
+        snapshot = None
+    if snapshot is not None and generation is not None and snapshot.generation != generation:
+        class_days = _pending_deltas(client, school_id, generation - (snapshot.generation or 0)) \
+            if snapshot.generation is not None else None
+        if class_days is None:
+            snapshot = None
+        else:
+            snapshot = snapshot.with_class_days(class_days)
+            snapshot.generation = generation
+            _store(snapshot)
+
+    if snapshot is None:
+        # Generation is read before loading, so writes during the load are replayed later
+        snapshot = _query_rows(school_id, term_start)
+        snapshot.generation = generation
+        _store(snapshot)
+    return snapshot
+
+
+def snapshot_for_range(school_id, start_date, end_date):
+    """The cached term snapshot if it covers start_date, else a one-off snapshot of the range."""
+    term_start = current_academic_year_start()
+    if start_date >= term_start:
+        return get_snapshot(school_id)
+    return _query_rows(school_id, start_date, end_date=end_date)
+
+
+def record_class_day(school_id, class_id, day):
+    """Call after committing attendance for a class and day."""
+    if _publish(school_id, f"{class_id}:{day.toordinal()}"):
+        return
+    with _lock:
+        snapshot = _snapshots.get(school_id)
+    if snapshot is not None and snapshot.covers(day):
+        _store(snapshot.with_class_days([(class_id, day)]))
+
+
+def invalidate_snapshot(school_id):
+    """Force a full reload (e.g. after bulk deletes)."""
+    _publish(school_id, RELOAD_MARKER)
+    with _lock:
+        _snapshots.pop(school_id, None)
@@ -0,0 +1,265 @@
+"""
+Audit Log Writer - Background, batched inserts for ActionLog records.
+
+log_action builds a plain dict inside the request and hands it to
+enqueue_action_log(); a single writer thread per worker collects records from
+a bounded queue and writes them with one multi-row INSERT every
+AUDIT_FLUSH_INTERVAL_SECONDS or AUDIT_BATCH_SIZE records, whichever comes
+first. Requests no longer pay for a second commit.
+
+If the database is unavailable (or the queue is full), records are appended to
+a JSON-lines spill file and replayed on a later successful flush.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+AUDIT_QUEUE_MAX = 10000
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL_SECONDS = 0.5
+# After a failed write, wait this long before touching the spill file again
+SPILL_RETRY_SECONDS = 30
+
+# Column limits of action_logs (description is TEXT: 64 KB)
+MAX_DESCRIPTION_CHARS = 8000
+MAX_STRING_CHARS = 255
+
+_queue = queue.Queue(maxsize=AUDIT_QUEUE_MAX)
+_start_lock = threading.Lock()
+_spill_lock = threading.Lock()
+_writer_thread = None
+_next_spill_retry = 0.0
+
+
+def _truncate(value, limit):
+    if value is None or len(value) <= limit:
+        return value
+    return value[:limit - 40] + f" ...[truncated {len(value) - limit + 40} chars]"
+
+
+def serialize_description(description):
+    """Text for action_logs.description: JSON for payloads, capped in size."""
+    if description is None:
+        return None
+    if not isinstance(description, str):
+        try:
+            description = json.dumps(description, ensure_ascii=False, default=str)
+        except (TypeError, ValueError):
+            description = str(description)
+    return _truncate(description, MAX_DESCRIPTION_CHARS)
+
+
+def build_action_log_record(**fields):
+    """Row dict for action_logs with string columns cut to their column sizes."""
+    record = dict(fields)
+    record['description'] = serialize_description(record.get('description'))
+    for key in ('action_type', 'endpoint', 'content', 'ip_address', 'mac_address'):
+        if isinstance(record.get(key), str):
+            record[key] = _truncate(record[key], MAX_STRING_CHARS)
+    return record
+
+
+def enqueue_action_log(app, record):
+    """Queue one action_logs row for the background writer."""
+    _ensure_writer(app)
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        logger.warning("Audit log queue full, spilling record to disk")
+        _spill([record])
+
+
+def _ensure_writer(app):
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+    with _start_lock:
+        if _writer_thread is not None and _writer_thread.is_alive():
+            return
+        _writer_thread = threading.Thread(target=_run, args=(app,), name='audit-log-writer', daemon=True)
+        _writer_thread.start()
+        atexit.register(_drain, app)
+
+
+def _collect_batch():
+    """Block until a record arrives, then gather more until the batch is full or the interval ends."""
+    try:
+        batch = [_queue.get(timeout=SPILL_RETRY_SECONDS)]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL_SECONDS
+    while len(batch) < AUDIT_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def _run(app):
+    while True:
+        batch = _collect_batch()
+        try:
+            _flush(app, batch)
+        except Exception as e:
+            logger.error(f"Audit log writer error: {str(e)}", exc_info=True)
+
+
+def _drain(app):
+    """Write whatever is still queued when the worker exits."""
+    batch = []
+    while True:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        try:
+            _flush(app, batch)
+        except Exception:
+            _spill(batch)
+
+
+def _insert(records):
+    from app import db
+    from app.models import ActionLog
+    # Multi-row VALUES needs identical keys; spilled rows may predate newer columns
+    columns = [column.name for column in ActionLog.__table__.columns if column.name != 'id']
+    rows = [{column: record.get(column) for column in columns} for record in records]
+    for start in range(0, len(rows), AUDIT_BATCH_SIZE):
+        db.session.execute(ActionLog.__table__.insert().values(rows[start:start + AUDIT_BATCH_SIZE]))
+    db.session.commit()
+
+
+def _flush(app, records):
+    global _next_spill_retry
+    from app import db
+
+    with app.app_context():
+        try:
+            if records:
+                try:
+                    _insert(records)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to write {len(records)} audit log record(s): {str(e)}")
+                    _spill(records)
+                    _next_spill_retry = time.monotonic() + SPILL_RETRY_SECONDS
+                    return
+
+            if time.monotonic() >= _next_spill_retry:
+                try:
+                    _replay_spill()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"Failed to replay spilled audit log records: {str(e)}")
+                    _next_spill_retry = time.monotonic() + SPILL_RETRY_SECONDS
+        finally:
+            db.session.remove()
+
+
+# ============================================================================
+# Spill file
+# ============================================================================
+
+def _spill_path():
+    return Config.AUDIT_SPILL_PATH
+
+
+def _spill(records):
+    """Append records to the spill file and fsync, so they survive a crash."""
+    if not records:
+        return
+    lines = []
+    for record in records:
+        row = dict(record)
+        if isinstance(row.get('timestamp'), datetime):
+            row['timestamp'] = row['timestamp'].isoformat()
+        lines.append(json.dumps(row, ensure_ascii=False, default=str))
+    try:
+        with _spill_lock:
+            with open(_spill_path(), 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+    except Exception as e:
+        logger.error(f"Could not spill {len(records)} audit log record(s): {str(e)}")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except Exception:
+        return True
+    return True
+
+
+def _claim_spill_file():
+    """
+    Return this worker's replay file, claiming one first if needed: a replay
+    file left by a dead worker, or else the shared spill file.
+    """
+    path = _spill_path()
+    own = f"{path}.{os.getpid()}.replaying"
+    if os.path.exists(own):
+        return own
+
+    for candidate in glob.glob(f"{path}.*.replaying"):
+        try:
+            pid = int(candidate.rsplit('.', 2)[-2])
+        except ValueError:
+            continue
+        if pid != os.getpid() and not _pid_alive(pid):
+            try:
+                os.rename(candidate, own)
+                return own
+            except OSError:
+                continue  # another worker claimed it first
+
+    if os.path.exists(path):
+        try:
+            with _spill_lock:
+                os.rename(path, own)
+            return own
+        except OSError:
+            pass
+    return None
+
+
+def _replay_spill(max_files=10):
+    """Insert spilled records; a replay file is deleted only after its rows are committed."""
+    for _ in range(max_files):
+        path = _claim_spill_file()
+        if path is None:
+            return
+        records = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue  # torn final line from a crash mid-write
+                if row.get('timestamp'):
+                    row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+                records.append(row)
+        if records:
+            _insert(records)
+        os.remove(path)
+        logger.info(f"Replayed {len(records)} spilled audit log record(s)")
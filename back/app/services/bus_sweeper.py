@@ -0,0 +1,186 @@
+"""
+Bus Sweeper - Detect students left on buses and alert drivers and school admins.
+
+Runs as a scheduled job (`flask sweep-forgotten-students`) or from the manual
+admin endpoint. All schools are checked with a fixed number of grouped queries,
+and every bus that was alerted is recorded in ForgottenStudentAlert so later
+sweeps on the same day do not notify it again.
+"""
+from app import db
+from app.models import Bus, BusScan, User, ForgottenStudentAlert
+from app.config import get_oman_time
+from app.services.notification_service import (
+    create_notifications_bulk,
+    build_driver_forgot_students_notification,
+    build_admin_forgot_students_notification
+)
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_
+from sqlalchemy.orm import aliased
+import json
+
+
+def find_students_still_on_buses(day, school_ids=None):
+    """
+    Return {bus_id: [(student_id, student_name), ...]} for every active bus whose
+    students' last scan of the day is 'board'.
+    """
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+
+    # Range filter on scan_time keeps the (bus_id, scan_time) index usable
+    last_scans = db.session.query(
+        BusScan.bus_id.label('bus_id'),
+        BusScan.student_id.label('student_id'),
+        func.max(BusScan.scan_time).label('last_time')
+    ).filter(
+        BusScan.scan_time >= day_start,
+        BusScan.scan_time < day_end
+    ).group_by(BusScan.bus_id, BusScan.student_id).subquery()
+
+    query = db.session.query(
+        BusScan.bus_id, BusScan.student_id, User.fullName
+    ).join(
+        last_scans,
+        and_(
+            BusScan.bus_id == last_scans.c.bus_id,
+            BusScan.student_id == last_scans.c.student_id,
+            BusScan.scan_time == last_scans.c.last_time
+        )
+    ).join(
+        Bus, Bus.id == BusScan.bus_id
+    ).join(
+        User, User.id == BusScan.student_id
+    ).filter(
+        BusScan.scan_type == 'board',
+        Bus.is_active == True
+    )
+
+    if school_ids is not None:
+        query = query.filter(Bus.school_id.in_(school_ids))
+
+    students_by_bus = {}
+    for bus_id, student_id, full_name in query.all():
+        students = students_by_bus.setdefault(bus_id, [])
+        # Two scans can share the same timestamp; keep one entry per student
+        if all(existing_id != student_id for existing_id, _ in students):
+            students.append((student_id, full_name))
+    return students_by_bus
+
+
+def sweep_forgotten_students(created_by, school_ids=None, day=None, notify=True):
+    """
+    Check all (or the given) schools for students left on buses and alert
+    drivers and school admins once per bus per day.
+
+    Args:
+        created_by: User ID recorded as the notification creator
+        school_ids: Optional list of school IDs to restrict the sweep to
+        day: Date to check (defaults to today in Oman time)
+        notify: When False, only report without notifying or recording
+
+    Returns:
+        Dict with 'buses' (every bus with students still on it),
+        'notifications' (alerts sent in this sweep) and 'already_notified' (bus IDs skipped)
+    """
+    day = day or get_oman_time().date()
+
+    students_by_bus = find_students_still_on_buses(day, school_ids)
+    if not students_by_bus:
+        return {'buses': [], 'notifications': [], 'already_notified': []}
+
+    bus_ids = list(students_by_bus.keys())
+    driver = aliased(User)
+    bus_rows = db.session.query(
+        Bus.id, Bus.bus_number, Bus.bus_name, Bus.school_id, Bus.driver_id, driver.fullName
+    ).outerjoin(
+        driver, driver.id == Bus.driver_id
+    ).filter(Bus.id.in_(bus_ids)).all()
+
+    already_notified = set(
+        row[0] for row in db.session.query(ForgottenStudentAlert.bus_id).filter(
+            ForgottenStudentAlert.bus_id.in_(bus_ids),
+            ForgottenStudentAlert.alert_date == day
+        ).all()
+    )
+
+    buses_with_students = []
+    notification_specs = []
+    notifications_sent = []
+    alerts = []
+
+    for bus_id, bus_number, bus_name, school_id, driver_id, driver_name in bus_rows:
+        students = students_by_bus[bus_id]
+        bus_data = {
+            'id': bus_id,
+            'school_id': school_id,
+            'bus_number': bus_number,
+            'bus_name': bus_name,
+            'students_count': len(students),
+            'student_names': [name for _, name in students],
+            'driver_name': driver_name or 'غير محدد'
+        }
+        buses_with_students.append(bus_data)
+
+        if not notify or bus_id in already_notified:
+            continue
+
+        if driver_id:
+            notification_specs.append(
+                build_driver_forgot_students_notification(driver_id, school_id, bus_data, created_by)
+            )
+            notifications_sent.append({
+                'type': 'driver',
+                'recipient_id': driver_id,
+                'bus_number': bus_number
+            })
+
+        notification_specs.append(
+            build_admin_forgot_students_notification(school_id, bus_data, created_by)
+        )
+        notifications_sent.append({
+            'type': 'admin',
+            'school_id': school_id,
+            'bus_number': bus_number
+        })
+
+        alerts.append(ForgottenStudentAlert(
+            bus_id=bus_id,
+            school_id=school_id,
+            alert_date=day,
+            students_count=len(students),
+            student_ids=json.dumps([student_id for student_id, _ in students])
+        ))
+
+    if alerts:
+        # Record the alerts first so a concurrent sweep hits the unique constraint
+        # instead of sending the same notifications twice
+        try:
+            db.session.add_all(alerts)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error recording forgotten student alerts: {str(e)}")
+            return {
+                'buses': buses_with_students,
+                'notifications': [],
+                'already_notified': sorted(already_notified)
+            }
+
+        if not create_notifications_bulk(notification_specs):
+            # Nothing was created: release this sweep's alerts so the next sweep retries these buses
+            try:
+                ForgottenStudentAlert.query.filter(
+                    ForgottenStudentAlert.id.in_([alert.id for alert in alerts])
+                ).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f"Error releasing forgotten student alerts: {str(e)}")
+            notifications_sent = []
+
+    return {
+        'buses': buses_with_students,
+        'notifications': notifications_sent,
+        'already_notified': sorted(already_notified)
+    }
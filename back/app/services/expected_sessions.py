@@ -0,0 +1,195 @@
+"""
+Expected Sessions - The active timetable resolved into (class, teacher, weekday, period) slots.
+
+Timetable rows carry XML ids and names; rebuild_expected_sessions() resolves
+them once, when a timetable is activated (or its teacher mappings change), into
+expected_sessions rows keyed by real class and teacher ids. Reports then find
+missing attendance as a set difference: the school's expected slots for a
+weekday minus the (class, period) / (teacher, period) pairs recorded that day,
+from one grouped query each.
+
+Schools without an active timetable have no rows; callers fall back to their
+previous estimates (periods 1-8 per class, week_Classes_Number per teacher).
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from app import db
+from app.models import (
+    Attendance, Class, ExpectedSession, Timetable, TimetableDay,
+    TimetablePeriod, TimetableSchedule, TimetableTeacherMapping
+)
+from app.services.school_calendar import get_school_calendar
+from app.services.partitioning import model_in_range
+
+# date.weekday() for Arabic/English day names (normalized: no hamza, ة -> ه)
+DAY_NAME_WEEKDAYS = {
+    'الاحد': 6, 'الاثنين': 0, 'الثلاثاء': 1, 'الاربعاء': 2, 'الخميس': 3, 'الجمعه': 4, 'السبت': 5,
+    'sunday': 6, 'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 'friday': 4, 'saturday': 5,
+    'sun': 6, 'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5,
+}
+
+# Timetable days whose names are not recognised are taken in this order
+SCHOOL_WEEK = (6, 0, 1, 2, 3)
+
+
+def _normalize(name):
+    if not name:
+        return ''
+    normalized = name.replace('أ', 'ا').replace('إ', 'ا').replace('ؤ', 'و').replace('ئ', 'ي')
+    normalized = normalized.replace('ة', 'ه').replace('يوم ', '').strip()
+    return normalized.lower()
+
+
+def _weekday_for(day, position):
+    for name in (day.name, day.short_name):
+        weekday = DAY_NAME_WEEKDAYS.get(_normalize(name))
+        if weekday is not None:
+            return weekday
+    return SCHOOL_WEEK[position] if position < len(SCHOOL_WEEK) else None
+
+
+def rebuild_expected_sessions(school_id):
+    """
+    Replace the school's expected_sessions with its active timetable's slots.
+    Runs in the caller's transaction; the caller commits. Returns rows written.
+    """
+    ExpectedSession.query.filter_by(school_id=school_id).delete(synchronize_session=False)
+
+    timetable = Timetable.query.filter_by(school_id=school_id, is_active=True).order_by(Timetable.id.desc()).first()
+    if not timetable:
+        return 0
+
+    days = TimetableDay.query.filter_by(timetable_id=timetable.id).order_by(TimetableDay.id).all()
+    weekday_by_day = {day.day_id: _weekday_for(day, position) for position, day in enumerate(days)}
+
+    period_by_id = {
+        period.period_id: period.period_number
+        for period in TimetablePeriod.query.filter_by(timetable_id=timetable.id).all()
+    }
+    teacher_by_xml_id = {
+        mapping.xml_teacher_id: mapping.teacher_id
+        for mapping in TimetableTeacherMapping.query.filter_by(timetable_id=timetable.id).all()
+    }
+    class_by_name = {_normalize(c.name): c.id for c in Class.query.filter_by(school_id=school_id).all()}
+
+    slots = {}
+    schedules = db.session.query(
+        TimetableSchedule.class_name,
+        TimetableSchedule.subject_name,
+        TimetableSchedule.teacher_xml_id,
+        TimetableSchedule.day_xml_id,
+        TimetableSchedule.period_xml_id
+    ).filter(TimetableSchedule.timetable_id == timetable.id).all()
+
+    for class_name, subject_name, teacher_xml_id, day_xml_id, period_xml_id in schedules:
+        weekday = weekday_by_day.get(day_xml_id)
+        period = period_by_id.get(period_xml_id)
+        if period is None and str(period_xml_id).isdigit():
+            period = int(period_xml_id)
+        if weekday is None or period is None:
+            continue
+        class_id = class_by_name.get(_normalize(class_name))
+        teacher_id = teacher_by_xml_id.get(teacher_xml_id)
+        slots.setdefault((class_id, teacher_id, weekday, period), subject_name)
+
+    rows = [{
+        'school_id': school_id,
+        'timetable_id': timetable.id,
+        'class_id': class_id,
+        'teacher_id': teacher_id,
+        'weekday': weekday,
+        'period': period,
+        'subject_name': (subject_name or '')[:100] or None
+    } for (class_id, teacher_id, weekday, period), subject_name in slots.items()]
+
+    if rows:
+        db.session.execute(ExpectedSession.__table__.insert(), rows)
+    return len(rows)
+
+
+def has_expected_sessions(school_id):
+    return db.session.query(ExpectedSession.id).filter_by(school_id=school_id).first() is not None
+
+
+def expected_periods_by_class(school_id, day):
+    """
+    {class_id: set(periods)} expected on `day`, or None when the school has no
+    timetable index. Non-working days (weekends, holidays) expect nothing.
+    """
+    if not has_expected_sessions(school_id):
+        return None
+    if not get_school_calendar(school_id).is_working_day(day):
+        return {}
+
+    expected = {}
+    rows = db.session.query(ExpectedSession.class_id, ExpectedSession.period).filter(
+        ExpectedSession.school_id == school_id,
+        ExpectedSession.weekday == day.weekday(),
+        ExpectedSession.class_id.isnot(None)
+    ).distinct().all()
+    for class_id, period in rows:
+        expected.setdefault(class_id, set()).add(period)
+    return expected
+
+
+def missing_sessions(school_id, day):
+    """
+    Expected slots on `day` with no attendance recorded, as dicts with
+    class_id, teacher_id, period and subject_name. A slot counts as recorded
+    if its class or its teacher has any attendance in that period that day
+    (a substitute may have taken it). None when the school has no index.
+    """
+    if not has_expected_sessions(school_id):
+        return None
+    if not get_school_calendar(school_id).is_working_day(day):
+        return []
+
+    day_start = datetime.combine(day, datetime.min.time())
+    day_end = day_start + timedelta(days=1)
+    attendance_rows = model_in_range(Attendance, day_start, day_end)
+    recorded = db.session.query(
+        attendance_rows.class_id, attendance_rows.teacher_id, attendance_rows.class_time_num
+    ).filter(
+        attendance_rows.class_id.in_(db.session.query(Class.id).filter(Class.school_id == school_id)),
+        attendance_rows.date >= day_start,
+        attendance_rows.date < day_end
+    ).group_by(attendance_rows.class_id, attendance_rows.teacher_id, attendance_rows.class_time_num).all()
+    recorded_class_slots = {(class_id, period) for class_id, _, period in recorded}
+    recorded_teacher_slots = {(teacher_id, period) for _, teacher_id, period in recorded}
+
+    expected = ExpectedSession.query.filter_by(school_id=school_id, weekday=day.weekday()).order_by(
+        ExpectedSession.period, ExpectedSession.class_id
+    ).all()
+    return [{
+        'class_id': slot.class_id,
+        'teacher_id': slot.teacher_id,
+        'period': slot.period,
+        'subject_name': slot.subject_name
+    } for slot in expected
+        if (slot.class_id, slot.period) not in recorded_class_slots
+        and (slot.teacher_id, slot.period) not in recorded_teacher_slots]
+
+
+def expected_sessions_by_teacher(school_id, start_date, end_date):
+    """
+    {teacher_id: sessions expected in [start_date, end_date]} from the timetable
+    index and each school's working days (school_id None = all schools).
+    Teachers without timetable slots are absent from the dict.
+    """
+    query = db.session.query(
+        ExpectedSession.school_id,
+        ExpectedSession.teacher_id,
+        ExpectedSession.weekday,
+        func.count(func.distinct(ExpectedSession.period))
+    ).filter(ExpectedSession.teacher_id.isnot(None))
+    if school_id:
+        query = query.filter(ExpectedSession.school_id == school_id)
+    rows = query.group_by(ExpectedSession.school_id, ExpectedSession.teacher_id, ExpectedSession.weekday).all()
+
+    weekday_counts = {}
+    expected = {}
+    for row_school_id, teacher_id, weekday, periods in rows:
+        if row_school_id not in weekday_counts:
+            weekday_counts[row_school_id] = get_school_calendar(row_school_id).weekday_counts(start_date, end_date)
+        expected[teacher_id] = expected.get(teacher_id, 0) + int(periods) * int(weekday_counts[row_school_id][weekday])
+    return expected
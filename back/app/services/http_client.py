@@ -0,0 +1,190 @@
+"""
+HTTP Client - Shared sessions, timeouts, retries and circuit breakers for provider calls.
+
+SMS (iBulk / ismartsms.net) and WhatsApp (Evolution API) calls used to go
+through bare requests.get/post: a new TCP+TLS handshake per message, and a
+provider that was down held request threads until a 15-30 s timeout fired,
+once per message. All provider calls now go through request():
+
+- One keep-alive requests.Session per scheme://host, so consecutive messages
+  to the same provider reuse pooled connections.
+- (connect, read) timeouts: Config.OUTBOUND_CONNECT_TIMEOUT_SECONDS, and the
+  caller's read timeout (Config.OUTBOUND_READ_TIMEOUT_SECONDS by default).
+- Up to Config.OUTBOUND_RETRIES retries with jittered exponential backoff on
+  connection errors and 502/503/504. Non-idempotent requests (POST) are only
+  retried when the request never reached the server (connection refused,
+  DNS failure, connect timeout), so an SMS is never sent twice by a retry.
+- A circuit breaker per caller-chosen key (e.g. 'evolution:<school_id>').
+  Connection errors, timeouts and 502/503/504 count as failures. After
+  Config.OUTBOUND_CIRCUIT_FAILURES consecutive failures the key is open
+  for Config.OUTBOUND_CIRCUIT_RESET_SECONDS: calls raise CircuitOpenError at
+  once. After that one trial call is let through; success closes the circuit.
+
+Breaker state is per process. CircuitOpenError subclasses
+requests.ConnectionError, so existing "cannot connect" handling applies.
+Nothing here is tied to a provider host; pointing a school's API URL at a local
+stand-in server exercises the same code, and reset() clears the sessions and
+breakers between runs.
+"""
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from app.config import Config
+
+# Connections kept alive per host
+POOL_MAXSIZE = 10
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 5
+RETRY_STATUSES = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+_lock = threading.Lock()
+_sessions = {}  # scheme://host -> requests.Session
+_breakers = {}  # breaker key -> _CircuitBreaker
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a provider whose circuit is open."""
+
+
+class _CircuitBreaker:
+    def __init__(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+
+    def before_call(self, key):
+        with _lock:
+            if self.failures < Config.OUTBOUND_CIRCUIT_FAILURES:
+                return
+            if time.monotonic() < self.open_until or self.trial_in_flight:
+                raise CircuitOpenError(f"Circuit open for {key}; provider calls are paused")
+            # Half open: let one trial call through
+            self.trial_in_flight = True
+
+    def record(self, success):
+        with _lock:
+            self.trial_in_flight = False
+            if success:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures >= Config.OUTBOUND_CIRCUIT_FAILURES:
+                self.open_until = time.monotonic() + Config.OUTBOUND_CIRCUIT_RESET_SECONDS
+
+
+def _origin(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def session_for(url):
+    """Shared keep-alive session for the URL's scheme://host."""
+    origin = _origin(url)
+    with _lock:
+        session = _sessions.get(origin)
+        if session is None:
+            session = requests.Session()
+            session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE))
+            _sessions[origin] = session
+        return session
+
+
+def _breaker(key):
+    with _lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = _CircuitBreaker()
+        return breaker
+
+
+def circuit_open(key):
+    """Whether calls under this breaker key currently fail fast."""
+    with _lock:
+        breaker = _breakers.get(key)
+        return bool(
+            breaker and breaker.failures >= Config.OUTBOUND_CIRCUIT_FAILURES
+            and time.monotonic() < breaker.open_until
+        )
+
+
+def reset_breaker(key):
+    """Close the circuit for a key, e.g. after the school's provider settings change."""
+    with _lock:
+        _breakers.pop(key, None)
+
+
+def _not_sent(exc):
+    """True if the request failed before any of it reached the server."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+    # Also covers DNS failures (NameResolutionError subclasses it in urllib3 2)
+    return isinstance(reason, NewConnectionError)
+
+
+def _backoff(attempt):
+    # Full jitter: spread retries from many workers instead of retrying in step
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def request(method, url, breaker_key=None, timeout=None, retries=None, **kwargs):
+    """
+    requests-style call through the shared session for the URL's host.
+    timeout is the read timeout in seconds; breaker_key defaults to the host.
+    Returns the final Response (any status). Raises requests.RequestException
+    (CircuitOpenError when the circuit is open) if no response was received.
+    """
+    method = method.upper()
+    breaker_key = breaker_key or _origin(url)
+    breaker = _breaker(breaker_key)
+    read_timeout = Config.OUTBOUND_READ_TIMEOUT_SECONDS if timeout is None else timeout
+    retries = Config.OUTBOUND_RETRIES if retries is None else retries
+    idempotent = method in IDEMPOTENT_METHODS
+
+    attempt = 0
+    while True:
+        breaker.before_call(breaker_key)
+        try:
+            response = session_for(url).request(
+                method, url,
+                timeout=(Config.OUTBOUND_CONNECT_TIMEOUT_SECONDS, read_timeout),
+                **kwargs
+            )
+        except requests.exceptions.RequestException as e:
+            transport_error = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            breaker.record(success=not transport_error)
+            if not transport_error or attempt >= retries or not (idempotent or _not_sent(e)):
+                raise
+        else:
+            # A plain 500 is usually the provider rejecting this payload, not an outage
+            breaker.record(success=response.status_code not in RETRY_STATUSES)
+            if response.status_code not in RETRY_STATUSES or attempt >= retries or not idempotent:
+                return response
+            response.close()
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+
+def reset():
+    """Close pooled sessions and forget breaker state."""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+        _breakers.clear()
+    for session in sessions:
+        session.close()
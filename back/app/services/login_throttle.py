@@ -0,0 +1,151 @@
+"""
+Login Throttle - Shared failed-login tracking for staff login and parent PIN login.
+
+Failures are counted in sliding windows per client IP and per account name.
+Counters live in Redis (same instance as the rate limiter) so every gunicorn
+worker sees the same state; without Redis each worker keeps its own counters.
+
+Instead of sleeping in the worker after a bad attempt, callers answer with a
+Retry-After header and reject further attempts until the cooldown expires.
+"""
+import math
+import threading
+import time
+import uuid
+from collections import deque
+from app.cache import get_redis, mark_redis_down
+
+# Sliding windows: (max failures, window seconds)
+IP_LIMIT = (15, 60)
+ACCOUNT_LIMIT = (10, 15 * 60)
+
+# Cooldown after each failure for the same account: grows with the failure count
+BASE_COOLDOWN_SECONDS = 1
+MAX_COOLDOWN_SECONDS = 30
+
+_lock = threading.Lock()
+_local_failures = {}   # key -> deque of failure timestamps
+_local_cooldowns = {}  # key -> epoch time when the cooldown ends
+
+
+def _keys(scope, ip, account):
+    """Return (key, (max failures, window), uses_cooldown) for each tracked dimension."""
+    keys = []
+    if ip:
+        # No per-failure cooldown on IPs: a whole school can share one NAT address
+        keys.append((f"login_throttle:{scope}:ip:{ip}", IP_LIMIT, False))
+    if account:
+        keys.append((f"login_throttle:{scope}:account:{str(account).strip().lower()}", ACCOUNT_LIMIT, True))
+    return keys
+
+
+def _cooldown_for(failures):
+    if failures <= 0:
+        return 0
+    return min(BASE_COOLDOWN_SECONDS * 2 ** (failures - 1), MAX_COOLDOWN_SECONDS)
+
+
+def _redis_window(client, key, window, now, add=False):
+    """Trim the window and return (count, oldest_timestamp)."""
+    pipe = client.pipeline()
+    pipe.zremrangebyscore(key, 0, now - window)
+    if add:
+        pipe.zadd(key, {f"{now}:{uuid.uuid4().hex[:8]}": now})
+        pipe.expire(key, window)
+    pipe.zcard(key)
+    pipe.zrange(key, 0, 0, withscores=True)
+    results = pipe.execute()
+    oldest = results[-1][0][1] if results[-1] else now
+    return results[-2], oldest
+
+
+def _local_window(key, window, now, add=False):
+    failures = _local_failures.setdefault(key, deque())
+    while failures and failures[0] <= now - window:
+        failures.popleft()
+    if add:
+        failures.append(now)
+    if not failures:
+        _local_failures.pop(key, None)
+        return 0, now
+    return len(failures), failures[0]
+
+
+def check_login_allowed(ip, account, scope='login'):
+    """
+    Return 0 if a login attempt may proceed, otherwise the number of seconds
+    the client must wait (for the Retry-After header).
+    """
+    now = time.time()
+    retry_after = 0
+    client = get_redis()
+
+    for key, (max_failures, window), uses_cooldown in _keys(scope, ip, account):
+        if client is not None:
+            try:
+                count, oldest = _redis_window(client, key, window, now)
+                cooldown_ms = client.pttl(f"{key}:cooldown") if uses_cooldown else 0
+                if cooldown_ms and cooldown_ms > 0:
+                    retry_after = max(retry_after, cooldown_ms / 1000.0)
+            except Exception:
+                mark_redis_down()
+                client = None
+        if client is None:
+            with _lock:
+                count, oldest = _local_window(key, window, now)
+                cooldown_until = _local_cooldowns.get(key, 0)
+            if cooldown_until > now:
+                retry_after = max(retry_after, cooldown_until - now)
+
+        if count >= max_failures:
+            retry_after = max(retry_after, oldest + window - now)
+
+    return int(math.ceil(retry_after)) if retry_after > 0 else 0
+
+
+def record_login_failure(ip, account, scope='login'):
+    """Count a failed attempt and return the Retry-After seconds for the client."""
+    now = time.time()
+    retry_after = 0
+    client = get_redis()
+
+    for key, (max_failures, window), uses_cooldown in _keys(scope, ip, account):
+        if client is not None:
+            try:
+                count, oldest = _redis_window(client, key, window, now, add=True)
+                cooldown = _cooldown_for(count) if uses_cooldown else 0
+                if cooldown:
+                    client.set(f"{key}:cooldown", 1, px=int(cooldown * 1000))
+            except Exception:
+                mark_redis_down()
+                client = None
+        if client is None:
+            with _lock:
+                count, oldest = _local_window(key, window, now, add=True)
+                cooldown = _cooldown_for(count) if uses_cooldown else 0
+                if cooldown:
+                    _local_cooldowns[key] = now + cooldown
+
+        retry_after = max(retry_after, cooldown)
+        if count >= max_failures:
+            retry_after = max(retry_after, oldest + window - now)
+
+    return int(math.ceil(retry_after))
+
+
+def clear_login_failures(account, scope='login'):
+    """
+    Reset the account's counters after a successful login. The IP window is
+    left to expire on its own so one valid login can't reset a stuffing burst.
+    """
+    client = get_redis()
+    keys = [key for key, _, _ in _keys(scope, None, account)]
+    if client is not None:
+        try:
+            client.delete(*keys, *[f"{key}:cooldown" for key in keys])
+        except Exception:
+            mark_redis_down()
+    with _lock:
+        for key in keys:
+            _local_failures.pop(key, None)
+            _local_cooldowns.pop(key, None)
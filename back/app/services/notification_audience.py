@@ -0,0 +1,135 @@
+"""
+Notification Audience - Read-time resolution of broadcast notifications.
+
+School and system news used to copy every recipient's user id into
+notifications.target_user_ids, and every read then LIKE-scanned those lists.
+A broadcast is now one notification row plus notification_audiences rows of
+(school_id, role), where school_id None means every school. A user sees it when
+an audience row matches their role and school, found through the
+(role, school_id, notification_id) index.
+
+Preferences are applied lazily as well: broadcasts of a type the user has
+disabled (or all broadcasts, when push is disabled) are filtered out when the
+user reads their notifications, instead of being left off a recipient list.
+Notifications for specific users (target_user_ids) and the older single
+target_role rows keep working as before.
+"""
+import json
+from sqlalchemy import or_, and_, select, true
+from app.models import Notification, NotificationAudience, User
+from app.services.notification_preferences import TYPE_BITS, get_preference_mask, push_enabled, type_enabled
+
+
+def add_audiences(notification, roles, school_id):
+    """Address `notification` to each role in the school (school_id None = all schools)."""
+    for role in dict.fromkeys(roles):
+        notification.audiences.append(NotificationAudience(school_id=school_id, role=role))
+
+
+def blocked_broadcast_types(user_id):
+    """
+    Notification types the user has opted out of: None if nothing is blocked,
+    'all' if push is disabled, else a list of types.
+    """
+    mask = get_preference_mask(user_id)
+    if not push_enabled(mask):
+        return 'all'
+    blocked = [t for t in TYPE_BITS if not type_enabled(mask, t)]
+    return blocked or None
+
+
+def _user_id_conditions(user_id):
+    return or_(
+        Notification.target_user_ids.like(f'%[{user_id}]%'),  # [1,2,3] format
+        Notification.target_user_ids.like(f'%"{user_id}"%'),  # ["1","2","3"] format
+        Notification.target_user_ids.like(f'%{user_id}%')     # Fallback
+    )
+
+
+def audience_notification_ids(role, school_id):
+    """Subquery of broadcast notification ids addressed to `role` in the school or globally."""
+    school_scope = NotificationAudience.school_id.is_(None)
+    if school_id is not None:
+        school_scope = or_(NotificationAudience.school_id == school_id, school_scope)
+    return select(NotificationAudience.notification_id).where(
+        NotificationAudience.role == role,
+        school_scope
+    )
+
+
+def visible_notification_scopes(user):
+    """
+    The conditions of visible_notifications_filter, split by school_id into
+    disjoint scopes: the user's school, global rows, and (super admin only)
+    other schools' rows that list them. Each of the first two pins school_id to
+    one value, so it reads ix_notifications_feed in order with a LIMIT.
+    """
+    user_id = user.id
+    targeted = _user_id_conditions(user_id)
+
+    conditions = [targeted]
+    if user.user_role:
+        conditions.append(Notification.target_role == user.user_role)
+
+        blocked = blocked_broadcast_types(user_id)
+        if blocked != 'all':
+            broadcast = Notification.id.in_(audience_notification_ids(user.user_role, user.school_id))
+            if blocked:
+                broadcast = and_(broadcast, Notification.type.notin_(blocked))
+            conditions.append(broadcast)
+    addressed = or_(*conditions)
+
+    scopes = []
+    if user.school_id is not None:
+        scopes.append(and_(Notification.school_id == user.school_id, addressed))
+    scopes.append(and_(Notification.school_id.is_(None), addressed))
+    if user.user_role == 'admin':
+        other_schools = Notification.school_id.isnot(None)
+        if user.school_id is not None:
+            other_schools = and_(other_schools, Notification.school_id != user.school_id)
+        scopes.append(and_(other_schools, targeted))
+    return scopes
+
+
+def visible_notifications_filter(user):
+    """
+    Condition selecting the notifications `user` (a User or Principal) should see:
+    their school's (any school's for super admin, when addressed to them) and
+    global rows that target them by id, by legacy target_role, or by audience.
+    Expiry and per-user read/delete state are left to the caller.
+    """
+    return or_(*visible_notification_scopes(user))
+
+
+def is_visible_to(notification, user):
+    """Python-side check of visible_notifications_filter for one loaded notification."""
+    if notification.school_id is not None and notification.school_id != user.school_id and user.user_role != 'admin':
+        return False
+
+    if notification.target_role and notification.target_role == user.user_role:
+        return True
+
+    if notification.target_user_ids:
+        try:
+            target_user_ids = json.loads(notification.target_user_ids)
+            if isinstance(target_user_ids, list) and user.id in [int(i) for i in target_user_ids]:
+                return True
+        except (ValueError, TypeError):
+            if str(user.id) in notification.target_user_ids:
+                return True
+
+    return any(
+        audience.role == user.user_role and audience.school_id in (None, user.school_id)
+        for audience in notification.audiences
+    )
+
+
+def audience_user_filter(notification):
+    """Condition on User matching any of the notification's audiences (None if it has none)."""
+    conditions = []
+    for audience in notification.audiences:
+        school_scope = User.school_id == audience.school_id if audience.school_id is not None else true()
+        conditions.append(and_(User.user_role == audience.role, school_scope))
+    if not conditions:
+        return None
+    return and_(User.is_active == True, or_(*conditions))
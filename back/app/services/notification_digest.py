@@ -0,0 +1,206 @@
+"""
+Notification Digest - One updatable notification per student, type and day.
+
+A student marked late in period 1, absent in period 3 and scanned on and off
+the bus used to get four notification rows and four pushes. Attendance and bus
+events are now queued here and merged into a single daily digest row per
+(student, type, day), identified by notifications.digest_key:
+
+- Events are buffered in process for Config.NOTIFICATION_DIGEST_WINDOW_SECONDS
+  (one timer per window), so a burst from one attendance submission or a bus
+  boarding queue costs one write and one push per student, not one per event.
+- On flush each digest row is created or updated under SELECT ... FOR UPDATE.
+  Two workers creating the same digest race on the unique digest_key, and the
+  loser retries as an update.
+- Updating a digest makes it unread (and undeleted) again for the student and
+  moves it to the top of their feed.
+- Events still buffered at interpreter exit are flushed by an atexit hook.
+  A hard kill loses at most one window of pushes; the attendance rows
+  themselves are already committed.
+"""
+import atexit
+import json
+import threading
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Notification, NotificationRead, NotificationDeleted
+from app.config import Config
+from app.services.notification_templates import encode_params, ATTENDANCE_STATUSES, BUS_SCAN_TYPES
+
+DIGEST_TEMPLATE_KEYS = {
+    'attendance': 'attendance_digest.v1',
+    'bus': 'bus_digest.v1',
+}
+
+PRIORITY_RANK = {'low': 0, 'normal': 1, 'high': 2, 'urgent': 3}
+
+# Oldest events are dropped beyond this many per digest
+MAX_EVENTS_PER_DIGEST = 30
+
+_lock = threading.Lock()
+_pending = {}  # (student_id, notification_type, day) -> _PendingDigest
+_timer = None
+_app = None
+
+
+class _PendingDigest:
+    def __init__(self, school_id, created_by, priority, related_entity_type, related_entity_id, action_url):
+        self.school_id = school_id
+        self.created_by = created_by
+        self.priority = priority
+        self.related_entity_type = related_entity_type
+        self.related_entity_id = related_entity_id
+        self.action_url = action_url
+        self.events = []
+
+    def add(self, event, priority, created_by, related_entity_id):
+        self.events.append(event)
+        self.priority = _max_priority(self.priority, priority)
+        self.created_by = created_by
+        self.related_entity_id = related_entity_id or self.related_entity_id
+
+
+def _max_priority(a, b):
+    return a if PRIORITY_RANK.get(a, 1) >= PRIORITY_RANK.get(b, 1) else b
+
+
+def digest_key(notification_type, student_id, day):
+    return f"{notification_type}:{student_id}:{day.isoformat()}"
+
+
+def _title(notification_type, events):
+    if notification_type == 'attendance':
+        if len(events) == 1:
+            emoji, text = ATTENDANCE_STATUSES.get(events[0].get('s'), ('📋', 'الحضور'))
+            return f"{emoji} {text}"
+        return f"📋 ملخص الحضور اليوم ({len(events)})"
+    if len(events) == 1:
+        emoji, action = BUS_SCAN_TYPES.get(events[0].get('k'), BUS_SCAN_TYPES['exit'])
+        return f"{emoji} {action}"
+    return f"🚍 الحافلة اليوم ({len(events)})"
+
+
+def queue_student_event(student_id, school_id, notification_type, day, event, created_by,
+                        priority='normal', related_entity_type=None, related_entity_id=None,
+                        action_url=None):
+    """
+    Add an event (template parameters for one attendance record or bus scan)
+    to the student's digest for `day`. notification_type is 'attendance' or 'bus'.
+    Must be called inside an application context.
+    """
+    from flask import current_app
+
+    event = {k: v for k, v in event.items() if v not in (None, '')}
+    key = (student_id, notification_type, day)
+    pending = _PendingDigest(school_id, created_by, priority, related_entity_type, related_entity_id, action_url)
+    pending.add(event, priority, created_by, related_entity_id)
+
+    window = Config.NOTIFICATION_DIGEST_WINDOW_SECONDS
+    if window <= 0:
+        _write_and_push(key, pending)
+        return
+
+    global _timer, _app
+    with _lock:
+        _app = current_app._get_current_object()
+        existing = _pending.get(key)
+        if existing is None:
+            _pending[key] = pending
+        else:
+            existing.add(event, priority, created_by, related_entity_id)
+        if _timer is None:
+            _timer = threading.Timer(window, flush_digests)
+            _timer.daemon = True
+            _timer.start()
+
+
+def flush_digests():
+    """Write every buffered digest and send one push per digest."""
+    global _timer
+    with _lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _timer = None
+        app = _app
+    if not batch or app is None:
+        return
+
+    with app.app_context():
+        try:
+            for key, pending in batch.items():
+                try:
+                    _write_and_push(key, pending)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Error writing notification digest {key}: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def _write_and_push(key, pending):
+    notification = _write_digest(key, pending)
+    if notification is None:
+        return
+    try:
+        from app.routes.notification_routes import send_push_notification
+        send_push_notification(notification)
+    except Exception as e:
+        print(f"Warning: Could not send push notification: {str(e)}")
+
+
+def _write_digest(key, pending):
+    student_id, notification_type, day = key
+    key_value = digest_key(notification_type, student_id, day)
+
+    for _ in range(2):
+        try:
+            notification = Notification.query.filter_by(digest_key=key_value).with_for_update().first()
+            if notification is None:
+                events = pending.events[-MAX_EVENTS_PER_DIGEST:]
+                notification = Notification(
+                    school_id=pending.school_id,
+                    title=_title(notification_type, events),
+                    message=None,
+                    type=notification_type,
+                    priority=pending.priority,
+                    template_key=DIGEST_TEMPLATE_KEYS[notification_type],
+                    target_user_ids=json.dumps([student_id]),
+                    related_entity_type=pending.related_entity_type,
+                    related_entity_id=pending.related_entity_id,
+                    created_by=pending.created_by,
+                    action_url=pending.action_url,
+                    is_active=True,
+                    digest_key=key_value
+                )
+                db.session.add(notification)
+            else:
+                try:
+                    previous = json.loads(notification.template_params or '{}').get('e') or []
+                except ValueError:
+                    previous = []
+                events = (previous + pending.events)[-MAX_EVENTS_PER_DIGEST:]
+                notification.title = _title(notification_type, events)
+                notification.priority = _max_priority(notification.priority, pending.priority)
+                notification.related_entity_id = pending.related_entity_id or notification.related_entity_id
+                notification.is_active = True
+                # Same clock as the column default; moves the digest to the top of the feed
+                notification.created_at = datetime.utcnow()
+                # New events make the digest unread (and visible again) for the student
+                NotificationRead.query.filter_by(
+                    notification_id=notification.id, user_id=student_id
+                ).delete(synchronize_session=False)
+                NotificationDeleted.query.filter_by(
+                    notification_id=notification.id, user_id=student_id
+                ).delete(synchronize_session=False)
+
+            notification.template_params = encode_params({'d': day.isoformat(), 'e': events})
+            db.session.commit()
+            return notification
+        except IntegrityError:
+            # Another worker created this digest first; merge into it
+            db.session.rollback()
+    return None
+
+
+atexit.register(flush_digests)
@@ -0,0 +1,171 @@
+"""
+Notification Preferences - Cached per-user bitmasks of enabled notification types.
+
+Preferences change rarely but are read on every fan-out (recipient filtering,
+web push) and every feed read (lazy broadcast filtering). Each user's row is
+reduced to one small integer:
+
+    bit 0-6  attendance, bus, behavior, timetable, substitution, news, general
+    bit 7    push_enabled
+
+Users without a row have every bit set. Masks are served from an in-process
+LRU (short TTL, since other workers may change a preference), then Redis
+(MGET for many users at once), then one column query for the remaining ids.
+update_notification_preferences calls invalidate_preferences() after commit.
+"""
+import threading
+import time
+from collections import OrderedDict
+from app import db
+from app.models import NotificationPreference
+from app.cache import get_redis, mark_redis_down
+
+TYPE_BITS = {
+    'attendance': 0,
+    'bus': 1,
+    'behavior': 2,
+    'timetable': 3,
+    'substitution': 4,
+    'news': 5,
+    'general': 6,
+}
+PUSH_BIT = 7
+ALL_ENABLED = (1 << (PUSH_BIT + 1)) - 1
+
+LOCAL_TTL_SECONDS = 60
+LOCAL_MAX_ENTRIES = 50000
+REDIS_TTL_SECONDS = 24 * 60 * 60
+
+_lock = threading.Lock()
+_local = OrderedDict()  # user_id -> (expires_at, mask), least recently used first
+
+
+def _redis_key(user_id):
+    return f"notif_pref:{user_id}"
+
+
+def preference_mask(pref):
+    """Bitmask for a NotificationPreference row (None = all enabled)."""
+    if pref is None:
+        return ALL_ENABLED
+    mask = 0
+    for notification_type, bit in TYPE_BITS.items():
+        if getattr(pref, f"{notification_type}_enabled", True) is not False:
+            mask |= 1 << bit
+    if pref.push_enabled is not False:
+        mask |= 1 << PUSH_BIT
+    return mask
+
+
+def type_enabled(mask, notification_type):
+    """Whether the type is enabled (unknown types follow 'general')."""
+    return bool(mask & (1 << TYPE_BITS.get(notification_type, TYPE_BITS['general'])))
+
+
+def push_enabled(mask):
+    return bool(mask & (1 << PUSH_BIT))
+
+
+def allows(mask, notification_type):
+    """Push enabled and the notification type enabled."""
+    return push_enabled(mask) and type_enabled(mask, notification_type)
+
+
+def _store_local(masks):
+    expires_at = time.monotonic() + LOCAL_TTL_SECONDS
+    with _lock:
+        for user_id, mask in masks.items():
+            _local[user_id] = (expires_at, mask)
+            _local.move_to_end(user_id)
+        while len(_local) > LOCAL_MAX_ENTRIES:
+            _local.popitem(last=False)
+
+
+def get_preference_masks(user_ids):
+    """{user_id: mask} for every id in user_ids."""
+    user_ids = list(dict.fromkeys(int(u) for u in user_ids))
+    masks = {}
+
+    now = time.monotonic()
+    with _lock:
+        for user_id in user_ids:
+            entry = _local.get(user_id)
+            if entry and entry[0] > now:
+                masks[user_id] = entry[1]
+                _local.move_to_end(user_id)
+    missing = [user_id for user_id in user_ids if user_id not in masks]
+    if not missing:
+        return masks
+
+    client = get_redis()
+    from_redis = {}
+    if client is not None:
+        try:
+            for user_id, value in zip(missing, client.mget([_redis_key(u) for u in missing])):
+                if value is not None:
+                    from_redis[user_id] = int(value)
+        except Exception:
+            mark_redis_down()
+            client = None
+    masks.update(from_redis)
+
+    missing = [user_id for user_id in missing if user_id not in from_redis]
+    from_db = {}
+    if missing:
+        rows = db.session.query(
+            NotificationPreference.user_id,
+            NotificationPreference.attendance_enabled,
+            NotificationPreference.bus_enabled,
+            NotificationPreference.behavior_enabled,
+            NotificationPreference.timetable_enabled,
+            NotificationPreference.substitution_enabled,
+            NotificationPreference.news_enabled,
+            NotificationPreference.general_enabled,
+            NotificationPreference.push_enabled
+        ).filter(NotificationPreference.user_id.in_(missing)).all()
+        found = {row.user_id: preference_mask(row) for row in rows}
+        from_db = {user_id: found.get(user_id, ALL_ENABLED) for user_id in missing}
+        masks.update(from_db)
+
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for user_id, mask in from_db.items():
+                    pipe.set(_redis_key(user_id), mask, ex=REDIS_TTL_SECONDS)
+                pipe.execute()
+            except Exception:
+                mark_redis_down()
+
+    _store_local({**from_redis, **from_db})
+    return masks
+
+
+def get_preference_mask(user_id):
+    return get_preference_masks([user_id])[int(user_id)]
+
+
+def filter_user_ids(user_ids, notification_type):
+    """The user ids whose preferences allow this notification type (one cache multi-get)."""
+    masks = get_preference_masks(user_ids)
+    return [user_id for user_id in user_ids if allows(masks[int(user_id)], notification_type)]
+
+
+def invalidate_preferences(user_id, pref=None):
+    """
+    Call after a user's NotificationPreference row changes. With the committed
+    row, the new mask is written through (so a concurrent reader can't leave an
+    older one in Redis); without it the cached mask is dropped.
+    """
+    user_id = int(user_id)
+    with _lock:
+        _local.pop(user_id, None)
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        if pref is not None:
+            client.set(_redis_key(user_id), preference_mask(pref), ex=REDIS_TTL_SECONDS)
+        else:
+            client.delete(_redis_key(user_id))
+    except Exception:
+        mark_redis_down()
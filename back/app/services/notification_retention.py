@@ -0,0 +1,121 @@
+"""
+Notification Retention - Move expired and old notifications out of the hot tables.
+
+notifications, notification_reads and notification_deleted only ever grew:
+expired rows stayed behind every feed query's expires_at filter, and receipts
+grow with users x notifications. sweep_notifications() (`flask
+sweep-notifications`, nightly) moves, in chunks of CHUNK_SIZE notifications:
+
+    notifications whose expires_at has passed, or older than
+    Config.NOTIFICATION_RETENTION_DAYS (digests: last update)
+    + their notification_reads, notification_deleted and notification_audiences rows
+
+into <table>_archive tables (created with partitioning.ensure_archive_table).
+Each chunk is copied and deleted in one transaction, children first. Push
+subscriptions that were deactivated (expired endpoints, unsubscribes) more
+than INACTIVE_SUBSCRIPTION_GRACE_DAYS ago are deleted outright.
+"""
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text, bindparam
+from app import db
+from app.config import Config, get_oman_time
+from app.services.partitioning import ensure_archive_table, _column_names
+
+CHUNK_SIZE = 1000
+INACTIVE_SUBSCRIPTION_GRACE_DAYS = 7
+
+# Per-notification child tables, archived before their notifications
+CHILD_TABLES = ('notification_reads', 'notification_deleted', 'notification_audiences')
+
+
+def _prepare_archive(conn, table):
+    """(archive table, column list) for copying `table`; creates the archive if needed."""
+    archive = ensure_archive_table(conn, table)
+    return archive, ", ".join(f"`{name}`" for name in _column_names(conn, table))
+
+
+def _archive_rows(conn, table, archive, columns, where, ids):
+    """Copy the matching rows into the archive, then delete them. Returns rows moved."""
+    conn.execute(
+        text(f"INSERT IGNORE INTO `{archive}` ({columns}) SELECT {columns} FROM `{table}` WHERE {where}")
+        .bindparams(bindparam('ids', expanding=True)),
+        {'ids': ids}
+    )
+    return conn.execute(
+        text(f"DELETE FROM `{table}` WHERE {where}").bindparams(bindparam('ids', expanding=True)),
+        {'ids': ids}
+    ).rowcount
+
+
+def sweep_notifications(retention_days=None, chunk_size=CHUNK_SIZE, dry_run=False, now=None, local_now=None):
+    """
+    Archive expired and old notifications with their receipts, and delete
+    long-inactive push subscriptions. Returns a metrics dict: rows moved per
+    table, subscriptions removed, chunks and elapsed seconds (counts only
+    when dry_run). `now` is UTC; `local_now` is Oman time.
+    """
+    started = time.monotonic()
+    retention_days = Config.NOTIFICATION_RETENTION_DAYS if retention_days is None else retention_days
+    # created_at defaults to UTC; expires_at is written and filtered by the feed in Oman time
+    now = now or datetime.utcnow()
+    local_now = local_now or get_oman_time()
+    params = {'local_now': local_now, 'cutoff': now - timedelta(days=retention_days)}
+    stale = "(expires_at IS NOT NULL AND expires_at <= :local_now) OR created_at < :cutoff"
+    subscription_cutoff = now - timedelta(days=INACTIVE_SUBSCRIPTION_GRACE_DAYS)
+    inactive_subscriptions = "is_active = 0 AND COALESCE(last_used_at, created_at) < :subscription_cutoff"
+
+    metrics = {table: 0 for table in ('notifications',) + CHILD_TABLES}
+    metrics.update({'push_subscriptions_removed': 0, 'chunks': 0})
+
+    with db.engine.connect() as conn:
+        if dry_run:
+            metrics['notifications'] = conn.execute(
+                text(f"SELECT COUNT(*) FROM notifications WHERE {stale}"), params
+            ).scalar() or 0
+            for table in CHILD_TABLES:
+                metrics[table] = conn.execute(text(
+                    f"SELECT COUNT(*) FROM `{table}` WHERE notification_id IN "
+                    f"(SELECT id FROM notifications WHERE {stale})"
+                ), params).scalar() or 0
+            metrics['push_subscriptions_removed'] = conn.execute(
+                text(f"SELECT COUNT(*) FROM push_subscriptions WHERE {inactive_subscriptions}"),
+                {'subscription_cutoff': subscription_cutoff}
+            ).scalar() or 0
+            metrics['seconds'] = round(time.monotonic() - started, 2)
+            return metrics
+
+        archives = {table: _prepare_archive(conn, table) for table in CHILD_TABLES + ('notifications',)}
+        conn.commit()
+
+        last_id = 0
+        while True:
+            # Walk the primary key so each chunk is an index range, not a rescan
+            ids = [row[0] for row in conn.execute(text(
+                f"SELECT id FROM notifications WHERE id > :last_id AND ({stale}) ORDER BY id LIMIT :limit"
+            ), dict(params, last_id=last_id, limit=chunk_size))]
+            if not ids:
+                break
+            try:
+                for table in CHILD_TABLES:
+                    metrics[table] += _archive_rows(conn, table, *archives[table], "notification_id IN :ids", ids)
+                metrics['notifications'] += _archive_rows(conn, 'notifications', *archives['notifications'], "id IN :ids", ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            metrics['chunks'] += 1
+            last_id = ids[-1]
+
+        while True:
+            removed = conn.execute(text(
+                f"DELETE FROM push_subscriptions WHERE {inactive_subscriptions} LIMIT {chunk_size}"
+            ), {'subscription_cutoff': subscription_cutoff}).rowcount
+            conn.commit()
+            metrics['push_subscriptions_removed'] += removed
+            if removed < chunk_size:
+                break
+
+    metrics['seconds'] = round(time.monotonic() - started, 2)
+    print("Notification sweep: " + ", ".join(f"{key}={value}" for key, value in metrics.items()))
+    return metrics
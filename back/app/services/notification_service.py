@@ -4,6 +4,9 @@ Notification Service - Centralized notification creation for all user roles
 from app import db
 from app.models import Notification, User, Student, Teacher
 from app.config import get_oman_time
+from app.services.notification_audience import add_audiences
+from app.services.notification_templates import encode_params
+from app.services.notification_digest import queue_student_event
 from datetime import datetime, timedelta
 import json
 
@@ -12,9 +15,14 @@ def create_notification(school_id, title, message, notification_type,
                        created_by, priority='normal', target_role=None,
                        target_user_ids=None, target_class_ids=None,
                        related_entity_type=None, related_entity_id=None,
-                       action_url=None, expires_at=None):
+                       action_url=None, expires_at=None, audience_roles=None,
+                       template_key=None, template_params=None):
     """
-    Helper function to create a notification and send push notifications
+    Helper function to create a notification and send push notifications.
+    audience_roles makes it a broadcast to those roles in the school (school_id
+    None = every school), resolved when users read their notifications.
+    template_key/template_params store the message as a template reference
+    (see notification_templates) instead of rendered text; pass message=None.
     """
     try:
         notification = Notification(
@@ -23,6 +31,8 @@ def create_notification(school_id, title, message, notification_type,
             message=message,
             type=notification_type,
             priority=priority,
+            template_key=template_key,
+            template_params=encode_params(template_params) if template_key and template_params else None,
             target_role=target_role,
             target_user_ids=json.dumps(target_user_ids) if target_user_ids else None,
             target_class_ids=json.dumps(target_class_ids) if target_class_ids else None,
@@ -33,6 +43,8 @@ def create_notification(school_id, title, message, notification_type,
             expires_at=expires_at,
             is_active=True
         )
+        if audience_roles:
+            add_audiences(notification, audience_roles, school_id)
         
         db.session.add(notification)
         db.session.commit()
@@ -51,67 +63,108 @@ def create_notification(school_id, title, message, notification_type,
         return None
 
 
+def create_notifications_bulk(notification_specs):
+    """
+    Create several notifications in a single transaction, then send their pushes.
+    Each spec is a dict of create_notification keyword arguments.
+    """
+    if not notification_specs:
+        return []
+    try:
+        notifications = []
+        for spec in notification_specs:
+            target_user_ids = spec.get('target_user_ids')
+            target_class_ids = spec.get('target_class_ids')
+            notifications.append(Notification(
+                school_id=spec['school_id'],
+                title=spec['title'],
+                message=spec.get('message'),
+                type=spec['notification_type'],
+                priority=spec.get('priority', 'normal'),
+                template_key=spec.get('template_key'),
+                template_params=encode_params(spec['template_params']) if spec.get('template_key') and spec.get('template_params') else None,
+                target_role=spec.get('target_role'),
+                target_user_ids=json.dumps(target_user_ids) if target_user_ids else None,
+                target_class_ids=json.dumps(target_class_ids) if target_class_ids else None,
+                related_entity_type=spec.get('related_entity_type'),
+                related_entity_id=spec.get('related_entity_id'),
+                created_by=spec['created_by'],
+                action_url=spec.get('action_url'),
+                expires_at=spec.get('expires_at'),
+                is_active=True
+            ))
+        
+        db.session.add_all(notifications)
+        db.session.commit()
+        
+        try:
+            from app.routes.notification_routes import send_push_notification
+            for notification in notifications:
+                send_push_notification(notification)
+        except Exception as e:
+            print(f"Warning: Could not send push notifications: {str(e)}")
+        
+        return notifications
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error creating notifications in bulk: {str(e)}")
+        return []
+
+
 # ============================================================================
 # STUDENT NOTIFICATIONS
 # ============================================================================
 
 def notify_student_attendance(student_id, school_id, attendance_record, created_by):
     """
-    Notify student about their attendance status (absent, late, excuse)
-    Similar to WhatsApp message format
+    Notify student about their attendance status (absent, late, excuse).
+    Events are merged into the student's daily attendance digest (one row and
+    one push per coalescing window); see notification_digest.
     """
     try:
         student = Student.query.get(student_id)
         if not student:
             return None
         
-        # Determine status and create appropriate message
-        status_emoji = ""
-        status_text = ""
-        
+        # Determine status
         if attendance_record.get('is_absent'):
-            status_emoji = "❌"
-            status_text = "هروب من الحصة"
+            status = 'absent'
             priority = "high"
         elif attendance_record.get('is_late'):
-            status_emoji = "⏰"
-            status_text = "تأخر عن الحصة"
+            status = 'late'
             priority = "normal"
         elif attendance_record.get('is_excused'):
-            status_emoji = "📝"
-            status_text = "غياب"
+            status = 'excused'
             priority = "normal"
         else:
             return None  # No need to notify for present
         
-        # Format message like WhatsApp
-        message = f"""
-{status_emoji} {status_text}
-
-📚 المادة: {attendance_record.get('subject_name', 'غير محدد')}
-🎓 الفصل: {attendance_record.get('class_name', 'غير محدد')}
-👨‍🏫 المعلم: {attendance_record.get('teacher_name', 'غير محدد')}
-📅 التاريخ: {attendance_record.get('date', get_oman_time().strftime('%Y-%m-%d'))}
-🕐 الحصة: {attendance_record.get('class_time_num', '-')}
-"""
-        
-        if attendance_record.get('excuse_note'):
-            message += f"\n📋 ملاحظة العذر: {attendance_record['excuse_note']}"
-        
-        title = f"{status_emoji} {status_text}"
+        day_str = attendance_record.get('date') or get_oman_time().strftime('%Y-%m-%d')
+        try:
+            day = datetime.strptime(day_str, '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            day = get_oman_time().date()
         
-        return create_notification(
+        queue_student_event(
+            student_id=student_id,
             school_id=school_id,
-            title=title,
-            message=message.strip(),
             notification_type='attendance',
+            day=day,
+            event={
+                's': status,
+                'sub': attendance_record.get('subject_name', 'غير محدد'),
+                'cls': attendance_record.get('class_name', 'غير محدد'),
+                'tch': attendance_record.get('teacher_name', 'غير محدد'),
+                'p': attendance_record.get('class_time_num', '-'),
+                'n': attendance_record.get('excuse_note')
+            },
             created_by=created_by,
             priority=priority,
-            target_user_ids=[student_id],
             related_entity_type='attendance',
             related_entity_id=attendance_record.get('id'),
             action_url='/app/dashboard'
         )
+        return None
     except Exception as e:
         print(f"Error notifying student about attendance: {str(e)}")
         return None
@@ -119,27 +172,19 @@ def notify_student_attendance(student_id, school_id, attendance_record, created_
 
 def notify_student_bus_scan(student_id, school_id, scan_data, created_by):
     """
-    Notify student when they board/exit the bus
+    Notify student when they board/exit the bus, merged into the student's
+    daily bus digest (see notification_digest).
     """
     try:
         student = Student.query.get(student_id)
         if not student:
             return None
         
-        scan_type = scan_data.get('scan_type')
+        scan_type = 'board' if scan_data.get('scan_type') == 'board' else 'exit'
         scan_time = scan_data.get('scan_time', get_oman_time())
         bus_number = scan_data.get('bus_number', 'غير محدد')
         location = scan_data.get('location', '')
         
-        if scan_type == 'board':
-            emoji = "🚌"
-            action = "صعود على الحافلة"
-            priority = "normal"
-        else:  # exit
-            emoji = "🏁"
-            action = "نزول من الحافلة"
-            priority = "normal"
-        
         # Format time
         if isinstance(scan_time, str):
             try:
@@ -148,31 +193,26 @@ def notify_student_bus_scan(student_id, school_id, scan_data, created_by):
                 pass
         
         time_str = scan_time.strftime('%I:%M %p') if isinstance(scan_time, datetime) else str(scan_time)
+        day = scan_time.date() if isinstance(scan_time, datetime) else get_oman_time().date()
         
-        message = f"""
-{emoji} تم {action}
-
-🚍 رقم الحافلة: {bus_number}
-🕐 الوقت: {time_str}
-"""
-        
-        if location:
-            message += f"📍 الموقع: {location}\n"
-        
-        title = f"{emoji} {action}"
-        
-        return create_notification(
+        queue_student_event(
+            student_id=student_id,
             school_id=school_id,
-            title=title,
-            message=message.strip(),
             notification_type='bus',
+            day=day,
+            event={
+                'k': scan_type,
+                'bus': bus_number,
+                'tm': time_str,
+                'loc': location
+            },
             created_by=created_by,
-            priority=priority,
-            target_user_ids=[student_id],
+            priority='normal',
             related_entity_type='bus_scan',
             related_entity_id=scan_data.get('id'),
             action_url='/app/dashboard'
         )
+        return None
     except Exception as e:
         print(f"Error notifying student about bus scan: {str(e)}")
         return None
@@ -216,46 +256,74 @@ def notify_student_behavior_note(student_id, school_id, behavior_data, created_b
         return None
 
 
-def notify_students_school_news(school_id, news_data, created_by):
+def _news_message(news_data, default_title, header=None):
+    """Title and body shared by the news notifications."""
+    title = news_data.get('title', default_title)
+    content = news_data.get('content', '')
+    
+    # Truncate content if too long
+    if len(content) > 200:
+        content = content[:200] + "..."
+    
+    if header:
+        return title, f"""
+{header}
+
+{title}
+
+{content}
+""".strip()
+    return title, f"""
+📰 {title}
+
+{content}
+""".strip()
+
+
+def notify_school_news(school_id, news_data, created_by):
     """
-    Notify all students about school news.
-    BEST PRACTICE: Use role-based targeting for broad announcements to students.
+    Notify students, teachers, analysts and drivers about school news.
+    One broadcast row for the school; recipients and their preferences are
+    resolved when they read their notifications.
     """
     try:
-        from app.services.notification_utils import get_users_by_role, create_targeted_notification
-        
-        title = news_data.get('title', 'خبر جديد')
-        content = news_data.get('content', '')
-        
-        # Truncate content if too long
-        if len(content) > 200:
-            content = content[:200] + "..."
-        
-        message = f"""
-📰 {title}
+        title, message = _news_message(news_data, 'خبر جديد')
+        return create_notification(
+            school_id=school_id,
+            title=f"📰 {title}",
+            message=message,
+            notification_type='news',
+            created_by=created_by,
+            priority='normal',
+            related_entity_type='news',
+            related_entity_id=news_data.get('id'),
+            action_url='/app/news',
+            expires_at=get_oman_time() + timedelta(days=30),
+            audience_roles=['student', 'teacher', 'data_analyst', 'driver']
+        )
+    except Exception as e:
+        print(f"Error notifying school about news: {str(e)}")
+        return None
 
-{content}
-"""
-        
-        # Get all active students in the school
-        student_ids = get_users_by_role('student', school_id)
-        
-        if not student_ids:
-            print(f"No students to notify in school {school_id}")
-            return None
-        
-        return create_targeted_notification(
+
+def notify_students_school_news(school_id, news_data, created_by):
+    """
+    Notify all students about school news (broadcast to the student role).
+    """
+    try:
+        title, message = _news_message(news_data, 'خبر جديد')
+        return create_notification(
             school_id=school_id,
             title=f"📰 {title}",
-            message=message.strip(),
+            message=message,
             notification_type='news',
             created_by=created_by,
-            target_user_ids=student_ids,
             priority='normal',
             related_entity_type='news',
             related_entity_id=news_data.get('id'),
             action_url='/app/news',
-            expires_at=get_oman_time() + timedelta(days=30)
+            expires_at=get_oman_time() + timedelta(days=30),
+            audience_roles=['student']
         )
     except Exception as e:
         print(f"Error notifying students about school news: {str(e)}")
@@ -370,100 +438,71 @@ def notify_teacher_substitution(teacher_id, school_id, substitution_data, create
 def notify_teachers_school_news(school_id, news_data, created_by):
     """
     Notify all teachers and analysts about school news.
-    BEST PRACTICE: Combine teachers and analysts into one notification to avoid duplicates.
+    BEST PRACTICE: One broadcast to both roles avoids duplicates.
     """
     try:
-        from app.services.notification_utils import get_users_by_role, create_targeted_notification
-        
-        title = news_data.get('title', 'خبر جديد')
-        content = news_data.get('content', '')
-        
-        # Truncate content if too long
-        if len(content) > 200:
-            content = content[:200] + "..."
-        
-        message = f"""
-📰 {title}
-
-{content}
-"""
-        
-        # Get all teachers and analysts (combined to avoid duplicate notifications)
-        teacher_ids = get_users_by_role('teacher', school_id)
-        analyst_ids = get_users_by_role('data_analyst', school_id)
-        
-        # Combine and deduplicate
-        all_user_ids = list(set(teacher_ids + analyst_ids))
-        
-        if not all_user_ids:
-            print(f"No teachers/analysts to notify in school {school_id}")
-            return None
-        
-        # Single notification to all relevant users
-        return create_targeted_notification(
+        title, message = _news_message(news_data, 'خبر جديد')
+        return create_notification(
             school_id=school_id,
             title=f"📰 {title}",
-            message=message.strip(),
+            message=message,
             notification_type='news',
             created_by=created_by,
-            target_user_ids=all_user_ids,
             priority='normal',
             related_entity_type='news',
             related_entity_id=news_data.get('id'),
             action_url='/app/news',
-            expires_at=get_oman_time() + timedelta(days=30)
+            expires_at=get_oman_time() + timedelta(days=30),
+            audience_roles=['teacher', 'data_analyst']
         )
     except Exception as e:
         print(f"Error notifying teachers about school news: {str(e)}")
         return None
 
 
-def notify_teachers_system_news(school_id, news_data, created_by):
+def notify_system_news(news_data, created_by):
     """
-    Notify teachers and analysts about system-wide news.
-    BEST PRACTICE: Single notification to all relevant users, deduplicated.
+    Notify teachers, analysts and school admins in every school about system news.
+    A single global broadcast row (school_id None) replaces one row per school.
     """
     try:
-        from app.services.notification_utils import get_users_by_role, create_targeted_notification
-        
-        title = news_data.get('title', 'خبر جديد من النظام')
-        content = news_data.get('content', '')
-        
-        # Truncate content if too long
-        if len(content) > 200:
-            content = content[:200] + "..."
-        
-        message = f"""
-🔔 إعلان من النظام
+        title, message = _news_message(news_data, 'خبر جديد من النظام', header='🔔 إعلان من النظام')
+        return create_notification(
+            school_id=None,
+            title=f"🔔 {title}",
+            message=message,
+            notification_type='news',
+            created_by=created_by,
+            priority='normal',
+            related_entity_type='news',
+            related_entity_id=news_data.get('id'),
+            action_url='/app/news',
+            expires_at=get_oman_time() + timedelta(days=30),
+            audience_roles=['teacher', 'data_analyst', 'school_admin']
+        )
+    except Exception as e:
+        print(f"Error notifying about system news: {str(e)}")
+        return None
 
-{title}
 
-{content}
-"""
-        
-        # Get teachers and analysts (combined for single notification)
-        teacher_ids = get_users_by_role('teacher', school_id)
-        analyst_ids = get_users_by_role('data_analyst', school_id)
-        
-        # Combine and deduplicate
-        all_user_ids = list(set(teacher_ids + analyst_ids))
-        
-        if not all_user_ids:
-            print(f"No teachers/analysts to notify in school {school_id}")
-            return None
-        
-        return create_targeted_notification(
+def notify_teachers_system_news(school_id, news_data, created_by):
+    """
+    Notify teachers and analysts of one school about system news.
+    """
+    try:
+        title, message = _news_message(news_data, 'خبر جديد من النظام', header='🔔 إعلان من النظام')
+        return create_notification(
             school_id=school_id,
             title=f"🔔 {title}",
-            message=message.strip(),
+            message=message,
             notification_type='news',
             created_by=created_by,
-            target_user_ids=all_user_ids,
             priority='normal',
             related_entity_type='news',
             related_entity_id=news_data.get('id'),
             action_url='/app/news',
-            expires_at=get_oman_time() + timedelta(days=30)
+            expires_at=get_oman_time() + timedelta(days=30),
+            audience_roles=['teacher', 'data_analyst']
         )
     except Exception as e:
         print(f"Error notifying teachers about system news: {str(e)}")
@@ -476,88 +515,73 @@ def notify_teachers_system_news(school_id, news_data, created_by):
 
 def notify_driver_school_news(school_id, news_data, created_by):
     """
-    Notify all drivers about school news.
-    BEST PRACTICE: Target specific drivers rather than using role-based.
+    Notify all drivers about school news (broadcast to the driver role).
     """
     try:
-        from app.services.notification_utils import get_users_by_role, create_targeted_notification
-        
-        title = news_data.get('title', 'خبر جديد')
-        content = news_data.get('content', '')
-        
-        # Truncate content if too long
-        if len(content) > 200:
-            content = content[:200] + "..."
-        
-        message = f"""
-📰 {title}
-
-{content}
-"""
-        
-        # Get all drivers in the school
-        driver_ids = get_users_by_role('driver', school_id)
-        
-        if not driver_ids:
-            print(f"No drivers to notify in school {school_id}")
-            return None
-        
-        return create_targeted_notification(
+        title, message = _news_message(news_data, 'خبر جديد')
+        return create_notification(
             school_id=school_id,
             title=f"📰 {title}",
-            message=message.strip(),
+            message=message,
             notification_type='news',
             created_by=created_by,
-            target_user_ids=driver_ids,
             priority='normal',
             related_entity_type='news',
             related_entity_id=news_data.get('id'),
             action_url='/app/news',
-            expires_at=get_oman_time() + timedelta(days=30)
+            expires_at=get_oman_time() + timedelta(days=30),
+            audience_roles=['driver']
         )
     except Exception as e:
         print(f"Error notifying drivers about school news: {str(e)}")
         return None
 
 
-def notify_driver_forgot_students(driver_id, school_id, bus_data, created_by):
+def build_driver_forgot_students_notification(driver_id, school_id, bus_data, created_by):
     """
-    Notify driver if they forgot students on the bus
+    Build the create_notification arguments for a driver who forgot students on the bus
     """
-    try:
-        bus_number = bus_data.get('bus_number', 'غير محدد')
-        students_count = bus_data.get('students_count', 0)
-        student_names = bus_data.get('student_names', [])
-        
-        message = f"""
+    bus_number = bus_data.get('bus_number', 'غير محدد')
+    students_count = bus_data.get('students_count', 0)
+    student_names = bus_data.get('student_names', [])
+    
+    message = f"""
 
 🚍 الحافلة: {bus_number}
 👥 عدد الطلاب: {students_count}
 
 الطلاب:
 """
-        
-        for name in student_names[:5]:  # Show max 5 names
-            message += f"• {name}\n"
-        
-        if len(student_names) > 5:
-            message += f"... و {len(student_names) - 5} طلاب آخرين\n"
-        
-        message += "\n⚠️ يرجى التأكد من نزول جميع الطلاب"
-        
-        title = "⚠️ تحذير: طلاب على الحافلة"
-        
+    
+    for name in student_names[:5]:  # Show max 5 names
+        message += f"• {name}\n"
+    
+    if len(student_names) > 5:
+        message += f"... و {len(student_names) - 5} طلاب آخرين\n"
+    
+    message += "\n⚠️ يرجى التأكد من نزول جميع الطلاب"
+    
+    return {
+        'school_id': school_id,
+        'title': "⚠️ تحذير: طلاب على الحافلة",
+        'message': message.strip(),
+        'notification_type': 'bus',
+        'created_by': created_by,
+        'priority': 'urgent',
+        'target_user_ids': [driver_id],
+        'related_entity_type': 'bus',
+        'related_entity_id': bus_data.get('id'),
+        'action_url': '/app/bus-scanner'
+    }
+
+
+def notify_driver_forgot_students(driver_id, school_id, bus_data, created_by):
+    """
+    Notify driver if they forgot students on the bus
+    """
+    try:
         return create_notification(
-            school_id=school_id,
-            title=title,
-            message=message.strip(),
-            notification_type='bus',
-            created_by=created_by,
-            priority='urgent',
-            target_user_ids=[driver_id],
-            related_entity_type='bus',
-            related_entity_id=bus_data.get('id'),
-            action_url='/app/bus-scanner'
+            **build_driver_forgot_students_notification(driver_id, school_id, bus_data, created_by)
         )
     except Exception as e:
         print(f"Error notifying driver about forgot students: {str(e)}")
@@ -570,92 +594,75 @@ def notify_driver_forgot_students(driver_id, school_id, bus_data, created_by):
 
 def notify_admin_system_news(school_id, news_data, created_by):
     """
-    Notify school admins about system-wide news.
-    BEST PRACTICE: Only for important system announcements directed at admins.
+    Notify school admins of one school about system news.
     This should be used sparingly - only for admin-relevant news.
     """
     try:
-        from app.services.notification_utils import get_users_by_role, create_targeted_notification
-        
-        title = news_data.get('title', 'خبر جديد من النظام')
-        content = news_data.get('content', '')
-        
-        # Truncate content if too long
-        if len(content) > 200:
-            content = content[:200] + "..."
-        
-        message = f"""
-🔔 إعلان من النظام
-
-{title}
-
-{content}
-"""
-        
-        # Get school admins
-        admin_ids = get_users_by_role('school_admin', school_id)
-        
-        if not admin_ids:
-            print(f"No admins to notify in school {school_id}")
-            return None
-        
-        return create_targeted_notification(
+        title, message = _news_message(news_data, 'خبر جديد من النظام', header='🔔 إعلان من النظام')
+        return create_notification(
             school_id=school_id,
             title=f"🔔 {title}",
-            message=message.strip(),
+            message=message,
             notification_type='news',
             created_by=created_by,
-            target_user_ids=admin_ids,
             priority='high',
             related_entity_type='news',
             related_entity_id=news_data.get('id'),
             action_url='/app/news',
-            expires_at=get_oman_time() + timedelta(days=30)
+            expires_at=get_oman_time() + timedelta(days=30),
+            audience_roles=['school_admin']
         )
     except Exception as e:
         print(f"Error notifying admins about system news: {str(e)}")
         return None
 
 
-def notify_admin_forgot_students_on_bus(school_id, bus_data, created_by):
+def build_admin_forgot_students_notification(school_id, bus_data, created_by):
     """
-    Notify school admins if a bus forgot students
+    Build the create_notification arguments for school admins when a bus forgot students
     """
-    try:
-        bus_number = bus_data.get('bus_number', 'غير محدد')
-        driver_name = bus_data.get('driver_name', 'غير محدد')
-        students_count = bus_data.get('students_count', 0)
-        student_names = bus_data.get('student_names', [])
-        
-        message = f"""
+    bus_number = bus_data.get('bus_number', 'غير محدد')
+    driver_name = bus_data.get('driver_name', 'غير محدد')
+    students_count = bus_data.get('students_count', 0)
+    student_names = bus_data.get('student_names', [])
+    
+    message = f"""
 🚍 الحافلة: {bus_number}
 👤 السائق: {driver_name}
 👥 عدد الطلاب: {students_count}
 
 الطلاب:
 """
-        
-        for name in student_names[:10]:  # Show max 10 names
-            message += f"• {name}\n"
-        
-        if len(student_names) > 10:
-            message += f"... و {len(student_names) - 10} طلاب آخرين\n"
-        
-        message += "\n⚠️ يرجى التواصل مع السائق فوراً"
-        
-        title = "⚠️ تنبيه: طلاب على الحافلة"
-        
+    
+    for name in student_names[:10]:  # Show max 10 names
+        message += f"• {name}\n"
+    
+    if len(student_names) > 10:
+        message += f"... و {len(student_names) - 10} طلاب آخرين\n"
+    
+    message += "\n⚠️ يرجى التواصل مع السائق فوراً"
+    
+    return {
+        'school_id': school_id,
+        'title': "⚠️ تنبيه: طلاب على الحافلة",
+        'message': message.strip(),
+        'notification_type': 'bus',
+        'created_by': created_by,
+        'priority': 'urgent',
+        'target_role': 'school_admin',
+        'related_entity_type': 'bus',
+        'related_entity_id': bus_data.get('id'),
+        'action_url': '/app/buses'
+    }
+
+
+def notify_admin_forgot_students_on_bus(school_id, bus_data, created_by):
+    """
+    Notify school admins if a bus forgot students
+    """
+    try:
         return create_notification(
-            school_id=school_id,
-            title=title,
-            message=message.strip(),
-            notification_type='bus',
-            created_by=created_by,
-            priority='urgent',
-            target_role='school_admin',
-            related_entity_type='bus',
-            related_entity_id=bus_data.get('id'),
-            action_url='/app/buses'
+            **build_admin_forgot_students_notification(school_id, bus_data, created_by)
         )
     except Exception as e:
         print(f"Error notifying admins about forgot students: {str(e)}")
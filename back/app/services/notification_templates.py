@@ -0,0 +1,160 @@
+"""
+Notification Templates - Compact storage for high-volume per-student notifications.
+
+Attendance and bus-scan notifications are written for every absent student and
+every scan, and their rendered multi-line messages are near-identical. Those
+rows store a template key and a small JSON parameter blob instead of the
+rendered message. The message is rendered when the notification is read.
+
+- Keys carry a version ('attendance.v1'). Changing the wording means adding a
+  new key; rows written with an old key still render the way they were sent.
+- Each template string is parsed once and kept compiled in an LRU cache.
+- Daily digest rows (DIGEST_TEMPLATES) hold a list of events and render one
+  line per event.
+- Rows with no template_key (older rows and all other notification types)
+  keep their rendered message in notifications.message and are returned as is.
+"""
+import json
+from functools import lru_cache
+from string import Formatter
+
+ATTENDANCE_STATUSES = {
+    'absent': ('❌', 'هروب من الحصة'),
+    'late': ('⏰', 'تأخر عن الحصة'),
+    'excused': ('📝', 'غياب'),
+}
+
+BUS_SCAN_TYPES = {
+    'board': ('🚌', 'صعود على الحافلة'),
+    'exit': ('🏁', 'نزول من الحافلة'),
+}
+
+# key -> (message template, [(param, template appended when the param is set)])
+TEMPLATES = {
+    'attendance.v1': (
+        "{emoji} {status_text}\n"
+        "\n"
+        "📚 المادة: {sub}\n"
+        "🎓 الفصل: {cls}\n"
+        "👨‍🏫 المعلم: {tch}\n"
+        "📅 التاريخ: {d}\n"
+        "🕐 الحصة: {p}",
+        [('n', "\n\n📋 ملاحظة العذر: {n}")]
+    ),
+    'bus_scan.v1': (
+        "{emoji} تم {action}\n"
+        "\n"
+        "🚍 رقم الحافلة: {bus}\n"
+        "🕐 الوقت: {tm}",
+        [('loc', "\n📍 الموقع: {loc}")]
+    ),
+}
+
+
+def _attendance_fields(params):
+    emoji, status_text = ATTENDANCE_STATUSES.get(params.get('s'), ('', ''))
+    return {'emoji': emoji, 'status_text': status_text}
+
+
+def _bus_scan_fields(params):
+    emoji, action = BUS_SCAN_TYPES.get(params.get('k'), BUS_SCAN_TYPES['exit'])
+    return {'emoji': emoji, 'action': action}
+
+
+# Values derived from the stored parameters rather than stored themselves
+DERIVED_FIELDS = {
+    'attendance.v1': _attendance_fields,
+    'bus_scan.v1': _bus_scan_fields,
+}
+
+# Daily digests (see notification_digest) store {'d': day, 'e': [event params, ...]}.
+# key -> (single-event template, header, line template, [(param, line suffix)])
+# A digest with one event renders exactly like the single-event template.
+DIGEST_TEMPLATES = {
+    'attendance_digest.v1': (
+        'attendance.v1',
+        "📋 ملخص الحضور - {d}",
+        "{emoji} {status_text} • الحصة {p} • {sub}",
+        [('n', " • {n}")]
+    ),
+    'bus_digest.v1': (
+        'bus_scan.v1',
+        "🚍 الحافلة - {d}",
+        "{emoji} {action} • {tm} • الحافلة {bus}",
+        []
+    ),
+}
+
+
+@lru_cache(maxsize=64)
+def _compile(template):
+    """Parse a format string once into (literal, field name) pairs."""
+    return tuple((literal, field) for literal, field, _, _ in Formatter().parse(template))
+
+
+def _render(template, values):
+    parts = []
+    for literal, field in _compile(template):
+        parts.append(literal)
+        if field is not None:
+            value = values.get(field)
+            parts.append('' if value is None else str(value))
+    return ''.join(parts)
+
+
+def encode_params(params):
+    """Compact JSON for notifications.template_params (unset values are dropped)."""
+    return json.dumps(
+        {k: v for k, v in params.items() if v not in (None, '')},
+        ensure_ascii=False,
+        separators=(',', ':')
+    )
+
+
+def _render_template(template_key, params):
+    template = TEMPLATES.get(template_key)
+    if template is None:
+        return None
+
+    values = dict(params)
+    derive = DERIVED_FIELDS.get(template_key)
+    if derive:
+        values.update(derive(params))
+
+    body, optional = template
+    message = _render(body, values)
+    for param, suffix in optional:
+        if values.get(param) not in (None, ''):
+            message += _render(suffix, values)
+    return message
+
+
+def _render_digest(template_key, params):
+    event_key, header, line, optional = DIGEST_TEMPLATES[template_key]
+    events = params.get('e') or []
+    if len(events) == 1:
+        return _render_template(event_key, dict(events[0], d=params.get('d')))
+
+    derive = DERIVED_FIELDS.get(event_key)
+    lines = [_render(header, params), '']
+    for event in events:
+        values = dict(event)
+        if derive:
+            values.update(derive(event))
+        text = _render(line, values)
+        for param, suffix in optional:
+            if values.get(param) not in (None, ''):
+                text += _render(suffix, values)
+        lines.append(text)
+    return '\n'.join(lines)
+
+
+def render_message(template_key, template_params):
+    """The rendered message, or None if the template key is unknown."""
+    try:
+        params = json.loads(template_params) if template_params else {}
+    except (ValueError, TypeError):
+        params = {}
+    if template_key in DIGEST_TEMPLATES:
+        return _render_digest(template_key, params)
+    return _render_template(template_key, params)
@@ -202,44 +202,16 @@ def filter_users_by_notification_preferences(user_ids: List[int], notification_t
         notification_type: Type of notification (attendance, bus, behavior, etc.)
         
     Returns:
-        Filtered list of user IDs who have this notification type enabled
+        Filtered list of user IDs who have push and this notification type enabled
+        (users without saved preferences get everything)
     """
-    from app.models import NotificationPreference
+    from app.services.notification_preferences import filter_user_ids
     
     if not user_ids:
         return []
     
-    # Get preferences for these users
-    preferences = NotificationPreference.query.filter(
-        NotificationPreference.user_id.in_(user_ids)
-    ).all()
-    
-    # Create a mapping of user_id to preferences
-    pref_map = {pref.user_id: pref for pref in preferences}
-    
-    # Filter users based on notification type
-    type_field_map = {
-        'attendance': 'attendance_enabled',
-        'bus': 'bus_enabled',
-        'behavior': 'behavior_enabled',
-        'timetable': 'timetable_enabled',
-        'substitution': 'substitution_enabled',
-        'news': 'news_enabled',
-        'general': 'general_enabled'
-    }
-    
-    field_name = type_field_map.get(notification_type, 'general_enabled')
-    
-    filtered_ids = []
-    for user_id in user_ids:
-        pref = pref_map.get(user_id)
-        if not pref:
-            # No preference set means all notifications enabled by default
-            filtered_ids.append(user_id)
-        elif pref.push_enabled and getattr(pref, field_name, True):
-            filtered_ids.append(user_id)
-    
-    return filtered_ids
+    # One cache multi-get of per-user preference bitmasks
+    return filter_user_ids(user_ids, notification_type)
 
 
 def create_targeted_notification(
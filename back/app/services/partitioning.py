@@ -0,0 +1,342 @@
+"""
+Partitioning - Monthly RANGE partitions and academic-year archives for the
+append-only history tables (MySQL only).
+
+    attendances   partitioned on date
+    bus_scans     partitioned on scan_time
+    action_logs   partitioned on timestamp
+
+Partitions are named pYYYYMM and hold one calendar month; pmax (MAXVALUE)
+catches anything beyond the last month created, and roll_partitions_forward()
+splits it so the next months always exist ahead of time.
+
+A closed academic year can be moved into <table>_archive (same columns,
+compressed rows, not partitioned). Whole months are removed from the live table
+with DROP PARTITION. Each archived range is recorded in data_archive_runs, and
+reads of attendances and bus_scans go through model_in_range(), which adds the
+archive only when the requested range starts before the archived boundary.
+action_logs is only read LOG_MAX_DAYS_BACK days back, so its years are archived
+once they are out of that window and are not read back.
+
+MySQL can't partition tables that have foreign keys, so converting a table
+drops its foreign keys and widens the primary key to (id, <date column>).
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+from sqlalchemy import text, select, union_all, and_, Table, Column, MetaData
+from sqlalchemy.orm import aliased
+from app import db
+from app.config import get_oman_time
+from app.services.action_log_browser import LOG_MAX_DAYS_BACK
+
+PARTITIONED_TABLES = {
+    'attendances': 'date',
+    'bus_scans': 'scan_time',
+    'action_logs': 'timestamp',
+}
+
+# The academic year runs from August to July
+ACADEMIC_YEAR_START_MONTH = 8
+
+MONTHS_AHEAD = 3
+DELETE_BATCH_SIZE = 10000
+ARCHIVE_BOUNDARY_TTL_SECONDS = 10 * 60
+
+_lock = threading.Lock()
+_boundaries = {}  # table -> (expires_at, date or None)
+_archive_metadata = MetaData()
+
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def _add_months(value, months):
+    month_index = value.year * 12 + (value.month - 1) + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(month):
+    return f"p{month.year:04d}{month.month:02d}"
+
+
+def academic_year_range(start_year):
+    """[start, end) of the academic year starting in start_year."""
+    return date(start_year, ACADEMIC_YEAR_START_MONTH, 1), date(start_year + 1, ACADEMIC_YEAR_START_MONTH, 1)
+
+
+def current_academic_year_start():
+    today = get_oman_time().date()
+    start_year = today.year if today.month >= ACADEMIC_YEAR_START_MONTH else today.year - 1
+    return academic_year_range(start_year)[0]
+
+
+# ============================================================================
+# Partition management
+# ============================================================================
+
+def get_partitions(conn, table):
+    """[(name, upper bound date or None for MAXVALUE)] in partition order; empty if not partitioned."""
+    rows = conn.execute(text("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """), {'table': table}).fetchall()
+
+    partitions = []
+    for name, description in rows:
+        bound = None
+        if description and description.upper() != 'MAXVALUE':
+            bound = datetime.strptime(description.strip("'")[:10], '%Y-%m-%d').date()
+        partitions.append((name, bound))
+    return partitions
+
+
+def _drop_foreign_keys(conn, table):
+    names = [row[0] for row in conn.execute(text("""
+        SELECT CONSTRAINT_NAME
+        FROM information_schema.TABLE_CONSTRAINTS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND CONSTRAINT_TYPE = 'FOREIGN KEY'
+    """), {'table': table})]
+    for name in names:
+        conn.execute(text(f"ALTER TABLE `{table}` DROP FOREIGN KEY `{name}`"))
+    return names
+
+
+def partition_table(conn, table, first_month=None, months_ahead=MONTHS_AHEAD):
+    """
+    Convert a table to monthly RANGE COLUMNS partitions. Rows older than
+    first_month (default: start of the current academic year) stay in a single
+    p_history partition.
+    """
+    column = PARTITIONED_TABLES[table]
+    if get_partitions(conn, table):
+        return False
+
+    first_month = _month_start(first_month or current_academic_year_start())
+    last_month = _add_months(_month_start(get_oman_time().date()), months_ahead)
+
+    definitions = [f"PARTITION p_history VALUES LESS THAN ('{first_month.isoformat()}')"]
+    month = first_month
+    while month <= last_month:
+        definitions.append(
+            f"PARTITION {_partition_name(month)} VALUES LESS THAN ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    definitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+
+    _drop_foreign_keys(conn, table)
+    conn.execute(text(f"ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY (id, `{column}`)"))
+    conn.execute(text(
+        f"ALTER TABLE `{table}` PARTITION BY RANGE COLUMNS(`{column}`) (\n    "
+        + ",\n    ".join(definitions) + "\n)"
+    ))
+    return True
+
+
+def roll_partitions_forward(conn, table, months_ahead=MONTHS_AHEAD):
+    """Split pmax so monthly partitions exist through months_ahead from now. Returns names added."""
+    partitions = get_partitions(conn, table)
+    if not partitions or partitions[-1][1] is not None:
+        return []
+
+    bounds = [bound for _, bound in partitions if bound is not None]
+    next_month = bounds[-1] if bounds else _month_start(get_oman_time().date())
+    last_month = _add_months(_month_start(get_oman_time().date()), months_ahead)
+
+    added = []
+    definitions = []
+    month = next_month
+    while month <= last_month:
+        name = _partition_name(month)
+        definitions.append(f"PARTITION {name} VALUES LESS THAN ('{_add_months(month, 1).isoformat()}')")
+        added.append(name)
+        month = _add_months(month, 1)
+    if not definitions:
+        return []
+
+    definitions.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+    conn.execute(text(
+        f"ALTER TABLE `{table}` REORGANIZE PARTITION pmax INTO (\n    " + ",\n    ".join(definitions) + "\n)"
+    ))
+    return added
+
+
+# ============================================================================
+# Archiving
+# ============================================================================
+
+def _archive_name(table):
+    return f"{table}_archive"
+
+
+def _column_names(conn, table):
+    return [row[0] for row in conn.execute(text("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+        ORDER BY ORDINAL_POSITION
+    """), {'table': table})]
+
+
+def ensure_archive_table(conn, table):
+    """Create <table>_archive with the live table's columns, compressed and unpartitioned."""
+    archive = _archive_name(table)
+    archive_columns = set(_column_names(conn, archive))
+    if archive_columns:
+        # Add columns the live table gained since the archive was created
+        for row in conn.execute(text(f"SHOW COLUMNS FROM `{table}`")).mappings():
+            if row['Field'] not in archive_columns:
+                conn.execute(text(f"ALTER TABLE `{archive}` ADD COLUMN `{row['Field']}` {row['Type']} NULL"))
+        return archive
+
+    conn.execute(text(f"CREATE TABLE `{archive}` LIKE `{table}`"))
+    if get_partitions(conn, archive):
+        conn.execute(text(f"ALTER TABLE `{archive}` REMOVE PARTITIONING"))
+    conn.execute(text(f"ALTER TABLE `{archive}` ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8"))
+    return archive
+
+
+def archive_range(conn, table, range_start, range_end, dry_run=False):
+    """
+    Copy rows with range_start <= column < range_end into the archive table,
+    verify the copy, then remove them from the live table (dropping whole
+    monthly partitions where possible). Returns the number of rows archived.
+    """
+    column = PARTITIONED_TABLES[table]
+    params = {'start': range_start, 'end': range_end}
+    where = f"`{column}` >= :start AND `{column}` < :end"
+
+    live_count = conn.execute(text(f"SELECT COUNT(*) FROM `{table}` WHERE {where}"), params).scalar() or 0
+    if dry_run or not live_count:
+        return live_count
+
+    archive = ensure_archive_table(conn, table)
+    columns = ", ".join(f"`{name}`" for name in _column_names(conn, table))
+    conn.execute(text(
+        f"INSERT IGNORE INTO `{archive}` ({columns}) SELECT {columns} FROM `{table}` WHERE {where}"
+    ), params)
+
+    archived_count = conn.execute(text(
+        f"SELECT COUNT(*) FROM `{archive}` WHERE {where}"
+    ), params).scalar() or 0
+    if archived_count < live_count:
+        raise RuntimeError(
+            f"Archive copy of {table} is incomplete ({archived_count} of {live_count} rows); live rows kept"
+        )
+
+    # Whole months inside the range go with DROP PARTITION; anything left is deleted in batches
+    droppable = []
+    lower = None
+    for name, upper in get_partitions(conn, table):
+        if lower is not None and upper is not None and lower >= range_start and upper <= range_end:
+            droppable.append(name)
+        lower = upper
+    if droppable:
+        conn.execute(text(f"ALTER TABLE `{table}` DROP PARTITION " + ", ".join(droppable)))
+
+    while True:
+        deleted = conn.execute(text(
+            f"DELETE FROM `{table}` WHERE {where} LIMIT {DELETE_BATCH_SIZE}"
+        ), params).rowcount
+        conn.commit()
+        if deleted < DELETE_BATCH_SIZE:
+            break
+
+    conn.execute(text("""
+        INSERT INTO data_archive_runs (table_name, range_start, range_end, rows_archived, archived_at)
+        VALUES (:table, :start, :end, :rows, :now)
+        ON DUPLICATE KEY UPDATE range_end = VALUES(range_end),
+            rows_archived = rows_archived + VALUES(rows_archived), archived_at = VALUES(archived_at)
+    """), {'table': table, 'start': range_start, 'end': range_end, 'rows': live_count, 'now': get_oman_time()})
+    conn.commit()
+
+    with _lock:
+        _boundaries.pop(table, None)
+    return live_count
+
+
+def archive_academic_year(conn, start_year, tables=None, dry_run=False):
+    """Archive one closed academic year for each table. Returns {table: rows}."""
+    range_start, range_end = academic_year_range(start_year)
+    if range_end > current_academic_year_start():
+        raise ValueError(f"Academic year {start_year}-{start_year + 1} is not closed yet")
+    tables = tables or list(PARTITIONED_TABLES)
+    # view_logs reads action_logs from the live table only
+    if 'action_logs' in tables and range_end > get_oman_time().date() - timedelta(days=LOG_MAX_DAYS_BACK):
+        raise ValueError(
+            f"action_logs for {start_year}-{start_year + 1} are still within the "
+            f"{LOG_MAX_DAYS_BACK}-day log view; archive the other tables with --table"
+        )
+    return {
+        table: archive_range(conn, table, range_start, range_end, dry_run=dry_run)
+        for table in tables
+    }
+
+
+# ============================================================================
+# Reads across live and archived rows
+# ============================================================================
+
+def archive_boundary(table):
+    """End of the newest archived range for a table (rows before it may be archived), or None."""
+    now = time.monotonic()
+    with _lock:
+        entry = _boundaries.get(table)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    from app.models import DataArchiveRun
+    boundary = db.session.query(db.func.max(DataArchiveRun.range_end)).filter(
+        DataArchiveRun.table_name == table
+    ).scalar()
+    with _lock:
+        _boundaries[table] = (now + ARCHIVE_BOUNDARY_TTL_SECONDS, boundary)
+    return boundary
+
+
+def range_needs_archive(table, range_start):
+    boundary = archive_boundary(table)
+    if boundary is None or range_start is None:
+        return boundary is not None
+    start = range_start.date() if isinstance(range_start, datetime) else range_start
+    return start < boundary
+
+
+def archive_table_for(model):
+    """Core Table for <table>_archive with the model's columns (no constraints)."""
+    name = _archive_name(model.__tablename__)
+    with _lock:
+        table = _archive_metadata.tables.get(name)
+        if table is None:
+            table = Table(name, _archive_metadata, *[
+                Column(column.name, column.type, primary_key=column.primary_key)
+                for column in model.__table__.columns
+            ])
+    return table
+
+
+def model_in_range(model, range_start, range_end=None):
+    """
+    Entity to read a partitioned model's rows with range_start <= date column
+    < range_end. That is the model itself, or, when the range reaches back into
+    archived years, an alias over live UNION ALL <table>_archive rows with the
+    range applied inside each branch. Build the query against the returned
+    entity's columns instead of the model's.
+    """
+    table_name = model.__tablename__
+    if not range_needs_archive(table_name, range_start):
+        return model
+    column = PARTITIONED_TABLES[table_name]
+
+    def _select(table):
+        conditions = []
+        if range_start is not None:
+            conditions.append(table.c[column] >= range_start)
+        if range_end is not None:
+            conditions.append(table.c[column] < range_end)
+        return select(*table.c).where(and_(*conditions))
+
+    combined = union_all(_select(model.__table__), _select(archive_table_for(model))).subquery(f"{table_name}_all")
+    return aliased(model, combined)
@@ -0,0 +1,119 @@
+"""
+Pickup Display Feed - Cached per-school feed for the school gate screen.
+
+The gate screen polls every few seconds, but the feed only changes when a
+pickup is requested, confirmed, completed or cancelled. Each of those routes
+calls bump_pickup_feed_version(); the feed is rebuilt only when the school's
+version (shared through Redis across workers) or the day has changed.
+"""
+import hashlib
+import json
+import threading
+import time
+from sqlalchemy.orm import joinedload
+from app.models import ParentPickup, School
+from app.config import get_oman_time
+from app.cache import get_redis, mark_redis_down
+
+# Without Redis, other workers can't see our version bumps; rebuild at least this often
+LOCAL_FEED_MAX_AGE_SECONDS = 15
+
+_lock = threading.Lock()
+_local_versions = {}   # school_id -> int (used when Redis is unavailable)
+_feed_cache = {}       # school_id -> dict(version, date, built_at, feed, etag)
+
+
+def _version_key(school_id):
+    return f"pickup_feed_version:{school_id}"
+
+
+def bump_pickup_feed_version(school_id):
+    """Invalidate the cached display feed for a school after a pickup mutation."""
+    if not school_id:
+        return
+    with _lock:
+        _local_versions[school_id] = _local_versions.get(school_id, 0) + 1
+        _feed_cache.pop(school_id, None)
+
+    client = get_redis()
+    if client is not None:
+        try:
+            client.incr(_version_key(school_id))
+        except Exception:
+            mark_redis_down()
+
+
+def _current_version(school_id):
+    """Return (version, shared) where shared is False if only this worker's counter is known."""
+    client = get_redis()
+    if client is not None:
+        try:
+            return (client.get(_version_key(school_id)) or '0'), True
+        except Exception:
+            mark_redis_down()
+    return str(_local_versions.get(school_id, 0)), False
+
+
+def _strip_tz(value):
+    return value.replace(tzinfo=None) if value is not None and value.tzinfo else value
+
+
+def _build_feed(school_id, current_date):
+    pickups = ParentPickup.query.options(
+        joinedload(ParentPickup.student)
+    ).filter(
+        ParentPickup.pickup_date == current_date,
+        ParentPickup.school_id == school_id
+    ).all()
+
+    # Priority order: confirmed first (oldest first), then pending (oldest first), then completed (newest first)
+    now = get_oman_time()
+    confirmed, pending, completed = [], [], []
+    for p in pickups:
+        if p.status == 'confirmed':
+            confirmed.append((_strip_tz(p.confirmation_time) or now, p))
+        elif p.status == 'pending':
+            pending.append((_strip_tz(p.request_time) or now, p))
+        else:
+            completed.append((_strip_tz(p.completed_time) or now, p))
+
+    ordered = (
+        sorted(confirmed, key=lambda item: item[0])
+        + sorted(pending, key=lambda item: item[0])
+        + sorted(completed, key=lambda item: item[0], reverse=True)
+    )
+
+    school = School.query.get(school_id)
+    return {
+        'pickups': [p.to_dict() for _, p in ordered],
+        'school_name': school.name if school else None
+    }
+
+
+def get_pickup_feed(school_id):
+    """
+    Return (feed, etag) for today's pickups of a school, rebuilding only when
+    a pickup mutation happened since the last build.
+    """
+    current_date = get_oman_time().date()
+    version, shared = _current_version(school_id)
+
+    with _lock:
+        entry = _feed_cache.get(school_id)
+    if entry and entry['version'] == version and entry['date'] == current_date:
+        if shared or time.monotonic() - entry['built_at'] < LOCAL_FEED_MAX_AGE_SECONDS:
+            return entry['feed'], entry['etag']
+
+    feed = _build_feed(school_id, current_date)
+    body = json.dumps(feed, sort_keys=True, ensure_ascii=False, default=str)
+    etag = hashlib.sha1(f"{current_date}:{body}".encode('utf-8')).hexdigest()
+
+    with _lock:
+        _feed_cache[school_id] = {
+            'version': version,
+            'date': current_date,
+            'built_at': time.monotonic(),
+            'feed': feed,
+            'etag': etag
+        }
+    return feed, etag
@@ -0,0 +1,109 @@
+"""
+Provider Registry - Per-school SMS and WhatsApp clients reused across requests.
+
+get_ibulk_sms_service built a new IBulkSMSService (and re-read the school) on
+every call, and get_evolution_service kept a per-worker dict that only the
+worker handling a config edit ever cleared. Clients are now kept per process
+under (provider, school_id) together with the schools.provider_config_version
+they were built from:
+
+- get_client() compares that version with the current one and rebuilds the
+  client only when it changed. The current version is one Redis GET
+  (provider_config:<school_id>), or a single-column primary key read when
+  Redis is down or the key has expired.
+- Routes that edit a school's SMS or WhatsApp settings call
+  bump_config_version() after committing. It increments the column and writes
+  the new value to Redis, so every worker rebuilds on its next use.
+- Readers only fill a missing Redis key (SET NX). A reader that loaded the old
+  version just before a bump cannot overwrite the bumped value.
+"""
+import threading
+from sqlalchemy import update
+from app import db
+from app.models import School
+from app.cache import get_redis, mark_redis_down
+
+VERSION_TTL_SECONDS = 60 * 60
+
+_lock = threading.Lock()
+_clients = {}  # (provider, school_id) -> (config_version, client)
+
+
+def _version_key(school_id):
+    return f"provider_config:{school_id}"
+
+
+def _db_version(school_id):
+    version = db.session.query(School.provider_config_version).filter(School.id == school_id).scalar()
+    return version or 0
+
+
+def config_version(school_id):
+    """Current provider config version of the school (0 if it doesn't exist)."""
+    client = get_redis()
+    if client is not None:
+        try:
+            value = client.get(_version_key(school_id))
+            if value is not None:
+                return int(value)
+        except Exception:
+            mark_redis_down()
+            client = None
+
+    version = _db_version(school_id)
+    if client is not None:
+        try:
+            client.set(_version_key(school_id), version, ex=VERSION_TTL_SECONDS, nx=True)
+        except Exception:
+            mark_redis_down()
+    return version
+
+
+def get_client(provider, school_id, factory):
+    """
+    The cached `provider` client for the school, rebuilt with factory(school_id)
+    when the school's provider config version has changed.
+    """
+    if school_id is None:
+        return factory(None)
+    school_id = int(school_id)
+    version = config_version(school_id)
+    key = (provider, school_id)
+
+    with _lock:
+        entry = _clients.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    client = factory(school_id)
+    with _lock:
+        _clients[key] = (version, client)
+    return client
+
+
+def bump_config_version(school_id):
+    """
+    Call after committing a change to a school's SMS or WhatsApp settings.
+    Every worker's cached clients for the school are rebuilt on next use.
+    """
+    school_id = int(school_id)
+    db.session.execute(
+        update(School)
+        .where(School.id == school_id)
+        .values(provider_config_version=School.provider_config_version + 1)
+    )
+    db.session.commit()
+    version = _db_version(school_id)
+
+    with _lock:
+        for key in [k for k in _clients if k[1] == school_id]:
+            del _clients[key]
+
+    client = get_redis()
+    if client is None:
+        return version
+    try:
+        client.set(_version_key(school_id), version, ex=VERSION_TTL_SECONDS)
+    except Exception:
+        mark_redis_down()
+    return version
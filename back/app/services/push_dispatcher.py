@@ -0,0 +1,230 @@
+"""
+Push Dispatcher - Background delivery of Web Push messages.
+
+Callers resolve subscriptions and preferences inside the request (see
+send_push_notification) and hand over plain tuples, so worker threads never
+touch the SQLAlchemy session. Delivery runs on a bounded thread pool with one
+pooled HTTP session per push service origin (FCM, Mozilla, Apple, ...), and
+VAPID headers are signed once per origin and reused until shortly before
+they expire. Subscriptions answered with 404/410 are deactivated in a single
+UPDATE once the whole batch has been sent.
+
+Daily digest pushes (attendance/bus, see notification_digest) are capped at
+one per device per Config.PUSH_DEVICE_MIN_INTERVAL_SECONDS, tracked with
+Redis SET NX EX keys shared by all workers (per-process when Redis is down).
+A capped digest push is skipped: the digest row already holds the events and
+its next update pushes again. Other notifications and urgent digests are
+never capped and don't count against the interval.
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# Concurrent deliveries across all notifications in this process
+PUSH_WORKERS = 8
+# Deliveries waiting for a worker; beyond this new batches are dropped
+PUSH_QUEUE_MAX = 5000
+PUSH_TIMEOUT_SECONDS = 10
+# VAPID JWTs are signed for 12 hours and re-signed an hour before expiry
+VAPID_TOKEN_LIFETIME_SECONDS = 12 * 60 * 60
+VAPID_RENEW_MARGIN_SECONDS = 60 * 60
+
+_executor = ThreadPoolExecutor(max_workers=PUSH_WORKERS, thread_name_prefix='push')
+_slots = threading.BoundedSemaphore(PUSH_QUEUE_MAX)
+_lock = threading.Lock()
+_sessions = {}       # origin -> requests.Session
+_vapid_keys = {}     # private key -> parsed py_vapid key
+_vapid_headers = {}  # (private key, origin, sub) -> (expires_at, headers)
+_device_next_push = {}  # subscription id -> monotonic time of the next allowed push (no Redis)
+
+
+def _origin(endpoint):
+    parsed = urlparse(endpoint)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def _session_for(origin):
+    """Shared keep-alive session for one push service."""
+    with _lock:
+        session = _sessions.get(origin)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.mount(origin, HTTPAdapter(pool_connections=1, pool_maxsize=PUSH_WORKERS))
+            _sessions[origin] = session
+        return session
+
+
+def _vapid_auth_headers(private_key, claim_email, origin):
+    """Authorization header for an origin, signed once and cached until near expiry."""
+    cache_key = (private_key, origin, claim_email)
+    now = time.time()
+    with _lock:
+        cached = _vapid_headers.get(cache_key)
+    if cached and cached[0] - VAPID_RENEW_MARGIN_SECONDS > now:
+        return cached[1]
+
+    from py_vapid import Vapid
+    with _lock:
+        vapid = _vapid_keys.get(private_key)
+    if vapid is None:
+        vapid = Vapid.from_string(private_key=private_key)
+        with _lock:
+            _vapid_keys[private_key] = vapid
+
+    expires_at = int(now) + VAPID_TOKEN_LIFETIME_SECONDS
+    headers = vapid.sign({'sub': claim_email, 'aud': origin, 'exp': expires_at})
+    with _lock:
+        _vapid_headers[cache_key] = (expires_at, headers)
+    return headers
+
+
+def _rate_limited(targets):
+    """The targets whose device has not received a digest push within the minimum interval."""
+    from app.config import Config
+    from app.cache import get_redis, mark_redis_down
+
+    interval = Config.PUSH_DEVICE_MIN_INTERVAL_SECONDS
+    if interval <= 0:
+        return targets
+
+    client = get_redis()
+    if client is not None:
+        try:
+            pipe = client.pipeline(transaction=False)
+            for target in targets:
+                pipe.set(f"push_digest_device:{target[0]}", 1, nx=True, ex=interval)
+            return [target for target, allowed in zip(targets, pipe.execute()) if allowed]
+        except Exception:
+            mark_redis_down()
+
+    now = time.monotonic()
+    allowed = []
+    with _lock:
+        if len(_device_next_push) > 10 * PUSH_QUEUE_MAX:
+            for subscription_id in [k for k, t in _device_next_push.items() if t <= now]:
+                del _device_next_push[subscription_id]
+        for target in targets:
+            if _device_next_push.get(target[0], 0) <= now:
+                _device_next_push[target[0]] = now + interval
+                allowed.append(target)
+    return allowed
+
+
+class _Batch:
+    """Tracks one notification's deliveries so expired subscriptions are flushed together."""
+
+    def __init__(self, app, notification_id, pending):
+        self.app = app
+        self.notification_id = notification_id
+        self.pending = pending
+        self.sent = 0
+        self.expired_ids = []
+        self.lock = threading.Lock()
+
+    def done(self, sent=False, expired_id=None):
+        with self.lock:
+            if sent:
+                self.sent += 1
+            if expired_id is not None:
+                self.expired_ids.append(expired_id)
+            self.pending -= 1
+            finished = self.pending == 0
+        if finished:
+            self.finish()
+
+    def finish(self):
+        print("Push: notification id=%s delivered to %s subscription(s), %s expired" % (
+            self.notification_id, self.sent, len(self.expired_ids)))
+        if self.expired_ids:
+            deactivate_subscriptions(self.app, self.expired_ids)
+
+
+def deactivate_subscriptions(app, subscription_ids):
+    """Mark subscriptions rejected by the push service (404/410) as inactive."""
+    from app import db
+    from app.models import PushSubscription
+    with app.app_context():
+        try:
+            PushSubscription.query.filter(PushSubscription.id.in_(subscription_ids)).update(
+                {PushSubscription.is_active: False}, synchronize_session=False
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error deactivating expired push subscriptions: {str(e)}")
+        finally:
+            db.session.remove()
+
+
+def _deliver(batch, target, data, private_key, claim_email):
+    subscription_id, user_id, endpoint, p256dh_key, auth_key = target
+    sent = False
+    expired_id = None
+    try:
+        from pywebpush import WebPusher
+        origin = _origin(endpoint)
+        response = WebPusher(
+            {"endpoint": endpoint, "keys": {"p256dh": p256dh_key, "auth": auth_key}},
+            requests_session=_session_for(origin)
+        ).send(
+            data,
+            headers=dict(_vapid_auth_headers(private_key, claim_email, origin)),
+            ttl=0,
+            timeout=PUSH_TIMEOUT_SECONDS
+        )
+        if response.status_code in (404, 410):
+            print("⚠️ Subscription expired for user %s (HTTP %s), marking inactive" % (user_id, response.status_code))
+            expired_id = subscription_id
+        elif response.status_code > 202:
+            print("❌ Push failed user %s: HTTP %s %s" % (user_id, response.status_code, (response.text or "")[:200]))
+        else:
+            sent = True
+    except Exception as e:
+        print("❌ Push error user %s: %s" % (user_id, str(e)))
+    finally:
+        _slots.release()
+        batch.done(sent=sent, expired_id=expired_id)
+
+
+def dispatch_push(app, notification_id, payload, targets, private_key, claim_email, digest=False):
+    """
+    Queue one payload for delivery to many subscriptions.
+
+    targets: iterable of (subscription_id, user_id, endpoint, p256dh_key, auth_key).
+    digest: the payload is a daily digest update, subject to the per-device cap.
+    Returns the number of deliveries queued.
+    """
+    targets = list(targets)
+    if targets and digest and payload.get('priority') != 'urgent':
+        capped = _rate_limited(targets)
+        if len(capped) < len(targets):
+            print("Push: %s device(s) skipped for digest id=%s (per-device rate cap)" % (
+                len(targets) - len(capped), notification_id))
+        targets = capped
+    if not targets:
+        return 0
+
+    data = json.dumps(payload)
+    batch = _Batch(app, notification_id, len(targets))
+    queued = 0
+    for target in targets:
+        if not _slots.acquire(blocking=False):
+            print("⚠️ Push queue full, dropping %s delivery(ies) for notification id=%s" % (
+                len(targets) - queued, notification_id))
+            break
+        try:
+            _executor.submit(_deliver, batch, target, data, private_key, claim_email)
+        except RuntimeError:
+            # Executor already shut down (interpreter exiting)
+            _slots.release()
+            break
+        queued += 1
+
+    # Settle the deliveries that will never run so the batch can finish
+    for _ in range(len(targets) - queued):
+        batch.done()
+    return queued
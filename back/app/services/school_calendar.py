@@ -0,0 +1,201 @@
+"""
+School Calendar - Holiday-aware working-day counts per school.
+
+A school works Sunday to Thursday, minus its 'holiday' entries, and (when it
+has 'term' entries) only inside a term. For each school the calendar is turned
+into a prefix-sum array over a span of days around the current academic year,
+so "working days between A and B" is two array lookups. Calendars are cached
+in process and rebuilt after CALENDAR_TTL_SECONDS, or when the school's
+calendar generation in Redis (school_calendar_gen:<school_id>) has moved on:
+invalidate_school_calendar() increments it after an import or delete, so every
+worker rebuilds on its next read.
+"""
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from app.models import SchoolCalendar
+from app.cache import get_redis, mark_redis_down
+from app.services.partitioning import current_academic_year_start
+
+# Friday and Saturday (date.weekday(): Monday = 0)
+WEEKEND_DAYS = (4, 5)
+
+ENTRY_TYPES = ('holiday', 'term')
+
+# Days covered by the prefix array around the current academic year start
+SPAN_DAYS_BEFORE = 2 * 366
+SPAN_DAYS_AFTER = 2 * 366
+
+CALENDAR_TTL_SECONDS = 10 * 60
+
+_lock = threading.Lock()
+_calendars = {}          # school_id -> (expires_at, generation, WorkingDayCalendar)
+_local_generations = {}  # school_id -> generation, used while Redis is down
+
+
+def count_weekdays(start_date, end_date):
+    """Sunday-Thursday days in [start_date, end_date], ignoring holidays."""
+    if start_date > end_date:
+        return 0
+    days = (end_date - start_date).days + 1
+    full_weeks, remainder = divmod(days, 7)
+    working = full_weeks * (7 - len(WEEKEND_DAYS))
+    weekday = start_date.weekday()
+    for offset in range(remainder):
+        if (weekday + offset) % 7 not in WEEKEND_DAYS:
+            working += 1
+    return working
+
+
+def count_weekdays_by_weekday(start_date, end_date):
+    """Like count_weekdays, split by weekday: a length-7 array indexed by date.weekday()."""
+    counts = np.zeros(7, dtype=np.int32)
+    if start_date > end_date:
+        return counts
+    full_weeks, remainder = divmod((end_date - start_date).days + 1, 7)
+    counts += full_weeks
+    for offset in range(remainder):
+        counts[(start_date.weekday() + offset) % 7] += 1
+    counts[list(WEEKEND_DAYS)] = 0
+    return counts
+
+
+class WorkingDayCalendar:
+    """Prefix sums of working days from `first_day`; prefix[i] = working days before first_day + i."""
+
+    def __init__(self, first_day, working):
+        self.first_day = first_day
+        self.last_day = first_day + timedelta(days=len(working) - 1)
+        self.prefix = np.zeros(len(working) + 1, dtype=np.int32)
+        np.cumsum(working, out=self.prefix[1:])
+        # The same prefix sums split by weekday (row = date.weekday())
+        weekdays = (np.arange(len(working)) + first_day.weekday()) % 7
+        self.weekday_prefix = np.zeros((7, len(working) + 1), dtype=np.int32)
+        for weekday in range(7):
+            np.cumsum(working * (weekdays == weekday), out=self.weekday_prefix[weekday, 1:])
+
+    def _index(self, day):
+        return (day - self.first_day).days
+
+    def working_days(self, start_date, end_date):
+        if start_date > end_date:
+            return 0
+        if start_date < self.first_day or end_date > self.last_day:
+            # Outside the span: count the covered part exactly, the rest by weekday
+            inner_start = max(start_date, self.first_day)
+            inner_end = min(end_date, self.last_day)
+            total = self.working_days(inner_start, inner_end) if inner_start <= inner_end else 0
+            if start_date < self.first_day:
+                total += count_weekdays(start_date, min(end_date, self.first_day - timedelta(days=1)))
+            if end_date > self.last_day:
+                total += count_weekdays(max(start_date, self.last_day + timedelta(days=1)), end_date)
+            return total
+        return int(self.prefix[self._index(end_date) + 1] - self.prefix[self._index(start_date)])
+
+    def weekday_counts(self, start_date, end_date):
+        """Working days in [start_date, end_date] per weekday, as a length-7 array (index = date.weekday())."""
+        if start_date > end_date:
+            return np.zeros(7, dtype=np.int32)
+        if start_date < self.first_day or end_date > self.last_day:
+            inner_start = max(start_date, self.first_day)
+            inner_end = min(end_date, self.last_day)
+            counts = self.weekday_counts(inner_start, inner_end) if inner_start <= inner_end else np.zeros(7, dtype=np.int32)
+            if start_date < self.first_day:
+                counts = counts + count_weekdays_by_weekday(start_date, min(end_date, self.first_day - timedelta(days=1)))
+            if end_date > self.last_day:
+                counts = counts + count_weekdays_by_weekday(max(start_date, self.last_day + timedelta(days=1)), end_date)
+            return counts
+        return self.weekday_prefix[:, self._index(end_date) + 1] - self.weekday_prefix[:, self._index(start_date)]
+
+    def is_working_day(self, day):
+        return self.working_days(day, day) == 1
+
+
+def build_calendar(entries, anchor=None):
+    """Build a WorkingDayCalendar from SchoolCalendar rows (or objects with the same fields)."""
+    anchor = anchor or current_academic_year_start()
+    first_day = anchor - timedelta(days=SPAN_DAYS_BEFORE)
+    last_day = anchor + timedelta(days=SPAN_DAYS_AFTER)
+    for entry in entries:
+        first_day = min(first_day, entry.start_date)
+        last_day = max(last_day, entry.end_date)
+
+    ordinals = np.arange(first_day.toordinal(), last_day.toordinal() + 1)
+    # date(1, 1, 1) is a Monday, so weekday() == (ordinal - 1) % 7
+    working = ~np.isin((ordinals - 1) % 7, WEEKEND_DAYS)
+
+    terms = [entry for entry in entries if entry.entry_type == 'term']
+    if terms:
+        # Between the first and last term, only term days are working days
+        in_term = np.zeros(len(ordinals), dtype=bool)
+        for term in terms:
+            in_term[term.start_date.toordinal() - ordinals[0]:term.end_date.toordinal() - ordinals[0] + 1] = True
+        term_start = min(term.start_date for term in terms).toordinal() - ordinals[0]
+        term_end = max(term.end_date for term in terms).toordinal() - ordinals[0] + 1
+        working[term_start:term_end] &= in_term[term_start:term_end]
+
+    for entry in entries:
+        if entry.entry_type == 'holiday':
+            working[entry.start_date.toordinal() - ordinals[0]:entry.end_date.toordinal() - ordinals[0] + 1] = False
+
+    return WorkingDayCalendar(first_day, working.astype(np.int32))
+
+
+def _generation_key(school_id):
+    return f"school_calendar_gen:{school_id}"
+
+
+def _generation(school_id):
+    client = get_redis()
+    if client is not None:
+        try:
+            return int(client.get(_generation_key(school_id)) or 0)
+        except Exception:
+            mark_redis_down()
+    with _lock:
+        return _local_generations.get(school_id, 0)
+
+
+def get_school_calendar(school_id):
+    """The cached WorkingDayCalendar for a school (None = weekdays only)."""
+    now = time.monotonic()
+    generation = _generation(school_id) if school_id else 0
+    with _lock:
+        cached = _calendars.get(school_id)
+    if cached and cached[0] > now and cached[1] == generation:
+        return cached[2]
+
+    entries = SchoolCalendar.query.filter_by(school_id=school_id).all() if school_id else []
+    calendar = build_calendar(entries)
+    with _lock:
+        _calendars[school_id] = (now + CALENDAR_TTL_SECONDS, generation, calendar)
+    return calendar
+
+
+def invalidate_school_calendar(school_id):
+    """Make every worker rebuild the school's calendar on its next read."""
+    with _lock:
+        _calendars.pop(school_id, None)
+        _local_generations[school_id] = _local_generations.get(school_id, 0) + 1
+    client = get_redis()
+    if client is not None:
+        try:
+            client.incr(_generation_key(school_id))
+        except Exception:
+            mark_redis_down()
+
+
+def working_days_between(school_id, start_date, end_date):
+    """Working days for the school in [start_date, end_date], inclusive."""
+    return get_school_calendar(school_id).working_days(start_date, end_date)
+
+
+def school_weeks(working_days):
+    """Working days expressed as full school weeks (Sunday-Thursday)."""
+    return working_days / (7 - len(WEEKEND_DAYS))
+
+
+def expected_sessions(weekly_classes, working_days):
+    """Class sessions a teacher with `weekly_classes` per week should record over `working_days`."""
+    return int(round((weekly_classes or 0) * school_weeks(working_days)))
@@ -0,0 +1,217 @@
+"""
+Student Summaries - Nightly term-to-date attendance totals and risk per student.
+
+`flask build-student-summaries` rebuilds student_attendance_summaries for every
+school through yesterday, one school per worker process. Endpoints read the
+stored row and add today's rows from student_day_attendance on top, so a
+student's statistics never scan their whole history at request time.
+
+The term is the current academic year (see app/services/partitioning.py).
+"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+from sqlalchemy import func, select
+from app import db
+from app.models import Class, StudentDayAttendance, StudentAttendanceSummary
+from app.config import get_oman_time
+from app.services.absence_analytics import load_absence_matrix, compute_absence_metrics, risk_tier
+from app.services.partitioning import current_academic_year_start
+
+_COUNT_FIELDS = ('total_records', 'present_count', 'absent_count', 'excused_count', 'late_count')
+
+
+def _period_counts(filters):
+    """{student_id: {...counts, total_days, absent_days, last_absence_date, class_id}} for day rows matching filters."""
+    day = StudentDayAttendance
+    any_status = day.present_mask.op('|')(day.absent_mask).op('|')(day.excused_mask).op('|')(day.late_mask)
+    is_absent = day.absent_mask.op('|')(day.excused_mask) != 0
+    rows = db.session.query(
+        day.student_id,
+        func.sum(func.bit_count(any_status)),
+        func.sum(func.bit_count(day.present_mask)),
+        func.sum(func.bit_count(day.absent_mask)),
+        func.sum(func.bit_count(day.excused_mask)),
+        func.sum(func.bit_count(day.late_mask)),
+        func.count(func.distinct(day.date)),
+        func.count(func.distinct(db.case((is_absent, day.date), else_=None))),
+        func.max(db.case((is_absent, day.date), else_=None)),
+        func.max(day.class_id)
+    ).filter(*filters).group_by(day.student_id).all()
+
+    counts = {}
+    for row in rows:
+        entry = {field: int(value or 0) for field, value in zip(_COUNT_FIELDS, row[1:6])}
+        entry['total_days'] = int(row[6] or 0)
+        entry['absent_days'] = int(row[7] or 0)
+        entry['last_absence_date'] = row[8]
+        entry['class_id'] = row[9]
+        counts[row[0]] = entry
+    return counts
+
+
+def build_school_summaries(school_id, as_of=None):
+    """Recompute summary rows for one school through as_of (default: yesterday). Returns rows written."""
+    as_of = as_of or (get_oman_time().date() - timedelta(days=1))
+    term_start = current_academic_year_start()
+    class_ids = [c[0] for c in db.session.query(Class.id).filter(Class.school_id == school_id).all()]
+
+    StudentAttendanceSummary.query.filter_by(school_id=school_id).delete(synchronize_session=False)
+    if not class_ids or as_of < term_start:
+        db.session.commit()
+        return 0
+
+    counts = _period_counts([
+        StudentDayAttendance.class_id.in_(class_ids),
+        StudentDayAttendance.date >= term_start,
+        StudentDayAttendance.date <= as_of
+    ])
+
+    matrix = load_absence_matrix(class_ids, term_start, as_of)
+    metrics = compute_absence_metrics(matrix.absent)
+    rows_by_student = {int(sid): row for row, sid in enumerate(matrix.student_ids)}
+
+    now = get_oman_time()
+    summaries = []
+    for student_id, entry in counts.items():
+        row = rows_by_student.get(student_id)
+        score = float(metrics['risk_score'][row]) if row is not None else 0.0
+        summaries.append({
+            'student_id': student_id,
+            'school_id': school_id,
+            'class_id': entry['class_id'],
+            'term_start': term_start,
+            'as_of_date': as_of,
+            'total_records': entry['total_records'],
+            'total_days': entry['total_days'],
+            'present_count': entry['present_count'],
+            'absent_count': entry['absent_count'],
+            'excused_count': entry['excused_count'],
+            'late_count': entry['late_count'],
+            'absent_days': entry['absent_days'],
+            'last_absence_date': entry['last_absence_date'],
+            'current_streak': int(metrics['current_streak'][row]) if row is not None else 0,
+            'longest_streak': int(metrics['longest_streak'][row]) if row is not None else 0,
+            'risk_score': score,
+            'risk_tier': risk_tier(score),
+            'computed_at': now
+        })
+
+    if summaries:
+        db.session.execute(StudentAttendanceSummary.__table__.insert(), summaries)
+    db.session.commit()
+    return len(summaries)
+
+
+# ============================================================================
+# Process pool (one school per task)
+# ============================================================================
+
+_worker_app = None
+
+
+def _init_worker():
+    # Each process gets its own app and connection pool; nothing is inherited from the parent
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app()
+
+
+def _build_in_worker(school_id, as_of_ordinal):
+    with _worker_app.app_context():
+        try:
+            return school_id, build_school_summaries(school_id, date.fromordinal(as_of_ordinal)), None
+        except Exception as e:
+            db.session.rollback()
+            return school_id, 0, str(e)
+        finally:
+            db.session.remove()
+
+
+def build_all_summaries(school_ids, as_of=None, workers=None):
+    """
+    Rebuild summaries for the given schools, one school per worker process.
+    Returns [(school_id, rows written, error or None)].
+    """
+    as_of = as_of or (get_oman_time().date() - timedelta(days=1))
+    workers = workers or min(len(school_ids), multiprocessing.cpu_count()) or 1
+
+    if workers == 1:
+        results = []
+        for school_id in school_ids:
+            try:
+                results.append((school_id, build_school_summaries(school_id, as_of), None))
+            except Exception as e:
+                db.session.rollback()
+                results.append((school_id, 0, str(e)))
+        return results
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        futures = [pool.submit(_build_in_worker, school_id, as_of.toordinal()) for school_id in school_ids]
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
+
+
+# ============================================================================
+# Reads: stored summary + today's live delta
+# ============================================================================
+
+def get_student_summary(student_id, school_id):
+    """
+    Term-to-date totals for a student in one school's classes: the nightly row
+    plus any day rows after its as_of_date (normally just today). Without a
+    stored row the whole term is read live. The stored risk score is not
+    adjusted until the next run.
+    """
+    today = get_oman_time().date()
+    term_start = current_academic_year_start()
+    stored = db.session.get(StudentAttendanceSummary, (school_id, student_id))
+    if stored and stored.term_start != term_start:
+        stored = None  # built for last year
+
+    since = stored.as_of_date + timedelta(days=1) if stored else term_start
+    school_classes = StudentDayAttendance.class_id.in_(select(Class.id).where(Class.school_id == school_id))
+    live = _period_counts([
+        StudentDayAttendance.student_id == student_id,
+        school_classes,
+        StudentDayAttendance.date >= since,
+        StudentDayAttendance.date <= today
+    ]).get(student_id)
+
+    summary = stored.to_dict() if stored else {
+        'student_id': student_id, 'school_id': school_id, 'term_start': term_start.isoformat(), 'as_of_date': None,
+        'total_records': 0, 'total_days': 0, 'present_count': 0, 'absent_count': 0,
+        'excused_count': 0, 'late_count': 0, 'absent_days': 0, 'last_absence_date': None,
+        'current_streak': 0, 'longest_streak': 0, 'risk_score': 0.0, 'risk_tier': 'low'
+    }
+    if not live:
+        return summary
+
+    for field in _COUNT_FIELDS + ('total_days', 'absent_days'):
+        summary[field] += live[field]
+    if live['last_absence_date']:
+        summary['last_absence_date'] = live['last_absence_date'].isoformat()
+
+    # Streaks: continue the stored streak through the days after the nightly run
+    day = StudentDayAttendance
+    live_days = db.session.query(
+        day.date,
+        func.max((day.absent_mask.op('|')(day.excused_mask)) != 0)
+    ).filter(
+        day.student_id == student_id,
+        school_classes,
+        day.date >= since,
+        day.date <= today
+    ).group_by(day.date).order_by(day.date).all()
+
+    current = summary['current_streak']
+    longest = summary['longest_streak']
+    for _, is_absent in live_days:
+        current = current + 1 if is_absent else 0
+        longest = max(longest, current)
+    summary['current_streak'] = current
+    summary['longest_streak'] = longest
+    return summary
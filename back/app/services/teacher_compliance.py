@@ -0,0 +1,160 @@
+"""
+Teacher Compliance - Per-teacher attendance-taking totals for a date range.
+
+/teacherReport, /teacher_master_report and /teacher_attendance_this_week all
+need, for every teacher of a school, the days on which they recorded
+attendance, the distinct class sessions (class, period, day) they recorded and
+the classes they teach, and how many recorded sessions fall on their timetable
+slots (expected_sessions). get_teacher_compliance() computes all of it with one
+GROUP BY teacher_id over the (teacher_id, date, ...) index plus one query for
+class names, and caches the result per (school, range).
+
+Taking attendance calls invalidate_teacher_compliance(school_id), which moves
+the school to a new cache generation so reports never lag behind a write.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, select, case, and_
+from app import db
+from app.models import Attendance, Class, ExpectedSession, User
+from app.config import get_oman_time
+from app.cache import get_redis, mark_redis_down
+from app.services.partitioning import model_in_range
+
+# Ranges that include today change as teachers take attendance; older ranges rarely do
+CURRENT_RANGE_TTL_SECONDS = 5 * 60
+PAST_RANGE_TTL_SECONDS = 60 * 60
+
+_lock = threading.Lock()
+_local_cache = {}        # cache key -> (expires_at, value)
+_local_generations = {}  # school key -> generation
+
+
+def _school_key(school_id):
+    return str(school_id) if school_id else 'all'
+
+
+def _generation(client, school_id):
+    key = _school_key(school_id)
+    if client is not None:
+        try:
+            return int(client.get(f"teacher_compliance_gen:{key}") or 0)
+        except Exception:
+            mark_redis_down()
+    with _lock:
+        return _local_generations.get(key, 0)
+
+
+def invalidate_teacher_compliance(school_id):
+    """Drop cached report totals for a school (and the all-schools view)."""
+    client = get_redis()
+    for key in (_school_key(school_id), 'all'):
+        with _lock:
+            _local_generations[key] = _local_generations.get(key, 0) + 1
+        if client is not None:
+            try:
+                client.incr(f"teacher_compliance_gen:{key}")
+            except Exception:
+                mark_redis_down()
+                client = None
+
+
+def _compute(school_id, start_date, end_date):
+    range_start = datetime.combine(start_date, datetime.min.time())
+    range_end = datetime.combine(end_date, datetime.min.time()) + timedelta(days=1)
+
+    attendance_rows = model_in_range(Attendance, range_start, range_end)
+    teacher_filter = []
+    class_filter = []
+    if school_id:
+        school_users = select(User.id).where(User.school_id == school_id)
+        teacher_filter.append(attendance_rows.teacher_id.in_(school_users))
+        class_filter.append(Class.teacher_id.in_(school_users))
+
+    # A recorded (day, period) matches the timetable when the teacher has a slot then
+    timetable_slot = and_(
+        ExpectedSession.teacher_id == attendance_rows.teacher_id,
+        ExpectedSession.weekday == func.weekday(attendance_rows.date),
+        ExpectedSession.period == attendance_rows.class_time_num
+    )
+    rows = db.session.query(
+        attendance_rows.teacher_id,
+        func.count(func.distinct(func.date(attendance_rows.date))),
+        func.count(func.distinct(
+            func.concat(attendance_rows.class_id, '-', attendance_rows.class_time_num, '-', func.date(attendance_rows.date))
+        )),
+        func.count(func.distinct(case(
+            (ExpectedSession.id.isnot(None), func.concat(func.date(attendance_rows.date), '-', attendance_rows.class_time_num)),
+            else_=None
+        )))
+    ).outerjoin(ExpectedSession, timetable_slot).filter(
+        attendance_rows.date >= range_start,
+        attendance_rows.date < range_end,
+        *teacher_filter
+    ).group_by(attendance_rows.teacher_id).all()
+
+    stats = {}
+    for teacher_id, recorded_days, recorded_sessions, matched_sessions in rows:
+        stats[teacher_id] = {
+            'recorded_days': int(recorded_days or 0),
+            'recorded_sessions': int(recorded_sessions or 0),
+            'matched_sessions': int(matched_sessions or 0),
+            'classes': []
+        }
+
+    classes = db.session.query(Class.teacher_id, Class.name).filter(
+        Class.teacher_id.isnot(None), *class_filter
+    ).order_by(Class.id).all()
+    for teacher_id, class_name in classes:
+        entry = stats.setdefault(teacher_id, {'recorded_days': 0, 'recorded_sessions': 0, 'matched_sessions': 0, 'classes': []})
+        entry['classes'].append(class_name)
+    return stats
+
+
+def get_teacher_compliance(school_id, start_date, end_date):
+    """
+    {teacher_id: {'recorded_days', 'recorded_sessions', 'matched_sessions',
+    'classes'}} for every teacher of the school (school_id None = all schools)
+    over the inclusive date range. matched_sessions are recorded (day, period)
+    pairs that fall on one of the teacher's timetable slots. Teachers with no
+    records or classes are absent from the dict.
+    """
+    client = get_redis()
+    cache_key = (
+        f"teacher_compliance:{_school_key(school_id)}:{_generation(client, school_id)}:"
+        f"{start_date.isoformat()}:{end_date.isoformat()}"
+    )
+
+    if client is not None:
+        try:
+            cached = client.get(cache_key)
+            if cached is not None:
+                return {int(k): v for k, v in json.loads(cached).items()}
+        except Exception:
+            mark_redis_down()
+            client = None
+
+    now = time.monotonic()
+    if client is None:
+        with _lock:
+            entry = _local_cache.get(cache_key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    stats = _compute(school_id, start_date, end_date)
+    ttl = CURRENT_RANGE_TTL_SECONDS if end_date >= get_oman_time().date() else PAST_RANGE_TTL_SECONDS
+
+    if client is not None:
+        try:
+            client.set(cache_key, json.dumps(stats), ex=ttl)
+        except Exception:
+            mark_redis_down()
+    else:
+        with _lock:
+            # Entries from old generations are dropped as they expire
+            for key in [k for k, (expires_at, _) in _local_cache.items() if expires_at <= now]:
+                del _local_cache[key]
+            _local_cache[cache_key] = (now + ttl, stats)
+    return stats
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark the columnar attendance snapshot (app/services/attendance_snapshot.py)
+on a synthetic school: 2,000 students in 60 classes over a 180-day term.
+
+Usage: python benchmark_attendance_snapshot.py [students] [days]
+"""
+import sys
+import time
+from datetime import date, timedelta
+import numpy as np
+
+from app.services.attendance_snapshot import AttendanceSnapshot, STATUSES
+from app.services.absence_analytics import compute_absence_metrics
+
+
+def build_snapshot(students, days):
+    rng = np.random.default_rng(42)
+    origin = date(2025, 8, 24)
+    student_ids = np.repeat(np.arange(1, students + 1, dtype=np.int32), days)
+    class_ids = ((student_ids - 1) % 60 + 1).astype(np.int32)
+    day_index = np.tile(np.arange(days, dtype=np.int16), students)
+    rows = len(day_index)
+
+    all_periods = np.int16((1 << 8) - 2)  # periods 1-7
+    absent = np.where(rng.random(rows) < 0.05, all_periods, 0).astype(np.int16)
+    late = np.where(rng.random(rows) < 0.03, np.int16(1 << 1), 0).astype(np.int16)
+    excused = np.where(rng.random(rows) < 0.02, all_periods, 0).astype(np.int16)
+    present = (all_periods & ~(absent | excused)).astype(np.int16)
+    masks = dict(zip(STATUSES, (absent, late, excused, present)))
+    return origin, AttendanceSnapshot(1, origin, student_ids, class_ids, day_index, masks)
+
+
+def timed(label, fn, runs=20):
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = fn()
+    print(f"  {label}: {(time.perf_counter() - started) * 1000 / runs:.2f} ms")
+    return result
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 180
+
+    origin, snapshot = build_snapshot(students, days)
+    end = origin + timedelta(days=days - 1)
+    print(f"{students} students x {days} days: {len(snapshot)} rows, {snapshot.nbytes / 1024 / 1024:.1f} MB")
+
+    day_ranges = [(origin + timedelta(days=i), origin + timedelta(days=i)) for i in range(days)]
+    week_ranges = [(origin + timedelta(days=i), origin + timedelta(days=i + 4)) for i in range(0, days, 7)]
+    timed("distinct absent students per day, full term", lambda: snapshot.distinct_students('absent', day_ranges))
+    timed("distinct absent students per week, full term", lambda: snapshot.distinct_students('absent', week_ranges))
+    timed("period totals, full term", lambda: snapshot.period_totals(origin, end))
+    timed("absence matrix + risk metrics, full term",
+          lambda: compute_absence_metrics(snapshot.absence_matrix(range(1, 61), origin, end).absent))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,16 @@
 """
 Evolution API WhatsApp Service
 Each school connects their own WhatsApp number via a dedicated Evolution API instance.
+Calls go through the shared HTTP client with a circuit breaker per school instance.
 """
 import requests
 import logging
 import time
+from app.services import http_client
+from app.services.provider_registry import get_client, bump_config_version
 
 logger = logging.getLogger(__name__)
 
-_service_cache = {}
-
 
 class EvolutionWhatsAppService:
     """
@@ -43,6 +44,10 @@ class EvolutionWhatsAppService:
     def is_configured(self):
         return bool(self.api_url and self.api_key and self.instance_name)
 
+    @property
+    def _breaker_key(self):
+        return f"evolution:{self.school_id}"
+
     def _headers(self):
         return {
             "apikey": self.api_key,
@@ -58,7 +63,7 @@ class EvolutionWhatsAppService:
             return {"success": False, "state": "not_configured", "error": "Evolution API not configured"}
         try:
             url = f"{self.api_url}/instance/connectionState/{self.instance_name}"
-            resp = requests.get(url, headers=self._headers(), timeout=15)
+            resp = http_client.get(url, headers=self._headers(), timeout=15, breaker_key=self._breaker_key)
             if resp.status_code == 200:
                 data = resp.json()
                 state = data.get("instance", {}).get("state", "unknown")
@@ -78,7 +83,7 @@ class EvolutionWhatsAppService:
             return {"success": False, "error": "Evolution API not configured"}
         try:
             url = f"{self.api_url}/instance/connect/{self.instance_name}"
-            resp = requests.get(url, headers=self._headers(), timeout=20)
+            resp = http_client.get(url, headers=self._headers(), timeout=20, breaker_key=self._breaker_key)
             if resp.status_code == 200:
                 data = resp.json()
                 return {"success": True, "data": data}
@@ -102,7 +107,7 @@ class EvolutionWhatsAppService:
                 "number": phone_number,
                 "text": message,
             }
-            resp = requests.post(url, json=payload, headers=self._headers(), timeout=30)
+            resp = http_client.post(url, json=payload, headers=self._headers(), timeout=30, breaker_key=self._breaker_key)
             if resp.status_code in [200, 201]:
                 return {"success": True, "data": resp.json()}
             return {"success": False, "error": f"HTTP {resp.status_code}: {resp.text[:300]}"}
@@ -120,7 +125,16 @@ class EvolutionWhatsAppService:
         Returns: { sent, failed, errors }
         """
         results = {"sent": 0, "failed": 0, "total": len(recipients), "errors": []}
-        for recipient in recipients:
+        for index, recipient in enumerate(recipients):
+            if http_client.circuit_open(self._breaker_key):
+                # Instance is down: fail the rest now instead of waiting out each delay
+                for skipped in recipients[index:]:
+                    results["failed"] += 1
+                    results["errors"].append({
+                        "phone": (skipped.get("phone_number") or "").strip(),
+                        "error": "Evolution API server unreachable"
+                    })
+                break
             phone = (recipient.get("phone_number") or "").strip()
             if not phone:
                 results["failed"] += 1
@@ -166,7 +180,7 @@ class EvolutionWhatsAppService:
                 "integration": "WHATSAPP-BAILEYS",
                 "qrcode": False,
             }
-            resp = requests.post(url, json=payload, headers=self._headers(), timeout=20)
+            resp = http_client.post(url, json=payload, headers=self._headers(), timeout=20, breaker_key=self._breaker_key)
             if resp.status_code in [200, 201]:
                 return {"success": True, "data": resp.json()}
             return {"success": False, "error": f"HTTP {resp.status_code}: {resp.text[:300]}"}
@@ -175,14 +189,11 @@ class EvolutionWhatsAppService:
 
 
 def get_evolution_service(school_id) -> EvolutionWhatsAppService:
-    """Return a cached service instance for the given school."""
-    global _service_cache
-    if school_id not in _service_cache:
-        _service_cache[school_id] = EvolutionWhatsAppService(school_id)
-    return _service_cache[school_id]
+    """Return the school's service, shared across requests until its provider config version changes."""
+    return get_client('evolution', school_id, EvolutionWhatsAppService)
 
 
 def invalidate_service_cache(school_id):
-    """Call this after updating a school's Evolution API config."""
-    global _service_cache
-    _service_cache.pop(school_id, None)
+    """Call this after committing a change to a school's Evolution API config (all workers rebuild)."""
+    bump_config_version(school_id)
+    http_client.reset_breaker(f"evolution:{school_id}")
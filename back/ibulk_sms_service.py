@@ -14,12 +14,24 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Optional, Tuple
 from app.models import School, Student, Attendance, Class, Subject
 from app import db
-from app.config import get_oman_time
+from app.config import Config, get_oman_time
+from app.services import http_client
+from app.services.provider_registry import get_client
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Balance request payload shapes (credential field names), in probe order.
+# The one that works is stored in schools.ibulk_balance_payload.
+BALANCE_PAYLOAD_KEYS = {
+    'UserID': ('UserID', 'Password'),
+    'UserName': ('UserName', 'Password'),
+    'username': ('username', 'password'),
+}
+# Stored in ibulk_balance_payload when no candidate URL has a balance service
+BALANCE_UNAVAILABLE = 'unavailable'
+
 class IBulkSMSService:
     """
     iBulk SMS service integration for attendance notifications
@@ -33,7 +45,7 @@ class IBulkSMSService:
             school_id (int): School ID to get configuration from
         """
         self.school_id = school_id
-        self.school = None
+        self.school_name = None
         self.api_url = None
         self.username = None
         self.password = None
@@ -42,34 +54,56 @@ class IBulkSMSService:
         if school_id:
             self.load_school_config()
     
+    @property
+    def school(self) -> Optional[School]:
+        """
+        The school row in the current session. Only plain configuration is kept
+        on the service, so one instance can be reused across requests (see
+        get_ibulk_sms_service).
+        """
+        if not self.school_id:
+            return None
+        return db.session.get(School, self.school_id)
+    
     def load_school_config(self):
         """Load SMS configuration from school settings"""
         try:
-            self.school = School.query.get(self.school_id)
-            if not self.school:
+            school = self.school
+            if not school:
                 logger.error(f"School with ID {self.school_id} not found")
                 return False
             
             # SMS is always enabled - no need to check ibulk_sms_enabled
-            self.api_url = self.school.ibulk_api_url or 'https://ismartsms.net/RestApi/api/SMS/PostSMS'
-            self.username = self.school.ibulk_username
-            self.password = self.school.ibulk_password
-            self.sender_id = self.school.ibulk_sender_id
+            self.school_name = school.name
+            self.api_url = school.ibulk_api_url or 'https://ismartsms.net/RestApi/api/SMS/PostSMS'
+            self.username = school.ibulk_username
+            self.password = school.ibulk_password
+            self.sender_id = school.ibulk_sender_id
             
             if not all([self.username, self.password]):
-                logger.error(f"Missing SMS credentials for school {self.school.name}")
+                logger.error(f"Missing SMS credentials for school {school.name}")
                 return False
             
-            logger.info(f"SMS configuration loaded for school: {self.school.name}")
+            logger.info(f"SMS configuration loaded for school: {school.name}")
             return True
             
         except Exception as e:
             logger.error(f"Error loading school SMS configuration: {str(e)}")
             return False
     
-    def check_balance(self) -> Dict:
+    def check_balance(self, force: bool = False) -> Dict:
         """
-        Check SMS account balance
+        Get the SMS account balance
+        
+        For a saved school the balance stored in ibulk_current_balance is returned
+        while it is younger than Config.SMS_BALANCE_TTL_SECONDS (the
+        `flask refresh-sms-balances` job keeps it fresh). Otherwise one request
+        is made to the balance endpoint discovered earlier for this school, and
+        only if there is none (or it stopped working) are all candidate
+        URL/payload pairs probed again.
+        
+        Args:
+            force (bool): Ignore the stored balance and query the provider
         
         Returns:
             Dict: Balance information
@@ -82,177 +116,38 @@ class IBulkSMSService:
                     'balance': 0.0
                 }
             
-            # Generate possible balance URLs based on API URL pattern
-            possible_balance_urls = []
-            
-            if self.api_url:
-                # Pattern 1: RestApi pattern (https://ismartsms.net/RestApi/api/SMS/PostSMS)
-                if '/RestApi/' in self.api_url and '/SMS/' in self.api_url:
-                    base_url = self.api_url.rsplit('/SMS/', 1)[0] + '/SMS'
-                    # Try different balance endpoint patterns
-                    possible_balance_urls.extend([
-                        f"{base_url}/GetBalance",
-                        f"{base_url}/Balance",
-                        f"{base_url}/CheckBalance",
-                        f"{base_url}/GetAccountBalance",
-                        f"{base_url}/AccountBalance",
-                        f"{base_url}/PostBalance",  # Some APIs use Post for balance too
-                        # Try using the same PostSMS endpoint with balance query parameter
-                        f"{self.api_url}?action=balance",
-                        f"{self.api_url}?type=balance"
-                    ])
-                # Pattern 2: Standard API pattern
-                elif '/PostSMS' in self.api_url:
-                    base_url = self.api_url.replace('/PostSMS', '')
-                    possible_balance_urls.extend([
-                        f"{base_url}/GetBalance",
-                        f"{base_url}/Balance",
-                        f"{base_url}/CheckBalance"
-                    ])
-                # Pattern 3: /send pattern
-                elif '/send' in self.api_url:
-                    base_url = self.api_url.replace('/send', '').replace('/api/send', '/api')
-                    possible_balance_urls.extend([
-                        f"{base_url}/balance",
-                        f"{base_url}/Balance",
-                        f"{base_url}/checkbalance"
-                    ])
-            
-            # Add default URLs
-            possible_balance_urls.extend([
-                'https://ismartsms.net/RestApi/api/SMS/GetBalance',
-                'https://ismartsms.net/RestApi/api/SMS/Balance',
-                'https://ismartsms.net/api/balance',
-                'https://ismartsms.net/api/checkbalance'
-            ])
-            
-            # Remove duplicates
-            seen = set()
-            possible_balance_urls = [url for url in possible_balance_urls if url not in seen and not seen.add(url)]
-            
-            # Prepare payload variants based on API documentation
-            # The API uses JSON with UserID/Password (not username/password)
-            payload_variants = [
-                {'UserID': self.username, 'Password': self.password},
-                {'UserName': self.username, 'Password': self.password},
-                {'username': self.username, 'password': self.password},
-            ]
-            
-            # Try each URL and payload combination
-            last_error = None
-            response = None
-            
-            for balance_url in possible_balance_urls:
-                for payload in payload_variants:
-                    try:
-                        logger.info(f"Trying balance check: {balance_url} with params: {list(payload.keys())}")
-                        # API uses JSON, not form-data
-                        response = requests.post(
-                            balance_url, 
-                            json=payload,  # Use json= instead of data=
-                            headers={'Content-Type': 'application/json'},
-                            timeout=30
-                        )
-                        logger.info(f"Response: {response.status_code}, body: {response.text[:200]}")
-                        
-                        if response.status_code in [200, 201]:
-                            try:
-                                response_data = response.json()
-                                
-                                # Check for error code in response
-                                # Note: API uses Code 1 for success (Message Pushed), Code 0 might also be success
-                                if 'Code' in response_data:
-                                    code = response_data.get('Code')
-                                    # Code 1 = success, Code 0 = success (some APIs), other codes = error
-                                    if code in [0, 1]:
-                                        # Success! Extract balance
-                                        balance = 0.0
-                                        
-                                        # Try different balance field names
-                                        if 'Balance' in response_data:
-                                            balance = float(response_data.get('Balance', 0.0))
-                                        elif 'balance' in response_data:
-                                            balance = float(response_data.get('balance', 0.0))
-                                        elif 'Data' in response_data and isinstance(response_data['Data'], dict):
-                                            if 'Balance' in response_data['Data']:
-                                                balance = float(response_data['Data'].get('Balance', 0.0))
-                                        
-                                        if balance > 0 or 'Balance' in str(response_data):
-                                            # Update school balance
-                    if self.school:
-                        self.school.ibulk_current_balance = balance
-                        self.school.ibulk_last_balance_check = get_oman_time().utcnow()
-                        db.session.commit()
-                    
-                                            logger.info(f"Balance retrieved successfully: {balance} OMR")
-                                            return {
-                                                'success': True,
-                                                'message': 'Balance retrieved successfully',
-                                                'balance': balance,
-                                                'currency': 'OMR'
-                                            }
-                                    else:
-                                        # Non-zero code means error - map to human-readable message
-                                        error_msg = self._get_error_message(code, response_data.get('Message', 'Unknown error'))
-                                        last_error = f"Code {code}: {error_msg}"
-                                        logger.warning(f"Balance check returned error code {code}: {error_msg}")
-                                        # Continue to try next URL/payload
-                                        continue
-                                else:
-                                    # No Code field, try to extract balance directly
-                                    if 'Balance' in response_data:
-                                        balance = float(response_data.get('Balance', 0.0))
-                                        if self.school:
-                                            self.school.ibulk_current_balance = balance
-                                            self.school.ibulk_last_balance_check = get_oman_time().utcnow()
-                                            db.session.commit()
+            school = self.school
+            if school and not force:
+                cached = self._cached_balance(school)
+                if cached:
+                    return cached
+            
+            # Known endpoint first: a single request instead of the full probe
+            if school and school.ibulk_balance_url and school.ibulk_balance_payload in BALANCE_PAYLOAD_KEYS:
+                balance_url = school.ibulk_balance_url
+                balance, error, _ = self._request_balance(balance_url, school.ibulk_balance_payload)
+                if balance is not None:
+                    return self._store_balance(balance, balance_url, school.ibulk_balance_payload)
+                if error:
+                    # The endpoint answered (e.g. wrong credentials); probing others won't help
+                    logger.warning(f"Balance check failed: {error}")
                     return {
-                        'success': True,
-                        'message': 'Balance retrieved successfully',
-                        'balance': balance,
-                        'currency': 'OMR'
+                        'success': False,
+                        'message': f"SMS service error: {error}",
+                        'balance': 0.0
                     }
-                except json.JSONDecodeError:
-                                logger.warning(f"Invalid JSON response from {balance_url}")
-                                continue
-                        elif response.status_code != 404:
-                            # Non-404 error, might be auth issue - don't try other payloads for this URL
-                            try:
-                                error_data = response.json()
-                                if 'Code' in error_data:
-                                    code = error_data.get('Code')
-                                    error_msg = self._get_error_message(code, error_data.get('Message', 'Unknown'))
-                                    last_error = f"Code {code}: {error_msg}"
-                                else:
-                                    last_error = f"HTTP {response.status_code}: {response.text[:100]}"
-                            except:
-                                last_error = f"HTTP {response.status_code}: {response.text[:100]}"
-                            break  # Try next URL
-                    except requests.RequestException as e:
-                        logger.warning(f"Connection error to {balance_url}: {str(e)}")
-                        continue
-            
-            # All attempts failed
-            if last_error:
-                # If we got Code 11 or 404, it likely means balance endpoint doesn't exist
-                if 'Code 11' in last_error or '404' in last_error or 'HTML' in str(response.text[:100] if response else ''):
-                    error_msg = f"Balance endpoint not available: The balance check endpoint may not be available in this API version. This is normal - balance checking is optional."
-                    logger.info(f"Balance endpoint not available (this is OK): {error_msg}")
-                else:
-                    error_msg = f"SMS service error: {last_error}"
-                    logger.warning(f"Balance check failed: {error_msg}")
-            else:
-                error_msg = "SMS service error: Could not connect to balance endpoint"
-                logger.warning(f"Balance check failed: {error_msg}")
+                logger.info(f"Stored balance endpoint {balance_url} no longer works, probing again")
             
-            # Return failure but note that this is expected if endpoint doesn't exist
-                return {
-                    'success': False,
-                'message': error_msg,
-                'balance': 0.0,
-                'note': 'Balance endpoint may not be available in this API version. This is normal and does not affect SMS sending.'
-                }
+            return self._discover_balance()
                 
+        except http_client.CircuitOpenError as e:
+            # Provider is down; the remaining probes would fail the same way
+            logger.warning(f"Balance check skipped: {str(e)}")
+            return {
+                'success': False,
+                'message': 'SMS service error: provider unreachable, try again shortly',
+                'balance': 0.0
+            }
         except requests.RequestException as e:
             logger.error(f"Error checking SMS balance: {str(e)}")
             return {
@@ -268,6 +163,215 @@ class IBulkSMSService:
                 'balance': 0.0
             }
     
+    def _cached_balance(self, school: School) -> Optional[Dict]:
+        """The stored balance (or stored 'no endpoint' result) if it is still fresh"""
+        checked_at = school.ibulk_last_balance_check
+        if not checked_at:
+            return None
+        if get_oman_time().utcnow() - checked_at > timedelta(seconds=Config.SMS_BALANCE_TTL_SECONDS):
+            return None
+        
+        if school.ibulk_balance_payload == BALANCE_UNAVAILABLE:
+            return self._unavailable_result(None)
+        return {
+            'success': True,
+            'message': 'Balance retrieved successfully',
+            'balance': school.ibulk_current_balance or 0.0,
+            'currency': 'OMR',
+            'checked_at': checked_at.isoformat(),
+            'cached': True
+        }
+    
+    def _balance_urls(self) -> List[str]:
+        """Candidate balance URLs derived from the configured API URL, most likely first"""
+        possible_balance_urls = []
+        
+        if self.api_url:
+            # Pattern 1: RestApi pattern (https://ismartsms.net/RestApi/api/SMS/PostSMS)
+            if '/RestApi/' in self.api_url and '/SMS/' in self.api_url:
+                base_url = self.api_url.rsplit('/SMS/', 1)[0] + '/SMS'
+                # Try different balance endpoint patterns
+                possible_balance_urls.extend([
+                    f"{base_url}/GetBalance",
+                    f"{base_url}/Balance",
+                    f"{base_url}/CheckBalance",
+                    f"{base_url}/GetAccountBalance",
+                    f"{base_url}/AccountBalance",
+                    f"{base_url}/PostBalance",  # Some APIs use Post for balance too
+                    # Try using the same PostSMS endpoint with balance query parameter
+                    f"{self.api_url}?action=balance",
+                    f"{self.api_url}?type=balance"
+                ])
+            # Pattern 2: Standard API pattern
+            elif '/PostSMS' in self.api_url:
+                base_url = self.api_url.replace('/PostSMS', '')
+                possible_balance_urls.extend([
+                    f"{base_url}/GetBalance",
+                    f"{base_url}/Balance",
+                    f"{base_url}/CheckBalance"
+                ])
+            # Pattern 3: /send pattern
+            elif '/send' in self.api_url:
+                base_url = self.api_url.replace('/send', '').replace('/api/send', '/api')
+                possible_balance_urls.extend([
+                    f"{base_url}/balance",
+                    f"{base_url}/Balance",
+                    f"{base_url}/checkbalance"
+                ])
+        
+        # Add default URLs
+        possible_balance_urls.extend([
+            'https://ismartsms.net/RestApi/api/SMS/GetBalance',
+            'https://ismartsms.net/RestApi/api/SMS/Balance',
+            'https://ismartsms.net/api/balance',
+            'https://ismartsms.net/api/checkbalance'
+        ])
+        
+        # Remove duplicates
+        seen = set()
+        return [url for url in possible_balance_urls if url not in seen and not seen.add(url)]
+    
+    def _request_balance(self, balance_url: str, payload_key: str) -> Tuple[Optional[float], Optional[str], bool]:
+        """
+        Send one balance request
+        
+        Returns:
+            Tuple: (balance or None, provider error or None, whether to skip the
+            remaining payload variants for this URL). No balance and no error
+            means there is no usable balance endpoint at this URL.
+        """
+        user_key, password_key = BALANCE_PAYLOAD_KEYS[payload_key]
+        payload = {user_key: self.username, password_key: self.password}
+        
+        logger.info(f"Trying balance check: {balance_url} with params: {list(payload.keys())}")
+        # API uses JSON, not form-data. Probes aren't retried: the next
+        # URL/payload variant is the retry.
+        response = http_client.post(
+            balance_url, 
+            json=payload,  # Use json= instead of data=
+            headers={'Content-Type': 'application/json'},
+            timeout=30,
+            retries=0
+        )
+        logger.info(f"Response: {response.status_code}, body: {response.text[:200]}")
+        
+        if response.status_code in [200, 201]:
+            try:
+                response_data = response.json()
+            except (json.JSONDecodeError, ValueError):
+                logger.warning(f"Invalid JSON response from {balance_url}")
+                return None, None, False
+            if not isinstance(response_data, dict):
+                return None, None, False
+            
+            # Check for error code in response
+            # Note: API uses Code 1 for success (Message Pushed), Code 0 might also be success
+            if 'Code' in response_data:
+                code = response_data.get('Code')
+                # Code 1 = success, Code 0 = success (some APIs), other codes = error
+                if code not in [0, 1]:
+                    # Non-zero code means error - map to human-readable message
+                    error_msg = self._get_error_message(code, response_data.get('Message', 'Unknown error'))
+                    logger.warning(f"Balance check returned error code {code}: {error_msg}")
+                    # Code 11: no balance service at this URL
+                    return None, (None if code == 11 else f"Code {code}: {error_msg}"), False
+            
+            # Try different balance field names
+            if 'Balance' in response_data:
+                return float(response_data.get('Balance', 0.0)), None, False
+            if 'balance' in response_data:
+                return float(response_data.get('balance', 0.0)), None, False
+            if isinstance(response_data.get('Data'), dict) and 'Balance' in response_data['Data']:
+                return float(response_data['Data'].get('Balance', 0.0)), None, False
+            return None, None, False
+        
+        if response.status_code == 404:
+            return None, None, False
+        
+        # Non-404 error, might be auth issue - don't try other payloads for this URL
+        try:
+            error_data = response.json()
+            if 'Code' in error_data:
+                code = error_data.get('Code')
+                error_msg = self._get_error_message(code, error_data.get('Message', 'Unknown'))
+                return None, f"Code {code}: {error_msg}", True
+        except Exception:
+            pass
+        if '<html' in response.text[:100].lower():
+            return None, None, True
+        return None, f"HTTP {response.status_code}: {response.text[:100]}", True
+    
+    def _discover_balance(self) -> Dict:
+        """Probe every candidate URL/payload pair and remember the first one that works"""
+        last_error = None
+        
+        for balance_url in self._balance_urls():
+            for payload_key in BALANCE_PAYLOAD_KEYS:
+                try:
+                    balance, error, next_url = self._request_balance(balance_url, payload_key)
+                except http_client.CircuitOpenError:
+                    raise
+                except requests.RequestException as e:
+                    logger.warning(f"Connection error to {balance_url}: {str(e)}")
+                    continue
+                
+                if balance is not None:
+                    return self._store_balance(balance, balance_url, payload_key)
+                last_error = error or last_error
+                if next_url:
+                    break  # Try next URL
+        
+        # All attempts failed
+        if last_error:
+            error_msg = f"SMS service error: {last_error}"
+            logger.warning(f"Balance check failed: {error_msg}")
+            return {
+                'success': False,
+                'message': error_msg,
+                'balance': 0.0
+            }
+        
+        # No candidate has a balance service: remember that for the TTL instead of probing on every read
+        school = self.school
+        if school:
+            school.ibulk_balance_url = None
+            school.ibulk_balance_payload = BALANCE_UNAVAILABLE
+            school.ibulk_last_balance_check = get_oman_time().utcnow()
+            db.session.commit()
+        return self._unavailable_result(last_error)
+    
+    def _unavailable_result(self, last_error: Optional[str]) -> Dict:
+        error_msg = "Balance endpoint not available: The balance check endpoint may not be available in this API version. This is normal - balance checking is optional."
+        logger.info(f"Balance endpoint not available (this is OK): {error_msg}")
+        # Return failure but note that this is expected if endpoint doesn't exist
+        return {
+            'success': False,
+            'message': error_msg,
+            'balance': 0.0,
+            'note': 'Balance endpoint may not be available in this API version. This is normal and does not affect SMS sending.'
+        }
+    
+    def _store_balance(self, balance: float, balance_url: str, payload_key: str) -> Dict:
+        """Save the balance and the endpoint that returned it on the school"""
+        checked_at = get_oman_time().utcnow()
+        school = self.school
+        if school:
+            school.ibulk_current_balance = balance
+            school.ibulk_last_balance_check = checked_at
+            school.ibulk_balance_url = balance_url
+            school.ibulk_balance_payload = payload_key
+            db.session.commit()
+        
+        logger.info(f"Balance retrieved successfully: {balance} OMR")
+        return {
+            'success': True,
+            'message': 'Balance retrieved successfully',
+            'balance': balance,
+            'currency': 'OMR',
+            'checked_at': checked_at.isoformat(),
+            'cached': False
+        }
+    
     def send_single_sms(self, phone_number: str, message: str) -> Dict:
         """
         Send a single SMS message
@@ -337,39 +441,26 @@ class IBulkSMSService:
             logger.info(f"Sending SMS to {formatted_phone} with payload: {json.dumps(payload_log, ensure_ascii=False)}")
             logger.info(f"Sender ID: {self.sender_id if self.sender_id else 'Not configured'}")
             
-            # Try JSON format first, then fallback to form-data if SOAP error
-            response = None
-            try:
-                # Send SMS using JSON format
-                response = requests.post(
-                    self.api_url, 
-                    json=payload,  # Use json= instead of data=
-                    headers={'Content-Type': 'application/json', 'Cache-Control': 'no-cache'},
+            # Try JSON format first, then fallback to form-data if SOAP error.
+            # Connection failures are retried by http_client only when the request
+            # never reached the provider, so a timed-out send is not sent twice.
+            response = http_client.post(
+                self.api_url, 
+                json=payload,  # Use json= instead of data=
+                headers={'Content-Type': 'application/json', 'Cache-Control': 'no-cache'},
+                timeout=30
+            )
+            
+            # Check if response is SOAP error (indicates API expects form-data)
+            if response.status_code == 500 and 'soap' in response.text.lower():
+                logger.warning("API returned SOAP error, retrying with form-data format")
+                # Retry with form-data
+                response = http_client.post(
+                    self.api_url,
+                    data=payload,  # Use data= for form-data
+                    headers={'Cache-Control': 'no-cache'},
                     timeout=30
                 )
-                
-                # Check if response is SOAP error (indicates API expects form-data)
-                if response.status_code == 500 and 'soap' in response.text.lower():
-                    logger.warning("API returned SOAP error, retrying with form-data format")
-                    # Retry with form-data
-                    response = requests.post(
-                        self.api_url,
-                        data=payload,  # Use data= for form-data
-                        headers={'Cache-Control': 'no-cache'},
-                        timeout=30
-                    )
-            except requests.RequestException as e:
-                # If JSON fails, try form-data
-                logger.warning(f"JSON request failed, retrying with form-data: {str(e)}")
-                try:
-                    response = requests.post(
-                        self.api_url,
-                        data=payload,  # Use data= for form-data
-                        headers={'Cache-Control': 'no-cache'},
-                        timeout=30
-                    )
-                except requests.RequestException as e2:
-                    raise e2
             
             # Log the full response for debugging
             logger.info(f"SMS API Response - Status: {response.status_code}, Body: {response.text[:500]}")
@@ -378,8 +469,8 @@ class IBulkSMSService:
             if response.status_code in [200, 201]:
                 try:
                     # Try to parse as JSON first
-                try:
-                    result_data = response.json()
+                    try:
+                        result_data = response.json()
                     except (json.JSONDecodeError, ValueError):
                         # Response might be XML/SOAP or other format
                         logger.warning(f"Response is not JSON, checking for success indicators: {response.text[:200]}")
@@ -423,20 +514,8 @@ class IBulkSMSService:
                         # 3. Recipient's phone status
                         # 4. Message content compliance
                         
-                        # Update balance after successful send (if school is configured)
-                        # Note: Balance endpoint may not be available, so this is optional
-                        if self.school:
-                            try:
-                                # Check balance to update it (non-blocking, may fail if endpoint doesn't exist)
-                                balance_result = self.check_balance()
-                                if balance_result.get('success'):
-                                    logger.info(f"Balance updated after SMS send: {balance_result.get('balance', 0)} OMR")
-                                else:
-                                    # Balance check failed (endpoint may not exist) - this is OK
-                                    logger.info(f"Balance check unavailable (endpoint may not exist): {balance_result.get('message', 'Unknown')}")
-                            except Exception as e:
-                                # Balance check failed - this is OK, endpoint may not exist
-                                logger.info(f"Balance check not available: {str(e)}")
+                        # The stored balance is refreshed by `flask refresh-sms-balances`,
+                        # not by a provider round trip on every send
                         
                         # Build detailed response with troubleshooting info
                         response_data = {
@@ -690,7 +769,7 @@ class IBulkSMSService:
         Returns:
             bool: True if configured, False otherwise
         """
-        return bool(self.username and self.password and self.school)
+        return bool(self.username and self.password and self.school_name)
 
 
 class AttendanceSMSService:
@@ -706,7 +785,7 @@ class AttendanceSMSService:
             school_id (int): School ID
         """
         self.school_id = school_id
-        self.sms_service = IBulkSMSService(school_id)
+        self.sms_service = get_ibulk_sms_service(school_id)
         self.school = School.query.get(school_id) if school_id else None
     
     def create_attendance_message(self, student_name: str, class_name: str, 
@@ -935,10 +1014,43 @@ class AttendanceSMSService:
         return '\n'.join(status_parts)
 
 
+def reset_balance_discovery(school: School):
+    """Forget the stored balance endpoint and balance after the school's SMS credentials or URL change"""
+    school.ibulk_balance_url = None
+    school.ibulk_balance_payload = None
+    school.ibulk_last_balance_check = None
+
+
+def refresh_sms_balances(school_ids: List[int] = None, stale_only: bool = True) -> Dict:
+    """
+    Refresh the stored SMS balance of every school with SMS credentials
+    
+    Args:
+        school_ids (List[int]): Only these schools (default: all)
+        stale_only (bool): Skip schools whose balance is younger than Config.SMS_BALANCE_TTL_SECONDS
+        
+    Returns:
+        Dict: {school_id: result of check_balance}
+    """
+    query = School.query.filter(School.ibulk_username.isnot(None), School.ibulk_password.isnot(None))
+    if school_ids:
+        query = query.filter(School.id.in_(school_ids))
+    if stale_only:
+        # Refresh a little before the TTL runs out so UI reads stay on the stored value
+        cutoff = get_oman_time().utcnow() - timedelta(seconds=Config.SMS_BALANCE_TTL_SECONDS // 2)
+        query = query.filter(db.or_(School.ibulk_last_balance_check.is_(None), School.ibulk_last_balance_check < cutoff))
+    
+    results = {}
+    for school_id, in query.with_entities(School.id).order_by(School.id).all():
+        results[school_id] = get_ibulk_sms_service(school_id).check_balance(force=True)
+        db.session.remove()
+    return results
+
+
 # Global service instances
 def get_ibulk_sms_service(school_id: int) -> IBulkSMSService:
-    """Get iBulk SMS service instance for a school"""
-    return IBulkSMSService(school_id)
+    """Get the iBulk SMS service for a school, reused until its provider config version changes"""
+    return get_client('ibulk_sms', school_id, IBulkSMSService)
 
 def get_attendance_sms_service(school_id: int) -> AttendanceSMSService:
     """Get attendance SMS service instance for a school"""
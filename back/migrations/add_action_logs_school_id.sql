@@ -0,0 +1,14 @@
+-- Denormalized school_id on action_logs for /api/auth/view_logs
+-- Lets the log browser filter by school and page by (timestamp, id) from one
+-- index instead of joining users and scanning with OFFSET.
+
+ALTER TABLE action_logs
+  ADD COLUMN school_id INT NULL,
+  ADD INDEX ix_action_logs_school_id_timestamp_id (school_id, timestamp, id),
+  ADD INDEX ix_action_logs_timestamp_id (timestamp, id);
+
+-- Backfill existing rows from the acting user (run in batches on very large tables)
+UPDATE action_logs al
+JOIN users u ON u.id = al.user_id
+SET al.school_id = u.school_id
+WHERE al.school_id IS NULL;
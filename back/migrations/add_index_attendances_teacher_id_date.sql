@@ -0,0 +1,6 @@
+-- Teacher compliance reports (/teacherReport, /teacher_master_report, /teacher_attendance_this_week)
+-- group attendances by teacher over a date range. This index covers that query, so
+-- it is answered from the index without reading attendance rows.
+-- Run once: mysql -u root -p tatubu < migrations/add_index_attendances_teacher_id_date.sql
+
+CREATE INDEX ix_attendances_teacher_id_date ON attendances (teacher_id, date, class_id, class_time_num);
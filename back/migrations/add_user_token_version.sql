@@ -0,0 +1,5 @@
+-- Token version for JWT revocation
+-- Login embeds users.token_version as the "tv" claim. Changing a user's role,
+-- school or activation increments it, and tokens with an older "tv" are rejected.
+
+ALTER TABLE users ADD COLUMN token_version INT NOT NULL DEFAULT 0;
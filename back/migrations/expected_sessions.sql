@@ -0,0 +1,22 @@
+-- Active timetable resolved into expected (class, teacher, weekday, period) lesson slots
+-- weekday follows MySQL WEEKDAY(): Monday = 0 ... Sunday = 6
+-- Run once: mysql -u root -p tatubu < migrations/expected_sessions.sql
+-- Then fill it for schools that already have an active timetable:
+--   FLASK_APP=run.py flask rebuild-expected-sessions
+
+CREATE TABLE IF NOT EXISTS expected_sessions (
+    id INTEGER AUTO_INCREMENT PRIMARY KEY,
+    school_id INTEGER NOT NULL,
+    timetable_id INTEGER NOT NULL,
+    class_id INTEGER NULL,
+    teacher_id INTEGER NULL,
+    weekday SMALLINT NOT NULL,
+    period SMALLINT NOT NULL,
+    subject_name VARCHAR(100) NULL,
+    FOREIGN KEY (school_id) REFERENCES schools(id) ON DELETE CASCADE,
+    FOREIGN KEY (timetable_id) REFERENCES timetables(id) ON DELETE CASCADE,
+    FOREIGN KEY (class_id) REFERENCES classes(id) ON DELETE CASCADE,
+    FOREIGN KEY (teacher_id) REFERENCES teachers(id) ON DELETE CASCADE,
+    INDEX ix_expected_sessions_school_weekday_class (school_id, weekday, class_id, period),
+    INDEX ix_expected_sessions_teacher_weekday (teacher_id, weekday, period)
+);
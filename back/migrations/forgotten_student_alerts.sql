@@ -0,0 +1,19 @@
+-- Forgotten-student sweeper: remember which buses were already alerted each day
+-- Run once: mysql -u root -p tatubu < migrations/forgotten_student_alerts.sql
+
+CREATE TABLE IF NOT EXISTS forgotten_student_alerts (
+    id INTEGER PRIMARY KEY AUTO_INCREMENT,
+    bus_id INTEGER NOT NULL,
+    school_id INTEGER NOT NULL,
+    alert_date DATE NOT NULL,
+    students_count INTEGER NOT NULL DEFAULT 0,
+    student_ids TEXT NULL,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (bus_id) REFERENCES buses(id) ON DELETE CASCADE,
+    FOREIGN KEY (school_id) REFERENCES schools(id) ON DELETE CASCADE,
+    UNIQUE KEY unique_bus_alert_date (bus_id, alert_date),
+    INDEX ix_forgotten_student_alerts_school_id_alert_date (school_id, alert_date)
+);
+
+-- Example cron entry (every 15 minutes between 12:00 and 17:00, Sunday-Thursday):
+-- */15 12-17 * * 0-4 cd /path/to/back && FLASK_APP=run.py flask sweep-forgotten-students
@@ -0,0 +1,15 @@
+-- Broadcast notifications addressed to roles instead of stored recipient id lists
+-- A NULL notifications.school_id / notification_audiences.school_id means every school
+-- Run once: mysql -u root -p tatubu < migrations/notification_audiences.sql
+
+ALTER TABLE notifications MODIFY school_id INTEGER NULL;
+
+CREATE TABLE IF NOT EXISTS notification_audiences (
+    id INTEGER AUTO_INCREMENT PRIMARY KEY,
+    notification_id INTEGER NOT NULL,
+    school_id INTEGER NULL,
+    role VARCHAR(50) NOT NULL,
+    FOREIGN KEY (notification_id) REFERENCES notifications(id) ON DELETE CASCADE,
+    FOREIGN KEY (school_id) REFERENCES schools(id) ON DELETE CASCADE,
+    INDEX ix_notification_audiences_role_school (role, school_id, notification_id)
+);
@@ -0,0 +1,7 @@
+-- Daily per-student attendance/bus digests: one updatable notification per (type, student, day)
+-- digest_key looks like 'attendance:<student_id>:<YYYY-MM-DD>'; NULL for every other notification
+-- Run once: mysql -u root -p tatubu < migrations/notification_digests.sql
+
+ALTER TABLE notifications
+    ADD COLUMN digest_key VARCHAR(100) NULL AFTER template_params,
+    ADD UNIQUE INDEX ux_notifications_digest_key (digest_key);
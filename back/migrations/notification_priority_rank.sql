@@ -0,0 +1,16 @@
+-- Stored feed sort key for notifications: priority_rank = 4 urgent, 3 high, 2 normal, 1 low, 0 other
+-- The feed orders by (priority_rank, created_at, id) DESC and pages with keyset cursors,
+-- read backwards from ix_notifications_feed instead of filesorting a CASE over priority
+-- Run once: mysql -u root -p tatubu < migrations/notification_priority_rank.sql
+
+ALTER TABLE notifications ADD COLUMN priority_rank SMALLINT NOT NULL DEFAULT 2 AFTER priority;
+
+UPDATE notifications SET priority_rank = CASE priority
+    WHEN 'urgent' THEN 4
+    WHEN 'high' THEN 3
+    WHEN 'normal' THEN 2
+    WHEN 'low' THEN 1
+    ELSE 0
+END;
+
+CREATE INDEX ix_notifications_feed ON notifications (school_id, is_active, priority_rank, created_at, id);
@@ -0,0 +1,8 @@
+-- Attendance and bus-scan notifications store a template key + compact JSON parameters
+-- instead of the rendered message (rendered at read time; see app/services/notification_templates.py)
+-- Run once: mysql -u root -p tatubu < migrations/notification_templates.sql
+
+ALTER TABLE notifications
+    MODIFY message TEXT NULL,
+    ADD COLUMN template_key VARCHAR(50) NULL AFTER type,
+    ADD COLUMN template_params TEXT NULL AFTER template_key;
@@ -0,0 +1,6 @@
+-- Version of each school's SMS/WhatsApp provider settings
+-- Bumped (and published to Redis) whenever the settings are edited, so every gunicorn
+-- worker rebuilds its cached provider clients instead of keeping stale credentials
+-- Run once: mysql -u root -p tatubu < migrations/provider_config_version.sql
+
+ALTER TABLE schools ADD COLUMN provider_config_version INT NOT NULL DEFAULT 1;
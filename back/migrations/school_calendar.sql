@@ -0,0 +1,15 @@
+-- Per-school calendar: holidays/breaks and term dates used for working-day counts in reports
+-- entry_type: 'holiday' (days off, inclusive range) or 'term' (teaching period)
+-- Run once: mysql -u root -p tatubu < migrations/school_calendar.sql
+
+CREATE TABLE IF NOT EXISTS school_calendar (
+    id INTEGER AUTO_INCREMENT PRIMARY KEY,
+    school_id INTEGER NOT NULL,
+    entry_type VARCHAR(20) NOT NULL DEFAULT 'holiday',
+    name VARCHAR(255) NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    created_at DATETIME NULL,
+    FOREIGN KEY (school_id) REFERENCES schools(id) ON DELETE CASCADE,
+    INDEX ix_school_calendar_school_id_start_date (school_id, start_date)
+);
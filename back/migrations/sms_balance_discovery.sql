@@ -0,0 +1,9 @@
+-- Remember which balance endpoint works for each school's SMS account
+-- check_balance used to probe up to a dozen URLs x three payload shapes on every call;
+-- the working pair is now stored here, and ibulk_current_balance / ibulk_last_balance_check
+-- are served as a cache (refreshed by `flask refresh-sms-balances`)
+-- Run once: mysql -u root -p tatubu < migrations/sms_balance_discovery.sql
+
+ALTER TABLE schools
+    ADD COLUMN ibulk_balance_url VARCHAR(255) NULL AFTER ibulk_current_balance,
+    ADD COLUMN ibulk_balance_payload VARCHAR(20) NULL AFTER ibulk_balance_url;
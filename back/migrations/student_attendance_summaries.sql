@@ -0,0 +1,30 @@
+-- Nightly term-to-date attendance totals and risk per student
+-- Filled by: FLASK_APP=run.py flask build-student-summaries
+-- Run once: mysql -u root -p tatubu < migrations/student_attendance_summaries.sql
+-- Cron (after midnight, Oman time):
+--   30 0 * * * cd /path/to/back && FLASK_APP=run.py flask build-student-summaries
+
+CREATE TABLE IF NOT EXISTS student_attendance_summaries (
+    school_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    class_id INTEGER NULL,
+    term_start DATE NOT NULL,
+    as_of_date DATE NOT NULL,
+    total_records INTEGER NOT NULL DEFAULT 0,
+    total_days INTEGER NOT NULL DEFAULT 0,
+    present_count INTEGER NOT NULL DEFAULT 0,
+    absent_count INTEGER NOT NULL DEFAULT 0,
+    excused_count INTEGER NOT NULL DEFAULT 0,
+    late_count INTEGER NOT NULL DEFAULT 0,
+    absent_days INTEGER NOT NULL DEFAULT 0,
+    last_absence_date DATE NULL,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    longest_streak INTEGER NOT NULL DEFAULT 0,
+    risk_score FLOAT NOT NULL DEFAULT 0,
+    risk_tier VARCHAR(10) NOT NULL DEFAULT 'low',
+    computed_at DATETIME NULL,
+    PRIMARY KEY (school_id, student_id),
+    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
+    INDEX ix_student_attendance_summaries_school_id_risk (school_id, risk_score),
+    INDEX ix_student_attendance_summaries_student_id (student_id)
+);
@@ -0,0 +1,10 @@
+-- Key student_attendance_summaries by (school_id, student_id) instead of student_id
+-- Each school's nightly build deletes and re-inserts its own rows; a student with
+-- classes in two schools made the second school's build fail on a duplicate key
+-- Only needed where student_attendance_summaries.sql was run before this change
+-- Run once: mysql -u root -p tatubu < migrations/student_attendance_summaries_school_key.sql
+
+ALTER TABLE student_attendance_summaries
+    ADD INDEX ix_student_attendance_summaries_student_id (student_id),
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (school_id, student_id);
@@ -0,0 +1,33 @@
+-- Per-student daily attendance bitmasks (one row per student, class and day)
+-- Bit k of each mask is set when the student had that status in period k.
+-- Run once: mysql -u root -p tatubu < migrations/student_day_attendance.sql
+
+CREATE TABLE IF NOT EXISTS student_day_attendance (
+    student_id INTEGER NOT NULL,
+    date DATE NOT NULL,
+    class_id INTEGER NOT NULL,
+    absent_mask SMALLINT NOT NULL DEFAULT 0,
+    late_mask SMALLINT NOT NULL DEFAULT 0,
+    excused_mask SMALLINT NOT NULL DEFAULT 0,
+    present_mask SMALLINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (student_id, date, class_id),
+    FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
+    FOREIGN KEY (class_id) REFERENCES classes(id) ON DELETE CASCADE,
+    INDEX ix_student_day_attendance_class_id_date (class_id, date)
+);
+
+-- Backfill from existing attendance (or: FLASK_APP=run.py flask rebuild-student-days)
+INSERT INTO student_day_attendance
+    (student_id, date, class_id, absent_mask, late_mask, excused_mask, present_mask)
+SELECT a.student_id, DATE(a.date), a.class_id,
+       BIT_OR(IF(a.is_Acsent, 1 << LEAST(GREATEST(a.class_time_num, 0), 14), 0)),
+       BIT_OR(IF(a.is_late, 1 << LEAST(GREATEST(a.class_time_num, 0), 14), 0)),
+       BIT_OR(IF(a.is_Excus, 1 << LEAST(GREATEST(a.class_time_num, 0), 14), 0)),
+       BIT_OR(IF(a.is_present, 1 << LEAST(GREATEST(a.class_time_num, 0), 14), 0))
+FROM attendances a
+GROUP BY a.student_id, DATE(a.date), a.class_id
+ON DUPLICATE KEY UPDATE
+    absent_mask = VALUES(absent_mask),
+    late_mask = VALUES(late_mask),
+    excused_mask = VALUES(excused_mask),
+    present_mask = VALUES(present_mask);
@@ -0,0 +1,31 @@
+-- Monthly partitions and academic-year archives for attendances, bus_scans, action_logs
+-- The partition DDL depends on the current date, so it is generated by the app:
+--   FLASK_APP=run.py flask roll-partitions --init     (one-time conversion, off-hours)
+--   FLASK_APP=run.py flask roll-partitions            (monthly cron, keeps 3 months ahead)
+--   FLASK_APP=run.py flask archive-academic-year 2023 (moves Aug 2023 - Jul 2024 to *_archive)
+-- Converting a table drops its foreign keys and changes its primary key to (id, <date column>).
+--
+-- Referential integrity for these tables is then the application's job:
+--   attendances (student_id, teacher_id, class_id, subject_id) had no ON DELETE rule,
+--     so deleting a student, teacher, class or subject used to fail while rows
+--     referenced it; it now succeeds and leaves orphan attendance rows.
+--   bus_scans no longer cascades when a student or bus is deleted, and scanned_by
+--     is no longer set to NULL when the scanning user is deleted.
+--   action_logs.user_id can point at deleted users.
+-- Delete or reassign dependent rows in the same transaction before deleting
+-- the parent. The Alembic downgrade restores the foreign keys and fails if
+-- orphan rows exist.
+--
+-- Example cron (1st of each month, 02:00):
+-- 0 2 1 * * cd /path/to/back && FLASK_APP=run.py flask roll-partitions
+
+CREATE TABLE IF NOT EXISTS data_archive_runs (
+  id INT NOT NULL AUTO_INCREMENT,
+  table_name VARCHAR(64) NOT NULL,
+  range_start DATE NOT NULL,
+  range_end DATE NOT NULL,
+  rows_archived INT NOT NULL DEFAULT 0,
+  archived_at DATETIME NULL,
+  PRIMARY KEY (id),
+  UNIQUE KEY unique_archive_table_range (table_name, range_start)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
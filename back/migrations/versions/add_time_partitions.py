@@ -0,0 +1,74 @@
+"""add monthly partitions to attendances, bus_scans and action_logs
+
+Revision ID: add_time_partitions
+Revises: 
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'add_time_partitions'
+down_revision = None  # Update this with your latest migration ID
+branch_labels = None
+depends_on = None
+
+# Foreign keys partition_table() drops: (column, referred table, ON DELETE)
+ORIGINAL_FOREIGN_KEYS = {
+    'attendances': [
+        ('student_id', 'students', None),
+        ('teacher_id', 'teachers', None),
+        ('class_id', 'classes', None),
+        ('subject_id', 'subjects', None),
+    ],
+    'bus_scans': [
+        ('student_id', 'students', 'CASCADE'),
+        ('bus_id', 'buses', 'CASCADE'),
+        ('scanned_by', 'users', 'SET NULL'),
+    ],
+    'action_logs': [
+        ('user_id', 'users', None),
+    ],
+}
+
+
+def upgrade():
+    from app.services.partitioning import PARTITIONED_TABLES, partition_table
+
+    # Record of academic-year ranges moved into <table>_archive
+    op.create_table('data_archive_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('table_name', sa.String(length=64), nullable=False),
+        sa.Column('range_start', sa.Date(), nullable=False),
+        sa.Column('range_end', sa.Date(), nullable=False),
+        sa.Column('rows_archived', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('table_name', 'range_start', name='unique_archive_table_range')
+    )
+
+    # Rebuilds each table; drops its foreign keys (MySQL can't partition tables that have them)
+    conn = op.get_bind()
+    for table in PARTITIONED_TABLES:
+        partition_table(conn, table)
+
+
+def downgrade():
+    from app.services.partitioning import PARTITIONED_TABLES, get_partitions
+
+    # Undo partition_table(): unpartition, restore PRIMARY KEY (id) and the
+    # foreign keys it dropped. Re-adding a foreign key fails if rows were left
+    # pointing at deleted students, classes, buses or users while partitioned;
+    # remove those first.
+    conn = op.get_bind()
+    for table in PARTITIONED_TABLES:
+        if get_partitions(conn, table):
+            op.execute(f"ALTER TABLE `{table}` REMOVE PARTITIONING")
+        op.execute(f"ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
+        for column, referred_table, ondelete in ORIGINAL_FOREIGN_KEYS[table]:
+            op.create_foreign_key(
+                None, table, referred_table, [column], ['id'], ondelete=ondelete
+            )
+    op.drop_table('data_archive_runs')
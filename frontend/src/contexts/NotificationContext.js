@@ -35,6 +35,7 @@ export const NotificationProvider = ({ children }) => {
       setLoading(true);
       const params = new URLSearchParams();
       
+      if (options.cursor) params.append('cursor', options.cursor);
       if (options.page) params.append('page', options.page);
       if (options.per_page) params.append('per_page', options.per_page);
       if (options.unread_only) params.append('unread_only', 'true');
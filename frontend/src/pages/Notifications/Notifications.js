@@ -31,26 +31,32 @@ const Notifications = () => {
   } = usePushNotifications();
 
   const [selectedType, setSelectedType] = useState('all');
-  const [page, setPage] = useState(1);
-  const [totalPages, setTotalPages] = useState(1);
+  // Cursor of each page visited so far; the last one is the current page
+  const [cursors, setCursors] = useState([null]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const currentPage = cursors.length;
+  const currentCursor = cursors[cursors.length - 1];
 
   useEffect(() => {
     loadNotifications();
-  }, [selectedType, page]);
+  }, [selectedType, currentCursor]);
 
   const loadNotifications = async () => {
     const options = {
-      page,
       per_page: 20,
     };
 
+    if (currentCursor) {
+      options.cursor = currentCursor;
+    }
+
     if (selectedType !== 'all') {
       options.type = selectedType;
     }
 
     const result = await fetchNotifications(options);
     if (result) {
-      setTotalPages(result.pages || 1);
+      setNextCursor(result.has_more ? result.next_cursor : null);
     }
   };
 
@@ -232,7 +238,7 @@ const Notifications = () => {
               key={type}
               onClick={() => {
                 setSelectedType(type);
-                setPage(1);
+                setCursors([null]);
               }}
               className={`px-2.5 py-1 text-sm rounded-md font-medium transition-colors ${
                 selectedType === type
@@ -333,24 +339,24 @@ const Notifications = () => {
             </div>
 
             {/* Pagination */}
-            {totalPages > 1 && (
+            {(currentPage > 1 || nextCursor) && (
               <div className="px-3 py-2 border-t border-gray-100 bg-gray-50/50">
                 <div className="flex items-center justify-center gap-2">
                   <button
-                    onClick={() => setPage((p) => Math.max(1, p - 1))}
-                    disabled={page === 1}
+                    onClick={() => setCursors(cursors.slice(0, -1))}
+                    disabled={currentPage === 1}
                     className="px-3 py-1.5 text-xs font-medium text-gray-700 bg-white border border-gray-200 rounded-md hover:bg-gray-50 disabled:opacity-50 disabled:cursor-not-allowed"
                   >
                     السابق
                   </button>
 
                   <span className="px-3 py-1.5 text-xs text-gray-700">
-                    صفحة {page} من {totalPages}
+                    صفحة {currentPage}
                   </span>
 
                   <button
-                    onClick={() => setPage((p) => Math.min(totalPages, p + 1))}
-                    disabled={page === totalPages}
+                    onClick={() => setCursors([...cursors, nextCursor])}
+                    disabled={!nextCursor}
                     className="px-3 py-1.5 text-xs font-medium text-gray-700 bg-white border border-gray-200 rounded-md hover:bg-gray-50 disabled:opacity-50 disabled:cursor-not-allowed"
                   >
                     التالي
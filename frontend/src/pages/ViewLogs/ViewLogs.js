@@ -82,15 +82,18 @@ const ViewLogs = () => {
     return Monitor;
   };
 
-  // Pagination state
-  const [currentPage, setCurrentPage] = useState(1);
+  // Pagination state: cursors[i] is the cursor that loads page i + 1 (first page has none)
+  const [cursors, setCursors] = useState([null]);
   const [pageSize, setPageSize] = useState(50);
   const [daysFilter, setDaysFilter] = useState(30);
+  const currentPage = cursors.length;
+  const currentCursor = cursors[cursors.length - 1];
+  const resetPages = () => setCursors([null]);
 
   // Fetch logs data with pagination
   const { data: logsResponse, isLoading, error } = useQuery(
-    ['viewLogs', currentPage, pageSize, daysFilter],
-    () => authAPI.viewLogs({ page: currentPage, per_page: pageSize, days: daysFilter }),
+    ['viewLogs', currentCursor, pageSize, daysFilter],
+    () => authAPI.viewLogs({ cursor: currentCursor, per_page: pageSize, days: daysFilter }),
     {
       enabled: !!user && (user.role === 'school_admin' || user.role === 'admin' || user.role === 'data_analyst'),
       refetchInterval: 30000, // Refetch every 30 seconds
@@ -502,7 +505,7 @@ const ViewLogs = () => {
             value={daysFilter}
             onChange={(e) => {
               setDaysFilter(parseInt(e.target.value));
-              setCurrentPage(1); // Reset to first page when changing date filter
+              resetPages(); // Reset to first page when changing date filter
             }}
             className="input"
           >
@@ -607,11 +610,11 @@ const ViewLogs = () => {
               />
               
               {/* Custom Pagination Controls */}
-              {pagination.pages > 1 && (
+              {(pagination.has_next || pagination.has_prev) && (
                 <div className="flex items-center justify-between mt-6 pt-6 border-t border-gray-200">
                   <div className="flex items-center space-x-2">
                     <span className="text-sm text-gray-700">
-                      عرض {((currentPage - 1) * pageSize) + 1} إلى {Math.min(currentPage * pageSize, pagination.total)} من {pagination.total} سجل
+                      عرض {((currentPage - 1) * pageSize) + 1} إلى {((currentPage - 1) * pageSize) + logs.length} من {pagination.total_is_estimate ? 'حوالي ' : ''}{pagination.total} سجل
                     </span>
                   </div>
                   
@@ -621,7 +624,7 @@ const ViewLogs = () => {
                       value={pageSize}
                       onChange={(e) => {
                         setPageSize(parseInt(e.target.value));
-                        setCurrentPage(1);
+                        resetPages();
                       }}
                       className="input text-sm"
                     >
@@ -633,7 +636,7 @@ const ViewLogs = () => {
                     {/* Pagination Buttons */}
                     <div className="flex items-center space-x-1">
                       <button
-                        onClick={() => setCurrentPage(1)}
+                        onClick={resetPages}
                         disabled={currentPage === 1}
                         className="btn btn-sm btn-outline disabled:opacity-50"
                       >
@@ -641,32 +644,24 @@ const ViewLogs = () => {
                       </button>
                       
                       <button
-                        onClick={() => setCurrentPage(currentPage - 1)}
-                        disabled={!pagination.has_prev}
+                        onClick={() => setCursors(cursors.slice(0, -1))}
+                        disabled={currentPage === 1}
                         className="btn btn-sm btn-outline disabled:opacity-50"
                       >
                         السابقة
                       </button>
                       
                       <span className="px-3 py-1 text-sm text-gray-700">
-                        صفحة {currentPage} من {pagination.pages}
+                        صفحة {currentPage}{pagination.pages ? ` من ${Math.max(pagination.pages, currentPage)}` : ''}
                       </span>
                       
                       <button
-                        onClick={() => setCurrentPage(currentPage + 1)}
-                        disabled={!pagination.has_next}
+                        onClick={() => setCursors([...cursors, pagination.next_cursor])}
+                        disabled={!pagination.has_next || !pagination.next_cursor}
                         className="btn btn-sm btn-outline disabled:opacity-50"
                       >
                         التالية
                       </button>
-                      
-                      <button
-                        onClick={() => setCurrentPage(pagination.pages)}
-                        disabled={currentPage === pagination.pages}
-                        className="btn btn-sm btn-outline disabled:opacity-50"
-                      >
-                        الأخيرة
-                      </button>
                     </div>
                   </div>
                 </div>
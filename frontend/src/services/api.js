@@ -189,8 +189,11 @@ export const authAPI = {
   deleteSchoolData: (options) => api.delete('/auth/delete_school_data', { data: { delete_options: options } }),
   toggleSchoolStatus: (schoolId) => api.put(`/auth/toggle_school_status/${schoolId}`),
   viewLogs: (params = {}) => {
-    const { page = 1, per_page = 50, days = 30, school_id } = params;
-    const queryParams = { page, per_page, days };
+    const { cursor, per_page = 50, days = 30, school_id } = params;
+    const queryParams = { per_page, days };
+    if (cursor) {
+      queryParams.cursor = cursor;
+    }
     if (school_id) {
       queryParams.school_id = school_id;
     }